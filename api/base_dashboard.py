@@ -11,9 +11,11 @@ from src.database import (
     get_db, Device, DetectionEvent, DetectionConfig, EdgeServer, ExternalEvent, CrowdAnalysisJob, CrowdAnalysisResult,SmartScheme,SmartEvent
 )
 from api.logger import log_action
+from api.response_cache import CachedRoute, cached
+from src.event_statistics import event_statistics, SOURCE_DETECTION, SOURCE_EXTERNAL, SOURCE_SMART
 import GPUtil # 导入GPUtil库
 
-router = APIRouter(prefix="/dashboard", tags=["数据大屏"])
+router = APIRouter(prefix="/dashboard", tags=["数据大屏"], route_class=CachedRoute)
 
 # 定义事件类型映射
 event_type_map = {
@@ -33,15 +35,16 @@ event_type_map = {
 
 #数据大屏API-旧
 @router.get("/overview-data")
+@cached(ttl=5, tags=["dashboard"])
 def get_dashboard_data(db: Session = Depends(get_db)):
     """获取数据大屏数据"""
     try:
         device_count = db.query(Device).count()
-        detection_event_count = db.query(DetectionEvent).count()
+        detection_event_count = event_statistics.total(SOURCE_DETECTION)
         detection_config_count = db.query(DetectionConfig).count()
         crowd_analysis_job_count = db.query(CrowdAnalysisJob).count()
         edge_server_count = db.query(EdgeServer).count()
-        external_event_count = db.query(ExternalEvent).count()
+        external_event_count = event_statistics.total(SOURCE_EXTERNAL)
         return {
             "data": {
                 "device_count": device_count,
@@ -56,6 +59,7 @@ def get_dashboard_data(db: Session = Depends(get_db)):
         raise HTTPException(status_code=500, detail="获取数据大屏数据失败")
     
 @router.get("/crowd-analysis-data")
+@cached(ttl=5, tags=["dashboard"])
 def get_dashboard_crowd_analysis_data(db: Session = Depends(get_db)):
     """获取数据大屏人群分析数据"""
     try:
@@ -96,6 +100,7 @@ def get_dashboard_crowd_analysis_data(db: Session = Depends(get_db)):
         raise HTTPException(status_code=500, detail="获取数据大屏人群分析数据失败")
     
 @router.get("/alert-history-data")
+@cached(ttl=5, tags=["dashboard"])
 def get_dashboard_alert_history_data(db: Session = Depends(get_db)):
     """获取数据大屏告警历史数据"""
     try:
@@ -107,29 +112,22 @@ def get_dashboard_alert_history_data(db: Session = Depends(get_db)):
         raise HTTPException(status_code=500, detail="获取数据大屏告警历史数据失败")
     
 @router.get("/historical-stats-data")
+@cached(ttl=5, tags=["dashboard"])
 def get_dashboard_historical_stats_data(db: Session = Depends(get_db)):
     """获取数据大屏历史数据事件数据"""
     try:
-        from sqlalchemy import func
-        
         # 获取最近5天的每天的数据条数
-        events = db.query(
-            func.date(ExternalEvent.timestamp).label('date'), 
-            func.count(ExternalEvent.event_id).label('count')
-        ).filter(
-            ExternalEvent.timestamp >= datetime.now() - timedelta(days=5)
-        ).group_by(
-            func.date(ExternalEvent.timestamp)
-        ).all()
-        # 升序
-        events = sorted(events, key=lambda x: x.date)
-        # 转换为字典格式
+        today = datetime.now().date()
+        days = [today - timedelta(days=i) for i in range(5, -1, -1)]
+        events = event_statistics.daily_totals(SOURCE_EXTERNAL, days)
+        # 转换为字典格式（升序，跳过没有数据的日期）
         result = []
-        for date, count in events:
-            result.append({
-                "date": date.isoformat() if date else None,
-                "count": count
-            })
+        for date in days:
+            if events[date]:
+                result.append({
+                    "date": date.isoformat(),
+                    "count": events[date]
+                })
         
         return {
             "data": result
@@ -138,27 +136,19 @@ def get_dashboard_historical_stats_data(db: Session = Depends(get_db)):
         raise HTTPException(status_code=500, detail="获取数据大屏历史数据事件数据失败")
     
 @router.get("/detection-event-data")
+@cached(ttl=5, tags=["dashboard"])
 def get_dashboard_detection_event_data(db: Session = Depends(get_db)):
     """获取数据大屏检测事件数据"""
     try:
-        from sqlalchemy import func
-        
         # 获取检测总数
-        detection_count = db.query(ExternalEvent).count()
+        detection_count = event_statistics.total(SOURCE_EXTERNAL)
         
         # 根据引擎名称统计检测数量
-        engine_count_query = db.query(
-            ExternalEvent.engine_name,
-            func.count(ExternalEvent.event_id).label('count')
-        ).filter(
-            ExternalEvent.engine_name.isnot(None)
-        ).group_by(
-            ExternalEvent.engine_name
-        ).all()
+        engine_count_query = event_statistics.group_by(SOURCE_EXTERNAL, "category", skip_empty=True)
         
         # 转换为列表格式
         engine_count = []
-        for engine_name, count in engine_count_query:
+        for engine_name, count in engine_count_query.items():
             engine_count.append({
                 "engine_name": engine_name or "未知引擎",
                 "detection_count": count
@@ -179,54 +169,24 @@ def get_dashboard_detection_event_data(db: Session = Depends(get_db)):
         raise HTTPException(status_code=500, detail="获取数据大屏检测事件数据失败")
     
 @router.get("/detection-type-data")
+@cached(ttl=5, tags=["dashboard"])
 def get_dashboard_detection_type_data(db: Session = Depends(get_db)):
     """获取数据大屏检测类型数据"""
     try:
-        from sqlalchemy import func, and_
-        
         # 计算时间范围
         now = datetime.now()
         today_start = now.replace(hour=0, minute=0, second=0, microsecond=0)
         yesterday_start = today_start - timedelta(days=1)
         day_before_yesterday_start = today_start - timedelta(days=2)
         
-        # 优化的查询：分别统计总数、昨天、前天的数据
-        # 总数统计
-        total_count_query = db.query(
-            ExternalEvent.engine_name,
-            func.count(ExternalEvent.event_id).label('total_count')
-        ).filter(
-            ExternalEvent.engine_name.isnot(None)
-        ).group_by(ExternalEvent.engine_name)
-        
-        # 昨天数据统计
-        yesterday_count_query = db.query(
-            ExternalEvent.engine_name,
-            func.count(ExternalEvent.event_id).label('yesterday_count')
-        ).filter(
-            and_(
-                ExternalEvent.engine_name.isnot(None),
-                ExternalEvent.timestamp >= yesterday_start,
-                ExternalEvent.timestamp < today_start
-            )
-        ).group_by(ExternalEvent.engine_name)
-        
-        # 前天数据统计
-        day_before_yesterday_count_query = db.query(
-            ExternalEvent.engine_name,
-            func.count(ExternalEvent.event_id).label('day_before_yesterday_count')
-        ).filter(
-            and_(
-                ExternalEvent.engine_name.isnot(None),
-                ExternalEvent.timestamp >= day_before_yesterday_start,
-                ExternalEvent.timestamp < yesterday_start
-            )
-        ).group_by(ExternalEvent.engine_name)
-        
-        # 执行查询
-        total_counts = {row.engine_name: row.total_count for row in total_count_query.all()}
-        yesterday_counts = {row.engine_name: row.yesterday_count for row in yesterday_count_query.all()}
-        day_before_yesterday_counts = {row.engine_name: row.day_before_yesterday_count for row in day_before_yesterday_count_query.all()}
+        # 从内存中的事件计数读取总数、昨天、前天的数据
+        total_counts = event_statistics.group_by(SOURCE_EXTERNAL, "category", skip_empty=True)
+        yesterday_counts = event_statistics.group_by(
+            SOURCE_EXTERNAL, "category", day=yesterday_start.date(), skip_empty=True
+        )
+        day_before_yesterday_counts = event_statistics.group_by(
+            SOURCE_EXTERNAL, "category", day=day_before_yesterday_start.date(), skip_empty=True
+        )
         
         # 合并数据并计算同比率
         detection_type_count = []
@@ -255,19 +215,9 @@ def get_dashboard_detection_type_data(db: Session = Depends(get_db)):
         
         # 添加本地检测引擎数据（从DetectionEvent表查询）
         try:
-            local_total = db.query(DetectionEvent).count()
-            local_yesterday = db.query(DetectionEvent).filter(
-                and_(
-                    DetectionEvent.timestamp >= yesterday_start,
-                    DetectionEvent.timestamp < today_start
-                )
-            ).count()
-            local_day_before_yesterday = db.query(DetectionEvent).filter(
-                and_(
-                    DetectionEvent.timestamp >= day_before_yesterday_start,
-                    DetectionEvent.timestamp < yesterday_start
-                )
-            ).count()
+            local_total = event_statistics.total(SOURCE_DETECTION)
+            local_yesterday = event_statistics.total(SOURCE_DETECTION, day=yesterday_start.date())
+            local_day_before_yesterday = event_statistics.total(SOURCE_DETECTION, day=day_before_yesterday_start.date())
             
             # 计算本地引擎同比率
             if local_day_before_yesterday > 0:
@@ -308,6 +258,7 @@ def get_dashboard_detection_type_data(db: Session = Depends(get_db)):
 
 #数据大屏API-新
 @router.get("/overview-smart-data")
+@cached(ttl=5, tags=["dashboard"])
 def get_dashboard_overview_data(db: Session = Depends(get_db)):
     """获取数据大屏数据"""
     try:
@@ -316,10 +267,10 @@ def get_dashboard_overview_data(db: Session = Depends(get_db)):
         crowd_analysis_job_count = db.query(CrowdAnalysisJob).count()
 
         smart_scheme_count = db.query(SmartScheme).count()
-        smart_event_count = db.query(SmartEvent).count()
+        smart_event_count = event_statistics.total(SOURCE_SMART)
         # smart_type_count = db.query(SmartEvent.event_type, func.count(SmartEvent.id)).group_by(SmartEvent.event_type).all()
 
-        detection_event_count = db.query(DetectionEvent).count()
+        detection_event_count = event_statistics.total(SOURCE_DETECTION)
         # detection_type_count = db.query(DetectionEvent.event_type, func.count(DetectionEvent.event_id)).group_by(DetectionEvent.event_type).all()
         detection_events = db.query(DetectionEvent, Device.device_name).join(Device, DetectionEvent.device_id == Device.device_id).order_by(DetectionEvent.created_at.desc()).limit(25).all()
         detection_lasted_events = db.query(DetectionEvent, Device.device_name).join(Device, DetectionEvent.device_id == Device.device_id
@@ -327,7 +278,7 @@ def get_dashboard_overview_data(db: Session = Depends(get_db)):
             ).order_by(DetectionEvent.created_at.desc()
             ).limit(12).all()
 
-        external_event_count = db.query(ExternalEvent).count()
+        external_event_count = event_statistics.total(SOURCE_EXTERNAL)
         # 根据引擎名称统计检测数量
         # external_type_count = db.query(
         #     ExternalEvent.engine_name,
@@ -400,64 +351,26 @@ def get_dashboard_overview_data(db: Session = Depends(get_db)):
         raise HTTPException(status_code=500, detail="获取数据大屏数据失败")
     
 @router.get("/historical-smart-data")
+@cached(ttl=5, tags=["dashboard"])
 def get_dashboard_historical_data(db: Session = Depends(get_db)):
     """获取数据大屏历史数据事件数据"""
     try:       
         # 获取最近5天的每天的数据条数
-        external_event_history = db.query(
-            func.date(ExternalEvent.timestamp).label('date'), 
-            func.count(ExternalEvent.event_id).label('count')
-        ).filter(
-            ExternalEvent.timestamp >= datetime.now() - timedelta(days=5)
-        ).group_by(
-            func.date(ExternalEvent.timestamp)
-        ).all()
-
-        detection_event_history = db.query(
-            func.date(DetectionEvent.created_at).label('date'), 
-            func.count(DetectionEvent.event_id).label('count')
-        ).filter(
-            DetectionEvent.created_at >= datetime.now() - timedelta(days=5)
-        ).group_by(
-            func.date(DetectionEvent.created_at)
-        ).all()
-
-        smart_event_history = db.query(
-            func.date(SmartEvent.timestamp).label('date'), 
-            func.count(SmartEvent.id).label('count')
-        ).filter(
-            SmartEvent.timestamp >= datetime.now() - timedelta(days=5)
-        ).group_by(
-            func.date(SmartEvent.timestamp)
-        ).all()
-
-        # 创建一个字典来存储所有数据，以日期为键
-        result_dict = {}
-        # 生成过去5天的所有日期，并初始化为0
         today = datetime.now().date()
-        for i in range(5, -1, -1): # 包括今天和过去5天，共6天
-            date = today - timedelta(days=i)
-            result_dict[date] = {
+        days = [today - timedelta(days=i) for i in range(5, -1, -1)] # 包括今天和过去5天，共6天
+        external_event_history = event_statistics.daily_totals(SOURCE_EXTERNAL, days)
+        detection_event_history = event_statistics.daily_totals(SOURCE_DETECTION, days)
+        smart_event_history = event_statistics.daily_totals(SOURCE_SMART, days)
+
+        result_dict = {
+            date: {
                 "date": date.isoformat(),
-                "external_event_count": 0,
-                "detection_event_count": 0,
-                "smart_event_count": 0
+                "external_event_count": external_event_history[date],
+                "detection_event_count": detection_event_history[date],
+                "smart_event_count": smart_event_history[date]
             }
-
-        # 处理外部事件数据
-        for date, count in external_event_history:
-            if date in result_dict: # 确保日期存在于初始化后的字典中
-                result_dict[date]["external_event_count"] = count
-
-        # 处理检测事件数据
-        for date, count in detection_event_history:
-            if date in result_dict:
-                result_dict[date]["detection_event_count"] = count
-
-        # 处理智能事件数据
-        for date, count in smart_event_history:
-            if date in result_dict:
-                result_dict[date]["smart_event_count"] = count
+            for date in days
+        }
 
         # 转换为列表并按日期排序
         result = sorted(result_dict.values(), key=lambda x: x["date"])
@@ -469,6 +382,7 @@ def get_dashboard_historical_data(db: Session = Depends(get_db)):
         raise HTTPException(status_code=500, detail="获取数据大屏历史数据事件数据失败")
 
 @router.get("/type-smart-data")
+@cached(ttl=5, tags=["dashboard"])
 def get_dashboard_type_data(db: Session = Depends(get_db)):
     """获取数据大屏检测类型数据"""
     try:       
@@ -480,73 +394,25 @@ def get_dashboard_type_data(db: Session = Depends(get_db)):
         day_before_yesterday_start = today_start - timedelta(days=2)
         day_before_yesterday_end = yesterday_start - timedelta(microseconds=1)  # 前天结束时刻是昨天开始前一微秒
 
-        # 定义一个函数来执行针对特定事件模型和分类字段的统计查询
-        def get_event_stats(event_model, category_field, timestamp_field,id_field):
-            """获取指定事件模型在三个时间段的统计信息（今天、昨天、前天）"""
-            
-            total_stats = db.query(
-                category_field.label('category'),
-                func.count(id_field).label('total_count')
-            ).filter(
-                category_field.isnot(None),
-            ).group_by(category_field).all()
-
-            # 今天数据统计
-            today_stats = db.query(
-                category_field.label('category'),
-                func.count(id_field).label('today_count')
-            ).filter(
-                and_(
-                    category_field.isnot(None),
-                    timestamp_field >= today_start,
-                    timestamp_field <= now  # 到今天当前时刻为止
-                )
-            ).group_by(category_field).all()
-            
-            # 昨天数据统计
-            yesterday_stats = db.query(
-                category_field.label('category'),
-                func.count(id_field).label('yesterday_count')
-            ).filter(
-                and_(
-                    category_field.isnot(None),
-                    timestamp_field >= yesterday_start,
-                    timestamp_field <= yesterday_end
-                )
-            ).group_by(category_field).all()
-            
-            # 前天数据统计
-            day_before_yesterday_stats = db.query(
-                category_field.label('category'),
-                func.count(id_field).label('day_before_yesterday_count')
-            ).filter(
-                and_(
-                    category_field.isnot(None),
-                    timestamp_field >= day_before_yesterday_start,
-                    timestamp_field <= day_before_yesterday_end
-                )
-            ).group_by(category_field).all()
-            
-            # 将查询结果转换为字典以便后续合并，键为 category
-            total_dict = {category: count for category, count in total_stats}
-            today_dict = {category: count for category, count in today_stats}
-            yesterday_dict = {category: count for category, count in yesterday_stats}
-            day_before_yesterday_dict = {category: count for category, count in day_before_yesterday_stats}
-            
+        # 从内存中的事件计数读取指定来源在各时间段的分类统计
+        def get_event_stats(source):
+            """获取指定事件来源的分类统计（总数、今天、昨天、前天）"""
             return {
-                'total_dict': total_dict,
-                'today_dict': today_dict,
-                'yesterday_dict': yesterday_dict,
-                'day_before_yesterday_dict': day_before_yesterday_dict
+                'total_dict': event_statistics.group_by(source, "category", skip_empty=True),
+                'today_dict': event_statistics.group_by(source, "category", day=today_start.date(), skip_empty=True),
+                'yesterday_dict': event_statistics.group_by(source, "category", day=yesterday_start.date(), skip_empty=True),
+                'day_before_yesterday_dict': event_statistics.group_by(
+                    source, "category", day=day_before_yesterday_start.date(), skip_empty=True
+                )
             }
 
         # 获取三种事件类型的统计信息
         # ExternalEvent 按 engine_name 分类
-        external_stats = get_event_stats(ExternalEvent, ExternalEvent.engine_name, ExternalEvent.timestamp,ExternalEvent.event_id)
+        external_stats = get_event_stats(SOURCE_EXTERNAL)
         # DetectionEvent 按 event_type 分类
-        detection_stats = get_event_stats(DetectionEvent, DetectionEvent.event_type, DetectionEvent.created_at,DetectionEvent.event_id)
+        detection_stats = get_event_stats(SOURCE_DETECTION)
         # SmartEvent 按 event_type 分类
-        smart_stats = get_event_stats(SmartEvent, SmartEvent.event_type, SmartEvent.timestamp,SmartEvent.id)
+        smart_stats = get_event_stats(SOURCE_SMART)
 
         # 获取所有可能的分类名（合并三种事件类型中的分类名）
         all_categories = set()
@@ -628,6 +494,7 @@ def get_dashboard_type_data(db: Session = Depends(get_db)):
         raise HTTPException(status_code=500, detail="获取数据大屏检测类型数据失败")
 
 @router.get("/system-status")
+@cached(ttl=5, tags=["dashboard"])
 def get_system_status():
     """获取系统资源状态"""
     try:
@@ -1,8 +1,10 @@
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
 from sqlalchemy.orm import Session
 from typing import List, Optional, Dict, Any
 from datetime import datetime, timedelta
 import uuid
+import mimetypes
+import urllib.parse
 import asyncio
 
 from src.database import (
@@ -10,70 +12,34 @@ from src.database import (
     ListenerType, ExternalEventType, EventStatus, User
 )
 from api.auth import get_current_user
+from src.pagination import TOTAL_MODE_PATTERN, count_total, fetch_page
 from api.logger import log_action
+from api.file_responses import file_response
+from src.image_store import VARIANT_PATTERN, resolve_event_file, variant_path
 
 router = APIRouter(prefix="/data-listeners", tags=["数据监听"])
 
 # 图片服务接口
 @router.get("/images/{image_path:path}")
-async def get_image(image_path: str):
-    """获取图片文件"""
+async def get_image(
+    image_path: str,
+    request: Request,
+    size: Optional[str] = Query(None, pattern=VARIANT_PATTERN, description="预览尺寸: thumb/medium，默认原图")
+):
+    """获取图片文件，支持 ETag/Last-Modified 条件请求和 Range 请求"""
     try:
-        from fastapi.responses import FileResponse
-        from pathlib import Path
-        import urllib.parse
-        import os
-        
-        # 解码图片路径
-        decoded_path = urllib.parse.unquote(image_path)
-        
-        # 处理Windows路径分隔符
-        decoded_path = decoded_path.replace('\\', '/')
-        
-        # 构建完整的文件路径
-        full_path = Path(decoded_path)
-        
-        # 如果路径不是绝对路径，检查是否在当前工作目录下
-        if not full_path.is_absolute():
-            # 尝试在当前工作目录下查找
-            full_path = Path.cwd() / decoded_path
-        
-        # 安全检查：确保文件路径存在且在合理范围内
-        if not full_path.exists() or not full_path.is_file():
-            # 如果文件不存在，尝试在几个常见目录中查找
-            possible_dirs = [
-                Path.cwd(),
-                Path.cwd() / "storage",
-                Path.cwd() / "images",
-                Path.cwd() / "data"
-            ]
-            
-            found = False
-            for base_dir in possible_dirs:
-                test_path = base_dir / decoded_path
-                if test_path.exists() and test_path.is_file():
-                    full_path = test_path
-                    found = True
-                    break
-            
-            if not found:
-                raise HTTPException(status_code=404, detail="文件不存在")
+        # 解码图片路径，相对路径依次在常见存储目录中查找
+        full_path = resolve_event_file(urllib.parse.unquote(image_path))
+        if full_path is None:
+            raise HTTPException(status_code=404, detail="文件不存在")
+        full_path = variant_path(full_path, size)
         
         # 获取文件的MIME类型
-        import mimetypes
         mime_type, _ = mimetypes.guess_type(str(full_path))
         if mime_type is None or not mime_type.startswith('image/'):
             mime_type = "image/jpeg"  # 默认JPEG类型
         
-        # 返回文件
-        return FileResponse(
-            path=str(full_path),
-            media_type=mime_type,
-            headers={
-                "Cache-Control": "public, max-age=3600",  # 缓存1小时
-                "Content-Disposition": f"inline; filename={full_path.name}"
-            }
-        )
+        return file_response(request, full_path, media_type=mime_type, filename=full_path.name)
         
     except HTTPException:
         raise
@@ -92,9 +58,11 @@ async def get_external_events(
     end_time: Optional[datetime] = Query(None, description="结束时间"),
     page: int = Query(1, ge=1, description="页码"),
     size: int = Query(20, ge=1, le=100, description="每页大小"),
+    cursor: Optional[str] = Query(None, description="分页游标，传入时忽略页码"),
+    total_mode: str = Query("exact", pattern=TOTAL_MODE_PATTERN, description="总数统计方式: exact/estimated/none"),
     db: Session = Depends(get_db)
 ):
-    """获取外部事件列表"""
+    """获取外部事件列表，传入 cursor 时按 (timestamp, event_id) 游标翻页"""
     try:
         query = db.query(ExternalEvent)
         
@@ -116,12 +84,15 @@ async def get_external_events(
         if end_time:
             query = query.filter(ExternalEvent.timestamp <= end_time)
         
-        # 按时间倒序
-        query = query.order_by(ExternalEvent.timestamp.desc())
-        
-        # 分页
-        total = query.count()
-        events = query.offset((page - 1) * size).limit(size).all()
+        # 分页（按时间倒序）
+        total, total_estimated = count_total(db, query, total_mode)
+        try:
+            events, next_cursor = fetch_page(
+                query, ExternalEvent.timestamp, ExternalEvent.event_id, size,
+                cursor=cursor, offset=(page - 1) * size
+            )
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
         
         event_list = []
         for event in events:
@@ -158,11 +129,15 @@ async def get_external_events(
                     "page": page,
                     "size": size,
                     "total": total,
-                    "pages": (total + size - 1) // size
+                    "total_estimated": total_estimated,
+                    "pages": (total + size - 1) // size if total is not None else None,
+                    "next_cursor": next_cursor
                 }
             }
         }
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"获取事件列表失败: {str(e)}")
 
@@ -9,6 +9,7 @@ import re
 
 from src.database import get_db, DetectionConfig, Device, CrowdAnalysisJob, DetectionModel, CrowdAnalysisResult
 from src.crowd_analyzer import crowd_analyzer
+from src.crowd_rollup import BUCKET_NAMES, SCOPE_CAMERA, SCOPE_JOB, pick_bucket_seconds, query_rollups
 from api.auth import get_current_user, User
 from api.logger import log_action
 # 配置日志
@@ -269,15 +270,23 @@ async def get_analysis_jobs(
         "total_pages": (total_count + page_size - 1) // page_size
     }
 
+def _with_previews(job_id: str, last_result: Optional[Dict]) -> Optional[Dict]:
+    """为最近一次结果的摄像头列表附上该任务缓存的预览图"""
+    if not last_result or not last_result.get("camera_counts"):
+        return last_result
+    return {**last_result, "camera_counts": crowd_analyzer.attach_previews(job_id, last_result["camera_counts"])}
+
 @router.get("/jobs/{job_id}", response_model=AnalysisJobResponse)
 async def get_analysis_job(
     job_id: str,
     db: Session = Depends(get_db)
 ):
-    """获取特定分析任务的详情"""
+    """获取特定分析任务的详情（附带各摄像头缓存的预览图）"""
     # 从内存中查找任务
     memory_jobs = crowd_analyzer.get_analysis_jobs()
     memory_job = next((j for j in memory_jobs if j.get("job_id") == job_id), None)
+    # 详情页正在查看，之后的定时分析也生成预览图
+    crowd_analyzer.subscribe_previews(job_id)
     
     # 从数据库获取任务
     db_job = db.query(CrowdAnalysisJob).filter(CrowdAnalysisJob.job_id == job_id).first()
@@ -303,7 +312,7 @@ async def get_analysis_job(
             "is_active": db_job.is_active,
             "last_run": memory_job.get("last_run"),
             "status": memory_job.get("status", "paused" if not db_job.is_active else "created"),
-            "last_result": memory_job.get("last_result"),
+            "last_result": _with_previews(job_id, memory_job.get("last_result")),
             "last_error": memory_job.get("last_error")
         }
     else:
@@ -440,7 +449,9 @@ async def run_analysis_job_now(
             job.get("models_id"),
             job.get("tags", []), 
             job.get("location_info", {}),
-            job.get("detect_classes", [])
+            job.get("detect_classes", []),
+            job.get("confidence_threshold", 0.5),
+            render_preview=True
         )
     
     background_tasks.add_task(run_job)
@@ -594,56 +605,86 @@ async def get_devices_details(
     
     return devices_details
 
+def _parse_history_datetime(value: Optional[str], label: str) -> Optional[datetime]:
+    """解析历史查询时间，带时区的时间转换为本地时间（数据库中按本地时间存储）"""
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        logger.warning(f"无效的{label}格式: {value}")
+        return None
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone().replace(tzinfo=None)
+    return parsed
+
 @router.get("/jobs/{job_id}/history")
 async def get_analysis_history(
     job_id: str,
     start_date: Optional[str] = None,
     end_date: Optional[str] = None,
+    bucket: Optional[str] = "auto",
     db: Session = Depends(get_db)
 ):
-    """获取分析任务的历史数据，用于展示趋势图"""
+    """获取分析任务的历史数据，用于展示趋势图
+    
+    bucket: auto（按时间范围自动选择）、raw（原始记录）或 1m/15m/1h/1d
+    """
     # 检查任务是否存在
     job = db.query(CrowdAnalysisJob).filter(CrowdAnalysisJob.job_id == job_id).first()
     if not job:
         raise HTTPException(status_code=404, detail=f"分析任务不存在: {job_id}")
     
-    # 构建查询
-    query = db.query(CrowdAnalysisResult).filter(CrowdAnalysisResult.job_id == job_id)
+    start_datetime = _parse_history_datetime(start_date, "开始日期")
+    end_datetime = _parse_history_datetime(end_date, "结束日期")
     
-    # 添加日期过滤
-    if start_date:
-        try:
-            start_datetime = datetime.fromisoformat(start_date.replace('Z', '+00:00'))
-            query = query.filter(CrowdAnalysisResult.timestamp >= start_datetime)
-        except ValueError:
-            logger.warning(f"无效的开始日期格式: {start_date}")
+    # 选择时间桶大小
+    if bucket in BUCKET_NAMES:
+        bucket_seconds = BUCKET_NAMES[bucket]
+    elif bucket == "raw":
+        bucket_seconds = None
+    else:
+        range_start = start_datetime or job.created_at or datetime.min
+        range_end = end_datetime or datetime.now()
+        bucket_seconds = pick_bucket_seconds(range_start, range_end)
     
-    if end_date:
-        try:
-            end_datetime = datetime.fromisoformat(end_date.replace('Z', '+00:00'))
-            query = query.filter(CrowdAnalysisResult.timestamp <= end_datetime)
-        except ValueError:
-            logger.warning(f"无效的结束日期格式: {end_date}")
+    if bucket_seconds is None:
+        response_data = _get_raw_history(db, job_id, start_datetime, end_datetime)
+    else:
+        response_data = _get_bucketed_history(db, job, bucket_seconds, start_datetime, end_datetime)
     
-    # 按时间排序
-    query = query.order_by(CrowdAnalysisResult.timestamp)
+    return {
+        "job_id": job_id,
+        "job_name": job.job_name,
+        "bucket_seconds": bucket_seconds,
+        "data_points": response_data
+    }
+
+def _get_raw_history(db: Session, job_id: str, start_datetime: Optional[datetime],
+                     end_datetime: Optional[datetime]) -> List[Dict]:
+    """逐条返回原始分析结果（短时间范围）"""
+    query = db.query(
+        CrowdAnalysisResult.timestamp,
+        CrowdAnalysisResult.total_person_count,
+        CrowdAnalysisResult.camera_counts
+    ).filter(CrowdAnalysisResult.job_id == job_id)
     
-    # 获取结果
-    results = query.all()
+    if start_datetime:
+        query = query.filter(CrowdAnalysisResult.timestamp >= start_datetime)
+    if end_datetime:
+        query = query.filter(CrowdAnalysisResult.timestamp <= end_datetime)
     
-    # 格式化响应
     response_data = []
-    for result in results:
-        # 提取主要数据点
+    for timestamp, total_person_count, camera_counts in query.order_by(CrowdAnalysisResult.timestamp):
         data_point = {
-            "timestamp": result.timestamp.isoformat(),
-            "total_person_count": result.total_person_count,
+            "timestamp": timestamp.isoformat(),
+            "total_person_count": total_person_count,
             "camera_counts": []
         }
         
         # 添加各摄像头的数据
-        if result.camera_counts:
-            for camera in result.camera_counts:
+        if camera_counts:
+            for camera in camera_counts:
                 data_point["camera_counts"].append({
                     "device_id": camera.get("device_id"),
                     "device_name": camera.get("device_name"),
@@ -652,11 +693,46 @@ async def get_analysis_history(
         
         response_data.append(data_point)
     
-    return {
-        "job_id": job_id,
-        "job_name": job.job_name,
-        "data_points": response_data
-    }
+    return response_data
+
+def _get_bucketed_history(db: Session, job: CrowdAnalysisJob, bucket_seconds: int,
+                          start_datetime: Optional[datetime], end_datetime: Optional[datetime]) -> List[Dict]:
+    """从时间桶汇总表读取趋势数据，人数取桶内平均值，并附带最小/最大/最新值"""
+    range_start = start_datetime or job.created_at or datetime.min
+    range_end = end_datetime or datetime.now()
+    
+    totals = query_rollups(db, SCOPE_JOB, bucket_seconds, range_start, range_end, job_id=job.job_id)
+    cameras = query_rollups(db, SCOPE_CAMERA, bucket_seconds, range_start, range_end, job_id=job.job_id)
+    
+    device_names = {}
+    device_ids = {camera["series_id"] for camera in cameras}
+    if device_ids:
+        device_names = dict(
+            db.query(Device.device_id, Device.device_name).filter(Device.device_id.in_(device_ids)).all()
+        )
+    
+    cameras_by_bucket = {}
+    for camera in cameras:
+        cameras_by_bucket.setdefault(camera["bucket_start"], []).append({
+            "device_id": camera["series_id"],
+            "device_name": device_names.get(camera["series_id"]),
+            "person_count": round(camera["avg"]),
+            "min": camera["min"],
+            "max": camera["max"],
+            "avg": camera["avg"],
+            "last": camera["last"]
+        })
+    
+    return [{
+        "timestamp": total["bucket_start"].isoformat(),
+        "total_person_count": round(total["avg"]),
+        "min": total["min"],
+        "max": total["max"],
+        "avg": total["avg"],
+        "last": total["last"],
+        "sample_count": total["sample_count"],
+        "camera_counts": cameras_by_bucket.get(total["bucket_start"], [])
+    } for total in totals]
 
 @router.put("/jobs/{job_id}", response_model=AnalysisJobResponse)
 async def update_analysis_job(
@@ -0,0 +1,131 @@
+"""
+文件响应 - 强 ETag、Last-Modified 条件请求和单段 Range 请求
+
+事件图片（见 src/image_store）写入后内容不再变化，以文件名中的内容摘要作为 ETag 并允许长期缓存；
+其他文件以 大小+修改时间 作为 ETag。完整文件由 FileResponse 分块发送，不整体读入内存。
+"""
+import mimetypes
+import os
+import re
+from email.utils import formatdate, parsedate_to_datetime
+from pathlib import Path
+from typing import Optional
+
+import anyio
+from fastapi import Request
+from starlette.responses import FileResponse, Response
+
+from api.response_cache import etag_matches, make_etag
+from src.image_store import content_etag
+
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+DEFAULT_CACHE_CONTROL = "public, max-age=3600"
+RANGE_CHUNK_SIZE = 64 * 1024
+
+_RANGE_PATTERN = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+class RangeFileResponse(Response):
+    """返回文件中的一段字节（206）"""
+
+    def __init__(self, path: Path, start: int, end: int, size: int, headers: dict, media_type: str):
+        super().__init__(status_code=206, headers=headers, media_type=media_type)
+        self.path = path
+        self.start = start
+        self.end = end
+        self.headers["content-range"] = f"bytes {start}-{end}/{size}"
+        self.headers["content-length"] = str(end - start + 1)
+
+    async def __call__(self, scope, receive, send):
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        remaining = self.end - self.start + 1
+        async with await anyio.open_file(self.path, mode="rb") as file:
+            await file.seek(self.start)
+            while remaining > 0:
+                chunk = await file.read(min(RANGE_CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                await send({"type": "http.response.body", "body": chunk, "more_body": remaining > 0})
+        if remaining > 0:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+
+def _not_modified(request: Request, etag: str, mtime: float) -> bool:
+    if request.headers.get("if-none-match"):
+        return etag_matches(request, etag)
+    since = request.headers.get("if-modified-since")
+    if since:
+        try:
+            return int(mtime) <= parsedate_to_datetime(since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def _parse_range(header: str, size: int):
+    """解析单段 Range，返回 (start, end)；格式不支持时返回 None，范围无效时抛出 ValueError"""
+    match = _RANGE_PATTERN.match(header.strip())
+    if not match or (not match.group(1) and not match.group(2)):
+        return None
+    if match.group(1):
+        start = int(match.group(1))
+        end = min(int(match.group(2)), size - 1) if match.group(2) else size - 1
+    else:
+        # bytes=-N 表示最后 N 个字节
+        start = max(size - int(match.group(2)), 0)
+        end = size - 1
+    if start >= size or start > end:
+        raise ValueError(header)
+    return start, end
+
+
+def file_response(request: Request, path: Path, media_type: Optional[str] = None,
+                  cache_control: Optional[str] = None, filename: Optional[str] = None) -> Response:
+    """按条件请求头返回 304 / 206 / 完整文件"""
+    stat = os.stat(path)
+    etag = content_etag(path)
+    if etag is None:
+        etag = f'"{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+        cache_control = cache_control or DEFAULT_CACHE_CONTROL
+    else:
+        cache_control = cache_control or IMMUTABLE_CACHE_CONTROL
+
+    if media_type is None:
+        media_type = mimetypes.guess_type(str(path))[0] or "application/octet-stream"
+
+    headers = {
+        "ETag": etag,
+        "Last-Modified": formatdate(stat.st_mtime, usegmt=True),
+        "Cache-Control": cache_control,
+        "Accept-Ranges": "bytes",
+    }
+    if filename:
+        headers["Content-Disposition"] = f"inline; filename={filename}"
+
+    if _not_modified(request, etag, stat.st_mtime):
+        return Response(status_code=304, headers=headers)
+
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if range_header and (not if_range or if_range.strip() == etag):
+        try:
+            byte_range = _parse_range(range_header, stat.st_size)
+        except ValueError:
+            return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{stat.st_size}"})
+        if byte_range:
+            return RangeFileResponse(path, byte_range[0], byte_range[1], stat.st_size, headers, media_type)
+
+    return FileResponse(path, media_type=media_type, headers=headers, stat_result=stat)
+
+
+def bytes_response(request: Request, content: bytes, media_type: str,
+                   cache_control: str = DEFAULT_CACHE_CONTROL, filename: Optional[str] = None) -> Response:
+    """内存中的二进制内容（如数据库中的缩略图），ETag 取内容摘要"""
+    etag = make_etag(content)
+    headers = {"ETag": etag, "Cache-Control": cache_control}
+    if filename:
+        headers["Content-Disposition"] = f"inline; filename={filename}"
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=content, media_type=media_type, headers=headers)
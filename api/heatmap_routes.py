@@ -1,8 +1,13 @@
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form, status
-from fastapi.responses import FileResponse
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form, Request, status
+from fastapi.responses import FileResponse, JSONResponse, Response, StreamingResponse
+from starlette.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
 from src.database import get_db, HeatmapMap, HeatmapArea, HeatmapBinding, HeatmapDashboardConfig, HeatmapHistory,CrowdAnalysisJob
+from src.heatmap_dashboard import heatmap_snapshot, query_map_areas
+from src.crowd_rollup import BUCKET_NAMES, SCOPE_AREA, pick_bucket_seconds, query_rollups
+from api.response_cache import CachedRoute, cached, invalidates
 from typing import Optional, Dict, Any, List
+import asyncio
 import os
 import json
 import uuid
@@ -11,13 +16,17 @@ from PIL import Image
 import traceback
 from pydantic import BaseModel
 
-heatmap_router = APIRouter(prefix="/heatmap", tags=["热力图管理"])
+heatmap_router = APIRouter(prefix="/heatmap", tags=["热力图管理"], route_class=CachedRoute)
 
 # 文件上传配置
 UPLOAD_FOLDER = 'uploads/heatmaps'
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
 MAX_FILE_SIZE = 50 * 1024 * 1024  # 50MB
 
+# 展板推送配置
+STREAM_KEEPALIVE_SECONDS = 15  # SSE 心跳间隔
+STREAM_MIN_PUSH_INTERVAL = 1.0  # 两次推送的最小间隔，合并短时间内的多次更新
+
 # Pydantic 模型
 class HeatmapMapCreate(BaseModel):
     name: str
@@ -95,6 +104,7 @@ def ensure_upload_dir():
     return upload_path
 
 @heatmap_router.get("/maps", response_model=List[HeatmapMapResponse])
+@cached(ttl=60, tags=["heatmap_maps"])
 async def get_maps(db: Session = Depends(get_db)):
     """获取所有地图列表"""
     try:
@@ -129,6 +139,7 @@ async def get_maps(db: Session = Depends(get_db)):
         raise HTTPException(status_code=500, detail="获取地图列表失败")
 
 @heatmap_router.post("/maps", response_model=Dict[str, Any])
+@invalidates("heatmap_maps")
 async def upload_map(
     file: UploadFile = File(...),
     name: str = Form(...),
@@ -244,6 +255,7 @@ async def get_map_image(map_id: int, db: Session = Depends(get_db)):
         raise HTTPException(status_code=500, detail="获取图片失败")
 
 @heatmap_router.delete("/maps/{map_id}")
+@invalidates("heatmap_maps")
 async def delete_map(map_id: int, db: Session = Depends(get_db)):
     """删除地图（级联删除相关区域、绑定和图片文件）"""
     try:
@@ -289,6 +301,7 @@ async def delete_map(map_id: int, db: Session = Depends(get_db)):
         # 软删除地图
         db_map.is_active = False
         db.commit()
+        heatmap_snapshot.invalidate()
         
         message = f"地图 '{map_name}' 及相关数据删除成功"
         if file_deleted:
@@ -313,62 +326,8 @@ async def delete_map(map_id: int, db: Session = Depends(get_db)):
 async def get_map_areas(map_id: int, db: Session = Depends(get_db)):
     """获取地图的区域列表"""
     try:
-        # 使用SQLAlchemy ORM查询，包含LEFT JOIN绑定信息
-        query = db.query(HeatmapArea).filter(
-            HeatmapArea.map_id == map_id,
-            HeatmapArea.is_active == True
-        ).order_by(HeatmapArea.created_at.asc())
-        
-        areas = query.all()
-        
-        result = []
-        for area in areas:
-            # 获取该区域的绑定信息
-            binding = db.query(HeatmapBinding).filter(
-                HeatmapBinding.area_id == area.id,
-                HeatmapBinding.is_active == True
-            ).first()
-
-            if binding:
-                crowd_analysis = db.query(CrowdAnalysisJob).filter(CrowdAnalysisJob.job_id == binding.data_source_id).first()
-            else:
-                crowd_analysis = None
-            
-            # 安全获取人数统计
-            current_count = 0
-            if crowd_analysis and crowd_analysis.last_result:
-                try:
-                    if isinstance(crowd_analysis.last_result, dict):
-                        current_count = int(crowd_analysis.last_result.get("total_person_count", 0))
-                    else:
-                        # 如果last_result是JSON字符串，需要解析
-                        import json
-                        result_data = json.loads(crowd_analysis.last_result) if isinstance(crowd_analysis.last_result, str) else crowd_analysis.last_result
-                        current_count = int(result_data.get("total_person_count", 0))
-                except (ValueError, TypeError, json.JSONDecodeError):
-                    current_count = 0
-            
-            area_dict = {
-                "id": area.id,
-                "map_id": area.map_id,
-                "name": area.name,
-                "points": area.points,
-                "color": area.color,
-                "area_size": area.area_size,
-                "max_capacity": area.max_capacity,
-                "description": area.description,
-                "data_source_type": binding.data_source_type if binding else None,
-                "data_source_id": binding.data_source_id if binding else None,
-                "data_source_name": binding.data_source_name if binding else None,
-                "current_count": current_count,
-                "last_update_time": crowd_analysis.last_run if crowd_analysis else None,
-                "created_at": area.created_at,
-                "updated_at": area.updated_at,
-                "is_active": area.is_active
-            }
-            result.append(area_dict)
-        
-        return result
+        # 区域、生效绑定和人群分析任务一次关联查询
+        return await run_in_threadpool(query_map_areas, db, map_id)
         
     except Exception as e:
         print(f"获取区域列表错误: {e}")
@@ -393,6 +352,7 @@ async def create_area(area: HeatmapAreaCreate, db: Session = Depends(get_db)):
         
         db.add(db_area)
         db.commit()
+        heatmap_snapshot.invalidate()
         db.refresh(db_area)
         
         return {
@@ -437,6 +397,7 @@ async def update_area(area_id: int, area_data: Dict[str, Any], db: Session = Dep
         
         db_area.updated_at = datetime.now()
         db.commit()
+        heatmap_snapshot.invalidate()
         
         return {"success": True, "data": {"id": db_area.id}}
         
@@ -463,6 +424,7 @@ async def delete_area(area_id: int, db: Session = Depends(get_db)):
         # 软删除区域
         db_area.is_active = False
         db.commit()
+        heatmap_snapshot.invalidate()
         
         return {"success": True, "message": "区域及相关绑定删除成功"}
         
@@ -470,6 +432,50 @@ async def delete_area(area_id: int, db: Session = Depends(get_db)):
         print(f"删除区域错误: {e}")
         raise HTTPException(status_code=500, detail="删除区域失败")
 
+@heatmap_router.get("/areas/{area_id}/history")
+async def get_area_history(
+    area_id: int,
+    start_time: datetime,
+    end_time: Optional[datetime] = None,
+    bucket: str = "auto",
+    db: Session = Depends(get_db)
+):
+    """获取区域人数趋势（来自绑定任务的时间桶汇总）"""
+    if end_time is None:
+        end_time = datetime.now()
+    # 数据库按本地时间存储
+    if start_time.tzinfo is not None:
+        start_time = start_time.astimezone().replace(tzinfo=None)
+    if end_time.tzinfo is not None:
+        end_time = end_time.astimezone().replace(tzinfo=None)
+    if bucket in BUCKET_NAMES:
+        bucket_seconds = BUCKET_NAMES[bucket]
+    else:
+        # 区域只有汇总数据，范围很短时使用最小的桶
+        bucket_seconds = pick_bucket_seconds(start_time, end_time) or BUCKET_NAMES["1m"]
+    
+    try:
+        rows = query_rollups(db, SCOPE_AREA, bucket_seconds, start_time, end_time, series_id=str(area_id))
+        return {
+            'success': True,
+            'data': {
+                'area_id': area_id,
+                'bucket_seconds': bucket_seconds,
+                'points': [{
+                    'timestamp': row['bucket_start'].isoformat(),
+                    'avg': row['avg'],
+                    'min': row['min'],
+                    'max': row['max'],
+                    'last': row['last'],
+                    'sample_count': row['sample_count']
+                } for row in rows]
+            }
+        }
+        
+    except Exception as e:
+        print(f"获取区域历史数据错误: {e}")
+        raise HTTPException(status_code=500, detail="获取区域历史数据失败")
+
 @heatmap_router.post("/bindings")
 async def create_binding(binding: HeatmapBindingCreate, db: Session = Depends(get_db)):
     """创建数据绑定"""
@@ -494,6 +500,7 @@ async def create_binding(binding: HeatmapBindingCreate, db: Session = Depends(ge
         
         db.add(db_binding)
         db.commit()
+        heatmap_snapshot.invalidate()
         db.refresh(db_binding)
         
         return {
@@ -517,6 +524,7 @@ async def delete_binding(binding_id: int, db: Session = Depends(get_db)):
         # 软删除绑定
         db_binding.is_active = False
         db.commit()
+        heatmap_snapshot.invalidate()
         
         return {"success": True, "message": "数据绑定删除成功"}
         
@@ -541,6 +549,7 @@ async def delete_area_bindings(area_id: int, db: Session = Depends(get_db)):
             binding.is_active = False
         
         db.commit()
+        heatmap_snapshot.invalidate()
         
         return {"success": True, "message": "区域绑定删除成功"}
         
@@ -598,6 +607,7 @@ async def save_dashboard_config(config: HeatmapDashboardConfigModel, db: Session
         
         db.add(db_config)
         db.commit()
+        heatmap_snapshot.invalidate()
         db.refresh(db_config)
         
         return {
@@ -610,93 +620,58 @@ async def save_dashboard_config(config: HeatmapDashboardConfigModel, db: Session
         raise HTTPException(status_code=500, detail="保存展板配置失败")
 
 @heatmap_router.get("/dashboard/data")
-async def get_dashboard_data(db: Session = Depends(get_db)):
-    """获取展板显示数据"""
+async def get_dashboard_data(request: Request):
+    """获取展板显示数据（内存快照，支持 If-None-Match）"""
     try:
-        # 获取当前活跃的配置
-        config = db.query(HeatmapDashboardConfig).filter(
-            HeatmapDashboardConfig.is_active == True
-        ).order_by(HeatmapDashboardConfig.updated_at.desc()).first()
-        
-        if not config:
-            return {'success': True, 'data': {'areas': [], 'map': None}}
+        version, data, etag = await run_in_threadpool(heatmap_snapshot.get_with_etag)
         
-        # 获取地图信息
-        map_data = db.query(HeatmapMap).filter(
-            HeatmapMap.id == config.map_id,
-            HeatmapMap.is_active == True
-        ).first()
-        
-        # 获取区域和绑定数据
-        areas = db.query(HeatmapArea).filter(
-            HeatmapArea.map_id == config.map_id,
-            HeatmapArea.is_active == True
-        ).order_by(HeatmapArea.created_at.asc()).all()
-        
-        areas_data = []
-        for area in areas:
-            binding = db.query(HeatmapBinding).filter(
-                HeatmapBinding.area_id == area.id,
-                HeatmapBinding.is_active == True
-            ).first()
-
-            if binding:
-                crowd_analysis = db.query(CrowdAnalysisJob).filter(CrowdAnalysisJob.job_id == binding.data_source_id).first()
-            else:
-                crowd_analysis = None
-            
-            area_dict = {
-                "id": area.id,
-                "map_id": area.map_id,
-                "name": area.name,
-                "points": area.points,
-                "color": area.color,
-                "area_size": area.area_size,
-                "max_capacity": area.max_capacity,
-                "description": area.description,
-                "data_source_type": binding.data_source_type if binding else None,
-                "data_source_id": binding.data_source_id if binding else None,
-                "data_source_name": binding.data_source_name if binding else None,
-                "current_count": crowd_analysis.last_result.get("total_person_count", 0) if crowd_analysis and crowd_analysis.last_result else 0,
-                "last_update_time": crowd_analysis.last_run if crowd_analysis else None,
-                "created_at": area.created_at,
-                "updated_at": area.updated_at,
-                "is_active": area.is_active
-            }
-            areas_data.append(area_dict)
-        
-        map_dict = None
-        if map_data:
-            map_dict = {
-                "id": map_data.id,
-                "name": map_data.name,
-                "file_path": map_data.file_path,
-                "file_name": map_data.file_name,
-                "file_size": map_data.file_size,
-                "mime_type": map_data.mime_type,
-                "width": map_data.width,
-                "height": map_data.height,
-                "scale_factor": map_data.scale_factor,
-                "description": map_data.description,
-                "image_url": f"/api/v1/heatmap/maps/{map_data.id}/image",
-                "created_at": map_data.created_at,
-                "updated_at": map_data.updated_at,
-                "is_active": map_data.is_active,
-                "created_by": map_data.created_by
-            }
+        if request.headers.get("if-none-match") == etag:
+            return Response(status_code=304, headers={"ETag": etag})
         
-        return {
-            'success': True,
-            'data': {
-                'map': map_dict,
-                'areas': areas_data
-            }
-        }
+        return JSONResponse(
+            content={'success': True, 'version': version, 'data': data},
+            headers={"ETag": etag, "Cache-Control": "no-cache"}
+        )
         
     except Exception as e:
         print(f"获取展板数据错误: {e}")
         raise HTTPException(status_code=500, detail="获取展板数据失败")
 
+@heatmap_router.get("/dashboard/stream")
+async def stream_dashboard_data(request: Request):
+    """以 SSE 推送展板数据，快照版本变化时推送一次"""
+    
+    async def event_stream():
+        wakeup = heatmap_snapshot.subscribe()
+        last_version = request.headers.get("last-event-id")
+        try:
+            while not await request.is_disconnected():
+                try:
+                    version, data = await run_in_threadpool(heatmap_snapshot.get)
+                except Exception as e:
+                    print(f"构建展板快照错误: {e}")
+                    version, data = None, None
+                
+                if version is not None and str(version) != last_version:
+                    last_version = str(version)
+                    payload = json.dumps({'success': True, 'version': version, 'data': data}, ensure_ascii=False)
+                    yield f"id: {version}\nevent: snapshot\ndata: {payload}\n\n"
+                
+                try:
+                    await asyncio.wait_for(wakeup.get(), timeout=STREAM_KEEPALIVE_SECONDS)
+                    await asyncio.sleep(STREAM_MIN_PUSH_INTERVAL)
+                except asyncio.TimeoutError:
+                    # 心跳注释，保持连接
+                    yield ": keepalive\n\n"
+        finally:
+            heatmap_snapshot.unsubscribe(wakeup)
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 def calculate_polygon_area(points, scale_factor=1.0):
     """使用鞋带公式计算多边形面积"""
     if len(points) < 3:
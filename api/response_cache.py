@@ -0,0 +1,235 @@
+"""
+接口响应缓存 - 读多写少的 GET 接口按 路由+规范化查询参数 缓存序列化后的响应体
+
+用法:
+    router = APIRouter(route_class=CachedRoute)
+
+    @router.get("/devices/")
+    @cached(ttl=10, tags=["devices"])
+    def get_devices(...): ...
+
+    @router.post("/devices/")
+    @invalidates("devices")
+    def create_device(...): ...
+
+命中缓存时不再执行接口函数及其依赖，因此只用于不依赖当前登录用户的接口。
+响应带强 ETag，客户端携带 If-None-Match 且内容未变化时返回 304。
+"""
+import asyncio
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Iterable, Optional, Set, Tuple
+
+from fastapi import Request
+from fastapi.routing import APIRoute
+from starlette.responses import Response, StreamingResponse, FileResponse
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_ENTRIES = 512
+MAX_CACHED_BODY_BYTES = 2 * 1024 * 1024  # 超过2MB的响应不缓存
+
+_CACHE_ATTR = "_response_cache_config"
+_INVALIDATE_ATTR = "_response_cache_invalidates"
+
+
+class _CacheEntry:
+    __slots__ = ("expires_at", "etag", "body", "media_type", "tags")
+
+    def __init__(self, expires_at: float, etag: str, body: bytes, media_type: Optional[str], tags: Tuple[str, ...]):
+        self.expires_at = expires_at
+        self.etag = etag
+        self.body = body
+        self.media_type = media_type
+        self.tags = tags
+
+
+class ResponseCache:
+    """进程内 LRU 响应缓存，按标签失效"""
+
+    def __init__(self, max_entries: int = DEFAULT_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, _CacheEntry]" = OrderedDict()
+        self._tag_keys: Dict[str, Set[str]] = {}
+        self._inflight: Dict[str, asyncio.Lock] = {}
+        self._lock = threading.Lock()
+
+        # 统计信息
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(self, key: str) -> Optional[_CacheEntry]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry.expires_at <= time.monotonic():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key: str, entry: _CacheEntry):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = entry
+            for tag in entry.tags:
+                self._tag_keys.setdefault(tag, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def invalidate(self, *tags: str):
+        """使带有任一标签的缓存失效"""
+        with self._lock:
+            for tag in tags:
+                for key in list(self._tag_keys.get(tag, ())):
+                    self._remove(key)
+            self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._tag_keys.clear()
+
+    def get_stats(self) -> Dict[str, int]:
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+        }
+
+    def key_lock(self, key: str) -> asyncio.Lock:
+        """同一缓存键的并发未命中只执行一次接口函数"""
+        lock = self._inflight.get(key)
+        if lock is None:
+            lock = self._inflight[key] = asyncio.Lock()
+        return lock
+
+    def release_key_lock(self, key: str, lock: asyncio.Lock):
+        if not lock.locked() and self._inflight.get(key) is lock:
+            del self._inflight[key]
+
+    def _remove(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        for tag in entry.tags:
+            keys = self._tag_keys.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tag_keys[tag]
+
+
+def cached(ttl: float, tags: Iterable[str] = ()) -> Callable:
+    """标记 GET 接口使用响应缓存（需要所在路由器使用 CachedRoute）"""
+    def decorator(func: Callable) -> Callable:
+        setattr(func, _CACHE_ATTR, (ttl, tuple(tags)))
+        return func
+    return decorator
+
+
+def invalidates(*tags: str) -> Callable:
+    """标记写接口成功后使指定标签的缓存失效"""
+    def decorator(func: Callable) -> Callable:
+        setattr(func, _INVALIDATE_ATTR, tuple(tags))
+        return func
+    return decorator
+
+
+def make_etag(body: bytes) -> str:
+    return '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    candidates = [value.strip() for value in header.split(",")]
+    return "*" in candidates or etag in candidates or f"W/{etag}" in candidates
+
+
+def cache_key(request: Request) -> str:
+    """路由路径 + 规范化后的查询参数（排序、去掉空值）"""
+    params = sorted((name, value) for name, value in request.query_params.multi_items() if value != "")
+    query = "&".join(f"{name}={value}" for name, value in params)
+    return f"{request.method} {request.url.path}?{query}"
+
+
+def _conditional_response(request: Request, etag: str, body: bytes, media_type: Optional[str],
+                          cache_status: str) -> Response:
+    headers = {"ETag": etag, "Cache-Control": "no-cache", "X-Cache": cache_status}
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type=media_type, headers=headers)
+
+
+class CachedRoute(APIRoute):
+    """支持 @cached / @invalidates 标记的路由类"""
+
+    def get_route_handler(self) -> Callable:
+        original_handler = super().get_route_handler()
+        cache_config = getattr(self.endpoint, _CACHE_ATTR, None)
+        invalidate_tags = getattr(self.endpoint, _INVALIDATE_ATTR, None)
+
+        if cache_config is not None:
+            ttl, tags = cache_config
+
+            async def cached_handler(request: Request) -> Response:
+                if request.method != "GET":
+                    return await original_handler(request)
+
+                key = cache_key(request)
+                entry = response_cache.get(key)
+                if entry is not None:
+                    response_cache.hits += 1
+                    return _conditional_response(request, entry.etag, entry.body, entry.media_type, "HIT")
+
+                lock = response_cache.key_lock(key)
+                try:
+                    async with lock:
+                        # 等待期间其他请求可能已经写入缓存
+                        entry = response_cache.get(key)
+                        if entry is not None:
+                            response_cache.hits += 1
+                            return _conditional_response(request, entry.etag, entry.body, entry.media_type, "HIT")
+
+                        response_cache.misses += 1
+                        response = await original_handler(request)
+                        if (response.status_code != 200
+                                or isinstance(response, (StreamingResponse, FileResponse))
+                                or len(response.body) > MAX_CACHED_BODY_BYTES):
+                            return response
+
+                        body = bytes(response.body)
+                        etag = make_etag(body)
+                        response_cache.put(key, _CacheEntry(
+                            time.monotonic() + ttl, etag, body, response.media_type, tags
+                        ))
+                        return _conditional_response(request, etag, body, response.media_type, "MISS")
+                finally:
+                    response_cache.release_key_lock(key, lock)
+
+            return cached_handler
+
+        if invalidate_tags:
+
+            async def invalidating_handler(request: Request) -> Response:
+                response = await original_handler(request)
+                if response.status_code < 400:
+                    response_cache.invalidate(*invalidate_tags)
+                return response
+
+            return invalidating_handler
+
+        return original_handler
+
+
+# 全局响应缓存实例
+response_cache = ResponseCache()
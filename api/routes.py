@@ -1,15 +1,22 @@
-from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File, Form, Query
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File, Form, Query, Request
+from sqlalchemy.orm import Session, contains_eager
 from typing import List, Optional, Dict, Any
 from datetime import datetime, timedelta
 from src.database import get_db, Device, User, SysLog, DetectionModel, DetectionConfig, DetectionEvent, DetectionPerformance, SaveMode, EventStatus, DetectionFrequency, DetectionLog, CrowdAnalysisJob,CrowdAnalysisResult, DataPushConfig, EdgeServer,ExternalEvent,ListenerConfig,SmartEvent
 from src.rtsp_url import build_rtsp_url, RTSP_URL_PRESETS
+from src.pagination import TOTAL_MODE_PATTERN, count_total, fetch_page
+from src.event_statistics import event_statistics, SOURCE_DETECTION, SOURCE_EXTERNAL, SOURCE_SMART
 from pydantic import BaseModel, Field, validator
 from fastapi.security import OAuth2PasswordRequestForm
 from api.auth import authenticate_user, create_access_token, ACCESS_TOKEN_EXPIRE_MINUTES, get_current_user, check_admin_permission, get_password_hash, verify_password
 from api.logger import log_action
+from api.response_cache import CachedRoute, cached, invalidates
+from api.file_responses import file_response, bytes_response
+from src.image_store import VARIANT_PATTERN, remove_event_file, variant_path
+from src.snapshot_client import build_snapshot_url, snapshot_clients
 from passlib.context import CryptContext
 from fastapi.responses import FileResponse, Response, StreamingResponse
+from starlette.concurrency import run_in_threadpool
 import requests
 
 import os
@@ -23,7 +30,7 @@ from pathlib import Path
 from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy import func, text, desc, and_, or_
 
-router = APIRouter()
+router = APIRouter(route_class=CachedRoute)
 
 # Pydantic模型定义
 class Point(BaseModel):
@@ -86,6 +93,7 @@ class DeviceUpdate(BaseModel):
 
 # 设备管理API
 @router.post("/devices/", response_model=DeviceResponse, tags=["设备管理"])
+@invalidates("devices", "dashboard")
 def create_device(device: DeviceCreate, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
     # 处理IP地址，将IPv4Address转换为字符串
     device_data = device.dict()
@@ -104,6 +112,7 @@ def create_device(device: DeviceCreate, db: Session = Depends(get_db), current_u
         raise HTTPException(status_code=400, detail=str(e))
 
 @router.get("/devices/", tags=["设备管理"])
+@cached(ttl=10, tags=["devices"])
 def get_devices(
     skip: int = 0, 
     limit: int = 100, 
@@ -177,6 +186,7 @@ def get_device(device_id: str, db: Session = Depends(get_db)):
     return device
 
 @router.get("/alldevices/status", tags=["设备管理"])
+@invalidates("devices", "dashboard")
 def update_device_status(db: Session = Depends(get_db)):
     devices = db.query(Device).all()
     for device in devices:
@@ -229,6 +239,7 @@ def get_device_rtsp_url(device_id: str, db: Session = Depends(get_db)):
     }
 
 @router.put("/devices/{device_id}", response_model=DeviceResponse, tags=["设备管理"])
+@invalidates("devices", "data_push", "dashboard")
 def update_device(device_id: str, device: DeviceUpdate, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
     db_device = db.query(Device).filter(Device.device_id == device_id).first()
     if not db_device:
@@ -274,7 +285,7 @@ def _delete_device_with_relations(db: Session, device: Device) -> None:
         for event in events:
             try:
                 if event.thumbnail_path and os.path.exists(event.thumbnail_path):
-                    os.remove(event.thumbnail_path)
+                    remove_event_file(event.thumbnail_path)
                 if event.snippet_path and os.path.exists(event.snippet_path):
                     os.remove(event.snippet_path)
             except OSError as e:
@@ -287,7 +298,7 @@ def _delete_device_with_relations(db: Session, device: Device) -> None:
     for event in device_events:
         try:
             if event.thumbnail_path and os.path.exists(event.thumbnail_path):
-                os.remove(event.thumbnail_path)
+                remove_event_file(event.thumbnail_path)
             if event.snippet_path and os.path.exists(event.snippet_path):
                 os.remove(event.snippet_path)
         except OSError as e:
@@ -313,6 +324,7 @@ def _delete_device_with_relations(db: Session, device: Device) -> None:
     db.delete(device)
 
 @router.delete("/devices/{device_id}", tags=["设备管理"])
+@invalidates("devices", "data_push", "dashboard")
 def delete_device(device_id: str, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
     device = db.query(Device).filter(Device.device_id == device_id).first()
     if not device:
@@ -332,6 +344,7 @@ def delete_device(device_id: str, db: Session = Depends(get_db), current_user: U
         raise HTTPException(status_code=400, detail=str(e))
 
 @router.post("/devices/batch-delete", tags=["设备管理"])
+@invalidates("devices", "data_push", "dashboard")
 def batch_delete_devices(
     request_data: Dict[str, List[str]],
     db: Session = Depends(get_db),
@@ -731,6 +744,7 @@ def _build_model_download_filename(models_name: str, file_suffix: str) -> str:
 
 # 模型管理API
 @router.get("/models/", response_model=List[ModelResponse], tags=["检测模型"])
+@cached(ttl=60, tags=["models"])
 def get_models(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
     """获取所有检测模型列表"""
     models = db.query(DetectionModel).order_by(DetectionModel.upload_time.desc()).offset(skip).limit(limit).all()
@@ -767,6 +781,7 @@ def download_model(
     )
 
 @router.post("/models/", response_model=ModelResponse, tags=["检测模型"])
+@invalidates("models", "dashboard")
 async def upload_model(
     models_file: UploadFile = File(...),
     models_name: str = Form(...),
@@ -870,6 +885,7 @@ async def upload_model(
     return db_model
 
 @router.delete("/models/{models_id}", tags=["检测模型"])
+@invalidates("models", "data_push", "dashboard")
 def delete_model(models_id: str, db: Session = Depends(get_db),
                 current_user: User = Depends(get_current_user)):
     """删除模型"""
@@ -911,7 +927,7 @@ def delete_model(models_id: str, db: Session = Depends(get_db),
                     # 删除事件关联的图片文件
                     try:
                         if event.thumbnail_path and os.path.exists(event.thumbnail_path):
-                            os.remove(event.thumbnail_path)
+                            remove_event_file(event.thumbnail_path)
                         if event.snippet_path and os.path.exists(event.snippet_path):
                             os.remove(event.snippet_path)
                     except OSError as e:
@@ -948,6 +964,7 @@ def delete_model(models_id: str, db: Session = Depends(get_db),
         raise HTTPException(status_code=400, detail=str(e))
 
 @router.put("/models/{models_id}", response_model=ModelResponse, tags=["检测模型"])
+@invalidates("models", "dashboard")
 def update_model(
     models_id: str, 
     model_update: ModelUpdate, 
@@ -980,6 +997,7 @@ def update_model(
         raise HTTPException(status_code=500, detail=f"更新模型失败: {str(e)}")
 
 @router.put("/models/{models_id}/toggle", tags=["检测模型"])
+@invalidates("models", "dashboard")
 def toggle_models_active(models_id: str, active: bool, db: Session = Depends(get_db),
                        current_user: User = Depends(get_current_user)):
     """切换模型激活状态"""
@@ -1258,6 +1276,7 @@ async def get_detection_config(
 
 # 创建检测配置
 @router.post("/detection/configs", response_model=DetectionConfigResponse, tags=["检测配置"])
+@invalidates("dashboard")
 async def create_detection_config(
     config: DetectionConfigCreate,
     db: Session = Depends(get_db),
@@ -1337,6 +1356,7 @@ async def create_detection_config(
 
 # 更新检测配置
 @router.put("/detection/configs/{config_id}", response_model=DetectionConfigResponse, tags=["检测配置"])
+@invalidates("dashboard")
 async def update_detection_config(
     config_id: str,
     config_update: DetectionConfigUpdate,
@@ -1429,6 +1449,7 @@ async def update_detection_config(
     return config_dict
 
 @router.put("/detection/configs/{config_id}/toggle", tags=["检测配置"])
+@invalidates("dashboard")
 def toggle_detection_active(config_id: str, enabled: bool, db: Session = Depends(get_db),
                        current_user: User = Depends(get_current_user)):
     """切换检测配置启用状态"""
@@ -1449,6 +1470,7 @@ def toggle_detection_active(config_id: str, enabled: bool, db: Session = Depends
 
 # 删除检测配置
 @router.delete("/detection/configs/{config_id}", tags=["检测配置"])
+@invalidates("data_push", "dashboard")
 async def delete_detection_config(
     config_id: str,
     db: Session = Depends(get_db),
@@ -1482,7 +1504,7 @@ async def delete_detection_config(
             # 删除事件关联的图片文件
             try:
                 if event.thumbnail_path and os.path.exists(event.thumbnail_path):
-                    os.remove(event.thumbnail_path)
+                    remove_event_file(event.thumbnail_path)
                 if event.snippet_path and os.path.exists(event.snippet_path):
                     os.remove(event.snippet_path)
             except OSError as e:
@@ -1514,11 +1536,15 @@ async def get_detection_events(
     min_confidence: Optional[float] = None,
     skip: int = 0,
     limit: int = 100,
+    cursor: Optional[str] = Query(None, description="分页游标，取自上一页返回的 next_cursor"),
+    total_mode: str = Query("exact", pattern=TOTAL_MODE_PATTERN, description="总数统计方式: exact/estimated/none"),
     db: Session = Depends(get_db)):
     """
     获取检测事件列表，支持多种筛选条件
+    
+    传入 cursor 时按 (created_at, event_id) 游标翻页，不再使用 skip
     """
-    query = db.query(DetectionEvent).join(DetectionConfig)
+    query = db.query(DetectionEvent).join(DetectionConfig).options(contains_eager(DetectionEvent.config))
     # 应用筛选条件
     if device_id:
         query = query.filter(DetectionEvent.device_id == device_id)
@@ -1540,12 +1566,15 @@ async def get_detection_events(
         query = query.filter(DetectionEvent.confidence >= min_confidence)
     
     # 获取总数
-    total_count = query.count()
+    total_count, total_estimated = count_total(db, query, total_mode)
     
     # 按时间倒序排列
-    query = query.order_by(desc(DetectionEvent.created_at))
-    
-    events = query.offset(skip).limit(limit).all()
+    try:
+        events, next_cursor = fetch_page(
+            query, DetectionEvent.created_at, DetectionEvent.event_id, limit, cursor=cursor, offset=skip
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     
     # 转换结果
     result = []
@@ -1592,7 +1621,9 @@ async def get_detection_events(
     # 返回包含总数的响应
     return {
         "data": result,
-        "total": total_count
+        "total": total_count,
+        "total_estimated": total_estimated,
+        "next_cursor": next_cursor
     }
 
 # 获取单个检测事件详情
@@ -1648,29 +1679,28 @@ async def get_detection_event(
     return event_dict
 
 @router.get("/detection/events/{event_id}/thumbnail", tags=["检测事件"])
-async def get_thumbnail(event_id: str, db: Session = Depends(get_db)):
-    """获取缩略图数据"""
-    event = db.query(DetectionEvent).filter(DetectionEvent.event_id == event_id).first() 
-
-    if not event or not event.thumbnail_data:
+async def get_thumbnail(
+    event_id: str,
+    request: Request,
+    size: str = Query("thumb", pattern=VARIANT_PATTERN, description="预览尺寸: thumb/medium"),
+    db: Session = Depends(get_db)
+):
+    """获取事件缩略图，优先使用写入时生成的预览文件，旧事件回退到数据库中的图像数据"""
+    thumbnail_path = db.query(DetectionEvent.thumbnail_path).filter(DetectionEvent.event_id == event_id).scalar()
+    if thumbnail_path and os.path.isfile(thumbnail_path):
+        return file_response(request, variant_path(Path(thumbnail_path), size),
+                             media_type="image/jpeg", filename=f"{event_id}.jpg")
+
+    thumbnail_data = db.query(DetectionEvent.thumbnail_data).filter(DetectionEvent.event_id == event_id).scalar()
+    if not thumbnail_data:
         raise HTTPException(status_code=404, detail="未找到图像数据")
     
-    # 添加缓存控制头
-    headers = {
-        "Content-Type": "image/jpeg",
-        "Cache-Control": "public, max-age=86400",
-        "Content-Disposition": f"inline; filename={event_id}.jpg"
-    }
-    
     # 验证二进制数据有效性
-    if not isinstance(event.thumbnail_data, bytes):
+    if not isinstance(thumbnail_data, bytes):
         raise HTTPException(status_code=500, detail="数据格式错误")
     
-    return Response(
-        content=event.thumbnail_data,
-        media_type="image/jpeg",
-        headers=headers
-    )
+    return bytes_response(request, thumbnail_data, "image/jpeg",
+                          cache_control="public, max-age=86400", filename=f"{event_id}.jpg")
 
 # 创建检测事件
 @router.post("/detection/events", response_model=DetectionEventResponse, tags=["检测事件"])
@@ -1873,7 +1903,7 @@ async def delete_detection_event(
         if db_event.thumbnail_path:
             try:
                 if os.path.exists(db_event.thumbnail_path):
-                    os.remove(db_event.thumbnail_path)
+                    remove_event_file(db_event.thumbnail_path)
                     files_deleted.append(db_event.thumbnail_path)
             except OSError as e:
                 files_failed.append(f"缩略图: {str(e)}")
@@ -1944,7 +1974,7 @@ async def batch_delete_detection_events(
                 if event.thumbnail_path:
                     try:
                         if os.path.exists(event.thumbnail_path):
-                            os.remove(event.thumbnail_path)
+                            remove_event_file(event.thumbnail_path)
                             event_files_deleted.append(event.thumbnail_path)
                     except OSError as e:
                         event_files_failed.append(f"缩略图: {str(e)}")
@@ -2077,7 +2107,11 @@ async def get_detection_events_overview(db: Session = Depends(get_db)):
         raise HTTPException(status_code=500, detail=f"获取检测事件统计失败: {str(e)}")
 
 @router.get("/files/{file_path:path}", tags=["检测事件"])
-async def get_file(file_path: str):
+async def get_file(
+    file_path: str,
+    request: Request,
+    size: Optional[str] = Query(None, pattern=VARIANT_PATTERN, description="预览尺寸: thumb/medium，默认原图")
+):
     # 构建完整的文件路径
     full_path = os.path.join(file_path)
 
@@ -2085,8 +2119,8 @@ async def get_file(file_path: str):
     if not os.path.isfile(full_path):
         raise HTTPException(status_code=404, detail="File not found")
 
-    # 返回文件
-    return FileResponse(full_path)
+    # 返回文件（支持条件请求和 Range 请求）
+    return file_response(request, variant_path(Path(full_path), size))
 
 # 添加清除系统日志的API
 @router.delete("/system/logs/clear", tags=["系统管理"])
@@ -2433,6 +2467,7 @@ def export_devices(db: Session = Depends(get_db), current_user: User = Depends(g
 
 # 设备数据导入
 @router.post("/devices/import", tags=["设备管理"])
+@invalidates("devices", "dashboard")
 async def import_devices(
     file: UploadFile = File(...),
     db: Session = Depends(get_db),
@@ -2698,6 +2733,7 @@ def clear_detection_logs(
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/data_push/list", tags=["数据推送"])
+@cached(ttl=5, tags=["data_push"])
 async def list_push_configs(
     config_id: str = None, 
     tag: str = None,
@@ -2860,6 +2896,7 @@ def get_system_status(db: Session = Depends(get_db)):
 
 # 首页仪表盘API
 @router.get("/dashboard/comprehensive-overview", tags=["首页仪表盘"] )
+@cached(ttl=5, tags=["dashboard"])
 def get_comprehensive_dashboard_overview(db: Session = Depends(get_db)):
     """获取完整的首页数据概览，包含所有模块的统计数据"""
     try:
@@ -2925,70 +2962,37 @@ def get_comprehensive_dashboard_overview(db: Session = Depends(get_db)):
         total_crowd_jobs = db.query(CrowdAnalysisJob).count()
         active_crowd_jobs = db.query(CrowdAnalysisJob).filter(CrowdAnalysisJob.is_active == True).count()
         
-        # 人群分析结果统计
-        total_crowd_results = db.query(CrowdAnalysisResult).count()
-        
-        # 按任务统计人群分析结果
-        crowd_job_stats = db.query(
-            CrowdAnalysisResult.job_id,
-            CrowdAnalysisJob.job_name,
-            func.count(CrowdAnalysisResult.result_id).label('count'),
-            func.avg(CrowdAnalysisResult.total_person_count).label('avg_count'),
-            func.max(CrowdAnalysisResult.total_person_count).label('max_count')
-        ).join(CrowdAnalysisJob, CrowdAnalysisResult.job_id == CrowdAnalysisJob.job_id).group_by(
-            CrowdAnalysisResult.job_id, CrowdAnalysisJob.job_name
-        ).all()
-        
-        crowd_job_distribution = [{
-            "job_id": job.job_id,
-            "job_name": job.job_name,
-            "count": job.count,
-            "avg_count": float(job.avg_count) if job.avg_count else 0,
-            "max_count": int(job.max_count) if job.max_count else 0
-        } for job in crowd_job_stats]
+        # 人群分析结果统计（来自时间桶汇总）
+        crowd_job_distribution = event_statistics.crowd_job_stats()
+        total_crowd_results = sum(job["count"] for job in crowd_job_distribution)
         
         # 7. 检测任务统计
         total_detection_configs = db.query(DetectionConfig).count()
         active_detection_configs = db.query(DetectionConfig).filter(DetectionConfig.enabled == True).count()
         
-        # 8. 检测事件统计（总数而非今日）
-        total_detection_events = db.query(DetectionEvent).count()
-        today_detection_events = db.query(DetectionEvent).filter(DetectionEvent.created_at >= today).count()
+        # 8. 检测事件统计（总数而非今日），事件计数均来自内存中的统计快照
+        today_date = today.date()
+        total_detection_events = event_statistics.total(SOURCE_DETECTION)
+        today_detection_events = event_statistics.total(SOURCE_DETECTION, day=today_date)
 
         # 按状态统计检测事件
-        event_status_stats = db.query(
-            DetectionEvent.status, 
-            func.count(DetectionEvent.event_id).label('count')
-        ).group_by(DetectionEvent.status).all()
-        event_status_distribution = {status.value: count for status, count in event_status_stats}
+        event_status_distribution = event_statistics.group_by(SOURCE_DETECTION, "status")
         
         # 按事件类型统计检测事件
-        event_type_stats = db.query(
-            DetectionEvent.event_type, 
-            func.count(DetectionEvent.event_id).label('count')
-        ).group_by(DetectionEvent.event_type).all()
-        event_type_distribution = {event_type: count for event_type, count in event_type_stats}
+        event_type_distribution = event_statistics.group_by(SOURCE_DETECTION, "category")
         
         # 9. 外部事件统计（总数而非今日）
-        total_external_events = db.query(ExternalEvent).count()
+        total_external_events = event_statistics.total(SOURCE_EXTERNAL)
         
         # 按引擎统计外部事件
-        external_engine_stats = db.query(
-            ExternalEvent.engine_name, 
-            func.count(ExternalEvent.event_id).label('count')
-        ).filter(ExternalEvent.engine_name.isnot(None)).group_by(ExternalEvent.engine_name).all()
-        external_engine_distribution = {engine_name: count for engine_name, count in external_engine_stats}
+        external_engine_distribution = event_statistics.group_by(SOURCE_EXTERNAL, "category", skip_empty=True)
         
         # 按状态统计外部事件
-        external_status_stats = db.query(
-            ExternalEvent.status, 
-            func.count(ExternalEvent.event_id).label('count')
-        ).group_by(ExternalEvent.status).all()
-        external_status_distribution = {status.value: count for status, count in external_status_stats}
+        external_status_distribution = event_statistics.group_by(SOURCE_EXTERNAL, "status")
         
         # 订阅事件统计
-        total_scheme_events = db.query(SmartEvent).count()
-        today_scheme_events = db.query(SmartEvent).filter(SmartEvent.created_at >= today).count()
+        total_scheme_events = event_statistics.total(SOURCE_SMART)
+        today_scheme_events = event_statistics.total(SOURCE_SMART, day=today_date)
 
         # 10. 用户统计
         total_users = db.query(User).count()
@@ -3005,67 +3009,29 @@ def get_comprehensive_dashboard_overview(db: Session = Depends(get_db)):
         # today_detection_logs = db.query(DetectionLog).filter(DetectionLog.created_at >= today).count()
         
         # 13. 近7天的数据趋势
-        # 获取最近5天的每天的数据条数
-        external_event_history = db.query(
-            func.date(ExternalEvent.timestamp).label('date'), 
-            func.count(ExternalEvent.event_id).label('count')
-        ).filter(
-            ExternalEvent.timestamp >= datetime.now() - timedelta(days=5)
-        ).group_by(
-            func.date(ExternalEvent.timestamp)
-        ).all()
-
-        detection_event_history = db.query(
-            func.date(DetectionEvent.created_at).label('date'), 
-            func.count(DetectionEvent.event_id).label('count')
-        ).filter(
-            DetectionEvent.created_at >= datetime.now() - timedelta(days=5)
-        ).group_by(
-            func.date(DetectionEvent.created_at)
-        ).all()
-
-        smart_event_history = db.query(
-            func.date(SmartEvent.timestamp).label('date'), 
-            func.count(SmartEvent.id).label('count')
-        ).filter(
-            SmartEvent.timestamp >= datetime.now() - timedelta(days=5)
-        ).group_by(
-            func.date(SmartEvent.timestamp)
-        ).all()
-
-        # 创建一个字典来存储所有数据，以日期为键
-        result_dict = {}
-        # 生成过去5天的所有日期，并初始化为0
         today = datetime.now().date()
-        for i in range(7, -1, -1): # 包括今天和过去5天，共6天
-            date = today - timedelta(days=i)
-            result_dict[date] = {
+        trend_days = [today - timedelta(days=i) for i in range(7, -1, -1)]
+        external_event_history = event_statistics.daily_totals(SOURCE_EXTERNAL, trend_days)
+        detection_event_history = event_statistics.daily_totals(SOURCE_DETECTION, trend_days)
+        smart_event_history = event_statistics.daily_totals(SOURCE_SMART, trend_days)
+
+        result_dict = {
+            date: {
                 "date": date.strftime("%Y-%m-%d"),
-                "external_events": 0,
-                "detection_events": 0,
-                "scheme_events": 0
+                "external_events": external_event_history[date],
+                "detection_events": detection_event_history[date],
+                "scheme_events": smart_event_history[date]
             }
-
-        # 处理外部事件数据
-        for date, count in external_event_history:
-            if date in result_dict: # 确保日期存在于初始化后的字典中
-                result_dict[date]["external_events"] = count
-
-        # 处理检测事件数据
-        for date, count in detection_event_history:
-            if date in result_dict:
-                result_dict[date]["detection_events"] = count
-
-        # 处理智能事件数据
-        for date, count in smart_event_history:
-            if date in result_dict:
-                result_dict[date]["scheme_events"] = count
+            for date in trend_days
+        }
 
         # 转换为列表并按日期排序
         daily_trends = sorted(result_dict.values(), key=lambda x: x["date"])       
         
         # 14. 最近活动（合并检测事件和外部事件）
-        recent_detection_events = db.query(DetectionEvent).order_by(
+        recent_detection_events = db.query(DetectionEvent, Device.device_name).outerjoin(
+            Device, DetectionEvent.device_id == Device.device_id
+        ).order_by(
             DetectionEvent.created_at.desc()
         ).limit(20).all()
         
@@ -3100,9 +3066,8 @@ def get_comprehensive_dashboard_overview(db: Session = Depends(get_db)):
         recent_activities = []
         
         # 添加检测事件
-        for event in recent_detection_events:
-            device = db.query(Device).filter(Device.device_id == event.device_id).first()
-            device_name = device.device_name if device else "未知设备"
+        for event, device_name in recent_detection_events:
+            device_name = device_name or "未知设备"
             
             event_type = "primary"
             if event.status == EventStatus.new:
@@ -3290,6 +3255,7 @@ class EdgeServerStatusUpdate(BaseModel):
 
 
 @router.post("/edge-servers", response_model=EdgeServerResponse, tags=["边缘服务"], summary="创建边缘服务器")
+@invalidates("dashboard")
 async def create_edge_server(
     server_data: EdgeServerCreate,
     db: Session = Depends(get_db),
@@ -3365,6 +3331,7 @@ async def get_edge_server(
     return server
 
 @router.put("/edge-servers/{server_id}", response_model=EdgeServerResponse, tags=["边缘服务"], summary="更新边缘服务器")
+@invalidates("dashboard")
 async def update_edge_server(
     server_id: int,
     server_data: EdgeServerUpdate,
@@ -3444,6 +3411,7 @@ async def update_edge_server_status(
         raise
 
 @router.delete("/edge-servers/{server_id}", tags=["边缘服务"], summary="删除边缘服务器")
+@invalidates("dashboard")
 async def delete_edge_server(
     server_id: int,
     db: Session = Depends(get_db),
@@ -3506,165 +3474,32 @@ async def get_device_snapshot(
 ):
     """
     获取设备抓图
-    支持Digest认证和Basic认证
+    支持Digest认证和Basic认证，同一设备复用长连接和认证信息
     """
     try:
-        
-        # 构建设备抓图URL
-        if request.device_type.lower() == 'nvr':
-            snapshot_url = f"http://{request.ip_address}/cgi-bin/snapshot.cgi?channel={request.channel}&type=0"
-        else:
-            snapshot_url = f"http://{request.ip_address}/cgi-bin/snapshot.cgi?channel=1&type=0"
-        
-        # 第一次请求，获取认证信息
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
-        }
-        
-        first_response = requests.get(snapshot_url, headers=headers, timeout=10)
+        snapshot_url = build_snapshot_url(request.ip_address, request.device_type, request.channel)
+        response = await run_in_threadpool(
+            snapshot_clients.fetch, request.device_id, request.username, request.password, snapshot_url
+        )
 
-        if first_response.status_code == 200:
-            # 如果直接成功，返回图片数据
+        if response.status_code == 200:
             return Response(
-                content=first_response.content,
+                content=response.content,
                 media_type="image/jpeg",
                 headers={"Cache-Control": "no-cache"}
             )
-        
-        elif first_response.status_code == 401:
-            # 需要认证
-            auth_header = first_response.headers.get('www-authenticate', '')
-            
-            if 'Digest' in auth_header:
-                # Digest认证
-                auth_response = await _generate_digest_auth(
-                    auth_header, request.username, request.password, 
-                    'GET', snapshot_url
-                )
-                
-                # 发送带认证的请求
-                auth_headers = {
-                    'Authorization': auth_response,
-                    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
-                }
-                
-                auth_response_obj = requests.get(snapshot_url, headers=auth_headers, timeout=10)
-                
-                if auth_response_obj.status_code == 200:
-                    return Response(
-                        content=auth_response_obj.content,
-                        media_type="image/jpeg",
-                        headers={"Cache-Control": "no-cache"}
-                    )
-                else:
-                    raise HTTPException(
-                        status_code=auth_response_obj.status_code,
-                        detail=f"Digest认证失败: {auth_response_obj.status_code}"
-                    )
-            
-            elif 'Basic' in auth_header:
-                # Basic认证
-                credentials = f"{request.username}:{request.password}"
-                encoded_credentials = base64.b64encode(credentials.encode()).decode()
-                
-                basic_headers = {
-                    'Authorization': f'Basic {encoded_credentials}',
-                    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
-                }
-                
-                basic_response = requests.get(snapshot_url, headers=basic_headers, timeout=10)
-                
-                if basic_response.status_code == 200:
-                    return Response(
-                        content=basic_response.content,
-                        media_type="image/jpeg",
-                        headers={"Cache-Control": "no-cache"}
-                    )
-                else:
-                    raise HTTPException(
-                        status_code=basic_response.status_code,
-                        detail=f"Basic认证失败: {basic_response.status_code}"
-                    )
-            
-            else:
-                # 尝试Basic认证（某些设备不返回www-authenticate头）
-                credentials = f"{request.username}:{request.password}"
-                encoded_credentials = base64.b64encode(credentials.encode()).decode()
-                
-                basic_headers = {
-                    'Authorization': f'Basic {encoded_credentials}',
-                    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
-                }
-                
-                basic_response = requests.get(snapshot_url, headers=basic_headers, timeout=10)
-                
-                if basic_response.status_code == 200:
-                    return Response(
-                        content=basic_response.content,
-                        media_type="image/jpeg",
-                        headers={"Cache-Control": "no-cache"}
-                    )
-                else:
-                    raise HTTPException(
-                        status_code=basic_response.status_code,
-                        detail=f"Basic认证失败: {basic_response.status_code}"
-                    )
-        
-        else:
-            # 其他状态码
-            raise HTTPException(
-                status_code=first_response.status_code,
-                detail=f"设备抓图失败: {first_response.status_code}"
-            )
+        if response.status_code == 401:
+            raise HTTPException(status_code=401, detail="设备认证失败: 401")
+        raise HTTPException(
+            status_code=response.status_code,
+            detail=f"设备抓图失败: {response.status_code}"
+        )
             
+    except HTTPException:
+        raise
     except requests.exceptions.Timeout:
         raise HTTPException(status_code=408, detail="请求超时，设备可能离线或网络不通")
     except requests.exceptions.ConnectionError:
         raise HTTPException(status_code=503, detail="连接失败，设备可能离线或网络不通")
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"设备抓图失败: {str(e)}")
-
-async def _generate_digest_auth(auth_header: str, username: str, password: str, method: str, uri: str) -> str:
-    """
-    生成Digest认证响应
-    """
-    import hashlib
-    import re
-    
-    # 解析认证头
-    auth_info = {}
-    pattern = r'(\w+)="([^"]*)"'
-    matches = re.findall(pattern, auth_header)
-    
-    for key, value in matches:
-        auth_info[key] = value
-    
-    realm = auth_info.get('realm', '')
-    nonce = auth_info.get('nonce', '')
-    qop = auth_info.get('qop', '')
-    algorithm = auth_info.get('algorithm', 'MD5')
-    
-    # 生成随机值
-    import secrets
-    cnonce = secrets.token_hex(8)
-    nc = '00000001'
-    
-    # 计算HA1 = MD5(username:realm:password)
-    ha1 = hashlib.md5(f"{username}:{realm}:{password}".encode()).hexdigest()
-    
-    # 计算HA2 = MD5(method:uri)
-    ha2 = hashlib.md5(f"{method}:{uri}".encode()).hexdigest()
-    
-    # 计算response
-    if qop:
-        response = hashlib.md5(f"{ha1}:{nonce}:{nc}:{cnonce}:{qop}:{ha2}".encode()).hexdigest()
-    else:
-        response = hashlib.md5(f"{ha1}:{nonce}:{ha2}".encode()).hexdigest()
-    
-    # 构建Authorization头
-    auth_response = f'Digest username="{username}", realm="{realm}", nonce="{nonce}", uri="{uri}", algorithm={algorithm}, response="{response}"'
-    
-    if qop:
-        auth_response += f', qop={qop}, nc={nc}, cnonce="{cnonce}"'
-    
-    return auth_response
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"设备抓图失败: {str(e)}")
\ No newline at end of file
@@ -12,13 +12,13 @@ from concurrent.futures import ThreadPoolExecutor # 导入线程池
 import logging # 导入日志模块
 import numpy as np # 导入NumPy模块
 from collections import deque # 导入双端队列
-from ultralytics import YOLO # 导入YOLO模型
 import torch # 导入PyTorch
 from contextlib import nullcontext # 导入上下文管理器
 from pathlib import Path # 导入路径模块
 import os # 导入操作系统模块
 import re # 导入正则表达式模块
 from urllib.parse import urlparse # 导入URL解析模块
+from src.model_registry import model_registry # 导入模型注册表
 
 # 配置日志
 logging.basicConfig(level=logging.INFO)
@@ -28,7 +28,7 @@ logger = logging.getLogger(__name__)
 router = APIRouter(prefix="/rtsp", tags=["RTSP流处理"])
 
 # 全局变量
-models_cache = {} # 模型缓存
+onnx_sessions = {} # ONNX Runtime 会话缓存（模型实例由 model_registry 共享）
 frame_queues = {} # 帧队列
 max_queue_size = 1  # 减小队列大小以降低延迟
 executor = ThreadPoolExecutor(max_workers=2)  # 减少线程数以避免资源竞争
@@ -552,57 +552,53 @@ class ConnectionManager:
                 await self.disconnect(connection_id)
 # 创建连接管理器实例
 manager = ConnectionManager()
+# 获取或加载ONNX Runtime会话
+def _get_onnx_session(models_name, model):
+    """GPU环境下导出ONNX模型并创建推理会话（按模型名缓存）"""
+    if models_name in onnx_sessions:
+        return onnx_sessions[models_name]
+    try:
+        onnx_path = f"models/{models_name}.onnx"
+        if not Path(onnx_path).exists():
+            model.export(format='onnx', dynamic=True, half=True)
+            logger.info(f"Model exported to ONNX: {onnx_path}")
+            
+            # 尝试使用ONNX Runtime
+            import onnxruntime as ort
+            providers = ['CUDAExecutionProvider', 'CPUExecutionProvider']
+            onnx_sessions[models_name] = ort.InferenceSession(onnx_path, providers=providers)
+            logger.info("Using ONNX Runtime for inference")
+            return onnx_sessions[models_name]
+    except Exception as e:
+        logger.warning(f"ONNX optimization failed: {e}")
+    return None
 # 获取或加载YOLO模型
 def get_model(models_name):
-    """获取或加载YOLO模型"""
-    if models_name not in models_cache:
-        models_path = f"models/{models_name}.pt"
-        try:
-            if not Path(models_path).exists():
-                logger.error(f"Model file not found: {models_path}")
-                return None
-            
-            model = YOLO(models_path)
-            
-            # 使用GPU并进行优化
-            device = 'cuda' if torch.cuda.is_available() else 'cpu'
-            if device == 'cuda':
-                model.to(device)
-                # 使用半精度浮点数以提高性能
-                if hasattr(model, 'model'):
-                    model.model.half()
-                logger.info("Using half precision on GPU")
-            
-                # 导出ONNX模型以提高性能
-                try:
-                    onnx_path = f"models/{models_name}.onnx"
-                    if not Path(onnx_path).exists():
-                        model.export(format='onnx', dynamic=True, half=True)
-                        logger.info(f"Model exported to ONNX: {onnx_path}")
-                        
-                        # 尝试使用ONNX Runtime
-                        import onnxruntime as ort
-                        providers = ['CUDAExecutionProvider', 'CPUExecutionProvider'] if device == 'cuda' else ['CPUExecutionProvider']
-                        session = ort.InferenceSession(onnx_path, providers=providers)
-                        models_cache[models_name] = {
-                            'type': 'onnx',
-                            'session': session,
-                            'model': model
-                        }
-                        logger.info("Using ONNX Runtime for inference")
-                        return models_cache[models_name]
-                except Exception as e:
-                    logger.warning(f"ONNX optimization failed: {e}")
-            
-            models_cache[models_name] = {
-                'type': 'pytorch',
-                'model': model
-            }
-            logger.info(f"Model {models_name} loaded successfully on {device}")
-        except Exception as e:
-            logger.error(f"Error loading model {models_name}: {e}")
-            return None
-    return models_cache.get(models_name)
+    """获取YOLO模型（来自进程内模型注册表，连接结束时调用 release_model 释放引用）"""
+    models_path = f"models/{models_name}.pt"
+    if not Path(models_path).exists():
+        logger.error(f"Model file not found: {models_path}")
+        return None
+    
+    try:
+        # 使用GPU时注册表会以半精度加载
+        model = model_registry.acquire(models_path, use_gpu=torch.cuda.is_available())
+    except Exception as e:
+        logger.error(f"Error loading model {models_name}: {e}")
+        return None
+    
+    if model.device == 'cuda':
+        # 导出ONNX模型以提高性能
+        session = _get_onnx_session(models_name, model)
+        if session is not None:
+            return {'type': 'onnx', 'session': session, 'model': model}
+    
+    logger.info(f"Model {models_name} loaded successfully on {model.device}")
+    return {'type': 'pytorch', 'model': model}
+# 释放模型引用
+def release_model(models_info):
+    if models_info:
+        models_info['model'].release()
 # 处理单帧图像
 def process_frame(frame, models_info, frame_id, timestamp, total_frames=None, start_time=None):
     """处理单帧图像。成功返回 (result_dict, None)，失败返回 (None, error_message)。"""
@@ -781,7 +777,7 @@ async def process_frame_queue(connection_id: str):
                 if current_time - last_processed_time < 0.033:
                     continue
                 
-                result, proc_err = await asyncio.get_event_loop().run_in_executor(
+                future = asyncio.get_event_loop().run_in_executor(
                     executor,
                     process_frame,
                     frame_data["frame"],
@@ -791,6 +787,12 @@ async def process_frame_queue(connection_id: str):
                     frame_data.get("total_frames"),
                     frame_data.get("start_time")
                 )
+                try:
+                    result, proc_err = await asyncio.shield(future)
+                except asyncio.CancelledError:
+                    # 取消时线程中的推理仍在执行，等它结束后调用方才能释放模型
+                    await asyncio.wait([future])
+                    raise
                 
                 if proc_err:
                     logger.error(f"process_frame failed for {connection_id}: {proc_err}")
@@ -880,6 +882,7 @@ async def websocket_endpoint(websocket: WebSocket):
     connection_id = await manager.connect(websocket)
     rtsp_sessions[connection_id] = {"status": "connected"}
     models_info = None
+    retired_models = []  # 切换模型时仍被视频帧处理任务使用的旧模型，连接结束时释放
     
     try:
         # 等待客户端的连接请求
@@ -934,6 +937,11 @@ async def websocket_endpoint(websocket: WebSocket):
                     continue
 
                 try:
+                    if connection_id in manager.connection_tasks:
+                        # 视频帧处理任务和队列中的帧仍在使用旧模型
+                        retired_models.append(models_info)
+                    else:
+                        release_model(models_info)
                     models_info = get_model(message.get("models_id"))
                     
                     if not models_info:
@@ -1205,4 +1213,8 @@ async def websocket_endpoint(websocket: WebSocket):
         # 确保断开连接时停止所有流处理
         if connection_id in active_connections:
             await rtsp_manager.stop_stream(connection_id)
-        await manager.disconnect(connection_id)
\ No newline at end of file
+        # 先取消并等待视频帧处理任务结束，再释放模型
+        await manager.disconnect(connection_id)
+        for retired in retired_models:
+            release_model(retired)
+        release_model(models_info)
\ No newline at end of file
@@ -1,5 +1,5 @@
 from fastapi import APIRouter, Depends, HTTPException, status, Query
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import Session, joinedload
 from sqlalchemy import func
 from typing import List, Optional, Dict, Any
 from datetime import datetime, timedelta
@@ -7,6 +7,7 @@ from pydantic import BaseModel, Field
 from src.database import get_db, Device, SmartScheme, SmartEvent
 from api.auth import get_current_user, check_admin_permission
 from api.logger import log_action
+from src.pagination import TOTAL_MODE_PATTERN, count_total, fetch_page
 import uuid
 import json
 
@@ -102,8 +103,8 @@ def get_schemes(
 ):
     """获取事件订阅列表"""
     try:
-        # 构建查询
-        query = db.query(SmartScheme)
+        # 构建查询（同时关联摄像头信息）
+        query = db.query(SmartScheme, Device).outerjoin(Device, Device.device_id == SmartScheme.camera_id)
         
         # 应用过滤条件
         if camera_id:
@@ -118,29 +119,28 @@ def get_schemes(
         
         if search:
             # 通过摄像头名称搜索
-            devices = db.query(Device).filter(Device.device_name.ilike(f"%{search}%")).all()
-            device_ids = [device.device_id for device in devices]
-            if device_ids:
-                query = query.filter(SmartScheme.camera_id.in_(device_ids))
-            else:
-                # 如果没有匹配的设备，返回空结果
-                return {
-                    'items': [],
-                    'total': 0,
-                    'page': page,
-                    'page_size': page_size
-                }
+            query = query.filter(Device.device_name.ilike(f"%{search}%"))
         
         # 获取总数
         total = query.count()
         
         # 分页
-        schemes = query.order_by(SmartScheme.created_at.desc()).offset((page - 1) * page_size).limit(page_size).all()
+        rows = query.order_by(SmartScheme.created_at.desc()).offset((page - 1) * page_size).limit(page_size).all()
+        
+        # 本页各订阅的事件数量（一次分组统计）
+        scheme_ids = [scheme.id for scheme, _ in rows]
+        event_counts = {}
+        if scheme_ids:
+            event_counts = dict(
+                db.query(SmartEvent.scheme_id, func.count(SmartEvent.id))
+                .filter(SmartEvent.scheme_id.in_(scheme_ids))
+                .group_by(SmartEvent.scheme_id)
+                .all()
+            )
         
         # 转换为响应格式
         items = []
-        for scheme in schemes:
-            device = db.query(Device).filter(Device.device_id == scheme.camera_id).first()
+        for scheme, device in rows:
             item = {
                 'id': scheme.id,
                 'camera_id': scheme.camera_id,
@@ -148,7 +148,7 @@ def get_schemes(
                 'camera_ip': device.ip_address if device else "未知摄像机",
                 'camera_port': scheme.camera_port,
                 'event_types': scheme.event_types,
-                'event_count': db.query(SmartEvent).filter(SmartEvent.scheme_id == scheme.id).count(), # 获取该订阅下的事件数量
+                'event_count': event_counts.get(scheme.id, 0), # 该订阅下的事件数量
                 'alarm_interval': scheme.alarm_interval,
                 'push_tags': scheme.push_tags,
                 'remarks': scheme.remarks,
@@ -583,9 +583,11 @@ def get_events(
     start_date: Optional[str] = Query(None, description="开始日期"),
     end_date: Optional[str] = Query(None, description="结束日期"),
     search: Optional[str] = Query(None, description="搜索关键词"),
+    cursor: Optional[str] = Query(None, description="分页游标，传入时忽略页码"),
+    total_mode: str = Query("exact", pattern=TOTAL_MODE_PATTERN, description="总数统计方式: exact/estimated/none"),
     db: Session = Depends(get_db)
 ):
-    """获取事件列表"""
+    """获取事件列表，传入 cursor 时按 (timestamp, id) 游标翻页"""
     try:
         # 构建查询
         query = db.query(SmartEvent)
@@ -614,21 +616,25 @@ def get_events(
                 (SmartEvent.description.ilike(f"%{search}%"))
             )
         
-        # 按时间倒序排序
-        query = query.order_by(SmartEvent.timestamp.desc())
-        
         # 获取总数
-        total = query.count()
+        total, total_estimated = count_total(db, query, total_mode)
         
-        # 分页
-        events = query.offset((page - 1) * page_size).limit(page_size).all()
+        # 分页（按时间倒序），订阅及其摄像头随事件一起加载
+        query = query.options(joinedload(SmartEvent.scheme).joinedload(SmartScheme.camera))
+        try:
+            events, next_cursor = fetch_page(
+                query, SmartEvent.timestamp, SmartEvent.id, page_size,
+                cursor=cursor, offset=(page - 1) * page_size
+            )
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
         
         # 转换为响应格式
         items = []
         for event in events:
             # 获取订阅和摄像头信息
-            scheme = db.query(SmartScheme).filter(SmartScheme.id == event.scheme_id).first()
-            device = db.query(Device).filter(Device.device_id == scheme.camera_id).first() if scheme else None
+            scheme = event.scheme
+            device = scheme.camera if scheme else None
             
             # 构建处理记录对象
             processing_record = None
@@ -661,10 +667,14 @@ def get_events(
         return {
             'items': items,
             'total': total,
+            'total_estimated': total_estimated,
             'page': page,
-            'page_size': page_size
+            'page_size': page_size,
+            'next_cursor': next_cursor
         }
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -3,7 +3,7 @@ from fastapi.middleware.cors import CORSMiddleware
 from api.routes import router
 from api.heatmap_routes import heatmap_router
 from src.database import Base, engine
-from src.db_migrations import ensure_device_rtsp_columns, ensure_detection_config_stream_type
+from src.db_migrations import ensure_device_rtsp_columns, ensure_detection_config_stream_type, ensure_crowd_metric_rollups, ensure_event_partitions, ensure_event_list_indexes, ensure_event_counters
 import uvicorn
 import logging
 import asyncio
@@ -16,6 +16,10 @@ logger = logging.getLogger("api")
 Base.metadata.create_all(bind=engine)
 ensure_device_rtsp_columns(engine)
 ensure_detection_config_stream_type(engine)
+ensure_crowd_metric_rollups(engine)
+ensure_event_partitions(engine)
+ensure_event_list_indexes(engine)
+ensure_event_counters(engine)
 
 # 创建FastAPI应用
 app = FastAPI(
@@ -2,13 +2,14 @@ import asyncio # 导入异步I/O模块
 import numpy as np # 导入NumPy模块
 import logging # 导入日志模块
 import os # 导入操作系统模块
+import random # 导入随机数模块
+from collections import OrderedDict # 导入有序字典
 from datetime import datetime, timedelta # 导入日期时间模块
 from pathlib import Path # 导入路径模块
 
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Depends # 导入FastAPI相关模块
 from fastapi.middleware.cors import CORSMiddleware # 导入CORS中间件
 from contextlib import asynccontextmanager # 导入异步上下文管理器
-from ultralytics import YOLO # 导入YOLO模型
 import torch # 导入torch模块
 from sqlalchemy.orm import Session # 导入数据库会话
 
@@ -24,7 +25,14 @@ from src.database import (
 
 from src.detection_runtime import extract_runtime_config
 from src.run_detection_task import DetectionTask
-from src.db_migrations import ensure_device_rtsp_columns, ensure_detection_config_stream_type
+from src.model_registry import model_registry, resolve_model_path
+from src.detection_scheduler import detection_scheduler
+from src.detection_workers import detection_worker_pool, RemoteDetectionTask
+from src.detection_admission import admission_controller
+from src.event_partitions import create_partitions, drop_expired_partitions, is_partitioned, process_manifests
+from src.event_retention import purge_expired_events
+from src.crowd_rollup import purge_expired_rollups
+from src.db_migrations import ensure_device_rtsp_columns, ensure_detection_config_stream_type, ensure_crowd_metric_rollups, ensure_event_partitions, ensure_event_list_indexes, ensure_event_counters
 
 # 导入认证模块
 from api.auth import get_current_user, User
@@ -45,6 +53,16 @@ from src.listeners.http_listener import HTTPListener
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# 事件保留天数
+DEFAULT_EVENT_RETENTION_DAYS = 30  # 检测配置未设置存储天数时
+EXTERNAL_EVENT_RETENTION_DAYS = 100
+SMART_EVENT_RETENTION_DAYS = 7
+
+ADMISSION_RETRY_SECONDS = 10  # 重试启动排队任务的间隔
+STARTUP_CONCURRENCY = int(os.environ.get("STARTUP_CONCURRENCY", "8"))  # 服务启动时同时创建的检测任务数
+STARTUP_JITTER_SECONDS = 3  # 服务启动时各任务随机错开的最长时间，避免摄像机同时建立连接
+STARTUP_PENDING_STATES = ("waiting", "starting", "loading_model", "connecting", "reconnecting")  # 尚未完成启动的就绪状态
+
 # 注册监听器类型
 def register_listener_types():
     """注册所有支持的监听器类型"""
@@ -65,8 +83,21 @@ class DetectionServer:
     # 初始化检测服务器
     def __init__(self):
         self.tasks = {}  # 存储所有检测任务，格式: {config_id: DetectionTask}
-        self.models_cache = {}  # 缓存已加载的模型，格式: {model_path: model}
         self.cleanup_task = None  # 全局清理任务
+        self.admission_task = None  # 排队任务的启动协程
+        self.pending_starts = OrderedDict()  # 因资源不足排队等待启动的配置，格式: {config_id: user_id}
+        self.startup_status = {}  # 服务启动时尚未创建任务的配置状态，格式: {config_id: waiting/queued/失败原因}
+        self.startup_progress = None  # 最近一次批量启动的进度
+        self.cleanup_progress = {  # 最近一次清理的进度
+            "running": False,
+            "table": None,
+            "deleted_events": 0,
+            "deleted_files": 0,
+            "batches": 0,
+            "started_at": None,
+            "updated_at": None,
+            "finished_at": None
+        }
         self.max_concurrent_tasks = 50 # 最大并发任务数
         # 资源监控相关属性
         self.total_cpu_usage = 0
@@ -77,12 +108,15 @@ class DetectionServer:
     async def start_detection(self, config_id: str, db: Session, user_id: str = None):
         """启动特定配置的检测任务"""
         # 检查任务是否已在运行
-        if config_id in self.tasks and self.tasks[config_id].thread and self.tasks[config_id].thread.is_alive():
+        if config_id in self.tasks and self.tasks[config_id].is_running():
             return {"status": "success", "message": "检测任务已在运行"}
         
-        # 检查系统资源是否允许启动新任务
-        if not self._should_start_new_task():
-            return {"status": "error", "message": "系统资源不足，无法启动新任务"}
+        # 按任务实测开销和节点预算判断是否可以启动新任务，不足时排队
+        admitted, reason = self._admit_task(config_id)
+        if not admitted:
+            self.pending_starts[config_id] = user_id
+            logger.warning(f"暂不启动检测任务 {config_id}: {reason}，已加入等待队列")
+            return {"status": "error", "message": f"系统资源不足（{reason}），任务已加入等待队列", "queued": True}
         
         try:
             # 获取检测配置
@@ -91,6 +125,7 @@ class DetectionServer:
                 logger.error(f"未找到检测配置: {config_id}")
                 # 记录失败日志
                 log_detection_action(config_id, "unknown", "start", "failed", "未找到检测配置", user_id)
+                admission_controller.release(config_id)
                 return {"status": "error", "message": "未找到检测配置"}
             
             # 获取模型信息
@@ -99,11 +134,13 @@ class DetectionServer:
                 logger.error(f"未找到模型: {config.models_id}")
                 # 记录失败日志
                 log_detection_action(config_id, config.device_id, "start", "failed", f"未找到模型: {config.models_id}", user_id)
+                admission_controller.release(config_id)
                 return {"status": "error", "message": "未找到模型"}
             
             # 检查频率
             if config.frequency.value == "scheduled":
                 log_detection_action(config_id, config.device_id, "start", "failed", "定时检测已移除，请改为实时检测或抽帧检测", user_id)
+                admission_controller.release(config_id)
                 return {"status": "error", "message": "定时检测已移除，请编辑配置并改为实时检测或抽帧检测"}
             elif config.frequency.value == "manual":
                 await self._create_and_start_task(config, model, db)
@@ -121,6 +158,8 @@ class DetectionServer:
             # 记录失败日志
             device_id = config.device_id if 'config' in locals() and hasattr(config, 'device_id') else "unknown"
             log_detection_action(config_id, device_id, "start", "failed", f"启动检测任务失败: {str(e)}", user_id)
+            # 启动失败，释放准入时的预留
+            admission_controller.release(config_id)
             return {"status": "error", "message": f"启动检测任务失败: {str(e)}"}
     
     # 停止特定配置的检测任务
@@ -142,8 +181,10 @@ class DetectionServer:
         
         try:
             # 停止任务
+            self.pending_starts.pop(config_id, None)
             if config_id in self.tasks:
                 await self.tasks[config_id].stop()
+            admission_controller.release(config_id)
             
             # 更新数据库中的任务状态
             if remove_scheduled_jobs:
@@ -172,25 +213,117 @@ class DetectionServer:
     
     # 启动所有已启用的检测任务
     async def start_all_enabled(self, db: Session):
-        """启动所有已启用的检测任务"""
+        """启动所有已启用的检测任务：先并行加载用到的模型，再限制并发、随机错开地创建任务"""
         enabled_configs = db.query(DetectionConfig).filter(DetectionConfig.enabled.is_(True)).all()
         
-        started_count = 0
+        start_configs = []
         skipped_count = 0
-        
         for config in enabled_configs:
+            if config.frequency.value == "scheduled":
+                skipped_count += 1
+                logger.warning(f"跳过已废弃的定时检测配置: {config.config_id}")
+            elif config.frequency.value in ("realtime", "manual"):
+                start_configs.append(config)
+        
+        config_ids = [config.config_id for config in start_configs]
+        self.startup_status = {config_id: "waiting" for config_id in config_ids}
+        self.startup_progress = {
+            "total": len(config_ids),
+            "config_ids": config_ids,
+            "started_at": datetime.now(),
+            "finished_at": None,
+            "covered_at": None
+        }
+        
+        # 工作进程模式下模型由各工作进程加载，这里只在进程内模式下预加载
+        model_handles = [] if detection_worker_pool.running else await self._preload_models(start_configs, db)
+        try:
+            semaphore = asyncio.Semaphore(STARTUP_CONCURRENCY)
+            results = await asyncio.gather(
+                *(self._start_enabled_task(config_id, semaphore) for config_id in config_ids)
+            )
+        finally:
+            # 任务已各自持有模型引用，释放预加载时的引用
+            for handle in model_handles:
+                handle.release()
+        
+        self.startup_progress["finished_at"] = datetime.now()
+        started_count = sum(1 for started in results if started)
+        elapsed = (self.startup_progress["finished_at"] - self.startup_progress["started_at"]).total_seconds()
+        logger.info(f"已启动 {started_count}/{len(config_ids)} 个检测任务，跳过 {skipped_count} 个废弃定时配置，耗时 {elapsed:.1f}秒")
+    
+    async def _preload_models(self, configs, db: Session):
+        """并行加载启用配置用到的所有模型（同一模型只加载一次），返回模型引用列表"""
+        models_ids = {config.models_id for config in configs}
+        if not models_ids:
+            return []
+        models = db.query(DetectionModel).filter(DetectionModel.models_id.in_(models_ids)).all()
+        model_keys = {
+            (model.file_path, 'pose' if model.models_type == 'pose' else 'detect', model.is_gpu)
+            for model in models
+        }
+        results = await asyncio.gather(
+            *(asyncio.to_thread(model_registry.acquire, *key) for key in model_keys),
+            return_exceptions=True
+        )
+        handles = []
+        for key, result in zip(model_keys, results):
+            if isinstance(result, BaseException):
+                # 失败但不中断启动，由各任务自己尝试加载
+                logger.error(f"预加载模型失败: {os.path.basename(key[0])}, {result}")
+            else:
+                handles.append(result)
+        logger.info(f"已预加载 {len(handles)}/{len(model_keys)} 个模型")
+        return handles
+    
+    async def _start_enabled_task(self, config_id: str, semaphore: asyncio.Semaphore):
+        """随机错开后启动单个启用的任务，每个任务使用独立的数据库会话"""
+        await asyncio.sleep(random.uniform(0, STARTUP_JITTER_SECONDS))
+        async with semaphore:
+            db = SessionLocal()
             try:
-                if config.frequency.value == "scheduled":
-                    skipped_count += 1
-                    logger.warning(f"跳过已废弃的定时检测配置: {config.config_id}")
-                elif config.frequency.value in ("realtime", "manual"):
-                    result = await self.start_detection(config.config_id, db)
-                    if result.get("status") == "success":
-                        started_count += 1
+                result = await self.start_detection(config_id, db)
             except Exception as e:
-                logger.error(f"启动任务 {config.config_id} 失败: {str(e)}")
+                logger.error(f"启动任务 {config_id} 失败: {str(e)}")
+                result = {"status": "error", "message": str(e)}
+            finally:
+                db.close()
         
-        logger.info(f"已启动 {started_count} 个检测任务，跳过 {skipped_count} 个废弃定时配置")
+        if result.get("status") == "success":
+            self.startup_status.pop(config_id, None)
+            return True
+        self.startup_status[config_id] = "queued" if result.get("queued") else result.get("message", "启动失败")
+        return False
+    
+    def get_startup_status(self):
+        """最近一次批量启动的进度：每个配置的就绪状态，全部启动完成（就绪或处于生效时段外）时记录覆盖时间"""
+        progress = self.startup_progress
+        if progress is None:
+            return None
+        
+        states = {}
+        for config_id in progress["config_ids"]:
+            task = self.tasks.get(config_id)
+            states[config_id] = task.readiness if task is not None else self.startup_status.get(config_id, "stopped")
+        
+        pending = sum(1 for state in states.values() if state in STARTUP_PENDING_STATES or state == "queued")
+        if progress["covered_at"] is None and progress["finished_at"] is not None and pending == 0:
+            progress["covered_at"] = datetime.now()
+        covered_at = progress["covered_at"]
+        
+        return {
+            "total": progress["total"],
+            "ready": sum(1 for state in states.values() if state == "ready"),
+            "paused": sum(1 for state in states.values() if state == "paused"),
+            "pending": pending,
+            "failed": sum(1 for state in states.values()
+                          if state not in STARTUP_PENDING_STATES and state not in ("queued", "ready", "paused", "stopped")),
+            "started_at": progress["started_at"],
+            "finished_at": progress["finished_at"],
+            "covered_at": covered_at,
+            "coverage_seconds": (covered_at - progress["started_at"]).total_seconds() if covered_at else None,
+            "tasks": states
+        }
     
     # 处理检测预览WebSocket连接
     async def handle_preview(self, websocket: WebSocket, config_id: str):
@@ -249,49 +382,13 @@ class DetectionServer:
             logger.error(f"未找到设备: {device_id}")
             raise ValueError("未找到设备")
         
-        # 检查模型文件是否存在
-        model_path = model.file_path
-        abs_model_path = os.path.abspath(model_path)
-        
-        if not os.path.exists(abs_model_path):
-            # 尝试在models目录中查找
-            base_name = os.path.basename(model_path)
-            alternative_path = os.path.join("models", base_name)
-            alt_abs_path = os.path.abspath(alternative_path)
-            
-            if os.path.exists(alt_abs_path):
-                model_path = alternative_path
-            else:
-                raise FileNotFoundError(f"模型文件不存在: {os.path.basename(model_path)}")
-        
-        # 预加载模型到缓存中
-        if model_path not in self.models_cache:
-            try:
-                # 设置离线模式
-                os.environ["ULTRALYTICS_OFFLINE"] = "1"
-                os.environ["YOLO_NO_ANALYTICS"] = "1"
-                os.environ["NO_VERSION_CHECK"] = "1"
-                
-                # 确定模型类型
-                task_type = 'detect'
-                if model.models_type == 'pose':
-                    task_type = 'pose'
-                
-                logger.info(f"预加载模型到缓存: {model_path}, 任务类型: {task_type}")
-                # 尝试加载模型到缓存
-                cached_model = YOLO(model_path, task=task_type)
-                self.models_cache[model_path] = cached_model
-
-            except Exception as e:
-                logger.error(f"预加载模型到缓存失败: {e}")
-                # 失败但不中断流程，让任务自己尝试加载
-        else:
-            logger.info(f"使用缓存的模型: {model_path}")
+        # 检查模型文件是否存在（找不到时在models目录中查找）
+        model_path = resolve_model_path(model.file_path)
         
         # 创建检测任务
         frequency_value = config.frequency.value if hasattr(config.frequency, "value") else config.frequency
         runtime_config = extract_runtime_config(config.schedule_config)
-        task = DetectionTask(
+        task_kwargs = dict(
             device_id=config.device_id,
             device_name=device.device_name,
             device_ip=device.ip_address,
@@ -306,21 +403,32 @@ class DetectionServer:
             stream_type=getattr(config, 'stream_type', None) or 'main',
             frequency=frequency_value,
             runtime_config=runtime_config,
+            save_duration=config.save_duration,
         )
-        
-        # 如果模型已缓存，直接设置
-        if model_path in self.models_cache:
 
-            task.model = self.models_cache[model_path]
-            # 设置其他必要属性
-            task.class_names = task.model.names
-            device = 'cuda' if torch.cuda.is_available() and model.is_gpu else 'cpu'
-            task.device = torch.device(device)
-            if device == 'cuda' and hasattr(task.model, 'model'):
-                if hasattr(task.model.model, 'dtype'):
-                    task.model.model.half()
-
-            logger.info(f"使用缓存模型设置任务: {config_id},硬件设备: {device}, 加载模型: {hasattr(task.model, 'model')}")
+        if detection_worker_pool.running:
+            # 拉流和推理在工作进程中执行，模型由工作进程加载
+            task = RemoteDetectionTask(detection_worker_pool, **task_kwargs)
+            model_handle = None
+        else:
+            task = DetectionTask(**task_kwargs)
+            # 从进程内模型注册表获取模型，同一权重文件的所有任务共享一份
+            task_type = 'pose' if model.models_type == 'pose' else 'detect'
+            try:
+                model_handle = await asyncio.to_thread(
+                    model_registry.acquire, model_path, task_type, model.is_gpu
+                )
+            except Exception as e:
+                logger.error(f"预加载模型失败: {e}")
+                # 失败但不中断流程，让任务自己尝试加载
+                model_handle = None
+        
+        # 模型已加载，直接设置（任务停止时释放引用）
+        if model_handle is not None:
+            task.model = model_handle
+            task.class_names = model_handle.names
+            task.device = torch.device(model_handle.device)
+            logger.info(f"使用共享模型设置任务: {config_id},硬件设备: {model_handle.device}")
         
         # 设置事件循环
         task.loop = asyncio.get_event_loop()
@@ -340,47 +448,51 @@ class DetectionServer:
         return task
     
     def _check_system_resources(self):
-        """检查系统资源使用情况"""
-        try:
-            import psutil
-            
-            cpu_percent = psutil.cpu_percent(interval=1)
-            memory_percent = psutil.virtual_memory().percent
-            
-            self.total_cpu_usage = cpu_percent
-            self.total_memory_usage = memory_percent
-            self.active_task_count = len([t for t in self.tasks.values() if t.thread and t.thread.is_alive()])
-            
-            # 记录资源使用情况
-            if self.active_task_count > 0:
-                logger.info(f"系统资源状态 - CPU: {cpu_percent:.1f}%, 内存: {memory_percent:.1f}%, 活跃任务: {self.active_task_count}")
-            
-            return cpu_percent, memory_percent
-            
-        except ImportError:
-            return 0, 0
-        except Exception as e:
-            logger.error(f"检查系统资源失败: {e}")
-            return 0, 0
+        """读取后台采样的系统资源使用情况（不阻塞）"""
+        self.total_cpu_usage = admission_controller.cpu_percent
+        self.total_memory_usage = admission_controller.memory_percent
+        self.active_task_count = len([t for t in self.tasks.values() if t.is_running()])
+        return self.total_cpu_usage, self.total_memory_usage
     
-    def _should_start_new_task(self):
-        """判断是否应该启动新任务"""
-        cpu_percent, memory_percent = self._check_system_resources()
-        
-        # 资源限制条件
-        if cpu_percent > 85:
-            logger.warning(f"CPU使用率过高({cpu_percent:.1f}%)，暂停启动新任务")
-            return False
-            
-        if memory_percent > 90:
-            logger.warning(f"内存使用率过高({memory_percent:.1f}%)，暂停启动新任务")
-            return False
-            
-        if self.active_task_count >= self.max_concurrent_tasks:
-            logger.warning(f"已达到最大并发任务数({self.max_concurrent_tasks})，暂停启动新任务")
-            return False
-            
-        return True
+    def _admit_task(self, config_id: str):
+        """判断是否可以启动新任务，返回 (是否允许, 原因)"""
+        running = [t for t in self.tasks.values() if t.is_running()]
+        self.active_task_count = len(running)
+        # 已准入但尚未注册的任务（并发启动中）同样计入并发数和预算
+        registered = set(self.tasks) | {config_id}
+        starting = admission_controller.starting(registered)
+        if self.active_task_count + len(starting) >= self.max_concurrent_tasks:
+            return False, f"已达到最大并发任务数({self.max_concurrent_tasks})"
+        return admission_controller.admit(config_id, running, registered)
+    
+    async def start_admission_worker(self):
+        """启动排队任务的重试协程"""
+        if self.admission_task is None or self.admission_task.done():
+            self.admission_task = asyncio.create_task(self._admission_worker())
+    
+    async def _admission_worker(self):
+        """定期按排队顺序启动等待中的任务，队首仍无法启动时保持顺序等待下次重试"""
+        while True:
+            try:
+                await asyncio.sleep(ADMISSION_RETRY_SECONDS)
+                if not self.pending_starts:
+                    continue
+                db = SessionLocal()
+                try:
+                    for config_id, user_id in list(self.pending_starts.items()):
+                        if config_id in self.tasks and self.tasks[config_id].is_running():
+                            self.pending_starts.pop(config_id, None)
+                            continue
+                        result = await self.start_detection(config_id, db, user_id)
+                        if result.get("queued"):
+                            break
+                        self.pending_starts.pop(config_id, None)
+                finally:
+                    db.close()
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logger.error(f"启动排队任务失败: {e}")
     
     async def start_global_cleanup_task(self):#启动全局清理任务
         """启动全局清理任务"""
@@ -429,10 +541,20 @@ class DetectionServer:
     async def _cleanup_all_expired_events(self):#清理所有配置的过期事件
         """清理所有配置的过期事件"""
         start_time = datetime.now()
+        self.cleanup_progress.update({
+            "running": True, "table": None, "deleted_events": 0, "deleted_files": 0, "batches": 0,
+            "started_at": start_time, "updated_at": start_time, "finished_at": None
+        })
         try:
             logger.info("开始执行全局清理任务...")
             
-            # 1. 清理检测事件
+            # 0. 预建未来分区，整分区删除已全部过期的分区，再按清单删除文件
+            try:
+                await asyncio.to_thread(self._maintain_event_partitions)
+            except Exception as e:
+                logger.error(f"事件分区维护失败: {e}")
+            
+            # 1. 清理检测事件（分区内剩余的过期事件，以及存储天数短于分区保留期的配置）
             await self._cleanup_detection_events()
             
             # 2. 清理外部数据事件
@@ -447,101 +569,125 @@ class DetectionServer:
             except Exception as e:
                 logger.warning(f"清理空目录失败: {e}")
             
+            # 5. 按桶大小清理过期的人数统计汇总
+            try:
+                await asyncio.to_thread(purge_expired_rollups, engine)
+            except Exception as e:
+                logger.error(f"清理人数统计汇总失败: {e}")
+            
             # 计算执行时间
             execution_time = (datetime.now() - start_time).total_seconds()
             logger.info(f"全局清理任务执行完成 - 总执行时间: {execution_time:.2f}秒")           
             
         except Exception as e:
             logger.error(f"全局清理任务失败: {e}")
+        finally:
+            self.cleanup_progress["running"] = False
+            self.cleanup_progress["finished_at"] = datetime.now()
     
-    async def _cleanup_detection_events(self):
-        """清理检测事件"""
+    def _event_partition_cutoffs(self) -> dict:
+        """各事件表整分区删除的截止时间：分区内所有事件都已超过保留期"""
+        now = datetime.now()
         db = SessionLocal()
         try:
-            current_time = datetime.now()
-            
-            # 获取所有检测配置
-            configs = db.query(DetectionConfig).all()
-            
-            total_deleted_events = 0
-            total_deleted_files = 0
-            processed_configs = 0
-            failed_configs = 0
-            
-            logger.info(f"开始清理检测事件，共有 {len(configs)} 个配置需要处理")
-            
-            for config in configs:
-                try:
-                    # 获取最大存储天数，如果为0则设置为30天
-                    max_storage_days = config.max_storage_days if config.max_storage_days > 0 else 30
-                    
-                    # 计算过期时间点
-                    expire_time = current_time - timedelta(days=max_storage_days)
-                    
-                    # 查询要删除的事件
-                    events_to_delete = db.query(DetectionEvent).filter(
-                        DetectionEvent.config_id == config.config_id,
-                        DetectionEvent.created_at < expire_time
-                    ).all()
-                    
-                    if not events_to_delete:
-                        continue  # 没有过期事件，跳过
-                    
-                    # 删除关联的文件
-                    deleted_files_count = 0
-                    for event in events_to_delete:
-                        # 删除缩略图文件
-                        if event.thumbnail_path and Path(event.thumbnail_path).exists():
-                            try:
-                                Path(event.thumbnail_path).unlink()
-                                deleted_files_count += 1
-                            except Exception as e:
-                                logger.warning(f"删除缩略图文件失败: {event.thumbnail_path}, 错误: {e}")
-                        
-                        # 删除视频片段文件
-                        if hasattr(event, 'snippet_path') and event.snippet_path and Path(event.snippet_path).exists():
-                            try:
-                                Path(event.snippet_path).unlink()
-                                deleted_files_count += 1
-                            except Exception as e:
-                                logger.warning(f"删除视频文件失败: {event.snippet_path}, 错误: {e}")
-                    
-                    # 删除数据库记录
-                    deleted_events_count = db.query(DetectionEvent).filter(
-                        DetectionEvent.config_id == config.config_id,
-                        DetectionEvent.created_at < expire_time
-                    ).delete()
-                    
-                    if deleted_events_count > 0:
-                        total_deleted_events += deleted_events_count
-                        total_deleted_files += deleted_files_count
-                        processed_configs += 1
-                        logger.info(f"配置 {config.config_id} (设备: {config.device_id}) 清理了 {deleted_events_count} 条过期事件 (>{max_storage_days}天), {deleted_files_count} 个文件")
-                        
-                except Exception as e:
-                    failed_configs += 1
-                    logger.error(f"清理配置 {config.config_id} 的过期事件失败: {e}")
-                    continue
-            
-            # 提交所有删除操作
-            if total_deleted_events > 0:
-                db.commit()
-            
-            # 输出清理统计
-            log_action(db, 'admin', 'cleanup_detection_events', 'system', f"检测事件清理完成 - 处理配置 {processed_configs}/{len(configs)} 个, 失败 {failed_configs} 个")
-            logger.info(f"检测事件清理完成 - 处理配置 {processed_configs}/{len(configs)} 个, 失败 {failed_configs} 个")
-            logger.info(f"检测事件删除统计: {total_deleted_events} 条记录, {total_deleted_files} 个文件")
-            
+            storage_days = [days for (days,) in db.query(DetectionConfig.max_storage_days).all()]
+        finally:
+            db.close()
+        # 检测事件按配置设置保留天数，分区只能在最长保留期之后删除
+        detection_days = max(
+            [days if days and days > 0 else DEFAULT_EVENT_RETENTION_DAYS for days in storage_days],
+            default=DEFAULT_EVENT_RETENTION_DAYS
+        )
+        return {
+            "detection_event": now - timedelta(days=detection_days),
+            "external_events": now - timedelta(days=EXTERNAL_EVENT_RETENTION_DAYS),
+            "smart_events": now - timedelta(days=SMART_EVENT_RETENTION_DAYS),
+        }
+    
+    def _maintain_event_partitions(self):
+        """事件分区维护（在线程中执行，不阻塞事件循环）"""
+        for table, cutoff in self._event_partition_cutoffs().items():
+            try:
+                with engine.begin() as conn:
+                    # 尚未改造的普通表由按行清理处理
+                    if not is_partitioned(conn, table):
+                        continue
+                    create_partitions(conn, table)
+                dropped = drop_expired_partitions(engine, table, cutoff)
+                if dropped:
+                    logger.info(f"{table} 删除过期分区 {len(dropped)} 个, 共 {sum(dropped.values())} 条记录")
+            except Exception as e:
+                logger.error(f"维护 {table} 分区失败: {e}")
+        
+        deleted_files = process_manifests(engine)
+        if deleted_files:
+            logger.info(f"按分区清单删除事件文件 {deleted_files} 个")
+    
+    def _report_cleanup_progress(self, table: str):
+        """返回写入清理进度的回调"""
+        def report(deleted_events: int, deleted_files: int):
+            self.cleanup_progress["table"] = table
+            self.cleanup_progress["deleted_events"] += deleted_events
+            self.cleanup_progress["deleted_files"] += deleted_files
+            self.cleanup_progress["batches"] += 1
+            self.cleanup_progress["updated_at"] = datetime.now()
+        return report
+    
+    async def _cleanup_detection_events(self):
+        """清理检测事件（在线程中分批执行，不阻塞事件循环）"""
+        try:
+            await asyncio.to_thread(self._purge_detection_events)
         except Exception as e:
             logger.error(f"清理检测事件失败: {e}")
-            if 'db' in locals():
-                db.rollback()
+    
+    def _purge_detection_events(self):
+        db = SessionLocal()
+        try:
+            configs = db.query(DetectionConfig.config_id, DetectionConfig.device_id, DetectionConfig.max_storage_days).all()
         finally:
-            if 'db' in locals():
-                db.close()
+            db.close()
+        
+        current_time = datetime.now()
+        total_deleted_events = 0
+        total_deleted_files = 0
+        processed_configs = 0
+        failed_configs = 0
+        
+        logger.info(f"开始清理检测事件，共有 {len(configs)} 个配置需要处理")
+        
+        for config_id, device_id, storage_days in configs:
+            try:
+                # 获取最大存储天数，如果为0则设置为默认天数
+                max_storage_days = storage_days if storage_days and storage_days > 0 else DEFAULT_EVENT_RETENTION_DAYS
+                expire_time = current_time - timedelta(days=max_storage_days)
+                
+                result = purge_expired_events(
+                    engine, "detection_event", expire_time,
+                    filters={"config_id": config_id},
+                    progress=self._report_cleanup_progress("detection_event")
+                )
+                if result["events"] > 0:
+                    total_deleted_events += result["events"]
+                    total_deleted_files += result["files"]
+                    processed_configs += 1
+                    logger.info(f"配置 {config_id} (设备: {device_id}) 清理了 {result['events']} 条过期事件 (>{max_storage_days}天), {result['files']} 个文件")
+            except Exception as e:
+                failed_configs += 1
+                logger.error(f"清理配置 {config_id} 的过期事件失败: {e}")
+        
+        db = SessionLocal()
+        try:
+            log_action(db, 'admin', 'cleanup_detection_events', 'system', f"检测事件清理完成 - 处理配置 {processed_configs}/{len(configs)} 个, 失败 {failed_configs} 个")
+        finally:
+            db.close()
+        logger.info(f"检测事件清理完成 - 处理配置 {processed_configs}/{len(configs)} 个, 失败 {failed_configs} 个")
+        logger.info(f"检测事件删除统计: {total_deleted_events} 条记录, {total_deleted_files} 个文件")
     
     async def _cleanup_empty_directories(self):#清理空的存储目录
         """清理空的存储目录"""
+        await asyncio.to_thread(self._remove_empty_directories)
+    
+    def _remove_empty_directories(self):
         storage_path = Path("storage/events")
         if not storage_path.exists():
             return
@@ -570,142 +716,57 @@ class DetectionServer:
             logger.warning(f"清理空目录时出错: {e}")
     
     async def _cleanup_external_events(self):#清理所有外部的数据事件
-        """清理所有外部的数据事件"""
+        """清理所有外部的数据事件（在线程中分批执行，不阻塞事件循环）"""
         try:
-            db = SessionLocal()
-            current_time = datetime.now()
-            
-            # 外部事件保留100天
-            expire_time = current_time - timedelta(days=100)
-            
-            # 查询要删除的外部事件（用于删除关联的文件）
-            events_to_delete = db.query(ExternalEvent).filter(
-                ExternalEvent.created_at < expire_time
-            ).all()
-            
-            if not events_to_delete:
-                logger.info("没有找到过期的外部数据事件")
-                return
-            
-            deleted_files_count = 0
-            deleted_events_count = 0
-            
-            logger.info(f"开始清理外部数据事件，共有 {len(events_to_delete)} 条过期事件需要处理")
-            log_action(db, 'admin', 'cleanup_external_events', 'system', f"开始清理外部数据事件，共有 {len(events_to_delete)} 条过期事件需要处理")
-            # 删除关联的图片文件
-            for event in events_to_delete:
-                try:
-                    image_paths = []
-                    
-                    # 从normalized_data中查找图片路径
-                    if event.normalized_data and isinstance(event.normalized_data, dict):
-                        # 检查processed_images字段
-                        processed_images = event.normalized_data.get('processed_images', {})
-                        if isinstance(processed_images, dict):
-                            # 遍历processed_images中的所有字段（如pic_data、spic_data等）
-                            for field_name, image_data in processed_images.items():
-                                if isinstance(image_data, dict):
-                                    # 检查original_path
-                                    if 'original_path' in image_data and image_data['original_path']:
-                                        image_paths.append(image_data['original_path'])
-                                    
-                                    # 检查thumbnail_path
-                                    if 'thumbnail_path' in image_data and image_data['thumbnail_path']:
-                                        image_paths.append(image_data['thumbnail_path'])                       
-                    
-                    # 删除所有找到的图片文件
-                    for image_path in set(image_paths):  # 使用set去重
-                        if image_path and isinstance(image_path, str):
-                            # 处理Windows路径分隔符
-                            image_path = image_path.replace('\\', '/')
-                            
-                            # 处理相对路径和绝对路径
-                            if not Path(image_path).is_absolute():
-                                # 如果是相对路径，直接使用，因为通常相对于项目根目录
-                                full_path = Path(image_path)
-                                if not full_path.exists():
-                                    # 如果直接路径不存在，尝试在常见的存储目录中查找
-                                    for base_dir in ['storage', 'uploads', 'images', 'data']:
-                                        full_path = Path(base_dir) / image_path
-                                        if full_path.exists():
-                                            break
-                            else:
-                                full_path = Path(image_path)
-                            
-                            if full_path.exists():
-                                try:
-                                    full_path.unlink()
-                                    deleted_files_count += 1
-                                    logger.debug(f"已删除外部事件图片: {full_path}")
-                                except Exception as e:
-                                    logger.warning(f"删除外部事件图片失败: {full_path}, 错误: {e}")
-                
-                except Exception as e:
-                    logger.warning(f"处理外部事件文件删除失败 (事件ID: {getattr(event, 'event_id', 'unknown')}): {e}")
-                    continue
-            
-            # 删除数据库记录
-            deleted_events_count = db.query(ExternalEvent).filter(
-                ExternalEvent.created_at < expire_time
-            ).delete()
-            
-            # 提交删除操作
-            if deleted_events_count > 0:
-                db.commit()
-                logger.info(f"外部数据事件清理完成: 删除 {deleted_events_count} 条记录 (>100天), {deleted_files_count} 个图片文件")
-            else:
-                logger.info("没有需要清理的外部数据事件")
-                
+            await asyncio.to_thread(self._purge_external_events)
         except Exception as e:
             logger.error(f"清理外部数据事件失败: {e}")
-            if 'db' in locals():
-                db.rollback()
-        finally:
-            if 'db' in locals():
+    
+    def _purge_external_events(self):
+        # 外部事件保留100天
+        expire_time = datetime.now() - timedelta(days=EXTERNAL_EVENT_RETENTION_DAYS)
+        logger.info(f"开始清理外部数据事件（{expire_time.strftime('%Y-%m-%d %H:%M:%S')} 之前）")
+        
+        result = purge_expired_events(
+            engine, "external_events", expire_time,
+            progress=self._report_cleanup_progress("external_events")
+        )
+        
+        if result["events"] > 0:
+            db = SessionLocal()
+            try:
+                log_action(db, 'admin', 'cleanup_external_events', 'system', f"外部数据事件清理完成，删除 {result['events']} 条过期事件, {result['files']} 个图片文件")
+            finally:
                 db.close()
+            logger.info(f"外部数据事件清理完成: 删除 {result['events']} 条记录 (>{EXTERNAL_EVENT_RETENTION_DAYS}天), {result['files']} 个图片文件")
+        else:
+            logger.info("没有需要清理的外部数据事件")
     
     async def _cleanup_smart_events(self):
-        """清理智能事件"""
+        """清理智能事件（在线程中分批执行，不阻塞事件循环）"""
         try:
-            db = SessionLocal()
-            current_time = datetime.now()
-            
-            # 智能事件保留7天
-            expire_time = current_time - timedelta(days=7)
-            
-            # 查询要删除的外部事件（用于删除关联的文件）
-            events_to_delete = db.query(SmartEvent).filter(
-                SmartEvent.created_at < expire_time
-            ).all()
-            
-            if not events_to_delete:
-                logger.info("没有找到过期的智能事件")
-                return
-            
-            deleted_events_count = 0
-            
-            logger.info(f"开始清理智能事件，共有 {len(events_to_delete)} 条过期事件需要处理")
-            log_action(db, 'admin', 'cleanup_smart_events', 'system', f"开始清理智能事件，共有 {len(events_to_delete)} 条过期事件需要处理")
-           
-            # 删除数据库记录
-            deleted_events_count = db.query(SmartEvent).filter(
-                SmartEvent.created_at < expire_time
-            ).delete()
-            
-            # 提交删除操作
-            if deleted_events_count > 0:
-                db.commit()
-                logger.info(f"智能事件清理完成: 删除 {deleted_events_count} 条记录 (>30天)")
-            else:
-                logger.info("没有需要清理的智能事件")
-                
+            await asyncio.to_thread(self._purge_smart_events)
         except Exception as e:
             logger.error(f"清理智能事件失败: {e}")
-            if 'db' in locals():
-                db.rollback()
-        finally:
-            if 'db' in locals():
+    
+    def _purge_smart_events(self):
+        # 智能事件保留7天
+        expire_time = datetime.now() - timedelta(days=SMART_EVENT_RETENTION_DAYS)
+        
+        result = purge_expired_events(
+            engine, "smart_events", expire_time,
+            progress=self._report_cleanup_progress("smart_events")
+        )
+        
+        if result["events"] > 0:
+            db = SessionLocal()
+            try:
+                log_action(db, 'admin', 'cleanup_smart_events', 'system', f"智能事件清理完成，删除 {result['events']} 条过期事件")
+            finally:
                 db.close()
+            logger.info(f"智能事件清理完成: 删除 {result['events']} 条记录 (>{SMART_EVENT_RETENTION_DAYS}天)")
+        else:
+            logger.info("没有需要清理的智能事件")
             
 # 创建检测服务器实例
 detection_server = DetectionServer()
@@ -720,6 +781,10 @@ async def lifespan(app: FastAPI):
     Base.metadata.create_all(bind=engine)
     ensure_device_rtsp_columns(engine)
     ensure_detection_config_stream_type(engine)
+    ensure_crowd_metric_rollups(engine)
+    ensure_event_partitions(engine)
+    ensure_event_list_indexes(engine)
+    ensure_event_counters(engine)
     
     # 1. 注册数据监听器类型
     try:
@@ -751,7 +816,12 @@ async def lifespan(app: FastAPI):
     except Exception as e:
         logger.error(f"事件订阅管理器初始化失败: {e}")
 
-    # 5. 启动检测服务
+    # 5. 启动检测服务（先启动负载采样和检测工作进程池）
+    try:
+        admission_controller.start()
+        detection_worker_pool.start()
+    except Exception as e:
+        logger.error(f"启动检测工作进程池失败: {e}")
     try:
         db = SessionLocal()
         await detection_server.start_all_enabled(db)
@@ -781,6 +851,11 @@ async def lifespan(app: FastAPI):
         await detection_server.start_global_cleanup_task()
     except Exception as e:
         logger.error(f"启动全局清理任务失败: {e}")
+
+    try:
+        await detection_server.start_admission_worker()
+    except Exception as e:
+        logger.error(f"启动排队任务重试协程失败: {e}")
     
     yield
     
@@ -791,6 +866,8 @@ async def lifespan(app: FastAPI):
     try:
         if detection_server.cleanup_task:
             detection_server.cleanup_task.cancel()
+        if detection_server.admission_task:
+            detection_server.admission_task.cancel()
     except Exception as e:
         logger.error(f"停止全局清理任务失败: {e}")
     
@@ -812,6 +889,11 @@ async def lifespan(app: FastAPI):
             await task.stop()
         except Exception as e:
             logger.error(f"停止检测任务 {config_id} 失败: {e}")
+    try:
+        await asyncio.to_thread(detection_worker_pool.stop)
+        admission_controller.stop()
+    except Exception as e:
+        logger.error(f"停止检测工作进程池失败: {e}")
     
     # 5. 关闭时清理事件订阅管理器
     try:
@@ -872,15 +954,18 @@ async def get_detection_status():
     for config_id, task in detection_server.tasks.items():
         tasks_status[config_id] = {
             "device_id": task.device_id,
-            "is_running": task.thread is not None and task.thread.is_alive(),
+            "is_running": task.is_running(),
             "connected": task.connected,
-            "clients_count": len(task.clients)
+            "clients_count": len(task.clients),
+            "readiness": task.readiness,
+            "ready_at": task.ready_at
         }
     
     return {
         "status": "success",
         "tasks": tasks_status,
-        "total_tasks": len(tasks_status)
+        "total_tasks": len(tasks_status),
+        "startup": detection_server.get_startup_status()
     }
 
 # 手动清理过期事件API
@@ -951,7 +1036,7 @@ async def get_cleanup_status_api(current_user: User = Depends(get_current_user))
             # 统计各配置的过期事件
             configs = db.query(DetectionConfig).all()
             for config in configs:
-                max_storage_days = config.max_storage_days if config.max_storage_days > 0 else 30
+                max_storage_days = config.max_storage_days if config.max_storage_days > 0 else DEFAULT_EVENT_RETENTION_DAYS
                 expire_time = now - timedelta(days=max_storage_days)
                 count = db.query(DetectionEvent).filter(
                     DetectionEvent.config_id == config.config_id,
@@ -961,7 +1046,7 @@ async def get_cleanup_status_api(current_user: User = Depends(get_current_user))
             
             # 统计外部事件
             total_external_events = db.query(ExternalEvent).count()
-            expire_time_external = now - timedelta(days=100)
+            expire_time_external = now - timedelta(days=EXTERNAL_EVENT_RETENTION_DAYS)
             expired_external_events = db.query(ExternalEvent).filter(
                 ExternalEvent.created_at < expire_time_external
             ).count()
@@ -976,6 +1061,7 @@ async def get_cleanup_status_api(current_user: User = Depends(get_current_user))
                 "next_cleanup_time": next_cleanup.strftime('%Y-%m-%d %H:%M:%S'),
                 "current_time": now.strftime('%Y-%m-%d %H:%M:%S'),
                 "time_until_next_cleanup": str(next_cleanup - now).split('.')[0],  # 去掉微秒
+                "progress": detection_server.cleanup_progress,
                 "statistics": {
                     "detection_events": {
                         "total": total_detection_events,
@@ -984,7 +1070,7 @@ async def get_cleanup_status_api(current_user: User = Depends(get_current_user))
                     "external_events": {
                         "total": total_external_events,
                         "expired": expired_external_events,
-                        "retention_days": 100
+                        "retention_days": EXTERNAL_EVENT_RETENTION_DAYS
                     }
                 }
             }
@@ -1009,11 +1095,13 @@ async def get_system_status_api(current_user: User = Depends(get_current_user)):
         for config_id, task in detection_server.tasks.items():
             tasks_status[config_id] = {
                 "device_id": task.device_id,
-                "is_running": task.thread is not None and task.thread.is_alive(),
+                "is_running": task.is_running(),
                 "connected": task.connected,
                 "clients_count": len(task.clients),
-                "use_gpu_decoder": hasattr(task, 'ffmpeg_decoder') and task.ffmpeg_decoder is not None,
-                "skip_frame_count": getattr(task, 'skip_frame_count', 5)
+                "use_gpu_decoder": getattr(task, 'remote_state', {}).get('use_gpu_decoder', False) or task.ffmpeg_decoder is not None,
+                "skip_frame_count": getattr(task, 'skip_frame_count', 5),
+                "readiness": task.readiness,
+                "latency": task.get_latency_stats()
             }
         
         return {
@@ -1027,6 +1115,13 @@ async def get_system_status_api(current_user: User = Depends(get_current_user)):
                 },
                 "tasks": tasks_status,
                 "total_tasks": len(tasks_status),
+                "scheduler": detection_scheduler.get_stats(),
+                "worker_pool": detection_worker_pool.get_stats(),
+                "admission": admission_controller.get_stats(
+                    [t for t in detection_server.tasks.values() if t.is_running()]
+                ),
+                "pending_starts": list(detection_server.pending_starts),
+                "startup": detection_server.get_startup_status(),
                 "gpu_available": torch.cuda.is_available(),
                 "gpu_device_count": torch.cuda.device_count() if torch.cuda.is_available() else 0
             }
@@ -1048,8 +1143,9 @@ async def load_model_api(model_data: dict): # 加载模型API端点
         if not model_path:
             return {"status": "error", "message": "缺少必要参数"}
             
-        model = YOLO(model_path)  # 加载模型
-        classes = model.names  # 获取类别名称
+        # 通过模型注册表加载，不重复占用内存
+        with model_registry.use(model_path) as model:
+            classes = model.names  # 获取类别名称
         
         if model:
             return {
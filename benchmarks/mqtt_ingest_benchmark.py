@@ -0,0 +1,117 @@
+"""
+MQTT 接入吞吐基准测试
+
+用一个生产者线程模拟 paho 网络线程（代替 mosquitto），以最快速度调用
+MQTTListener._on_message，测量从回调入队到事件处理器收到事件的端到端吞吐（条/秒）。
+队列满时生产者等待而不是丢弃，事件处理器只计数，不写数据库。
+
+用法:
+    python -m benchmarks.mqtt_ingest_benchmark --messages 50000 --payload-bytes 2048
+"""
+import argparse
+import asyncio
+import json
+import threading
+import time
+from types import SimpleNamespace
+
+from src.database import ListenerType
+from src.listeners.mqtt_listener import MQTTListener, ORJSON_AVAILABLE
+
+
+def build_payload(size: int) -> bytes:
+    """构造一条接近边缘盒子算法上报格式的JSON负载"""
+    message = {
+        "sn": "EDGE-0001",
+        "channel": 1,
+        "engine_id": 17,
+        "timestamp": "2025-01-01 12:00:00",
+        "detections": [
+            {"class_name": "person", "gcid": 0, "conf": 0.91, "x1": 10, "y1": 20, "x2": 110, "y2": 220}
+        ],
+        "extra": "",
+    }
+    padding = max(size - len(json.dumps(message)), 0)
+    message["extra"] = "x" * padding
+    return json.dumps(message).encode("utf-8")
+
+
+def build_listener(queue_size: int, raw_payload_mode: str) -> MQTTListener:
+    config = SimpleNamespace(
+        config_id="benchmark",
+        name="benchmark",
+        listener_type=ListenerType.mqtt,
+        connection_config={
+            "host": "localhost",
+            "queue_size": queue_size,
+            "raw_payload_mode": raw_payload_mode,
+        },
+        data_mapping={},
+        filter_rules={},
+    )
+    return MQTTListener(config)
+
+
+async def run_benchmark(total: int, payload: bytes, queue_size: int, raw_payload_mode: str) -> dict:
+    listener = build_listener(queue_size, raw_payload_mode)
+    listener.running = True
+    received = 0
+    done = asyncio.Event()
+
+    async def count_event(event):
+        nonlocal received
+        received += 1
+        if received >= total:
+            done.set()
+
+    listener.add_event_handler(count_event)
+    consumer = asyncio.create_task(listener.listen())
+
+    # 等待 listen() 初始化事件循环引用
+    while listener.loop is None:
+        await asyncio.sleep(0.01)
+
+    message = SimpleNamespace(topic="edge/EDGE-0001/detection", payload=payload, qos=0, retain=False)
+
+    def produce():
+        # 队列满时短暂等待，模拟 broker 侧的 TCP 背压，保证所有消息都被处理
+        for _ in range(total):
+            while listener.thread_safe_queue.full():
+                time.sleep(0.0005)
+            listener._on_message(None, None, message)
+
+    started = time.perf_counter()
+    producer = threading.Thread(target=produce)
+    producer.start()
+    await done.wait()
+    elapsed = time.perf_counter() - started
+    producer.join()
+
+    listener.running = False
+    await consumer
+
+    return {
+        "messages": total,
+        "processed": received,
+        "seconds": round(elapsed, 3),
+        "messages_per_sec": round(received / elapsed, 1) if elapsed else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="MQTT 接入吞吐基准测试")
+    parser.add_argument("--messages", type=int, default=50000)
+    parser.add_argument("--payload-bytes", type=int, default=2048)
+    parser.add_argument("--queue-size", type=int, default=10000)
+    parser.add_argument("--raw-payload-mode", choices=["none", "base64", "hex"], default="none")
+    args = parser.parse_args()
+
+    payload = build_payload(args.payload_bytes)
+    result = asyncio.run(run_benchmark(args.messages, payload, args.queue_size, args.raw_payload_mode))
+    result["json_backend"] = "orjson" if ORJSON_AVAILABLE else "json"
+    result["payload_bytes"] = len(payload)
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
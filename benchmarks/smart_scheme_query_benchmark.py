@@ -0,0 +1,150 @@
+"""
+事件订阅列表查询数基准测试
+
+在一个最终回滚的事务中写入若干摄像头、订阅和事件，直接调用 v1/v2 两份
+get_schemes / get_events 接口函数，统计每次请求执行的 SQL 语句数和耗时。
+语句数必须与每页条数无关（不存在按行查询的 N+1），否则以非零状态退出。
+
+用法:
+    DATABASE_URL=postgresql://... python -m benchmarks.smart_scheme_query_benchmark --schemes 200 --events 2000
+"""
+import argparse
+import json
+import sys
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from src.database import engine, Device, SmartScheme, SmartEvent
+from api import base_smart_scheme, smart_scheme_routes
+
+PAGE_SIZES = (10, 100)
+MAX_STATEMENTS_PER_REQUEST = 3  # 总数 + 本页数据 + 事件数量分组统计
+
+
+@contextmanager
+def statement_counter(connection):
+    """统计上下文内在该连接上执行的 SQL 语句数"""
+    counter = {"statements": 0}
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        counter["statements"] += 1
+
+    event.listen(connection, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield counter
+    finally:
+        event.remove(connection, "before_cursor_execute", before_cursor_execute)
+
+
+def seed(db: Session, schemes: int, events: int):
+    """写入测试数据，摄像头与订阅一一对应，事件平均分配到各订阅"""
+    now = datetime.now()
+    prefix = uuid.uuid4().hex[:8]
+    scheme_ids = []
+    for index in range(schemes):
+        device_id = f"bench-{prefix}-{index}"
+        db.add(Device(
+            device_id=device_id,
+            device_name=f"基准摄像头{index}",
+            device_type="camera",
+            ip_address=f"10.0.{index // 250}.{index % 250 + 1}",
+            port=80,
+            username="admin",
+            password="admin",
+        ))
+        scheme_id = str(uuid.uuid4())
+        scheme_ids.append(scheme_id)
+        db.add(SmartScheme(
+            id=scheme_id,
+            camera_id=device_id,
+            event_types=["alarm", "smart"],
+            created_at=now - timedelta(seconds=index),
+        ))
+    db.flush()
+
+    db.bulk_insert_mappings(SmartEvent, [{
+        "id": str(uuid.uuid4()),
+        "scheme_id": scheme_ids[index % schemes],
+        "event_type": "alarm",
+        "title": f"基准事件{index}",
+        "status": "pending",
+        "timestamp": now - timedelta(seconds=index),
+    } for index in range(events)])
+    db.flush()
+
+
+def measure(connection, db: Session, call) -> dict:
+    # 清空会话中的对象，避免命中身份映射而少发查询
+    db.expire_all()
+    with statement_counter(connection) as counter:
+        started = time.perf_counter()
+        result = call()
+        elapsed = time.perf_counter() - started
+    return {
+        "items": len(result["items"]),
+        "statements": counter["statements"],
+        "ms": round(elapsed * 1000, 2),
+    }
+
+
+def run_benchmark(schemes: int, events: int) -> dict:
+    connection = engine.connect()
+    transaction = connection.begin()
+    db = Session(bind=connection, join_transaction_mode="create_savepoint")
+    try:
+        seed(db, schemes, events)
+
+        results = {}
+        for module in (base_smart_scheme, smart_scheme_routes):
+            for page_size in PAGE_SIZES:
+                results[f"{module.__name__}.get_schemes[{page_size}]"] = measure(
+                    connection, db, lambda: module.get_schemes(
+                        page=1, page_size=page_size, camera_id=None, event_type=None,
+                        status=None, search=None, db=db
+                    )
+                )
+                results[f"{module.__name__}.get_events[{page_size}]"] = measure(
+                    connection, db, lambda: module.get_events(
+                        page=1, page_size=page_size, scheme_id=None, event_type=None, status=None,
+                        start_date=None, end_date=None, search=None, cursor=None,
+                        total_mode="exact", db=db
+                    )
+                )
+        return results
+    finally:
+        db.close()
+        transaction.rollback()
+        connection.close()
+
+
+def check(results: dict) -> list:
+    """每个接口的语句数应为常数且不超过上限"""
+    failures = []
+    endpoints = {name.split("[")[0] for name in results}
+    for endpoint in sorted(endpoints):
+        counts = {results[f"{endpoint}[{page_size}]"]["statements"] for page_size in PAGE_SIZES}
+        if len(counts) != 1 or max(counts) > MAX_STATEMENTS_PER_REQUEST:
+            failures.append(f"{endpoint}: 语句数 {sorted(counts)}")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="事件订阅列表查询数基准测试")
+    parser.add_argument("--schemes", type=int, default=200)
+    parser.add_argument("--events", type=int, default=2000)
+    args = parser.parse_args()
+
+    results = run_benchmark(args.schemes, args.events)
+    failures = check(results)
+    print(json.dumps({"results": results, "failures": failures}, ensure_ascii=False, indent=2))
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
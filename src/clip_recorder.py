@@ -0,0 +1,292 @@
+"""
+事件视频片段录制 - 基于压缩数据包环形缓冲区的事件前/后录像
+
+每个检测任务额外开一路 FFmpeg 复制码流（-c copy，不解码不重编码），输出 MPEG-TS，
+按关键帧（random_access_indicator）切分成 GOP 存入内存环形缓冲区，保留最近 pre_seconds 秒。
+事件发生时取事件前的 GOP，继续收集事件后 post_seconds 秒，由后台线程用 FFmpeg 封装为 MP4
+（同样是 -c copy 重封装），完成后写回 detection_event.snippet_path。
+"""
+import logging
+import os
+import subprocess
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Deque, Dict, List, Optional
+
+from src.database import SessionLocal, DetectionEvent
+
+logger = logging.getLogger(__name__)
+
+CLIP_ROOT = Path("storage/events")
+TS_PACKET_SIZE = 188
+TS_SYNC_BYTE = 0x47
+READ_CHUNK_SIZE = TS_PACKET_SIZE * 256
+MAX_BUFFER_BYTES = 64 * 1024 * 1024  # 单路环形缓冲区上限，码率异常时丢弃最旧的 GOP
+MAX_PENDING_CLIPS = 4  # 同时等待事件后数据的片段数
+MUX_TIMEOUT = 60
+
+
+class _Gop:
+    """以关键帧开始的一组 TS 包"""
+    __slots__ = ("start_time", "data")
+
+    def __init__(self, start_time: float):
+        self.start_time = start_time
+        self.data = bytearray()
+
+
+class _PendingClip:
+    __slots__ = ("event_id", "created_at", "end_time", "gops")
+
+    def __init__(self, event_id: str, created_at: datetime, end_time: float, gops: List[_Gop]):
+        self.event_id = event_id
+        self.created_at = created_at
+        self.end_time = end_time
+        self.gops = gops
+
+
+def _ts_pid(packet: bytes) -> int:
+    return ((packet[1] & 0x1F) << 8) | packet[2]
+
+
+def _is_random_access(packet: bytes) -> bool:
+    """适配域中的 random_access_indicator，FFmpeg 的 TS 封装在视频关键帧处设置"""
+    adaptation = (packet[3] >> 4) & 0x3
+    return adaptation in (2, 3) and packet[4] > 0 and bool(packet[5] & 0x40)
+
+
+def _pmt_pid(packet: bytes) -> Optional[int]:
+    """从 PAT 包中取第一个节目的 PMT PID"""
+    if not packet[1] & 0x40:  # payload_unit_start_indicator
+        return None
+    offset = 4
+    if (packet[3] >> 4) & 0x2:
+        offset += 1 + packet[4]
+    offset += 1 + packet[offset]  # pointer_field
+    section_length = ((packet[offset + 1] & 0x0F) << 8) | packet[offset + 2]
+    entries_end = min(offset + 3 + section_length - 4, TS_PACKET_SIZE)  # 去掉 CRC
+    for entry in range(offset + 8, entries_end - 3, 4):
+        program_number = (packet[entry] << 8) | packet[entry + 1]
+        if program_number != 0:
+            return ((packet[entry + 2] & 0x1F) << 8) | packet[entry + 3]
+    return None
+
+
+class ClipRecorder:
+    """单路摄像机的压缩数据包环形缓冲区和事件片段录制"""
+
+    def __init__(self, device_id: str, pre_seconds: float, post_seconds: float,
+                 on_clip: Optional[Callable[[str, datetime, str], None]] = None):
+        self.device_id = device_id
+        self.pre_seconds = pre_seconds
+        self.post_seconds = post_seconds
+        self.on_clip = on_clip or update_clip_path  # 片段封装完成后的回调，默认直接写回数据库
+        self.process: Optional[subprocess.Popen] = None
+        self.thread: Optional[threading.Thread] = None
+        self.lock = threading.Lock()
+        self.gops: Deque[_Gop] = deque()
+        self.buffer_bytes = 0
+        self.current_gop: Optional[_Gop] = None
+        self.pending: List[_PendingClip] = []
+        self.pat_packet: Optional[bytes] = None
+        self.pmt_packet: Optional[bytes] = None
+        self.pmt_pid: Optional[int] = None
+
+    def is_running(self) -> bool:
+        return self.process is not None and self.process.poll() is None
+
+    def start(self, rtsp_url: str) -> bool:
+        """启动复制码流的 FFmpeg 进程，已在运行时直接返回"""
+        if self.is_running():
+            return True
+        self.stop()
+        cmd = [
+            'ffmpeg', '-hide_banner', '-loglevel', 'error',
+            '-rtsp_transport', 'tcp',
+            '-i', rtsp_url,
+            '-map', '0:v:0',
+            '-c', 'copy',
+            '-an',
+            '-f', 'mpegts',
+            'pipe:1',
+        ]
+        try:
+            self.process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, bufsize=0)
+        except Exception as e:
+            logger.error(f"启动片段录制失败: {self.device_id}, {e}")
+            self.process = None
+            return False
+
+        self.thread = threading.Thread(target=self._read_packets, args=(self.process,),
+                                       name=f"clip-recorder-{self.device_id}", daemon=True)
+        self.thread.start()
+        logger.info(f"已启动事件片段录制缓冲: {self.device_id} (事件前 {self.pre_seconds}秒, 事件后 {self.post_seconds}秒)")
+        return True
+
+    def stop(self):
+        """停止 FFmpeg 进程，已收集的待录制片段按现有数据封装"""
+        process, self.process = self.process, None
+        if process:
+            try:
+                process.kill()
+                process.wait(timeout=5)
+            except Exception as e:
+                logger.warning(f"停止片段录制进程失败: {self.device_id}, {e}")
+        if self.thread and self.thread is not threading.current_thread():
+            self.thread.join(timeout=5)
+        self.thread = None
+
+        with self.lock:
+            pending, self.pending = self.pending, []
+            self.gops.clear()
+            self.buffer_bytes = 0
+            self.current_gop = None
+        for clip in pending:
+            self._submit(clip)
+
+    def request_clip(self, event_id: str, created_at: datetime) -> bool:
+        """登记一个事件片段：取事件前的 GOP，并继续收集事件后的数据"""
+        event_time = created_at.timestamp()
+        with self.lock:
+            if not self.gops:
+                return False
+            if len(self.pending) >= MAX_PENDING_CLIPS:
+                logger.warning(f"待录制片段过多，跳过事件片段: {self.device_id}, {event_id}")
+                return False
+            window_start = event_time - self.pre_seconds
+            # 从覆盖 window_start 的最后一个关键帧开始
+            gops = list(self.gops)
+            first = 0
+            for index, gop in enumerate(gops):
+                if gop.start_time <= window_start:
+                    first = index
+            self.pending.append(_PendingClip(event_id, created_at, event_time + self.post_seconds, gops[first:]))
+        return True
+
+    def _read_packets(self, process: subprocess.Popen):
+        remainder = b""
+        while process.poll() is None:
+            try:
+                chunk = process.stdout.read(READ_CHUNK_SIZE)
+            except Exception:
+                break
+            if not chunk:
+                break
+            data = remainder + chunk
+            now = time.time()
+            offset = 0
+            with self.lock:
+                while offset + TS_PACKET_SIZE <= len(data):
+                    if data[offset] != TS_SYNC_BYTE:
+                        # 失步时逐字节寻找下一个同步字节
+                        offset += 1
+                        continue
+                    self._add_packet(data[offset:offset + TS_PACKET_SIZE], now)
+                    offset += TS_PACKET_SIZE
+                ready = self._take_ready(now)
+            remainder = data[offset:]
+            for clip in ready:
+                self._submit(clip)
+        logger.info(f"片段录制码流已结束: {self.device_id}")
+
+    def _add_packet(self, packet: bytes, now: float):
+        pid = _ts_pid(packet)
+        if pid == 0:
+            self.pat_packet = packet
+            self.pmt_pid = _pmt_pid(packet) or self.pmt_pid
+        elif pid == self.pmt_pid:
+            self.pmt_packet = packet
+
+        if _is_random_access(packet):
+            self.current_gop = _Gop(now)
+            self.gops.append(self.current_gop)
+            for clip in self.pending:
+                if now < clip.end_time:
+                    clip.gops.append(self.current_gop)
+            self._trim(now)
+
+        if self.current_gop is not None:
+            self.current_gop.data += packet
+            self.buffer_bytes += TS_PACKET_SIZE
+
+    def _trim(self, now: float):
+        """保留覆盖最近 pre_seconds 秒所需的 GOP"""
+        window_start = now - self.pre_seconds
+        while len(self.gops) > 1 and (self.gops[1].start_time <= window_start
+                                      or self.buffer_bytes > MAX_BUFFER_BYTES):
+            self.buffer_bytes -= len(self.gops.popleft().data)
+
+    def _take_ready(self, now: float) -> List[_PendingClip]:
+        ready = [clip for clip in self.pending if now >= clip.end_time]
+        if ready:
+            self.pending = [clip for clip in self.pending if now < clip.end_time]
+        return ready
+
+    def _submit(self, clip: _PendingClip):
+        headers = (self.pat_packet or b"") + (self.pmt_packet or b"")
+        with self.lock:
+            data = headers + b"".join(bytes(gop.data) for gop in clip.gops)
+        clip.gops = []
+        if len(data) <= len(headers):
+            return
+        clip_executor.submit(_mux_clip, self.device_id, clip.event_id, clip.created_at, data, self.on_clip)
+
+
+def _mux_clip(device_id: str, event_id: str, created_at: datetime, data: bytes,
+              on_clip: Callable[[str, datetime, str], None]):
+    """将 TS 数据重封装为 MP4，完成后交给 on_clip 写回事件记录"""
+    save_dir = CLIP_ROOT / created_at.strftime('%Y-%m-%d') / str(device_id)
+    save_dir.mkdir(parents=True, exist_ok=True, mode=0o777)
+    clip_path = save_dir / f"{event_id}.mp4"
+    tmp_path = save_dir / f".tmp-{event_id}.mp4"
+    cmd = [
+        'ffmpeg', '-hide_banner', '-loglevel', 'error',
+        '-f', 'mpegts', '-i', 'pipe:0',
+        '-c', 'copy',
+        '-movflags', '+faststart',
+        '-y', str(tmp_path),
+    ]
+    try:
+        started = time.perf_counter()
+        result = subprocess.run(cmd, input=data, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                                timeout=MUX_TIMEOUT)
+        if result.returncode != 0:
+            logger.error(f"事件片段封装失败: {event_id}, {result.stderr.decode(errors='ignore').strip()}")
+            tmp_path.unlink(missing_ok=True)
+            return
+        os.replace(tmp_path, clip_path)
+    except Exception as e:
+        logger.error(f"事件片段封装失败: {event_id}, {e}")
+        tmp_path.unlink(missing_ok=True)
+        return
+
+    logger.info(f"已封装事件片段: {clip_path} ({len(data) / 1024:.0f}KB, "
+                f"耗时 {(time.perf_counter() - started) * 1000:.0f}ms)")
+    on_clip(event_id, created_at, str(clip_path))
+
+
+def update_clip_path(event_id: str, created_at: datetime, clip_path: str):
+    """将片段路径写回事件记录，事件已不存在时删除片段文件"""
+    db = SessionLocal()
+    try:
+        updated = db.query(DetectionEvent).filter(
+            DetectionEvent.event_id == event_id,
+            DetectionEvent.created_at == created_at
+        ).update({DetectionEvent.snippet_path: clip_path}, synchronize_session=False)
+        db.commit()
+        if not updated:
+            # 事件已被删除或保存失败，片段不再有引用
+            Path(clip_path).unlink(missing_ok=True)
+    except Exception as e:
+        db.rollback()
+        logger.error(f"更新事件片段路径失败: {event_id}, {e}")
+    finally:
+        db.close()
+
+
+# 全局片段封装线程池实例
+clip_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="clip-mux")
@@ -22,6 +22,7 @@ import os # 导入操作系统模块
 import psutil # 导入系统监控模块
 import requests # 导入HTTP请求模块
 from collections import OrderedDict # 导入有序字典
+from concurrent.futures import ThreadPoolExecutor, as_completed, TimeoutError as FuturesTimeoutError # 导入线程池
 # 导入数据库模型
 from src.database import (
     SessionLocal, Device, 
@@ -29,166 +30,23 @@ from src.database import (
 )
 # 导入数据推送模块
 from src.data_pusher import data_pusher
+from src.heatmap_dashboard import notify_heatmap_update
+from src.crowd_rollup import update_rollups
 from src.rtsp_url import build_rtsp_url
+from src.snapshot_client import build_snapshot_url, snapshot_clients
+from src.model_registry import model_registry
 
 # 配置日志
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-class ModelCache:
-    """模型缓存管理类，实现LRU策略和内存监控"""
-    
-    def __init__(self, max_size: int = 10, max_memory_mb: int = 2048):
-        """
-        初始化模型缓存
-        
-        Args:
-            max_size: 最大缓存模型数量
-            max_memory_mb: 最大内存使用量（MB）
-        """
-        self.max_size = max_size
-        self.max_memory_mb = max_memory_mb
-        self.cache = OrderedDict()  # 使用有序字典实现LRU
-        self.lock = threading.RLock()
-        self.model_info = {}  # 存储模型信息：{model_key: {size_mb, last_used, load_time}}
-        
-    def get(self, model_key: str):
-        """获取模型，如果存在则移动到末尾（最近使用）"""
-        with self.lock:
-            if model_key in self.cache:
-                # 移动到末尾（最近使用）
-                self.cache.move_to_end(model_key)
-                # 更新最后使用时间
-                if model_key in self.model_info:
-                    self.model_info[model_key]['last_used'] = time.time()
-                return self.cache[model_key]
-            return None
-    
-    def put(self, model_key: str, model, model_size_mb: float = None):
-        """添加模型到缓存"""
-        with self.lock:
-            # 如果模型已存在，先移除
-            if model_key in self.cache:
-                self.cache.pop(model_key)
-                if model_key in self.model_info:
-                    del self.model_info[model_key]
-            
-            # 检查内存使用量
-            if self._check_memory_limit(model_size_mb):
-                # 移除最久未使用的模型
-                self._evict_oldest()
-            
-            # 添加新模型
-            self.cache[model_key] = model
-            self.model_info[model_key] = {
-                'size_mb': model_size_mb or 0,
-                'last_used': time.time(),
-                'load_time': time.time()
-            }
-            
-            logger.info(f"模型已缓存: {model_key}, 当前缓存大小: {len(self.cache)}/{self.max_size}")
-    
-    def _check_memory_limit(self, new_model_size_mb: float = None) -> bool:
-        """检查是否超过内存限制"""
-        if new_model_size_mb is None:
-            new_model_size_mb = 0
-            
-        # 计算当前内存使用量
-        current_memory = sum(info['size_mb'] for info in self.model_info.values())
-        total_memory = current_memory + new_model_size_mb
-        
-        # 检查模型数量限制
-        if len(self.cache) >= self.max_size:
-            return True
-            
-        # 检查内存限制
-        if total_memory > self.max_memory_mb:
-            return True
-            
-        return False
-    
-    def _evict_oldest(self):
-        """移除最久未使用的模型"""
-        if not self.cache:
-            return
-            
-        # 移除第一个（最久未使用）
-        oldest_key = next(iter(self.cache))
-        removed_model = self.cache.pop(oldest_key)
-        
-        if oldest_key in self.model_info:
-            del self.model_info[oldest_key]
-        
-        # 尝试释放GPU内存
-        try:
-            if hasattr(removed_model, 'model'):
-                del removed_model.model
-            del removed_model
-            import gc
-            gc.collect()
-            # logger.info(f"已移除最久未使用的模型: {oldest_key}")
-        except Exception as e:
-            logger.warning(f"释放模型内存时出错: {e}")
-    
-    def clear(self):
-        """清空所有缓存"""
-        with self.lock:
-            for model in self.cache.values():
-                try:
-                    if hasattr(model, 'model'):
-                        del model.model
-                    del model
-                except:
-                    pass
-            
-            self.cache.clear()
-            self.model_info.clear()
-            
-            import gc
-            gc.collect()
-            # logger.info("模型缓存已清空")
-    
-    def get_stats(self) -> Dict:
-        """获取缓存统计信息"""
-        with self.lock:
-            total_size = sum(info['size_mb'] for info in self.model_info.values())
-            return {
-                'cache_size': len(self.cache),
-                'max_size': self.max_size,
-                'total_memory_mb': total_size,
-                'max_memory_mb': self.max_memory_mb,
-                'models': list(self.model_info.keys())
-            }
-    
-    def cleanup(self):
-        """清理过期或未使用的模型"""
-        with self.lock:
-            current_time = time.time()
-            expired_keys = []
-            
-            for key, info in self.model_info.items():
-                # 如果模型超过1小时未使用，标记为过期
-                if current_time - info['last_used'] > 3600:  # 1小时
-                    expired_keys.append(key)
-            
-            # 移除过期的模型
-            for key in expired_keys:
-                if key in self.cache:
-                    removed_model = self.cache.pop(key)
-                    try:
-                        if hasattr(removed_model, 'model'):
-                            del removed_model.model
-                        del removed_model
-                    except:
-                        pass
-                
-                if key in self.model_info:
-                    del self.model_info[key]
-            
-            if expired_keys:
-                import gc
-                gc.collect()
-                # logger.info(f"已清理 {len(expired_keys)} 个过期模型")
+FRAME_FETCH_WORKERS = 16  # 并发抓图的最大线程数（所有任务共享）
+FRAME_FETCH_TIMEOUT = 12  # 单次任务抓图截止时间（秒），略大于HTTP抓图超时，超时的摄像头本轮跳过
+RTSP_TIMEOUT_MS = 5000  # RTSP 回退抓图的连接/读取超时
+INFERENCE_BATCH_SIZE = 16  # 批量推理每批的图像数
+MODEL_IDLE_SECONDS = 3600  # 模型超过该时间未使用且无引用时释放
+PREVIEW_CACHE_SIZE = 256  # 预览图缓存的(任务, 摄像头)条目数
+PREVIEW_SUBSCRIBER_TTL = 300  # 任务详情页最近一次查看后多长时间内（秒）定时分析也生成预览图
 
 class CrowdAnalyzer:
     """人群分析类，管理多个摄像机的人数分析流程"""
@@ -199,10 +57,12 @@ class CrowdAnalyzer:
         logging.getLogger('apscheduler').setLevel(logging.WARNING)
         self.running = False
         self.analysis_jobs = {}  # 存储所有分析任务 {job_id: job_details}
-        self.model_cache = ModelCache(max_size=10, max_memory_mb=2048)  # 使用新的模型缓存类
         self.lock = threading.Lock()
         self.device_get_frame_method = {}
         self.usedevice = 'cpu'
+        self.frame_executor = ThreadPoolExecutor(max_workers=FRAME_FETCH_WORKERS, thread_name_prefix="crowd-frame")
+        self.preview_cache = OrderedDict()  # 每个任务下每个摄像头最近一次生成的预览图 {(job_id, device_id): {preview_image, preview_timestamp}}
+        self.preview_subscribers = {}  # 正在查看预览的任务 {job_id: 最近查看时间}
         # 启动缓存清理定时任务
         self._start_cache_cleanup()
         
@@ -213,7 +73,7 @@ class CrowdAnalyzer:
                 try:
                     time.sleep(3600)  # 每小时清理一次
                     if self.running:
-                        self.model_cache.cleanup()
+                        model_registry.evict_idle(MODEL_IDLE_SECONDS)
                         # 清理设备图片获取方法记录
                         self._cleanup_device_frame_methods()
                 except Exception as e:
@@ -223,13 +83,20 @@ class CrowdAnalyzer:
         cleanup_thread.start()
     
     def _cleanup_device_frame_methods(self):
-        """清理设备图片获取方法记录"""
+        """清理已不在任何分析任务中的设备的抓图方式记录和抓图客户端"""
         try:
             with self.lock:
-                if self.device_get_frame_method:
-                    old_count = len(self.device_get_frame_method)
-                    self.device_get_frame_method.clear()
-                    logger.info(f"已清理 {old_count} 个设备的图片获取方法记录")
+                active_devices = {
+                    device_id
+                    for job_details in self.analysis_jobs.values()
+                    for device_id in job_details.get("device_ids", [])
+                }
+                stale = [device_id for device_id in self.device_get_frame_method if device_id not in active_devices]
+                for device_id in stale:
+                    del self.device_get_frame_method[device_id]
+            closed = snapshot_clients.retain(active_devices)
+            if stale or closed:
+                logger.info(f"已清理 {len(stale)} 个设备的图片获取方法记录, 关闭 {closed} 个抓图客户端")
         except Exception as e:
             logger.error(f"清理设备图片获取方法记录时出错: {e}")
         
@@ -243,7 +110,7 @@ class CrowdAnalyzer:
         """停止人群分析服务"""
         if self.running:
             self.running = False
-            self.model_cache.clear()  # 清空模型缓存
+            model_registry.clear()  # 释放未被引用的模型
             self.scheduler.shutdown()
             
     def add_analysis_job(self, job_id: str, job_name: str, device_ids: List[str], 
@@ -314,6 +181,7 @@ class CrowdAnalyzer:
                 if "job" in job_details:
                     self.scheduler.remove_job(job_id)
                 del self.analysis_jobs[job_id]
+                self._drop_previews(job_id)
                 logger.info(f"人群分析任务已移除: {job_id}")
                 return True
             return False
@@ -327,42 +195,49 @@ class CrowdAnalyzer:
     
     def get_cache_stats(self):
         """获取模型缓存统计信息"""
-        return self.model_cache.get_stats()
+        return model_registry.get_stats()
     
     def clear_model_cache(self):
-        """清空模型缓存"""
-        self.model_cache.clear()
+        """清空模型缓存（正在使用的模型除外）"""
+        model_registry.clear()
         logger.info("模型缓存已手动清空")
     
-    def reload_model(self, model_path: str, confidence: float):
-        """重新加载指定模型"""
-        model_key = f"{model_path}_{confidence}"
-        
-        # 从缓存中移除旧模型
-        with self.lock:
-            # 使用缓存类的内部方法移除模型
-            if model_key in self.model_cache.cache:
-                old_model = self.model_cache.cache.pop(model_key)
-                if model_key in self.model_cache.model_info:
-                    del self.model_cache.model_info[model_key]
-                
-                # 尝试释放GPU内存
-                try:
-                    if hasattr(old_model, 'model'):
-                        del old_model.model
-                    del old_model
-                    import gc
-                    gc.collect()
-                except Exception as e:
-                    logger.warning(f"释放旧模型内存时出错: {e}")
-        
-        # 重新加载模型
+    def reload_model(self, model_path: str, confidence: float = None):
+        """重新加载指定模型（置信度在推理时传入，与模型实例无关）"""
+        model_registry.invalidate(model_path)
         logger.info(f"重新加载模型: {model_path}")
-        return self._get_model(model_path, confidence)
+        handle = model_registry.acquire(model_path, use_gpu=False)
+        handle.release()
+        return handle
     
+    def subscribe_previews(self, job_id: str):
+        """记录任务详情页正在查看预览，之后一段时间内的定时分析也生成预览图"""
+        with self.lock:
+            # 只记录仍在运行的任务，已停止或不存在的任务不留订阅
+            if job_id in self.analysis_jobs:
+                self.preview_subscribers[job_id] = time.time()
+
+    def _wants_preview(self, job_id: str) -> bool:
+        last_seen = self.preview_subscribers.get(job_id)
+        return last_seen is not None and time.time() - last_seen < PREVIEW_SUBSCRIBER_TTL
+
+    def _drop_previews(self, job_id: str):
+        """清理任务的预览订阅和缓存的预览图（调用方持有 self.lock）"""
+        self.preview_subscribers.pop(job_id, None)
+        for key in [key for key in self.preview_cache if key[0] == job_id]:
+            del self.preview_cache[key]
+
+    def attach_previews(self, job_id: str, camera_counts: List[dict]) -> List[dict]:
+        """为摄像头结果附上该任务缓存中的预览图（返回副本）"""
+        attached = []
+        for camera in camera_counts or []:
+            preview = self.preview_cache.get((job_id, camera.get("device_id")))
+            attached.append({**camera, **preview} if preview else camera)
+        return attached
+
     def _run_analysis(self, job_id: str, device_ids: List[str], 
                      models_id: str, tags: List[str], location_info: Dict, detect_classes: List[str], 
-                     confidence_threshold: float = 0.5):
+                     confidence_threshold: float = 0.5, render_preview: Optional[bool] = None):
         """
         执行人群分析的具体逻辑
         
@@ -372,9 +247,13 @@ class CrowdAnalyzer:
             models_id: 检测模型ID
             tags: 数据推送标签
             location_info: 位置信息
+            render_preview: 是否生成预览图；None 表示仅在有详情页订阅时生成（定时执行）
         """
+        if render_preview is None:
+            render_preview = self._wants_preview(job_id)
         start_time = time.time()
         # logger.info(f"开始执行人群分析: {job_id}")
+        yolo_model = None
         
         try:
             # 更新任务状态
@@ -396,8 +275,8 @@ class CrowdAnalyzer:
                         self.analysis_jobs[job_id]["last_error"] = f"未找到模型: {models_id}"
                 return None
             
-            # 加载YOLO模型
-            yolo_model = self._get_model(model.file_path, confidence_threshold, model.is_gpu)  # 使用任务配置的置信度
+            # 获取共享的YOLO模型，置信度在推理时传入
+            yolo_model = self._get_model(model.file_path, model.models_type)
             if not yolo_model:
                 logger.error(f"模型加载失败: {model.file_path}")
                 with self.lock:
@@ -416,29 +295,19 @@ class CrowdAnalyzer:
             
             total_person_count = 0
             
-            # 遍历所有设备
-            for device_id in device_ids:
-                result = self._analyze_single_camera(device_id, yolo_model, confidence_threshold, detect_classes, tags)  # 使用任务配置的置信度
-                if result:
-                    # 确保所有结果都可JSON序列化
-                    result_serializable = self._ensure_json_serializable(result)
-                    analysis_results["camera_counts"].append(result_serializable)
-                    total_person_count += result.get("person_count", 0)
+            # 并发抓取所有摄像头画面，批量推理后汇总
+            for result in self._analyze_cameras(device_ids, yolo_model, confidence_threshold, detect_classes, tags,
+                                                render_preview=render_preview, job_id=job_id):  # 使用任务配置的置信度
+                # 确保所有结果都可JSON序列化
+                result_serializable = self._ensure_json_serializable(result)
+                analysis_results["camera_counts"].append(result_serializable)
+                total_person_count += result.get("person_count", 0)
             
             # 添加总人数
             analysis_results["total_person_count"] = total_person_count
             
-            # 删除preview_image字段
-            def remove_preview_image(camera_counts):
-                processed_camera_counts = []
-                for camera in camera_counts:
-                    camera_copy = camera.copy()
-                    if "preview_image" in camera_copy:
-                        del camera_copy["preview_image"]
-                    processed_camera_counts.append(camera_copy)
-                return processed_camera_counts
-            
-            processed_camera_counts = remove_preview_image(analysis_results["camera_counts"])
+            # 预览图只保存在 preview_cache 中，结果里不带
+            processed_camera_counts = analysis_results["camera_counts"]
             # 检查是否需要发送预警
             self._check_warning(job_id, total_person_count, processed_camera_counts)
             
@@ -455,7 +324,7 @@ class CrowdAnalyzer:
                     self.analysis_jobs[job_id]["last_result"] = {
                         "timestamp": datetime.now().isoformat(),
                         "total_person_count": total_person_count,
-                        "camera_counts": analysis_results["camera_counts"],
+                        "camera_counts": processed_camera_counts,
                         "analysis_time": analysis_time
                     }
                     # 记录分析时间统计
@@ -501,11 +370,17 @@ class CrowdAnalyzer:
             
             logger.error(f"人群分析任务失败: {job_id}, 耗时: {analysis_time:.2f}秒")
             return None
+        finally:
+            if yolo_model:
+                yolo_model.release()
     
     def _get_camera_frame(self, device):
         """       
         优先使用摄像机API抓图，失败时回退到OpenCV RTSP拉流
         
+        记录每个设备上次成功的方式，之后直接使用该方式；该方式失败时才尝试另一种，
+        另一种成功后再切换记录。
+        
         Args:
             device: 设备对象
             
@@ -513,48 +388,21 @@ class CrowdAnalyzer:
             图像帧，失败则返回None
         """
         device_id = device.device_id
+        methods = {'api': self._get_frame_via_api, 'rtsp': self._get_frame_via_rtsp}
         
-        # 检查是否有记录的成功方法
-        if device_id in self.device_get_frame_method:
-            method = self.device_get_frame_method[device_id]
-            if method == 'api':
-                # 直接使用API方法
-                frame = self._get_frame_via_api(device)
-                if frame is not None:
-                    return frame
-                else:
-                    # API失败，清除记录并尝试RTSP
-                    del self.device_get_frame_method[device_id]
-
-            elif method == 'rtsp':
-                # 直接使用RTSP方法
-                frame = self._get_frame_via_rtsp(device)
-                if frame is not None:
-                    return frame
-                else:
-                    # RTSP失败，清除记录并尝试API
-                    del self.device_get_frame_method[device_id]
-        
-        # 没有记录或记录的方法失败，按优先级尝试
-        # 首先尝试使用摄像机API抓图
-        frame = self._get_frame_via_api(device)
-        if frame is not None:
-            # 记录API方法成功
-            self.device_get_frame_method[device_id] = 'api'
-            return frame
-        
-        # API抓图失败，回退到OpenCV RTSP拉流
-        frame = self._get_frame_via_rtsp(device)
-        if frame is not None:
-            # 记录RTSP方法成功
-            self.device_get_frame_method[device_id] = 'rtsp'
-            return frame
+        preferred = self.device_get_frame_method.get(device_id, 'api')
+        fallback = 'rtsp' if preferred == 'api' else 'api'
+        for method in (preferred, fallback):
+            frame = methods[method](device)
+            if frame is not None:
+                self.device_get_frame_method[device_id] = method
+                return frame
         
         return None
     
     def _get_frame_via_api(self, device):
         """
-        通过摄像机API抓图获取图像
+        通过摄像机API抓图获取图像（复用设备的长连接和认证信息）
         
         Args:
             device: 设备对象
@@ -563,67 +411,15 @@ class CrowdAnalyzer:
             OpenCV图像帧，失败则返回None
         """
         try:
-            # 构建设备抓图URL
-            if device.device_type.lower() == 'nvr':
-                snapshot_url = f"http://{device.ip_address}/cgi-bin/snapshot.cgi?channel={device.channel}&type=0"
-            else:
-                snapshot_url = f"http://{device.ip_address}/cgi-bin/snapshot.cgi?channel=1&type=0"
-            
-            # 第一次请求，获取认证信息
-            headers = {
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
-            }
-            
-            first_response = requests.get(snapshot_url, headers=headers, timeout=10)
-
-            if first_response.status_code == 200:
-                # 如果直接成功，将图片字节数据转换为OpenCV图像
-                image_array = np.frombuffer(first_response.content, np.uint8)
-                frame = cv2.imdecode(image_array, cv2.IMREAD_COLOR)
-                if frame is not None:
-                    # logger.info(f"API抓图成功: {device.device_id}, 图像尺寸: {frame.shape}")
-                    return frame
-                else:
-                    # logger.error(f"API抓图成功但图像解码失败: {device.device_id}")
-                    return None
-            
-            elif first_response.status_code == 401:
-                # 需要认证
-                auth_header = first_response.headers.get('www-authenticate', '')
-                
-                if 'Digest' in auth_header:
-                    # Digest认证
-                    auth_response = self._generate_digest_auth(
-                        auth_header, device.username, device.password, 
-                        'GET', snapshot_url
-                    )
-                    
-                    # 发送带认证的请求
-                    auth_headers = {
-                        'Authorization': auth_response,
-                        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
-                    }
-                    
-                    auth_response_obj = requests.get(snapshot_url, headers=auth_headers, timeout=10)
-                    
-                    if auth_response_obj.status_code == 200:
-                        # 将认证后的图片字节数据转换为OpenCV图像
-                        image_array = np.frombuffer(auth_response_obj.content, np.uint8)
-                        frame = cv2.imdecode(image_array, cv2.IMREAD_COLOR)
-                        if frame is not None:
-                            # logger.info(f"API抓图成功(认证): {device.device_id}, 图像尺寸: {frame.shape}")
-                            return frame
-                        else:
-                            # logger.error(f"API抓图成功(认证)但图像解码失败: {device.device_id}")
-                            return None
-                    else:
-                        # logger.error(f"设备抓图失败: {device.device_id}, {auth_response_obj.status_code}")
-                        return None
-            
-            else:
-                # 其他状态码
-                # logger.error(f"设备抓图失败: {device.device_id}, {first_response.status_code}")
+            snapshot_url = build_snapshot_url(device.ip_address, device.device_type, device.channel)
+            response = snapshot_clients.fetch(device.device_id, device.username, device.password, snapshot_url)
+            if response.status_code != 200:
+                # logger.error(f"设备抓图失败: {device.device_id}, {response.status_code}")
                 return None
+            
+            # 将图片字节数据转换为OpenCV图像
+            image_array = np.frombuffer(response.content, np.uint8)
+            return cv2.imdecode(image_array, cv2.IMREAD_COLOR)
              
         except requests.exceptions.Timeout:
             # logger.error(f"请求超时，设备可能离线或网络不通: {device.device_id}")
@@ -634,51 +430,6 @@ class CrowdAnalyzer:
         except Exception as e:
             # logger.error(f"设备抓图失败: {device.device_id}, {e}")
             return None
-    
-    def _generate_digest_auth(self, auth_header: str, username: str, password: str, method: str, uri: str) -> str:
-        """
-        生成Digest认证响应
-        """
-        import hashlib
-        import re
-        
-        # 解析认证头
-        auth_info = {}
-        pattern = r'(\w+)="([^"]*)"'
-        matches = re.findall(pattern, auth_header)
-        
-        for key, value in matches:
-            auth_info[key] = value
-        
-        realm = auth_info.get('realm', '')
-        nonce = auth_info.get('nonce', '')
-        qop = auth_info.get('qop', '')
-        algorithm = auth_info.get('algorithm', 'MD5')
-        
-        # 生成随机值
-        import secrets
-        cnonce = secrets.token_hex(8)
-        nc = '00000001'
-        
-        # 计算HA1 = MD5(username:realm:password)
-        ha1 = hashlib.md5(f"{username}:{realm}:{password}".encode()).hexdigest()
-        
-        # 计算HA2 = MD5(method:uri)
-        ha2 = hashlib.md5(f"{method}:{uri}".encode()).hexdigest()
-        
-        # 计算response
-        if qop:
-            response = hashlib.md5(f"{ha1}:{nonce}:{nc}:{cnonce}:{qop}:{ha2}".encode()).hexdigest()
-        else:
-            response = hashlib.md5(f"{ha1}:{nonce}:{ha2}".encode()).hexdigest()
-        
-        # 构建Authorization头
-        auth_response = f'Digest username="{username}", realm="{realm}", nonce="{nonce}", uri="{uri}", algorithm={algorithm}, response="{response}"'
-        
-        if qop:
-            auth_response += f', qop={qop}, nc={nc}, cnonce="{cnonce}"'
-        
-        return auth_response
 
     def _get_frame_via_rtsp(self, device):
         """
@@ -693,16 +444,13 @@ class CrowdAnalyzer:
         try:
             rtsp_url = build_rtsp_url(device)
             
-            # 连接到摄像机
-            cap = cv2.VideoCapture(rtsp_url)
+            # 连接到摄像机，限制连接和读取超时，避免单个离线摄像头拖住抓图线程
+            cap = cv2.VideoCapture(rtsp_url, cv2.CAP_FFMPEG, [
+                cv2.CAP_PROP_OPEN_TIMEOUT_MSEC, RTSP_TIMEOUT_MS,
+                cv2.CAP_PROP_READ_TIMEOUT_MSEC, RTSP_TIMEOUT_MS,
+            ])
             cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
             
-            # 兼容性处理：某些OpenCV版本可能不支持CAP_PROP_TIMEOUT
-            # try:
-            #     cap.set(cv2.CAP_PROP_TIMEOUT, 10000)  # 设置10秒超时
-            # except AttributeError:
-                # logger.warning(f"当前OpenCV版本不支持CAP_PROP_TIMEOUT，将使用默认超时设置")
-            
             if not cap.isOpened():
                 logger.error(f"无法连接到摄像机: {device.device_id}")
                 return None
@@ -806,218 +554,277 @@ class CrowdAnalyzer:
         Returns:
             (person_count, person_boxes) 元组
         """
-        try:
-            # 使用YOLO模型进行检测
-            # results = model.predict(frame, conf=confidence, verbose=False)[0]
-            results = model(frame, conf=confidence,iou=0.45,max_det=300,device=self.usedevice)           
+        return self._detect_persons_batch([frame], model, confidence, [area_points], detect_classes)[0]
 
-            # 统计人数
-            person_count = 0
+    def _detect_persons_batch(self, frames, model, confidence, area_points_list, detect_classes: List[str] = None):
+        """
+        批量检测多张图像中的人员，每 INFERENCE_BATCH_SIZE 张图像做一次推理
+        
+        Args:
+            frames: 图像帧列表
+            model: YOLO模型
+            confidence: 置信度阈值
+            area_points_list: 与 frames 一一对应的区域像素坐标（无区域为None）
+            detect_classes: 检测类别
+
+        Returns:
+            与 frames 一一对应的 (person_count, person_boxes) 列表
+        """
+        results = []
+        for start in range(0, len(frames), INFERENCE_BATCH_SIZE):
+            batch = frames[start:start + INFERENCE_BATCH_SIZE]
+            try:
+                batch_results = model(batch, conf=confidence, iou=0.45, max_det=300, device=self.usedevice, verbose=False)
+            except Exception as e:
+                logger.error(f"批量人员检测失败: {e}")
+                batch_results = [None] * len(batch)
+            for offset, r in enumerate(batch_results):
+                results.append(self._count_persons(r, area_points_list[start + offset], detect_classes))
+        return results
+
+    def _count_persons(self, r, area_points, detect_classes: List[str] = None):
+        """从单张图像的检测结果中筛选目标类别并统计区域内人数"""
+        if r is None:
+            return (0, [])
+        try:
             person_boxes = []
-            
-            for r in results:
-                boxes = r.boxes
-                for box in boxes:
-                    x1, y1, x2, y2 = box.xyxy[0].tolist()
-                    confidence = box.conf.item()
-                    class_id = int(box.cls.item())
-                    class_name = r.names[class_id]
-                    
-                    if str(class_id) in detect_classes:
-                        person_boxes.append({
-                            "bbox": [x1, y1, x2, y2],
-                            "confidence": confidence,
-                            "class_id": class_id,
-                            "class_name": class_name
-                        })
+            for box in r.boxes:
+                x1, y1, x2, y2 = box.xyxy[0].tolist()
+                confidence = box.conf.item()
+                class_id = int(box.cls.item())
+                class_name = r.names[class_id]
+                
+                if str(class_id) in detect_classes:
+                    person_boxes.append({
+                        "bbox": [x1, y1, x2, y2],
+                        "confidence": confidence,
+                        "class_id": class_id,
+                        "class_name": class_name
+                    })
 
             if area_points:
-                for bbox in person_boxes:
-                    center = self._get_center(bbox['bbox'])
-                    if self._point_in_polygon(center, area_points):
-                        person_count += 1
+                person_count = sum(
+                    1 for bbox in person_boxes
+                    if self._point_in_polygon(self._get_center(bbox['bbox']), area_points)
+                )
             else:
-                for bbox in person_boxes:   
-                    person_count += 1
+                person_count = len(person_boxes)
 
             return (person_count, person_boxes)
         except Exception as e:
             logger.error(f"人员检测失败: {e}")
             return (0, [])
-            
-    def _analyze_single_camera(self, device_id: str, yolo_model=None, confidence=0.5, detect_classes: List[str] = None, tags: List[str] = None):   
+
+    def _fetch_frames(self, device_ids: List[str]):
         """
-        分析单个摄像头的画面
+        并发抓取多个摄像头的画面
+        
+        设备信息一次查询；抓图提交到共享线程池并行执行，所有摄像头共用 FRAME_FETCH_TIMEOUT 截止时间，
+        到期仍未返回（或排队到截止时间后才开始）的摄像头本轮跳过。
         
-        Args:
-            device_id: 设备ID
-            yolo_model: 已加载的YOLO模型实例
-            confidence: 置信度阈值
-            
         Returns:
-            包含分析结果的字典
+            按 device_ids 顺序排列的 (device, frame) 列表，只包含抓图成功的摄像头
         """
+        db = SessionLocal()
         try:
-            # 获取设备信息
-            db = SessionLocal()
-            
-            # 获取设备信息
-            device = db.query(Device).filter(Device.device_id == device_id).first()
-            if not device:
-                logger.error(f"未找到设备: {device_id}")
-                db.close()
-                return None
-            
+            devices = {
+                device.device_id: device
+                for device in db.query(Device).filter(Device.device_id.in_(device_ids)).all()
+            }
+        finally:
             db.close()
-            
-            # 获取摄像机画面
-            frame = self._get_camera_frame(device)
-            if frame is None:
-                return None
-            
-            # 如果未提供模型，则尝试使用设备配置的模型（向后兼容）
-            if yolo_model is None:               
+
+        for device_id in device_ids:
+            if device_id not in devices:
+                logger.error(f"未找到设备: {device_id}")
+
+        deadline = time.monotonic() + FRAME_FETCH_TIMEOUT
+
+        def fetch(device):
+            if time.monotonic() >= deadline:
                 return None
-            
+            return self._get_camera_frame(device)
+
+        futures = {
+            self.frame_executor.submit(fetch, devices[device_id]): device_id
+            for device_id in device_ids if device_id in devices
+        }
+        frames = {}
+        try:
+            for future in as_completed(futures, timeout=max(deadline - time.monotonic(), 0)):
+                try:
+                    frame = future.result()
+                except Exception as e:
+                    logger.error(f"获取摄像头画面失败: {futures[future]}, {e}")
+                    continue
+                if frame is not None:
+                    frames[futures[future]] = frame
+        except FuturesTimeoutError:
+            timed_out = [device_id for future, device_id in futures.items() if not future.done()]
+            for future in futures:
+                future.cancel()
+            logger.warning(f"摄像头抓图超时({FRAME_FETCH_TIMEOUT}秒)，本轮跳过: {', '.join(timed_out)}")
+
+        return [(devices[device_id], frames[device_id]) for device_id in device_ids if device_id in frames]
+
+    def _analyze_cameras(self, device_ids: List[str], yolo_model, confidence=0.5, detect_classes: List[str] = None, tags: List[str] = None,
+                         render_preview: bool = False, job_id: Optional[str] = None):
+        """
+        分析多个摄像头的画面：并发抓图 -> 一次批量推理 -> 逐个生成结果
+        
+        render_preview 为 True 时为每个摄像头绘制预览图并以 (job_id, device_id) 更新 preview_cache
+        
+        Returns:
+            分析结果字典列表（抓图失败的摄像头不包含在内）
+        """
+        if yolo_model is None:
+            return []
+
+        captured = self._fetch_frames(device_ids)
+        if not captured:
+            return []
+
+        area_points_list = []
+        for device, frame in captured:
             area_coordinates = device.area_coordinates
-            
             # 将归一化坐标转换为像素坐标
-            if area_coordinates and area_coordinates.get('points'):               
-                area_points = self.normalize_points(area_coordinates.get('points'), frame.shape)
+            if area_coordinates and area_coordinates.get('points'):
+                area_points_list.append(self.normalize_points(area_coordinates.get('points'), frame.shape))
             else:
-                area_points = None
+                area_points_list.append(None)
 
-            # 检测人员
-            person_count, person_boxes = self._detect_persons(frame, yolo_model, confidence, area_points, detect_classes)
-            
-            # 构建结果
-            camera_result = {
-                "device_id": device_id,
-                "device_name": device.device_name,
-                "timestamp": datetime.now().isoformat(),
-                "person_count": person_count,
-                "location": device.location or "",
-                "area": device.area or "",
-                "person_detections": person_boxes
-            }
+        detections = self._detect_persons_batch(
+            [frame for _, frame in captured], yolo_model, confidence, area_points_list, detect_classes
+        )
 
-            # 推送分析结果
+        results = []
+        for (device, frame), area_points, (person_count, person_boxes) in zip(captured, area_points_list, detections):
             try:
-                if data_pusher.push_configs and tags:
-                    # 确保标签列表可序列化
-                    serializable_tags = [str(tag) for tag in tags]
-
-                    event_data={
-                        'cameraInfo': device.device_name + ":" + device.ip_address,
-                        'deviceId': device_id,
-                        'enteredCount': 0,
-                        'exitedCount': 0,
-                        'stayingCount': person_count,
-                        'passedCount': 0,
-                        'recordTime': datetime.now().isoformat() + '+08:00', 
-                        'event_description': f'区域内人数={person_count}'
-                    }
-
-                    data_pusher.push_data(
-                        data=event_data,
-                        tags=serializable_tags  # 添加固定标签
-                    )
-                
+                results.append(self._build_camera_result(device, frame, area_points, person_count, person_boxes, tags))
+                if render_preview:
+                    self._render_preview(job_id, device.device_id, frame, area_points, person_count, person_boxes)
             except Exception as e:
-                logger.error(f"推送分析结果时出错: {e}")
-            
-            # 可选：添加预览图（缩小尺寸以减少数据量）
-            if frame is not None:
-                # 在原始图像上绘制检测框和人数标签
-                frame_with_boxes = frame.copy()
-                
-                self.draw_roi(frame_with_boxes, area_points)
-
-                # 添加人员检测框
-                for detection in person_boxes:
-                    box = detection.get("bbox")
-                    conf = detection.get("confidence", 0)
-                    if box:
-                        x1, y1, x2, y2 = [int(coord) for coord in box]
-                        # 绘制矩形框
-                        cv2.rectangle(frame_with_boxes, (x1, y1), (x2, y2), (0, 255, 0), 2)
-                        # 添加置信度标签
-                        conf_text = f"{conf:.2f}"
-                        cv2.putText(frame_with_boxes, conf_text, (x1, y1-5), 
-                                    cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 1, cv2.LINE_AA)
-                
-                # 添加总人数标签
-                font = cv2.FONT_HERSHEY_SIMPLEX
-                cv2.putText(frame_with_boxes, f"People: {person_count}", (10, 30), 
-                            font, 0.5, (0, 0, 255), 1, cv2.LINE_AA)
-
-                # 调整图像大小以减少数据量
-                preview_frame = cv2.resize(frame_with_boxes, (640, 360))
-                
-                # 将图像编码为JPEG，然后转换为base64字符串
-                import base64
-                _, buffer = cv2.imencode('.jpg', preview_frame, [cv2.IMWRITE_JPEG_QUALITY, 100])
-                image_base64 = base64.b64encode(buffer).decode('utf-8')
-                camera_result["preview_image"] = image_base64
-            
-            return camera_result
+                logger.error(f"分析摄像头 {device.device_id} 失败: {e}")
+        return results
             
-        except Exception as e:
-            logger.error(f"分析摄像头 {device_id} 失败: {e}")
-            return None
-    
-    def _get_model(self, model_path: str, confidence: float, is_gpu: bool):
+    def _analyze_single_camera(self, device_id: str, yolo_model=None, confidence=0.5, detect_classes: List[str] = None, tags: List[str] = None,
+                               job_id: Optional[str] = None):
         """
-        获取YOLO模型（优先使用缓存）
+        分析单个摄像头的画面
         
         Args:
-            model_path: 模型路径
+            device_id: 设备ID
+            yolo_model: 已加载的YOLO模型实例
             confidence: 置信度阈值
+            job_id: 所属任务ID，预览图按 (job_id, device_id) 缓存
             
         Returns:
-            YOLO模型实例
+            包含分析结果的字典
         """
-        model_key = f"{model_path}_{confidence}"
-        
-        # 从缓存获取模型
-        cached_model = self.model_cache.get(model_key)
-        if cached_model:
-            return cached_model
-        
+        results = self._analyze_cameras([device_id], yolo_model, confidence, detect_classes, tags,
+                                        render_preview=True, job_id=job_id)
+        return self.attach_previews(job_id, results)[0] if results else None
+
+    def _build_camera_result(self, device, frame, area_points, person_count: int, person_boxes: List[dict], tags: List[str] = None):
+        """根据检测结果生成单个摄像头的分析结果并推送数据"""
+        # 构建结果
+        camera_result = {
+            "device_id": device.device_id,
+            "device_name": device.device_name,
+            "timestamp": datetime.now().isoformat(),
+            "person_count": person_count,
+            "location": device.location or "",
+            "area": device.area or "",
+            "person_detections": person_boxes
+        }
+
+        # 推送分析结果
         try:
-            from ultralytics import YOLO
-            import torch
-            
-            # 加载模型
-            model = YOLO(model_path)
+            if data_pusher.push_configs and tags:
+                # 确保标签列表可序列化
+                serializable_tags = [str(tag) for tag in tags]
+
+                event_data={
+                    'cameraInfo': device.device_name + ":" + device.ip_address,
+                    'deviceId': device.device_id,
+                    'enteredCount': 0,
+                    'exitedCount': 0,
+                    'stayingCount': person_count,
+                    'passedCount': 0,
+                    'recordTime': datetime.now().isoformat() + '+08:00', 
+                    'event_description': f'区域内人数={person_count}'
+                }
+
+                data_pusher.push_data(
+                    data=event_data,
+                    tags=serializable_tags  # 添加固定标签
+                )
             
-            # 设置设备
-            # device = 'cuda' if torch.cuda.is_available() and is_gpu else 'cpu'
-            device = 'cpu'
-            model.to(torch.device(device))
+        except Exception as e:
+            logger.error(f"推送分析结果时出错: {e}")
+        
+        return camera_result
+    
+    def _render_preview(self, job_id: Optional[str], device_id: str, frame, area_points, person_count: int, person_boxes: List[dict]):
+        """绘制检测框和人数标签，缩小后编码为预览图存入 preview_cache"""
+        # 在原始图像上绘制检测框和人数标签
+        frame_with_boxes = frame.copy()
+        
+        self.draw_roi(frame_with_boxes, area_points)
 
-            if device == 'cuda' and hasattr(model, 'model'): 
-                # 使用半精度浮点数以提高性能
-                if hasattr(model.model, 'dtype'):
-                    model.model.half()
+        # 添加人员检测框
+        for detection in person_boxes:
+            box = detection.get("bbox")
+            conf = detection.get("confidence", 0)
+            if box:
+                x1, y1, x2, y2 = [int(coord) for coord in box]
+                # 绘制矩形框
+                cv2.rectangle(frame_with_boxes, (x1, y1), (x2, y2), (0, 255, 0), 2)
+                # 添加置信度标签
+                conf_text = f"{conf:.2f}"
+                cv2.putText(frame_with_boxes, conf_text, (x1, y1-5), 
+                            cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 1, cv2.LINE_AA)
+        
+        # 添加总人数标签
+        font = cv2.FONT_HERSHEY_SIMPLEX
+        cv2.putText(frame_with_boxes, f"People: {person_count}", (10, 30), 
+                    font, 0.5, (0, 0, 255), 1, cv2.LINE_AA)
 
-            self.usedevice = device
+        # 调整图像大小以减少数据量
+        preview_frame = cv2.resize(frame_with_boxes, (640, 360))
+        
+        # 将图像编码为JPEG，然后转换为base64字符串
+        import base64
+        _, buffer = cv2.imencode('.jpg', preview_frame, [cv2.IMWRITE_JPEG_QUALITY, 100])
+        image_base64 = base64.b64encode(buffer).decode('utf-8')
+        key = (job_id, device_id)
+        with self.lock:
+            # 任务已被移除（分析进行中被删除）时不再写入，避免残留
+            if job_id is not None and job_id not in self.analysis_jobs:
+                return
+            self.preview_cache[key] = {
+                "preview_image": image_base64,
+                "preview_timestamp": datetime.now().isoformat()
+            }
+            self.preview_cache.move_to_end(key)
+            while len(self.preview_cache) > PREVIEW_CACHE_SIZE:
+                self.preview_cache.popitem(last=False)
 
-            # 估算模型大小（MB）
-            try:
-                # 尝试获取模型文件大小
-                if os.path.exists(model_path):
-                    model_size_mb = os.path.getsize(model_path) / (1024 * 1024)
-                else:
-                    # 如果文件不存在，使用默认大小
-                    model_size_mb = 100  # 默认100MB
-            except:
-                model_size_mb = 100
+    def _get_model(self, model_path: str, models_type: str = None):
+        """
+        从进程内模型注册表获取YOLO模型引用（同一权重文件只加载一次），用完后需 release()
+        
+        Args:
+            model_path: 模型路径
+            models_type: 模型类型（pose 模型按 pose 任务加载）
             
-            # 缓存模型
-            self.model_cache.put(model_key, model, model_size_mb)
-                
-            return model
+        Returns:
+            模型引用，加载失败返回None
+        """
+        task_type = 'pose' if models_type == 'pose' else 'detect'
+        try:
+            # 人群分析固定使用CPU推理
+            return model_registry.acquire(model_path, task=task_type, use_gpu=False)
         except Exception as e:
             logger.error(f"加载模型失败: {e}")
             return None
@@ -1120,25 +927,32 @@ class CrowdAnalyzer:
         try:
             db = SessionLocal()                      
 
+            now = datetime.now()
+
             # 更新分析任务最新一次的记录
-            result1 = db.query(CrowdAnalysisJob).filter(CrowdAnalysisJob.job_id == job_id).first()
-            if result1:
-                result1.last_result = { "total_person_count": total_person_count }
-                result1.last_run = datetime.now()
-                db.commit()
+            db.query(CrowdAnalysisJob).filter(CrowdAnalysisJob.job_id == job_id).update(
+                {"last_result": {"total_person_count": total_person_count}, "last_run": now},
+                synchronize_session=False
+            )
             
             # 创建新的分析结果记录
             result = CrowdAnalysisResult(
                 result_id=str(uuid.uuid4()),
                 job_id=job_id,
-                timestamp=datetime.now(),
+                timestamp=now,
                 total_person_count=total_person_count,
                 location_info=location_info,
                 camera_counts=camera_counts
             )
-            
-            # 保存到数据库
             db.add(result)
+
+            # 合并进时间桶汇总表
+            update_rollups(db, job_id, now, total_person_count, camera_counts)
+
+            # 通知热力图展板刷新快照，随事务一起提交
+            notify_heatmap_update(db, job_id)
+
+            # 一次事务提交
             db.commit()
             
             # logger.info(f"分析结果已保存到数据库: {job_id}")
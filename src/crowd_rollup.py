@@ -0,0 +1,203 @@
+"""
+人数统计时间桶汇总 - 写入人群分析结果时增量维护 1分钟/15分钟/1小时/1天 汇总，
+历史查询按时间范围自动选择桶大小，避免逐条扫描 CrowdAnalysisResult 的 JSONB。
+细粒度的桶按 ROLLUP_RETENTION 定期删除，查询超出保留期的范围时改用更粗的桶。
+"""
+import logging
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import case, func, text
+from sqlalchemy.dialects.postgresql import aggregate_order_by, insert
+from sqlalchemy.orm import Session
+
+from src.database import CrowdMetricRollup, HeatmapBinding
+
+logger = logging.getLogger(__name__)
+
+SCOPE_JOB = "job"
+SCOPE_CAMERA = "camera"
+SCOPE_AREA = "area"
+
+BUCKET_SIZES = (60, 900, 3600, 86400)
+BUCKET_NAMES = {"1m": 60, "15m": 900, "1h": 3600, "1d": 86400}
+
+# 各桶大小的保留期，None 表示永久保留
+ROLLUP_RETENTION = {
+    60: timedelta(days=7),
+    900: timedelta(days=62),
+    3600: timedelta(days=400),
+    86400: None,
+}
+ROLLUP_PURGE_BATCH_SIZE = 5000
+
+# 时间范围 -> 桶大小，每条曲线控制在几百个点以内；1小时以内直接返回原始记录
+AUTO_BUCKET_RULES = (
+    (timedelta(hours=1), None),
+    (timedelta(hours=6), 60),
+    (timedelta(days=3), 900),
+    (timedelta(days=31), 3600),
+)
+
+_EPOCH = datetime(1970, 1, 1)
+
+
+def bucket_start(timestamp: datetime, bucket_seconds: int) -> datetime:
+    """按本地时间对齐到桶起点（天桶对齐到零点）"""
+    seconds = int((timestamp - _EPOCH).total_seconds())
+    return _EPOCH + timedelta(seconds=seconds - seconds % bucket_seconds)
+
+
+def pick_bucket_seconds(start: datetime, end: datetime) -> Optional[int]:
+    """根据查询范围选择桶大小，返回 None 表示使用原始记录；起点超出保留期的桶大小跳过"""
+    span = end - start
+    for limit, bucket_seconds in AUTO_BUCKET_RULES:
+        if span <= limit and (bucket_seconds is None or bucket_retained(bucket_seconds, start)):
+            return bucket_seconds
+    return BUCKET_SIZES[-1]
+
+
+def bucket_retained(bucket_seconds: int, start: datetime) -> bool:
+    """该桶大小的汇总是否仍保留了 start 之后的数据"""
+    retention = ROLLUP_RETENTION.get(bucket_seconds)
+    return retention is None or start >= datetime.now() - retention
+
+
+def _to_int(value: Any) -> int:
+    try:
+        return int(value or 0)
+    except (TypeError, ValueError):
+        return 0
+
+
+def build_samples(db: Session, job_id: str, total_person_count: int,
+                  camera_counts: Optional[Iterable[Dict[str, Any]]]) -> List[Tuple[str, str, int]]:
+    """展开一次分析结果的各汇总序列: (scope, series_id, value)"""
+    samples = {(SCOPE_JOB, ""): _to_int(total_person_count)}
+
+    for camera in camera_counts or []:
+        device_id = camera.get("device_id") if isinstance(camera, dict) else None
+        if device_id:
+            samples[(SCOPE_CAMERA, str(device_id))] = _to_int(camera.get("person_count"))
+
+    # 绑定到该任务的热力图区域
+    area_ids = db.query(HeatmapBinding.area_id).filter(
+        HeatmapBinding.data_source_id == job_id,
+        HeatmapBinding.is_active == True
+    ).all()
+    for (area_id,) in area_ids:
+        samples[(SCOPE_AREA, str(area_id))] = _to_int(total_person_count)
+
+    return [(scope, series_id, value) for (scope, series_id), value in samples.items()]
+
+
+def update_rollups(db: Session, job_id: str, timestamp: datetime, total_person_count: int,
+                   camera_counts: Optional[Iterable[Dict[str, Any]]]):
+    """在当前事务中把一次分析结果合并进所有汇总桶（一条 upsert 语句）"""
+    rows = []
+    for scope, series_id, value in build_samples(db, job_id, total_person_count, camera_counts):
+        for bucket_seconds in BUCKET_SIZES:
+            rows.append({
+                "scope": scope,
+                "job_id": job_id,
+                "series_id": series_id,
+                "bucket_seconds": bucket_seconds,
+                "bucket_start": bucket_start(timestamp, bucket_seconds),
+                "sample_count": 1,
+                "sum_value": value,
+                "min_value": value,
+                "max_value": value,
+                "last_value": value,
+                "first_time": timestamp,
+                "last_time": timestamp,
+            })
+
+    table = CrowdMetricRollup.__table__
+    stmt = insert(table).values(rows)
+    excluded = stmt.excluded
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[table.c.scope, table.c.job_id, table.c.series_id,
+                        table.c.bucket_seconds, table.c.bucket_start],
+        set_={
+            "sample_count": table.c.sample_count + excluded.sample_count,
+            "sum_value": table.c.sum_value + excluded.sum_value,
+            "min_value": func.least(table.c.min_value, excluded.min_value),
+            "max_value": func.greatest(table.c.max_value, excluded.max_value),
+            "last_value": case(
+                (excluded.last_time >= table.c.last_time, excluded.last_value),
+                else_=table.c.last_value
+            ),
+            "first_time": func.least(table.c.first_time, excluded.first_time),
+            "last_time": func.greatest(table.c.last_time, excluded.last_time),
+        }
+    )
+    db.execute(stmt)
+
+
+def query_rollups(db: Session, scope: str, bucket_seconds: int, start: datetime, end: datetime,
+                  job_id: Optional[str] = None, series_id: Optional[str] = None) -> List[Dict[str, Any]]:
+    """读取汇总桶；同一序列来自多个任务时（区域换绑）按桶合并"""
+    query = db.query(
+        CrowdMetricRollup.series_id,
+        CrowdMetricRollup.bucket_start,
+        func.sum(CrowdMetricRollup.sample_count).label("sample_count"),
+        func.sum(CrowdMetricRollup.sum_value).label("sum_value"),
+        func.min(CrowdMetricRollup.min_value).label("min_value"),
+        func.max(CrowdMetricRollup.max_value).label("max_value"),
+        # 取桶内最新样本的值
+        func.array_agg(
+            aggregate_order_by(CrowdMetricRollup.last_value, CrowdMetricRollup.last_time.desc())
+        )[1].label("last_value"),
+    ).filter(
+        CrowdMetricRollup.scope == scope,
+        CrowdMetricRollup.bucket_seconds == bucket_seconds,
+        CrowdMetricRollup.bucket_start >= bucket_start(start, bucket_seconds),
+        CrowdMetricRollup.bucket_start <= end,
+    )
+    if job_id is not None:
+        query = query.filter(CrowdMetricRollup.job_id == job_id)
+    if series_id is not None:
+        query = query.filter(CrowdMetricRollup.series_id == series_id)
+
+    rows = query.group_by(
+        CrowdMetricRollup.series_id, CrowdMetricRollup.bucket_start
+    ).order_by(CrowdMetricRollup.bucket_start, CrowdMetricRollup.series_id).all()
+
+    return [{
+        "series_id": row.series_id,
+        "bucket_start": row.bucket_start,
+        "sample_count": int(row.sample_count),
+        "avg": round(row.sum_value / row.sample_count, 2) if row.sample_count else 0,
+        "min": row.min_value,
+        "max": row.max_value,
+        "last": row.last_value,
+    } for row in rows]
+
+
+def purge_expired_rollups(engine, now: Optional[datetime] = None,
+                          batch_size: int = ROLLUP_PURGE_BATCH_SIZE) -> Dict[int, int]:
+    """按 ROLLUP_RETENTION 分批删除过期的汇总桶，每批单独提交，返回 {桶大小: 删除行数}"""
+    now = now or datetime.now()
+    delete_batch = text(
+        "DELETE FROM crowd_metric_rollup WHERE ctid = ANY(ARRAY("
+        "SELECT ctid FROM crowd_metric_rollup "
+        "WHERE bucket_seconds = :bucket_seconds AND bucket_start < :cutoff LIMIT :limit))"
+    )
+    deleted = {}
+    for bucket_seconds, retention in ROLLUP_RETENTION.items():
+        if retention is None:
+            continue
+        params = {"bucket_seconds": bucket_seconds, "cutoff": now - retention, "limit": batch_size}
+        started = time.perf_counter()
+        total = 0
+        while True:
+            with engine.begin() as conn:
+                count = conn.execute(delete_batch, params).rowcount
+            total += count
+            if count < batch_size:
+                break
+        if total:
+            deleted[bucket_seconds] = total
+            logger.info(f"已删除过期人数统计汇总: 桶 {bucket_seconds}秒 {total} 条, 耗时 {time.perf_counter() - started:.2f}秒")
+    return deleted
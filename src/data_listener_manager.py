@@ -2,11 +2,15 @@
 数据监听器管理模块 - 用于管理数据监听器，将原始数据标准化为统一格式，并推送到外部平台
 """
 import asyncio
+import hashlib
 import json
+import os
 import uuid
 import threading
 import logging
 from abc import ABC, abstractmethod
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from typing import Dict, List, Optional, Any, Callable
 from dataclasses import dataclass
@@ -16,9 +20,42 @@ from src.database import (
     SessionLocal, ListenerConfig, ExternalEvent, ListenerStatus, 
     ListenerType, ExternalEventType, EventStatus
 )
+from src.event_sink import external_event_sink
 
 logger = logging.getLogger(__name__)
 
+# 图片解码、写文件和缩略图生成在共享线程池中执行，避免阻塞监听器事件循环
+# （PIL 的解码/缩放和文件写入都会释放 GIL，线程池即可获得并行度）
+IMAGE_WORKERS = 4
+image_executor = ThreadPoolExecutor(max_workers=IMAGE_WORKERS, thread_name_prefix="listener-image")
+
+class _ImageDedupIndex:
+    """已保存图片的有界 LRU 索引（键为内容哈希），供多个图片线程共享"""
+    
+    def __init__(self, max_entries: int = 2048):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def get(self, key: str, need_thumbnail: bool = False) -> Optional[Dict]:
+        with self._lock:
+            result = self._entries.get(key)
+            if result is None:
+                return None
+            # 文件已被清理或缺少所需缩略图时视为未命中
+            if not os.path.exists(result['original_path']) or (need_thumbnail and 'thumbnail_path' not in result):
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return dict(result)
+    
+    def put(self, key: str, result: Dict):
+        with self._lock:
+            self._entries[key] = dict(result)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
 @dataclass
 class UnifiedEvent:
     """统一事件数据格式"""
@@ -71,6 +108,16 @@ class BaseListener(ABC):
         self.last_event_time = None
         self.error_count = 0
         self.last_error = None
+        
+        # URL图片下载配置（会话在监听线程的事件循环中按需创建并复用）
+        self.image_fetch_concurrency = self.connection_config.get('image_fetch_concurrency', 4)
+        self.image_fetch_timeout = self.connection_config.get('image_fetch_timeout', 30)
+        self.image_max_bytes = self.connection_config.get('image_max_bytes', 20 * 1024 * 1024)  # 20MB
+        self._image_session = None
+        self._image_session_loop = None
+        self._image_semaphore = None
+        self._image_inflight: Dict[str, asyncio.Future] = {}
+        self._image_dedup = _ImageDedupIndex()
     
     @abstractmethod
     async def connect(self) -> bool:
@@ -251,6 +298,26 @@ class BaseListener(ABC):
                 original_data=raw_data
             )
     
+    async def normalize_event(self, raw_data: Dict) -> Optional[UnifiedEvent]:
+        """标准化数据，图片字段在线程池中处理，不阻塞事件循环"""
+        image_config = self.data_mapping.get('image_fields') or {}
+        image_payloads = {}
+        if image_config and isinstance(raw_data, dict):
+            # 先取出图片字段，标准化过程不再同步处理图片
+            for field_name in image_config:
+                if field_name in raw_data:
+                    image_payloads[field_name] = raw_data.pop(field_name)
+        
+        event = self.normalize_data(raw_data)
+        if not event or not image_payloads:
+            return event
+        
+        processed_images = await self._process_image_fields_async(image_payloads, image_config)
+        if event.metadata is None:
+            event.metadata = {'source_config': self.config_id}
+        event.metadata['processed_images'] = processed_images
+        return event
+    
     def _parse_timestamp(self, timestamp_data) -> datetime:
         """解析时间戳"""
         if isinstance(timestamp_data, datetime):
@@ -493,6 +560,10 @@ class BaseListener(ABC):
             logger.error(f"监听循环异常: {e}")
             self.last_error = str(e)
         finally:
+            try:
+                loop.run_until_complete(self._close_image_session())
+            except Exception as e:
+                logger.warning(f"关闭图片下载会话失败: {e}")
             loop.close()
     
     async def stop(self):
@@ -514,8 +585,38 @@ class BaseListener(ABC):
         except Exception as e:
             logger.error(f"停止监听器 {self.config_id} 失败: {e}")
 
+    async def _process_image_fields_async(self, image_payloads: Dict, image_config: Dict) -> Dict:
+        """并发处理图片字段"""
+        field_names = list(image_payloads.keys())
+        results = await asyncio.gather(*[
+            self._process_image_field_async(image_payloads[field_name], image_config[field_name] or {})
+            for field_name in field_names
+        ], return_exceptions=True)
+        
+        processed_images = {}
+        for field_name, result in zip(field_names, results):
+            if isinstance(result, Exception):
+                logger.error(f"处理图片字段 {field_name} 失败: {result}")
+                processed_images[field_name] = {'error': str(result), 'original_field': field_name}
+            else:
+                processed_images[field_name] = {
+                    'original_field': field_name,
+                    'encoding': (image_config[field_name] or {}).get('encoding', 'base64'),
+                    **result
+                }
+        return processed_images
+    
+    async def _process_image_field_async(self, image_data, config: Dict) -> Dict:
+        """处理单个图片字段：URL图片在事件循环中异步下载，其余在线程池中解码写入"""
+        if config.get('encoding', 'base64') == 'url':
+            return await self._download_and_save_image(
+                image_data, config.get('save_path', 'images/events'), config.get('generate_thumbnail', False)
+            )
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(image_executor, self._save_image_field, image_data, config)
+    
     def _process_image_fields(self, raw_data: Dict, image_config: Dict) -> Dict:
-        """处理图片字段"""
+        """处理图片字段（同步版本，URL图片需通过 normalize_event 异步下载）"""
         processed_images = {}
         
         for field_name, config in image_config.items():
@@ -523,28 +624,8 @@ class BaseListener(ABC):
                 continue
                 
             try:
-                image_data = raw_data[field_name]
                 encoding = config.get('encoding', 'base64')
-                save_path_prefix = config.get('save_path', 'images/events')
-                generate_thumbnail = config.get('generate_thumbnail', False)
-                
-                # 根据编码类型处理图片
-                if encoding == 'base64':
-                    saved_paths = self._save_base64_image(
-                        image_data, save_path_prefix, generate_thumbnail
-                    )
-                elif encoding == 'url':
-                    saved_paths = self._download_and_save_image(
-                        image_data, save_path_prefix, generate_thumbnail
-                    )
-                elif encoding == 'binary':
-                    saved_paths = self._save_binary_image(
-                        image_data, save_path_prefix, generate_thumbnail
-                    )
-                else:
-                    logger.warning(f"不支持的图片编码类型: {encoding}")
-                    continue
-                
+                saved_paths = self._save_image_field(raw_data[field_name], config)
                 processed_images[field_name] = {
                     'original_field': field_name,
                     'encoding': encoding,
@@ -560,13 +641,24 @@ class BaseListener(ABC):
         
         return processed_images
     
+    def _save_image_field(self, image_data, config: Dict) -> Dict:
+        """按编码类型保存单个图片字段"""
+        encoding = config.get('encoding', 'base64')
+        save_path_prefix = config.get('save_path', 'images/events')
+        generate_thumbnail = config.get('generate_thumbnail', False)
+        
+        # 根据编码类型处理图片
+        if encoding == 'base64':
+            return self._save_base64_image(image_data, save_path_prefix, generate_thumbnail)
+        elif encoding == 'binary':
+            return self._save_binary_image(image_data, save_path_prefix, generate_thumbnail)
+        elif encoding == 'url':
+            raise ValueError("URL图片需在事件循环中异步下载")
+        raise ValueError(f"不支持的图片编码类型: {encoding}")
+    
     def _save_base64_image(self, base64_data: str, save_path_prefix: str, generate_thumbnail: bool) -> Dict:
         """保存base64编码的图片"""
         import base64
-        import os
-        from pathlib import Path
-        from PIL import Image
-        import io
         
         try:
             # 去除base64前缀（如果有的话）
@@ -575,155 +667,171 @@ class BaseListener(ABC):
             
             # 解码图片数据
             image_bytes = base64.b64decode(base64_data)
-            
-            # 生成文件名
-            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-            filename = f"{self.config_id}_{timestamp}_{uuid.uuid4().hex[:8]}.jpg"
-            
-            # 创建保存目录
-            save_dir = Path(save_path_prefix)
-            save_dir.mkdir(parents=True, exist_ok=True)
-            
-            # 保存原图
-            original_path = save_dir / filename
-            with open(original_path, 'wb') as f:
-                f.write(image_bytes)
-            
-            result = {
-                'original_path': str(original_path),
-                'file_size': len(image_bytes)
-            }
-            
-            # 生成缩略图
-            if generate_thumbnail:
-                try:
-                    thumbnail_filename = f"thumb_{filename}"
-                    thumbnail_path = save_dir / thumbnail_filename
-                    
-                    image = Image.open(io.BytesIO(image_bytes))
-                    image.thumbnail((200, 200), Image.Resampling.LANCZOS)
-                    image.save(thumbnail_path, 'JPEG', quality=85)
-                    
-                    result['thumbnail_path'] = str(thumbnail_path)
-                    result['thumbnail_size'] = thumbnail_path.stat().st_size
-                    
-                except Exception as e:
-                    logger.warning(f"生成缩略图失败: {e}")
-            
-            return result
+            return self._write_image_file(image_bytes, save_path_prefix, generate_thumbnail)
             
         except Exception as e:
             logger.error(f"保存base64图片失败: {e}")
             raise
     
-    def _download_and_save_image(self, image_url: str, save_path_prefix: str, generate_thumbnail: bool) -> Dict:
-        """下载并保存网络图片"""
-        import aiohttp
-        import asyncio
+    def _write_image_file(self, image_bytes: bytes, save_path_prefix: str, generate_thumbnail: bool) -> Dict:
+        """写入原图并按需生成缩略图，每个事件使用独立的文件名
+
+        内容相同的图片以硬链接方式复用已保存的文件（不重复占用磁盘、不重复生成缩略图），
+        删除任一事件的文件只移除它自己的链接，不影响其他事件。
+        """
         from pathlib import Path
         from PIL import Image
+        import io
+        
+        # 生成文件名
+        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        filename = f"{self.config_id}_{timestamp}_{uuid.uuid4().hex[:8]}.jpg"
+        
+        # 创建保存目录
+        save_dir = Path(save_path_prefix)
+        save_dir.mkdir(parents=True, exist_ok=True)
+        
+        content_hash = hashlib.sha1(image_bytes).hexdigest()
+        cached = self._image_dedup.get(f"sha1:{content_hash}", generate_thumbnail)
+        if cached:
+            linked = self._link_cached_image(cached, save_dir, filename, generate_thumbnail)
+            if linked:
+                return linked
+        
+        # 保存原图
+        original_path = save_dir / filename
+        with open(original_path, 'wb') as f:
+            f.write(image_bytes)
+        
+        result = {
+            'original_path': str(original_path),
+            'file_size': len(image_bytes),
+            'content_hash': content_hash
+        }
         
-        async def download_image():
+        # 生成缩略图
+        if generate_thumbnail:
             try:
-                async with aiohttp.ClientSession() as session:
-                    async with session.get(image_url, timeout=aiohttp.ClientTimeout(total=30)) as response:
-                        if response.status == 200:
-                            image_bytes = await response.read()
-                            return image_bytes
-                        else:
-                            raise ValueError(f"HTTP {response.status}: 下载图片失败")
+                thumbnail_filename = f"thumb_{filename}"
+                thumbnail_path = save_dir / thumbnail_filename
+                
+                image = Image.open(io.BytesIO(image_bytes))
+                image.draft('RGB', (400, 400))  # JPEG 按缩放比例解码，减少解码开销
+                image.thumbnail((200, 200), Image.Resampling.LANCZOS)
+                if image.mode not in ('RGB', 'L'):
+                    image = image.convert('RGB')
+                image.save(thumbnail_path, 'JPEG', quality=85)
+                
+                result['thumbnail_path'] = str(thumbnail_path)
+                result['thumbnail_size'] = thumbnail_path.stat().st_size
+                
             except Exception as e:
-                logger.error(f"下载图片失败: {e}")
-                raise
+                logger.warning(f"生成缩略图失败: {e}")
         
+        self._image_dedup.put(f"sha1:{content_hash}", result)
+        return result
+    
+    @staticmethod
+    def _link_cached_image(cached: Dict, save_dir, filename: str, generate_thumbnail: bool) -> Optional[Dict]:
+        """为内容相同的已保存图片创建本事件的硬链接，失败（如跨文件系统、文件已删除）时返回 None"""
+        created = []
         try:
-            # 在事件循环中下载图片
-            loop = asyncio.get_event_loop()
-            image_bytes = loop.run_until_complete(download_image())
-            
-            # 生成文件名
-            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-            filename = f"{self.config_id}_{timestamp}_{uuid.uuid4().hex[:8]}.jpg"
-            
-            # 创建保存目录
-            save_dir = Path(save_path_prefix)
-            save_dir.mkdir(parents=True, exist_ok=True)
-            
-            # 保存原图
             original_path = save_dir / filename
-            with open(original_path, 'wb') as f:
-                f.write(image_bytes)
-            
+            os.link(cached['original_path'], original_path)
+            created.append(original_path)
             result = {
                 'original_path': str(original_path),
-                'file_size': len(image_bytes),
-                'source_url': image_url
+                'file_size': cached['file_size'],
+                'content_hash': cached['content_hash'],
+                'deduplicated': True
             }
-            
-            # 生成缩略图
             if generate_thumbnail:
-                try:
-                    thumbnail_filename = f"thumb_{filename}"
-                    thumbnail_path = save_dir / thumbnail_filename
-                    
-                    image = Image.open(io.BytesIO(image_bytes))
-                    image.thumbnail((200, 200), Image.Resampling.LANCZOS)
-                    image.save(thumbnail_path, 'JPEG', quality=85)
-                    
-                    result['thumbnail_path'] = str(thumbnail_path)
-                    result['thumbnail_size'] = thumbnail_path.stat().st_size
-                    
-                except Exception as e:
-                    logger.warning(f"生成缩略图失败: {e}")
-            
+                thumbnail_path = save_dir / f"thumb_{filename}"
+                os.link(cached['thumbnail_path'], thumbnail_path)
+                created.append(thumbnail_path)
+                result['thumbnail_path'] = str(thumbnail_path)
+                result['thumbnail_size'] = cached['thumbnail_size']
             return result
-            
+        except OSError:
+            for path in created:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            return None
+    
+    async def _download_and_save_image(self, image_url: str, save_path_prefix: str, generate_thumbnail: bool) -> Dict:
+        """下载并保存网络图片（同一URL的并发请求只下载一次，每个事件各自保存文件）"""
+        inflight = self._image_inflight.get(image_url)
+        if inflight is not None:
+            image_bytes = await asyncio.shield(inflight)
+        else:
+            future = asyncio.get_running_loop().create_future()
+            self._image_inflight[image_url] = future
+            try:
+                image_bytes = await self._fetch_image_bytes(image_url)
+                future.set_result(image_bytes)
+            except Exception as e:
+                logger.error(f"下载图片失败: {e}")
+                future.set_exception(e)
+                future.exception()  # 已记录日志，避免无人等待时报未取回异常
+                raise
+            finally:
+                self._image_inflight.pop(image_url, None)
+        
+        try:
+            result = await asyncio.get_running_loop().run_in_executor(
+                image_executor, self._write_image_file, image_bytes, save_path_prefix, generate_thumbnail
+            )
         except Exception as e:
-            logger.error(f"下载并保存图片失败: {e}")
+            logger.error(f"保存下载的图片失败: {e}")
             raise
+        result['source_url'] = image_url
+        return result
+    
+    async def _get_image_session(self):
+        """获取当前事件循环上的共享图片下载会话"""
+        import aiohttp
+        
+        loop = asyncio.get_running_loop()
+        if self._image_session is None or self._image_session.closed or self._image_session_loop is not loop:
+            connector = aiohttp.TCPConnector(limit=self.image_fetch_concurrency, ttl_dns_cache=300)
+            self._image_session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=self.image_fetch_timeout)
+            )
+            self._image_session_loop = loop
+            self._image_semaphore = asyncio.Semaphore(self.image_fetch_concurrency)
+        return self._image_session
+    
+    async def _fetch_image_bytes(self, image_url: str) -> bytes:
+        """限并发、限大小地下载图片内容"""
+        session = await self._get_image_session()
+        async with self._image_semaphore:
+            async with session.get(image_url) as response:
+                if response.status != 200:
+                    raise ValueError(f"HTTP {response.status}: 下载图片失败")
+                if response.content_length and response.content_length > self.image_max_bytes:
+                    raise ValueError(f"图片大小 {response.content_length} 超过上限 {self.image_max_bytes}")
+                
+                image_bytes = bytearray()
+                async for chunk in response.content.iter_chunked(64 * 1024):
+                    image_bytes += chunk
+                    if len(image_bytes) > self.image_max_bytes:
+                        raise ValueError(f"图片大小超过上限 {self.image_max_bytes}")
+                return bytes(image_bytes)
+    
+    async def _close_image_session(self):
+        """关闭图片下载会话"""
+        if self._image_session and not self._image_session.closed:
+            await self._image_session.close()
+        self._image_session = None
+        self._image_session_loop = None
     
     def _save_binary_image(self, binary_data: bytes, save_path_prefix: str, generate_thumbnail: bool) -> Dict:
         """保存二进制图片数据"""
-        from pathlib import Path
-        from PIL import Image
-        import io
-        
         try:
-            # 生成文件名
-            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-            filename = f"{self.config_id}_{timestamp}_{uuid.uuid4().hex[:8]}.jpg"
-            
-            # 创建保存目录
-            save_dir = Path(save_path_prefix)
-            save_dir.mkdir(parents=True, exist_ok=True)
-            
-            # 保存原图
-            original_path = save_dir / filename
-            with open(original_path, 'wb') as f:
-                f.write(binary_data)
-            
-            result = {
-                'original_path': str(original_path),
-                'file_size': len(binary_data)
-            }
-            
-            # 生成缩略图
-            if generate_thumbnail:
-                try:
-                    thumbnail_filename = f"thumb_{filename}"
-                    thumbnail_path = save_dir / thumbnail_filename
-                    
-                    image = Image.open(io.BytesIO(binary_data))
-                    image.thumbnail((200, 200), Image.Resampling.LANCZOS)
-                    image.save(thumbnail_path, 'JPEG', quality=85)
-                    
-                    result['thumbnail_path'] = str(thumbnail_path)
-                    result['thumbnail_size'] = thumbnail_path.stat().st_size
-                    
-                except Exception as e:
-                    logger.warning(f"生成缩略图失败: {e}")
-            
-            return result
+            return self._write_image_file(binary_data, save_path_prefix, generate_thumbnail)
             
         except Exception as e:
             logger.error(f"保存二进制图片失败: {e}")
@@ -830,6 +938,8 @@ class DataListenerManager:
     
     async def start_all_enabled(self, db: Session):
         """启动所有已启用的监听器"""
+        external_event_sink.start()
+        
         enabled_configs = db.query(ListenerConfig).filter(ListenerConfig.enabled.is_(True)).all()
         
         started_count = 0
@@ -848,6 +958,9 @@ class DataListenerManager:
         """停止所有监听器"""
         for config_id in list(self.listeners.keys()):
             await self.stop_listener(config_id)
+        
+        # 写完队列中剩余的事件
+        await asyncio.get_running_loop().run_in_executor(None, external_event_sink.stop)
     
     def get_listener_status(self, config_id: str) -> Dict:
         """获取监听器状态"""
@@ -874,7 +987,8 @@ class DataListenerManager:
             "listeners": status,
             "total_listeners": self.total_listeners,
             "total_events": self.total_events,
-            "running_count": len([l for l in self.listeners.values() if l.running])
+            "running_count": len([l for l in self.listeners.values() if l.running]),
+            "event_sink": external_event_sink.get_stats()
         }
     
     async def _handle_event(self, event: UnifiedEvent):
@@ -970,53 +1084,46 @@ class DataListenerManager:
             }
     
     async def save_event_to_db(self, event: UnifiedEvent):
-        """保存事件到数据库"""
+        """保存事件到数据库（放入写库队列，由写库线程批量插入）"""
         try:
-            from src.database import SessionLocal, ExternalEvent
-            
-            db = SessionLocal()
-            
-            # 提取元数据
-            metadata = event.metadata or {}
-            
-            # 创建事件记录
-            db_event = ExternalEvent(
-                event_id=event.event_id,
-                config_id=metadata.get('source_config'),
-                source_type=event.source_type,
-                event_type=event.event_type,
-                device_id=event.device_id,  # 现在存储设备SN
-                device_sn=metadata.get('device_sn'),
-                device_name=metadata.get('device_mapping', {}).get('device_name'),  # 设备名称
-                channel_id=metadata.get('channel_id'),
-                engine_id=metadata.get('engine_id'),
-                engine_name=metadata.get('device_mapping', {}).get('engine_name'),  # 引擎名称
-                location=event.location,
-                confidence=event.confidence,
-                original_data=event.original_data,
-                normalized_data={
-                    "description": event.description,
-                    "targets": event.targets,
-                    "custom_data": metadata.get('custom_data', {}),
-                    "processed_images": metadata.get('processed_images', {}),
-                    "device_mapping": metadata.get('device_mapping', {})
-                },
-                algorithm_data=metadata.get('algorithm_data', {}),
-                event_metadata=metadata,
-                timestamp=event.timestamp
-            )
-            
-            db.add(db_event)
-            db.commit()
-            db.close()
-            
-            logger.info(f"事件已保存到数据库: {event.event_id}")
+            record = self._build_event_record(event)
+            if await external_event_sink.submit_async(record):
+                logger.debug(f"事件已加入写库队列: {event.event_id}")
             
         except Exception as e:
             logger.error(f"保存事件到数据库失败: {e}")
-            if 'db' in locals():
-                db.rollback()
-                db.close()
+    
+    def _build_event_record(self, event: UnifiedEvent) -> Dict:
+        """构建 ExternalEvent 行数据"""
+        # 提取元数据
+        metadata = event.metadata or {}
+        device_mapping = metadata.get('device_mapping') or {}
+        
+        return {
+            'event_id': event.event_id,
+            'config_id': metadata.get('source_config'),
+            'source_type': event.source_type,
+            'event_type': event.event_type,
+            'device_id': event.device_id,  # 现在存储设备SN
+            'device_sn': metadata.get('device_sn'),
+            'device_name': device_mapping.get('device_name'),  # 设备名称
+            'channel_id': metadata.get('channel_id'),
+            'engine_id': metadata.get('engine_id'),
+            'engine_name': device_mapping.get('engine_name'),  # 引擎名称
+            'location': event.location,
+            'confidence': event.confidence,
+            'original_data': event.original_data,
+            'normalized_data': {
+                "description": event.description,
+                "targets": event.targets,
+                "custom_data": metadata.get('custom_data', {}),
+                "processed_images": metadata.get('processed_images', {}),
+                "device_mapping": device_mapping
+            },
+            'algorithm_data': metadata.get('algorithm_data', {}),
+            'event_metadata': metadata,
+            'timestamp': event.timestamp
+        }
     
     def _update_listener_status(self, config_id: str):
         """更新监听器状态到数据库"""
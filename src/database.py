@@ -1,4 +1,4 @@
-from sqlalchemy import create_engine, Column, String, Boolean, DateTime, Integer, Float, Enum, ForeignKey, ARRAY, Text, SmallInteger, Index
+from sqlalchemy import create_engine, Column, String, Boolean, DateTime, Date, Integer, BigInteger, Float, Enum, ForeignKey, ARRAY, Text, SmallInteger, Index
 from sqlalchemy.dialects.postgresql import INET, JSONB
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship
@@ -137,6 +137,8 @@ class DetectionConfig(Base):
 
 class DetectionEvent(Base):
     __tablename__ = "detection_event"
+    # 按 created_at 每日分区，主键需包含分区字段；ORM 仍以 event_id 标识对象
+    __table_args__ = {"postgresql_partition_by": "RANGE (created_at)"}
     
     event_id = Column(String(64), primary_key=True, default=lambda: str(uuid.uuid4()))
     device_id = Column(String(64), ForeignKey('device.device_id'), nullable=False)
@@ -158,12 +160,21 @@ class DetectionEvent(Base):
     viewed_by = Column(String(64), ForeignKey('users.user_id'))
     notes = Column(Text)
     location = Column(Text)
-    created_at = Column(DateTime, default=datetime.now)
+    created_at = Column(DateTime, primary_key=True, default=datetime.now)
+    
+    __mapper_args__ = {"primary_key": [event_id]}
     
     device = relationship("Device", back_populates="detection_events")
     config = relationship("DetectionConfig", back_populates="events")
     viewer = relationship("User", foreign_keys=[viewed_by])
 
+# 检测事件列表的游标分页索引（按筛选条件组合）
+Index('idx_detection_event_created', DetectionEvent.created_at, DetectionEvent.event_id)
+Index('idx_detection_event_device_created', DetectionEvent.device_id, DetectionEvent.created_at, DetectionEvent.event_id)
+Index('idx_detection_event_config_created', DetectionEvent.config_id, DetectionEvent.created_at, DetectionEvent.event_id)
+Index('idx_detection_event_type_created', DetectionEvent.event_type, DetectionEvent.created_at, DetectionEvent.event_id)
+Index('idx_detection_event_status_created', DetectionEvent.status, DetectionEvent.created_at, DetectionEvent.event_id)
+
 class DetectionPerformance(Base):
     __tablename__ = "detection_performance"
     
@@ -263,6 +274,28 @@ class CrowdAnalysisResult(Base):
 # 添加反向关系
 CrowdAnalysisJob.results = relationship("CrowdAnalysisResult", back_populates="job")
 
+class CrowdMetricRollup(Base):
+    """人数统计时间桶汇总表，写入分析结果时增量维护"""
+    __tablename__ = "crowd_metric_rollup"
+    
+    scope = Column(String(16), primary_key=True)  # 汇总维度: job/camera/area
+    job_id = Column(String(64), primary_key=True)  # 数据来源的分析任务ID
+    series_id = Column(String(64), primary_key=True, default='')  # job为空串，camera为设备ID，area为区域ID
+    bucket_seconds = Column(Integer, primary_key=True)  # 时间桶大小(秒): 60/900/3600/86400
+    bucket_start = Column(DateTime, primary_key=True)  # 时间桶起点
+    sample_count = Column(Integer, nullable=False, default=0)
+    sum_value = Column(Float, nullable=False, default=0)
+    min_value = Column(Integer)
+    max_value = Column(Integer)
+    last_value = Column(Integer)
+    first_time = Column(DateTime)  # 桶内最早样本时间
+    last_time = Column(DateTime)  # 桶内最新样本时间
+
+Index('idx_crowd_analysis_result_job_time', CrowdAnalysisResult.job_id, CrowdAnalysisResult.timestamp)
+Index('idx_crowd_metric_rollup_series', CrowdMetricRollup.scope, CrowdMetricRollup.series_id,
+      CrowdMetricRollup.bucket_seconds, CrowdMetricRollup.bucket_start)
+Index('idx_crowd_metric_rollup_bucket', CrowdMetricRollup.bucket_seconds, CrowdMetricRollup.bucket_start)
+
 # 根据环境区分数据库连接字符串
 # 开发环境使用本地数据库，生产环境使用Docker容器内数据库
 # 开发环境设置的环境变量或默认使用localhost
@@ -379,6 +412,8 @@ class ListenerConfig(Base):
 
 class ExternalEvent(Base):
     __tablename__ = "external_events"
+    # 按 created_at 每月分区
+    __table_args__ = {"postgresql_partition_by": "RANGE (created_at)"}
     
     event_id = Column(String, primary_key=True)
     config_id = Column(String, ForeignKey('listener_configs.config_id'), nullable=False)
@@ -405,7 +440,9 @@ class ExternalEvent(Base):
     viewed_by = Column(String(64), ForeignKey('users.user_id'))  # 新增：查看者
     notes = Column(Text)  # 新增：备注
     timestamp = Column(DateTime, nullable=False)
-    created_at = Column(DateTime, default=datetime.now)
+    created_at = Column(DateTime, primary_key=True, default=datetime.now)
+    
+    __mapper_args__ = {"primary_key": [event_id]}
     
     config = relationship("ListenerConfig")
     # viewer = relationship("User", foreign_keys=[viewed_by])  # 新增：查看者关系
@@ -430,6 +467,10 @@ Index('idx_external_events_timestamp', ExternalEvent.timestamp)
 Index('idx_external_events_type', ExternalEvent.event_type)
 Index('idx_external_events_config', ExternalEvent.config_id)
 Index('idx_listener_configs_type', ListenerConfig.listener_type)
+Index('idx_external_events_timestamp_id', ExternalEvent.timestamp, ExternalEvent.event_id)
+Index('idx_external_events_config_timestamp', ExternalEvent.config_id, ExternalEvent.timestamp, ExternalEvent.event_id)
+Index('idx_external_events_type_timestamp', ExternalEvent.event_type, ExternalEvent.timestamp, ExternalEvent.event_id)
+Index('idx_external_events_device_sn_timestamp', ExternalEvent.device_sn, ExternalEvent.timestamp, ExternalEvent.event_id)
 
 # 事件订阅相关表模型
 class SmartScheme(Base):
@@ -456,6 +497,8 @@ class SmartScheme(Base):
 class SmartEvent(Base):
     """智能事件表"""
     __tablename__ = "smart_events"
+    # 按 created_at 每日分区
+    __table_args__ = {"postgresql_partition_by": "RANGE (created_at)"}
     
     id = Column(String(64), primary_key=True, default=lambda: str(uuid.uuid4()))
     scheme_id = Column(String(64), ForeignKey('smart_schemes.id'), nullable=False, comment="订阅ID")
@@ -470,7 +513,9 @@ class SmartEvent(Base):
     processing_result = Column(String(50), comment="处理结果")
     processing_comment = Column(Text, comment="处理备注")
     processing_by = Column(String(100), comment="处理人")
-    created_at = Column(DateTime, default=datetime.now, comment="创建时间")
+    created_at = Column(DateTime, primary_key=True, default=datetime.now, comment="创建时间")
+    
+    __mapper_args__ = {"primary_key": [id]}
     
     # 关系
     scheme = relationship("SmartScheme", back_populates="events")
@@ -594,6 +639,19 @@ Index('idx_smart_events_scheme_id', SmartEvent.scheme_id)
 Index('idx_smart_events_event_type', SmartEvent.event_type)
 Index('idx_smart_events_status', SmartEvent.status)
 Index('idx_smart_events_timestamp', SmartEvent.timestamp)
+Index('idx_smart_events_timestamp_id', SmartEvent.timestamp, SmartEvent.id)
+Index('idx_smart_events_scheme_timestamp', SmartEvent.scheme_id, SmartEvent.timestamp, SmartEvent.id)
+Index('idx_smart_events_status_timestamp', SmartEvent.status, SmartEvent.timestamp, SmartEvent.id)
+
+class EventDailyCounter(Base):
+    """事件按天/类型/状态计数表，由数据库触发器在事件增删改时增量维护"""
+    __tablename__ = "event_daily_counter"
+    
+    source = Column(String(16), primary_key=True)  # 事件来源: detection/external/smart
+    day = Column(Date, primary_key=True)  # 事件日期（检测事件按created_at，外部/订阅事件按timestamp）
+    category = Column(String(200), primary_key=True, default='')  # 检测/订阅事件为event_type，外部事件为engine_name，空值记为空串
+    status = Column(String(20), primary_key=True, default='')
+    count = Column(BigInteger, nullable=False, default=0)
 
 # 数据库依赖注入
 def get_db():
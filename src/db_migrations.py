@@ -2,6 +2,9 @@
 import logging
 from sqlalchemy import inspect, text
 
+from src.event_statistics import EVENT_COUNTER_SOURCES, counter_select, counter_upsert, install_counter_triggers
+from src.event_partitions import PARTITIONED_EVENT_TABLES, create_partitions, ensure_unique_key_trigger, is_partitioned, list_partitions
+
 logger = logging.getLogger(__name__)
 
 
@@ -58,3 +61,247 @@ def ensure_detection_config_stream_type(engine) -> None:
                 )
             )
             logger.info("已从 device 回填 detection_config.stream_type")
+
+
+def ensure_crowd_metric_rollups(engine) -> None:
+    """补建人群分析结果和汇总表的索引，并把汇总表启用前的历史结果回填到时间桶
+
+    每个任务只回填早于其已有汇总中最早样本的结果，重复执行不会重复计数。
+    """
+    inspector = inspect(engine)
+    tables = inspector.get_table_names()
+    if "crowd_analysis_result" not in tables or "crowd_metric_rollup" not in tables:
+        return
+
+    with engine.begin() as conn:
+        # 两个服务同时启动时只由一个执行回填
+        conn.execute(text("SELECT pg_advisory_xact_lock(hashtext('crowd_metric_rollup_backfill'))"))
+        conn.execute(
+            text(
+                "CREATE INDEX IF NOT EXISTS idx_crowd_analysis_result_job_time "
+                "ON crowd_analysis_result (job_id, timestamp)"
+            )
+        )
+        result = conn.execute(
+            text(
+                """
+                WITH boundary AS (
+                    SELECT job_id, MIN(first_time) AS first_time
+                    FROM crowd_metric_rollup
+                    WHERE scope = 'job'
+                    GROUP BY job_id
+                ),
+                results AS (
+                    SELECT r.job_id, r.timestamp, r.total_person_count, r.camera_counts
+                    FROM crowd_analysis_result AS r
+                    LEFT JOIN boundary AS b ON b.job_id = r.job_id
+                    WHERE r.timestamp IS NOT NULL
+                      AND (b.first_time IS NULL OR r.timestamp < b.first_time)
+                ),
+                samples AS (
+                    SELECT 'job' AS scope, job_id, '' AS series_id, timestamp AS ts,
+                           COALESCE(total_person_count, 0) AS value
+                    FROM results
+                    UNION ALL
+                    SELECT 'camera', r.job_id, c->>'device_id', r.timestamp,
+                           COALESCE((c->>'person_count')::numeric, 0)::int
+                    FROM results AS r
+                    CROSS JOIN LATERAL jsonb_array_elements(
+                        CASE WHEN jsonb_typeof(r.camera_counts) = 'array'
+                             THEN r.camera_counts ELSE '[]'::jsonb END
+                    ) AS c
+                    WHERE c->>'device_id' IS NOT NULL
+                    UNION ALL
+                    SELECT 'area', r.job_id, hb.area_id::text, r.timestamp,
+                           COALESCE(r.total_person_count, 0)
+                    FROM results AS r
+                    JOIN heatmap_bindings AS hb
+                      ON hb.data_source_id = r.job_id AND hb.is_active
+                ),
+                sizes AS (
+                    SELECT unnest(ARRAY[60, 900, 3600, 86400]) AS bucket_seconds
+                )
+                INSERT INTO crowd_metric_rollup (
+                    scope, job_id, series_id, bucket_seconds, bucket_start,
+                    sample_count, sum_value, min_value, max_value, last_value,
+                    first_time, last_time
+                )
+                SELECT s.scope, s.job_id, s.series_id, z.bucket_seconds,
+                       to_timestamp(floor(extract(epoch FROM s.ts) / z.bucket_seconds) * z.bucket_seconds)
+                           AT TIME ZONE 'UTC',
+                       COUNT(*), SUM(s.value), MIN(s.value), MAX(s.value),
+                       (array_agg(s.value ORDER BY s.ts DESC))[1],
+                       MIN(s.ts), MAX(s.ts)
+                FROM samples AS s
+                CROSS JOIN sizes AS z
+                GROUP BY 1, 2, 3, 4, 5
+                ON CONFLICT (scope, job_id, series_id, bucket_seconds, bucket_start) DO UPDATE SET
+                    sample_count = crowd_metric_rollup.sample_count + EXCLUDED.sample_count,
+                    sum_value = crowd_metric_rollup.sum_value + EXCLUDED.sum_value,
+                    min_value = LEAST(crowd_metric_rollup.min_value, EXCLUDED.min_value),
+                    max_value = GREATEST(crowd_metric_rollup.max_value, EXCLUDED.max_value),
+                    last_value = CASE WHEN EXCLUDED.last_time >= crowd_metric_rollup.last_time
+                                      THEN EXCLUDED.last_value ELSE crowd_metric_rollup.last_value END,
+                    first_time = LEAST(crowd_metric_rollup.first_time, EXCLUDED.first_time),
+                    last_time = GREATEST(crowd_metric_rollup.last_time, EXCLUDED.last_time)
+                """
+            )
+        )
+        if result.rowcount:
+            logger.info("已回填人数统计时间桶汇总: %s 条", result.rowcount)
+
+    # 保留期清理按 (桶大小, 桶起点) 查找过期行；CONCURRENTLY 建索引不阻塞写入，且不能在事务中执行
+    existing = {index["name"] for index in inspector.get_indexes("crowd_metric_rollup")}
+    if "idx_crowd_metric_rollup_bucket" not in existing:
+        sql = ("CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_crowd_metric_rollup_bucket "
+               "ON crowd_metric_rollup (bucket_seconds, bucket_start)")
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            try:
+                conn.execute(text(sql))
+                logger.info("已执行数据库补丁: %s", sql)
+            except Exception as e:
+                logger.warning("创建索引失败: %s, %s", sql, e)
+
+
+EVENT_LIST_INDEXES = {
+    "detection_event": [
+        ("idx_detection_event_created", "created_at, event_id"),
+        ("idx_detection_event_device_created", "device_id, created_at, event_id"),
+        ("idx_detection_event_config_created", "config_id, created_at, event_id"),
+        ("idx_detection_event_type_created", "event_type, created_at, event_id"),
+        ("idx_detection_event_status_created", "status, created_at, event_id"),
+    ],
+    "external_events": [
+        ("idx_external_events_timestamp_id", "timestamp, event_id"),
+        ("idx_external_events_config_timestamp", "config_id, timestamp, event_id"),
+        ("idx_external_events_type_timestamp", "event_type, timestamp, event_id"),
+        ("idx_external_events_device_sn_timestamp", "device_sn, timestamp, event_id"),
+    ],
+    "smart_events": [
+        ("idx_smart_events_timestamp_id", "timestamp, id"),
+        ("idx_smart_events_scheme_timestamp", "scheme_id, timestamp, id"),
+        ("idx_smart_events_status_timestamp", "status, timestamp, id"),
+    ],
+}
+
+
+def ensure_event_partitions(engine) -> None:
+    """为已分区的事件表预建默认分区和未来分区，并安装主键唯一性检查
+
+    已有的普通事件表不在启动时改造（改造需扫描大表），需执行一次
+    python -m src.event_partitions convert。
+    """
+    inspector = inspect(engine)
+    tables = set(inspector.get_table_names())
+
+    for table in PARTITIONED_EVENT_TABLES:
+        if table not in tables:
+            continue
+        try:
+            with engine.begin() as conn:
+                # 两个服务同时启动时只由一个执行
+                conn.execute(text("SELECT pg_advisory_xact_lock(hashtext('event_partitions_migration'))"))
+                if not is_partitioned(conn, table):
+                    logger.warning("%s 尚未改造为分区表，请执行: python -m src.event_partitions convert %s", table, table)
+                    continue
+                if ensure_unique_key_trigger(conn, table):
+                    logger.info("已执行数据库补丁: %s 主键唯一性检查", table)
+                created = create_partitions(conn, table)
+                if created:
+                    logger.info("已创建 %s 分区: %s", table, ", ".join(created))
+        except Exception as e:
+            logger.error("事件表分区改造失败: %s, %s", table, e)
+
+
+def ensure_event_list_indexes(engine) -> None:
+    """为已有的事件表补建游标分页用的复合索引
+
+    create_all 只在建表时创建索引；这里用 CONCURRENTLY 建索引，不阻塞事件写入。
+    分区父表不支持 CONCURRENTLY：先在父表上 ON ONLY 登记索引（不建索引，处于无效状态），
+    再在各分区上 CONCURRENTLY 建索引并挂到父表索引，所有分区挂齐后父表索引自动生效。
+    """
+    inspector = inspect(engine)
+    tables = set(inspector.get_table_names())
+
+    # CONCURRENTLY 不能在事务中执行
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        for table, indexes in EVENT_LIST_INDEXES.items():
+            if table not in tables:
+                continue
+            if is_partitioned(conn, table):
+                for name, columns in indexes:
+                    _ensure_partitioned_index(conn, table, name, columns)
+                continue
+            existing = {index["name"] for index in inspector.get_indexes(table)}
+            for name, columns in indexes:
+                if name not in existing:
+                    _execute_index_sql(conn, f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {table} ({columns})")
+
+
+def _execute_index_sql(conn, sql: str) -> bool:
+    try:
+        conn.execute(text(sql))
+        logger.info("已执行数据库补丁: %s", sql)
+        return True
+    except Exception as e:
+        logger.warning("创建索引失败: %s, %s", sql, e)
+        return False
+
+
+def _ensure_partitioned_index(conn, table: str, name: str, columns: str) -> None:
+    """在分区表上逐个分区 CONCURRENTLY 建索引并挂到父表索引（可重复执行，从中断处继续）"""
+    valid = conn.execute(text(
+        "SELECT indisvalid FROM pg_index WHERE indexrelid = to_regclass(:name)"
+    ), {"name": name}).scalar()
+    if valid:
+        return
+    if valid is None and not _execute_index_sql(conn, f"CREATE INDEX IF NOT EXISTS {name} ON ONLY {table} ({columns})"):
+        return
+
+    partitions = [partition for partition, _, _ in list_partitions(conn, table)]
+    if conn.execute(text("SELECT to_regclass(:name)"), {"name": f"{table}_default"}).scalar():
+        partitions.append(f"{table}_default")
+    for partition in partitions:
+        attached = conn.execute(text(
+            "SELECT 1 FROM pg_inherits AS i JOIN pg_index AS x ON x.indexrelid = i.inhrelid "
+            "WHERE i.inhparent = to_regclass(:name) AND x.indrelid = to_regclass(:partition)"
+        ), {"name": name, "partition": partition}).first()
+        if attached:
+            continue
+        partition_index = f"{name}_{partition[len(table) + 1:]}"[:63]
+        invalid = conn.execute(text(
+            "SELECT 1 FROM pg_index WHERE indexrelid = to_regclass(:index) AND NOT indisvalid"
+        ), {"index": partition_index}).first()
+        if invalid:
+            # 上次 CONCURRENTLY 中断遗留的无效索引
+            conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {partition_index}"))
+        if _execute_index_sql(conn, f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {partition_index} ON {partition} ({columns})"):
+            _execute_index_sql(conn, f"ALTER INDEX {name} ATTACH PARTITION {partition_index}")
+
+
+
+def ensure_event_counters(engine) -> None:
+    """安装事件计数触发器（语句级，批量写入时每条语句只更新一次计数），首次安装时回填历史计数"""
+    inspector = inspect(engine)
+    tables = set(inspector.get_table_names())
+    if "event_daily_counter" not in tables:
+        return
+
+    with engine.begin() as conn:
+        conn.execute(text("SELECT pg_advisory_xact_lock(hashtext('event_daily_counter_install'))"))
+
+        for source, (table, *_) in EVENT_COUNTER_SOURCES.items():
+            if table not in tables:
+                continue
+
+            install_counter_triggers(conn, source)
+
+            # 该来源还没有计数时回填历史数据；锁表保证回填与触发器之间不漏计也不重复
+            has_counters = conn.execute(
+                text("SELECT 1 FROM event_daily_counter WHERE source = :source LIMIT 1"),
+                {"source": source}
+            ).first()
+            if not has_counters:
+                conn.execute(text(f"LOCK TABLE {table} IN SHARE MODE"))
+                conn.execute(text(counter_upsert([counter_select(source, table)])))
+                logger.info("已回填事件计数: %s", source)
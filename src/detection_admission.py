@@ -0,0 +1,210 @@
+"""
+检测任务准入控制 - 按任务实测开销分配节点计算预算
+
+每个检测任务记录每帧解码和每次检测（推理+跟踪+绘制+事件保存）在本线程上消耗的 CPU 时间，按实际帧率和
+检测频率折算为"每秒消耗的计算毫秒数"（1000 相当于一个 CPU 核）。等待共享模型、GPU 推理和事件写入等
+非 CPU 时间单独统计，不计入预算，避免节点存在资源争用但 CPU 并不繁忙时拒绝任务。节点预算默认为 CPU 核数的 80%；
+启动新任务时用该配置上次运行的实测值（没有时用已有实测值的中位数）估算开销，超出预算则拒绝并排队。
+系统 CPU/内存占用由后台线程定期采样，启动任务时不再阻塞等待采样。
+"""
+import logging
+import os
+import statistics
+import threading
+import time
+from typing import Dict, Iterable, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+DETECTION_BUDGET_MS = float(os.environ.get(
+    "DETECTION_BUDGET_MS", str((os.cpu_count() or 1) * 1000 * 0.8)
+))
+DEFAULT_TASK_COST_MS = 250.0  # 没有任何实测数据时的单任务开销估计
+COST_WINDOW_SECONDS = 10  # 帧率/检测频率的统计窗口
+COST_ALPHA = 0.2  # 单帧耗时的指数平滑系数
+SAMPLE_INTERVAL = 5  # 系统负载采样间隔（秒）
+CPU_LIMIT = 90  # 系统 CPU 占用超过该值时不再启动新任务
+MEMORY_LIMIT = 90
+
+
+class TaskCostMeter:
+    """单个检测任务的实测开销"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.decode_ms: Optional[float] = None  # 每帧解码 CPU 时间
+        self.detect_ms: Optional[float] = None  # 每次检测 CPU 时间
+        self.infer_ms: Optional[float] = None  # 每次推理调用的耗时（含等待模型和 GPU 时间）
+        self.gpu_ms: Optional[float] = None  # 每次推理的 GPU 耗时（仅 GPU 推理）
+        self.post_ms: Optional[float] = None  # 每次后处理（跟踪、事件保存、推送）的耗时（含 I/O）
+        self.fps: Optional[float] = None
+        self.detect_rate: Optional[float] = None  # 每秒检测次数
+        self.frames = 0
+        self.detections = 0
+        self.window_start = time.monotonic()
+
+    def record_decode(self, ms: float):
+        with self.lock:
+            self.decode_ms = ms if self.decode_ms is None else self.decode_ms + COST_ALPHA * (ms - self.decode_ms)
+            self.frames += 1
+            self._roll()
+
+    @staticmethod
+    def _smooth(current: Optional[float], value: Optional[float]) -> Optional[float]:
+        if value is None:
+            return current
+        return value if current is None else current + COST_ALPHA * (value - current)
+
+    def record_detection(self, cpu_ms: float, infer_ms: Optional[float] = None,
+                         gpu_ms: Optional[float] = None, post_ms: Optional[float] = None):
+        """记录一次检测：cpu_ms 计入开销，其余耗时只用于统计"""
+        with self.lock:
+            self.detect_ms = self._smooth(self.detect_ms, cpu_ms)
+            self.infer_ms = self._smooth(self.infer_ms, infer_ms)
+            self.gpu_ms = self._smooth(self.gpu_ms, gpu_ms)
+            self.post_ms = self._smooth(self.post_ms, post_ms)
+            self.detections += 1
+
+    def _roll(self):
+        now = time.monotonic()
+        elapsed = now - self.window_start
+        if elapsed >= COST_WINDOW_SECONDS:
+            self.fps = self.frames / elapsed
+            self.detect_rate = self.detections / elapsed
+            self.frames = self.detections = 0
+            self.window_start = now
+
+    def cost_ms(self) -> Optional[float]:
+        """每秒消耗的计算毫秒数，第一个统计窗口结束前返回 None"""
+        with self.lock:
+            if self.fps is None:
+                return None
+            return (self.decode_ms or 0.0) * self.fps + (self.detect_ms or 0.0) * self.detect_rate
+
+    def snapshot(self) -> Dict:
+        cost = self.cost_ms()
+        return {
+            "cost_ms": round(cost, 1) if cost is not None else None,
+            "decode_ms": round(self.decode_ms, 2) if self.decode_ms is not None else None,
+            "detect_ms": round(self.detect_ms, 2) if self.detect_ms is not None else None,
+            "infer_ms": round(self.infer_ms, 2) if self.infer_ms is not None else None,
+            "gpu_ms": round(self.gpu_ms, 2) if self.gpu_ms is not None else None,
+            "post_ms": round(self.post_ms, 2) if self.post_ms is not None else None,
+            "fps": round(self.fps, 2) if self.fps is not None else None,
+            "detect_rate": round(self.detect_rate, 2) if self.detect_rate is not None else None,
+        }
+
+
+class AdmissionController:
+    """节点级准入控制"""
+
+    def __init__(self, budget_ms: float = DETECTION_BUDGET_MS):
+        self.budget_ms = budget_ms
+        self.history: Dict[str, float] = {}  # config_id -> 最近一次实测开销
+        self.reserved: Dict[str, float] = {}  # 已准入但还没有实测数据的任务的估计开销
+        self.cpu_percent = 0.0
+        self.memory_percent = 0.0
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def start(self):
+        """启动后台负载采样线程"""
+        if self.thread and self.thread.is_alive():
+            return
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self._sample_loop, name="load-sampler", daemon=True)
+        self.thread.start()
+        logger.info(f"检测准入控制已启动，节点预算: {self.budget_ms:.0f}ms/s")
+
+    def stop(self):
+        self.stop_event.set()
+
+    def _sample_loop(self):
+        try:
+            import psutil
+        except ImportError:
+            logger.warning("psutil 不可用，准入控制只按任务开销预算判断")
+            return
+        psutil.cpu_percent(interval=None)  # 第一次调用只建立基准
+        while not self.stop_event.wait(SAMPLE_INTERVAL):
+            try:
+                self.cpu_percent = psutil.cpu_percent(interval=None)
+                self.memory_percent = psutil.virtual_memory().percent
+            except Exception as e:
+                logger.warning(f"系统负载采样失败: {e}")
+
+    def _task_cost(self, config_id: str, cost: Optional[float]) -> float:
+        if cost is not None:
+            return cost
+        return self.reserved.get(config_id, self.history.get(config_id, DEFAULT_TASK_COST_MS))
+
+    def update(self, tasks: Iterable) -> float:
+        """根据运行中任务的实测开销更新历史记录，返回已占用的预算"""
+        used = 0.0
+        with self.lock:
+            for task in tasks:
+                cost = task.get_cost()
+                if cost is not None:
+                    self.history[task.config_id] = cost
+                    self.reserved.pop(task.config_id, None)
+                used += self._task_cost(task.config_id, cost)
+        return used
+
+    def estimate(self, config_id: str) -> float:
+        """估算任务开销：该配置上次运行的实测值，否则为已有实测值的中位数"""
+        with self.lock:
+            if config_id in self.history:
+                return self.history[config_id]
+            if self.history:
+                return statistics.median(self.history.values())
+            return DEFAULT_TASK_COST_MS
+
+    def starting(self, registered: Iterable[str]) -> Dict[str, float]:
+        """已准入但还没有注册为任务（正在启动）的配置及其预留开销"""
+        registered = set(registered)
+        with self.lock:
+            return {config_id: cost for config_id, cost in self.reserved.items() if config_id not in registered}
+
+    def admit(self, config_id: str, tasks: Iterable, registered: Iterable[str] = ()) -> Tuple[bool, str]:
+        """判断是否可以启动任务，准入时为该任务预留估计开销
+
+        registered 为已注册的任务ID（含未运行的任务），其余有预留的配置视为正在启动，其开销计入已占用预算，
+        避免并发启动时多个任务按同一占用值通过准入。
+        """
+        if self.memory_percent > MEMORY_LIMIT:
+            return False, f"内存使用率过高({self.memory_percent:.1f}%)"
+        if self.cpu_percent > CPU_LIMIT:
+            return False, f"CPU使用率过高({self.cpu_percent:.1f}%)"
+
+        running = [task for task in tasks if task.config_id != config_id]
+        used = self.update(running)
+        starting = self.starting({task.config_id for task in running} | set(registered) | {config_id})
+        used += sum(starting.values())
+        estimate = self.estimate(config_id)
+        # 节点上没有任务时总是允许启动一个，避免单个任务的估计值超过预算时永远无法启动
+        if (running or starting) and used + estimate > self.budget_ms:
+            return False, f"计算预算不足(已用 {used:.0f}ms/s + 预计 {estimate:.0f}ms/s > {self.budget_ms:.0f}ms/s)"
+        with self.lock:
+            self.reserved[config_id] = estimate
+        return True, ""
+
+    def release(self, config_id: str):
+        """任务停止时释放预留（实测历史保留，用于下次启动时估算）"""
+        with self.lock:
+            self.reserved.pop(config_id, None)
+
+    def get_stats(self, tasks: Iterable) -> Dict:
+        tasks = list(tasks)
+        used = self.update(tasks)
+        return {
+            "budget_ms": round(self.budget_ms, 1),
+            "used_ms": round(used, 1),
+            "cpu_percent": self.cpu_percent,
+            "memory_percent": self.memory_percent,
+            "tasks": {task.config_id: task.get_cost_stats() for task in tasks},
+        }
+
+
+# 全局准入控制实例
+admission_controller = AdmissionController()
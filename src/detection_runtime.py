@@ -1,7 +1,12 @@
 """检测运行时段与图片检测间隔配置"""
-from datetime import datetime
+from bisect import bisect_right
+from datetime import datetime, timedelta
 from typing import Any, Dict, List, Optional
 
+MINUTES_PER_DAY = 24 * 60
+MINUTES_PER_WEEK = 7 * MINUTES_PER_DAY
+COMPILED_SCHEDULE_KEY = "compiled_schedule"
+
 
 def _get_attr(source: Any, name: str, default=None):
     if isinstance(source, dict):
@@ -17,77 +22,132 @@ def _time_str_to_minutes(value: str) -> int:
     return min(total, 24 * 60)
 
 
-def _is_minute_in_range(current_minute: int, start: str, end: str) -> bool:
-    start_minute = _time_str_to_minutes(start)
-    end_minute = _time_str_to_minutes(end)
-    if start_minute == end_minute:
-        return True
-    if start_minute < end_minute:
-        return start_minute <= current_minute < end_minute
-    return current_minute >= start_minute or current_minute < end_minute
-
-
 def _weekday_key(now: datetime) -> str:
     """将 datetime.weekday() 映射为前端周计划键：0=周日 ... 6=周六"""
     return str((now.weekday() + 1) % 7)
 
 
-def extract_runtime_config(schedule_config: Any) -> Dict[str, Any]:
-    """从 schedule_config 中提取 realtime/manual 的运行配置"""
-    if not schedule_config or not isinstance(schedule_config, dict):
-        return {}
-    runtime = schedule_config.get("runtime")
-    if not isinstance(runtime, dict):
-        return {}
-    return runtime
+def _week_minute(now: datetime) -> int:
+    """一周内的分钟序号，从周日 00:00 开始（与前端周计划键一致）"""
+    return int(_weekday_key(now)) * MINUTES_PER_DAY + now.hour * 60 + now.minute
 
 
-def is_within_active_period(now: datetime, runtime: Optional[Dict[str, Any]]) -> bool:
-    """判断当前时间是否处于配置的生效时段内"""
+def _range_minutes(start: str, end: str):
+    """时段覆盖的当天分钟区间 [(起, 止), ...]：起止相同表示全天，起点晚于终点时跨零点拆成两段"""
+    start_minute = _time_str_to_minutes(start)
+    end_minute = _time_str_to_minutes(end)
+    if start_minute == end_minute:
+        return [(0, MINUTES_PER_DAY)]
+    if start_minute < end_minute:
+        return [(start_minute, end_minute)]
+    return [(start_minute, MINUTES_PER_DAY), (0, end_minute)]
+
+
+class ActiveSchedule:
+    """
+    预编译的生效时段：一周 10080 分钟的位图（Python 整数），以及按时间排序的状态切换点
+    is_active() 只做一次位运算，next_transition() 二分查找下一个开始/结束时刻。
+    """
+    __slots__ = ("bits", "transitions")
+
+    def __init__(self, bits: int):
+        self.bits = bits
+        self.transitions = [
+            minute for minute in range(MINUTES_PER_WEEK)
+            if self._bit(minute) != self._bit(minute - 1)
+        ]
+
+    def _bit(self, minute: int) -> bool:
+        return bool((self.bits >> (minute % MINUTES_PER_WEEK)) & 1)
+
+    @classmethod
+    def from_days(cls, day_ranges: List[List[tuple]]) -> "ActiveSchedule":
+        bits = 0
+        for day, ranges in enumerate(day_ranges):
+            for start, end in ranges:
+                if end > start:
+                    bits |= ((1 << (end - start)) - 1) << (day * MINUTES_PER_DAY + start)
+        return cls(bits)
+
+    def is_active(self, now: datetime) -> bool:
+        return self._bit(_week_minute(now))
+
+    def next_transition(self, now: datetime) -> Optional[datetime]:
+        """下一次开始或结束生效的时刻，全天生效/从不生效时返回 None"""
+        if not self.transitions:
+            return None
+        minute = _week_minute(now)
+        index = bisect_right(self.transitions, minute)
+        target = self.transitions[index] if index < len(self.transitions) else self.transitions[0] + MINUTES_PER_WEEK
+        return now.replace(second=0, microsecond=0) + timedelta(minutes=target - minute)
+
+
+def compile_schedule(runtime: Optional[Dict[str, Any]]) -> ActiveSchedule:
+    """将运行配置中的生效时段编译为 ActiveSchedule"""
     runtime = runtime or {}
     mode = runtime.get("time_period_mode") or "all"
-    if mode == "all":
-        return True
-
-    current_minute = now.hour * 60 + now.minute
+    whole_day = [(0, MINUTES_PER_DAY)]
 
     if mode == "weekly":
         weekly = runtime.get("weekly_schedule") or {}
-        day_key = _weekday_key(now)
-        ranges: List[Dict[str, str]] = weekly.get(day_key) or weekly.get(str(day_key)) or []
-        if not ranges:
-            return False
-        return any(
-            _is_minute_in_range(current_minute, item.get("start", "00:00"), item.get("end", "24:00"))
-            for item in ranges
-            if item.get("start") and item.get("end")
-        )
+        day_ranges = []
+        for day in range(7):
+            ranges = weekly.get(str(day)) or weekly.get(day) or []
+            day_ranges.append([
+                minutes
+                for item in ranges
+                if item.get("start") and item.get("end")
+                for minutes in _range_minutes(item.get("start", "00:00"), item.get("end", "24:00"))
+            ])
+        return ActiveSchedule.from_days(day_ranges)
 
     if mode == "day_night":
         scope = runtime.get("day_night_scope") or "both"
-        day_start = runtime.get("day_start") or "06:00"
-        day_end = runtime.get("day_end") or "18:00"
-        night_start = runtime.get("night_start") or "18:00"
-        night_end = runtime.get("night_end") or "06:00"
-        in_day = _is_minute_in_range(current_minute, day_start, day_end)
-        in_night = _is_minute_in_range(current_minute, night_start, night_end)
-        if scope == "day":
-            return in_day
-        if scope == "night":
-            return in_night
-        return in_day or in_night
+        ranges = []
+        if scope != "night":
+            ranges += _range_minutes(runtime.get("day_start") or "06:00", runtime.get("day_end") or "18:00")
+        if scope != "day":
+            ranges += _range_minutes(runtime.get("night_start") or "18:00", runtime.get("night_end") or "06:00")
+        return ActiveSchedule.from_days([ranges] * 7)
 
     if mode == "custom":
-        ranges = runtime.get("custom_ranges") or []
-        if not ranges:
-            return True
-        return any(
-            _is_minute_in_range(current_minute, item.get("start", "00:00"), item.get("end", "23:59"))
-            for item in ranges
-            if item.get("start") and item.get("end")
-        )
-
-    return True
+        items = [item for item in runtime.get("custom_ranges") or [] if item.get("start") and item.get("end")]
+        if not runtime.get("custom_ranges"):
+            return ActiveSchedule.from_days([whole_day] * 7)
+        ranges = [
+            minutes
+            for item in items
+            for minutes in _range_minutes(item.get("start", "00:00"), item.get("end", "23:59"))
+        ]
+        return ActiveSchedule.from_days([ranges] * 7)
+
+    # all 或未知模式：全天生效
+    return ActiveSchedule.from_days([whole_day] * 7)
+
+
+def get_active_schedule(runtime: Optional[Dict[str, Any]]) -> ActiveSchedule:
+    """取运行配置中预编译的生效时段，没有时现场编译"""
+    schedule = (runtime or {}).get(COMPILED_SCHEDULE_KEY)
+    if isinstance(schedule, ActiveSchedule):
+        return schedule
+    return compile_schedule(runtime)
+
+
+def extract_runtime_config(schedule_config: Any) -> Dict[str, Any]:
+    """从 schedule_config 中提取 realtime/manual 的运行配置，并附带预编译的生效时段"""
+    if not schedule_config or not isinstance(schedule_config, dict):
+        runtime = {}
+    else:
+        runtime = schedule_config.get("runtime")
+        if not isinstance(runtime, dict):
+            runtime = {}
+    # 复制一份，不修改数据库对象上的 JSON
+    return dict(runtime, **{COMPILED_SCHEDULE_KEY: compile_schedule(runtime)})
+
+
+def is_within_active_period(now: datetime, runtime: Optional[Dict[str, Any]]) -> bool:
+    """判断当前时间是否处于配置的生效时段内"""
+    return get_active_schedule(runtime).is_active(now)
 
 
 def get_frame_interval(runtime: Optional[Dict[str, Any]], default: float = 5.0) -> float:
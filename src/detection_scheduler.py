@@ -0,0 +1,170 @@
+"""
+检测调度器 - 进程内共享的固定大小推理线程池
+
+每路摄像机只保留一个阻塞读帧的线程；读到需要检测的帧后通知调度器，
+由固定数量的工作线程执行 "取最新帧 -> 推理 -> 后处理"，没有就绪任务时工作线程阻塞等待，不轮询。
+同一任务同一时刻只在一个工作线程上执行（跟踪器等状态无需加锁）；执行期间到达的新帧只记一次，
+完成后重新排队，始终处理最新帧。
+就绪队列按 (优先级, 上次被调度时间) 排序：有实时预览客户端的任务优先，其次是有目标/活跃轨迹的任务，
+同优先级中等待最久的先执行。
+调度器记录任务第一次被通知（有待检测帧）的时间，执行时传给任务，用于计算排队等待时间。
+"""
+import heapq
+import itertools
+import logging
+import os
+import threading
+import time
+from typing import Dict, List
+
+logger = logging.getLogger(__name__)
+
+DETECTION_WORKERS = int(os.environ.get("DETECTION_WORKERS", str(min(4, os.cpu_count() or 1))))
+
+PRIORITY_PREVIEW = 0  # 有预览客户端
+PRIORITY_ACTIVE = 1  # 有目标或活跃轨迹
+PRIORITY_NORMAL = 2
+
+
+class _ScheduleEntry:
+    __slots__ = ("task", "queued", "running", "pending", "notified_at", "last_served", "runs", "busy_seconds", "idle")
+
+    def __init__(self, task):
+        self.task = task
+        self.queued = False
+        self.running = False
+        self.pending = False
+        self.notified_at = None  # 上次执行后第一次被通知的时间（monotonic）
+        self.last_served = 0.0
+        self.runs = 0
+        self.busy_seconds = 0.0
+        self.idle = threading.Event()
+        self.idle.set()
+
+
+class DetectionScheduler:
+    """检测任务调度器"""
+
+    def __init__(self, workers: int = DETECTION_WORKERS):
+        self.workers = max(1, workers)
+        self.condition = threading.Condition()
+        self.ready: List = []  # 堆: (优先级, 上次调度时间, 序号, entry)
+        self.entries: Dict[str, _ScheduleEntry] = {}
+        self.sequence = itertools.count()
+        self.threads: List[threading.Thread] = []
+        self.running = False
+
+    def start(self):
+        """启动工作线程（已启动时忽略）"""
+        with self.condition:
+            if self.running:
+                return
+            self.running = True
+            self.threads = [
+                threading.Thread(target=self._worker, name=f"detection-worker-{index}", daemon=True)
+                for index in range(self.workers)
+            ]
+        for thread in self.threads:
+            thread.start()
+        logger.info(f"检测调度器已启动，工作线程数: {self.workers}")
+
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.ready.clear()
+            self.condition.notify_all()
+        for thread in self.threads:
+            thread.join(timeout=5)
+        self.threads = []
+
+    def register(self, task):
+        with self.condition:
+            self.entries[task.config_id] = _ScheduleEntry(task)
+
+    def unregister(self, task, timeout: float = 5.0):
+        """移除任务，并等待正在执行的检测结束"""
+        with self.condition:
+            entry = self.entries.pop(task.config_id, None)
+            if entry is None or entry.task is not task:
+                return
+            if entry.queued:
+                self.ready = [item for item in self.ready if item[3] is not entry]
+                heapq.heapify(self.ready)
+                entry.queued = False
+            entry.pending = False
+        if not entry.idle.wait(timeout):
+            logger.warning(f"等待检测任务结束超时: {task.config_id}")
+
+    def notify(self, task):
+        """读帧线程调用：有新的待检测帧"""
+        with self.condition:
+            entry = self.entries.get(task.config_id)
+            if entry is None or entry.task is not task:
+                return
+            if entry.notified_at is None:
+                entry.notified_at = time.monotonic()
+            if entry.running:
+                entry.pending = True
+            elif not entry.queued:
+                self._enqueue(entry)
+
+    def _enqueue(self, entry: _ScheduleEntry):
+        task = entry.task
+        if task.clients:
+            priority = PRIORITY_PREVIEW
+        elif task.latency_controller.active:
+            priority = PRIORITY_ACTIVE
+        else:
+            priority = PRIORITY_NORMAL
+        heapq.heappush(self.ready, (priority, entry.last_served, next(self.sequence), entry))
+        entry.queued = True
+        self.condition.notify()
+
+    def _worker(self):
+        while True:
+            with self.condition:
+                while self.running and not self.ready:
+                    self.condition.wait()
+                if not self.running:
+                    return
+                entry = heapq.heappop(self.ready)[3]
+                entry.queued = False
+                entry.running = True
+                entry.idle.clear()
+                notified_at, entry.notified_at = entry.notified_at, None
+
+            started = time.perf_counter()
+            try:
+                entry.task.process_latest_frame(notified_at)
+            except Exception as e:
+                logger.error(f"检测任务执行出错: {entry.task.config_id}, {e}")
+            elapsed = time.perf_counter() - started
+
+            with self.condition:
+                entry.running = False
+                entry.last_served = time.monotonic()
+                entry.runs += 1
+                entry.busy_seconds += elapsed
+                entry.idle.set()
+                if entry.pending and self.entries.get(entry.task.config_id) is entry:
+                    entry.pending = False
+                    self._enqueue(entry)
+
+    def get_stats(self) -> Dict:
+        with self.condition:
+            return {
+                "workers": self.workers,
+                "queued": len(self.ready),
+                "running": sum(1 for entry in self.entries.values() if entry.running),
+                "tasks": {
+                    config_id: {
+                        "runs": entry.runs,
+                        "busy_seconds": round(entry.busy_seconds, 2),
+                    }
+                    for config_id, entry in self.entries.items()
+                },
+            }
+
+
+# 全局检测调度器实例
+detection_scheduler = DetectionScheduler()
@@ -0,0 +1,661 @@
+"""
+检测工作进程池 - 将拉流解码、推理、跟踪和绘制分散到多个工作进程
+
+API 进程（base_detect_server）只保留 WebSocket 预览、事件入库和数据推送；每路摄像机的检测在某个
+工作进程中运行（同一权重文件的任务尽量分配到同一进程，共享进程内的模型注册表）。
+工作进程把需要入库/推送的帧写入 multiprocessing.shared_memory 环形缓冲区，只通过队列回传
+检测结果、事件描述和帧在缓冲区中的位置；API 进程读取帧后调用代理任务上同名的方法完成入库和推送。
+转发出去的槽位被钉住，API 进程读取后回送 release 才会被覆盖，事件帧不会因积压而丢失。
+预览图在工作进程中编码，只回传编码后的消息。
+DETECTION_PROCESSES=0 时不启用工作进程，检测任务在 API 进程内运行。
+"""
+import asyncio
+import logging
+import multiprocessing
+import os
+import queue
+import signal
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import shared_memory
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from src.clip_recorder import ClipRecorder, update_clip_path
+from src.database import SaveMode
+from src.detection_scheduler import detection_scheduler
+from src.run_detection_task import DetectionTask
+
+logger = logging.getLogger(__name__)
+
+DETECTION_PROCESSES = int(os.environ.get(
+    "DETECTION_PROCESSES", str(min(4, max(1, (os.cpu_count() or 1) // 4)))
+))
+FRAME_RING_SLOTS = 8  # 每路摄像机环形缓冲区的帧数
+STATE_INTERVAL = 2  # 工作进程上报任务状态的间隔（秒）
+STOP_TIMEOUT = 15  # 等待工作进程停止任务的时间（秒）
+SHUTDOWN_TIMEOUT = 30
+EVENT_WORKERS = 4  # API 进程中执行入库和推送的线程数
+
+PREVIEW_CLIENT = "api"  # 工作进程中代表 API 进程预览客户端的占位元素
+
+# 工作进程转发给 API 进程执行的 DetectionTask 方法（入库、推送、预览）
+FORWARDED_METHODS = (
+    "save_detection_event",
+    "_create_behavior_event",
+    "_create_counting_event",
+    "push_detection_data",
+    "push_behavior_event",
+    "push_counting_event",
+    "_check_alert",
+    "_enqueue_preview",
+)
+
+FrameRef = namedtuple("FrameRef", ["ring", "slot", "seq", "shape"])
+
+
+class FrameRing:
+    """
+    共享内存帧环形缓冲区（单写多读）
+    头部: int64[0] 为槽位数，int64[1:] 为各槽位当前帧的序号（写入中为 0）；之后是定长的帧数据。
+    读取前后各检查一次序号，槽位已被覆盖时返回 None。
+    写入方钉住已转发、尚未确认的槽位，写入时跳过这些槽位。
+    """
+
+    def __init__(self, shm: shared_memory.SharedMemory, shape, owner: bool):
+        self.shm = shm
+        self.shape = tuple(shape)
+        self.owner = owner
+        self.frame_bytes = int(np.prod(self.shape))
+        self.slots = int(np.ndarray((1,), dtype=np.int64, buffer=shm.buf)[0])
+        self.header = np.ndarray((1 + self.slots,), dtype=np.int64, buffer=shm.buf)
+        self.data_offset = _header_bytes(self.slots)
+        self.next_seq = 1
+        self.pins: Dict[int, int] = {}  # 写入方：槽位 -> 尚未确认的引用数
+
+    @property
+    def name(self) -> str:
+        return self.shm.name
+
+    @classmethod
+    def create(cls, shape, slots: int = FRAME_RING_SLOTS) -> "FrameRing":
+        frame_bytes = int(np.prod(shape))
+        shm = shared_memory.SharedMemory(create=True, size=_header_bytes(slots) + slots * frame_bytes)
+        header = np.ndarray((1 + slots,), dtype=np.int64, buffer=shm.buf)
+        header[0] = slots
+        header[1:] = 0
+        del header
+        return cls(shm, shape, owner=True)
+
+    @classmethod
+    def attach(cls, ref: FrameRef) -> "FrameRing":
+        return cls(shared_memory.SharedMemory(name=ref.ring), ref.shape, owner=False)
+
+    def _view(self, slot: int) -> np.ndarray:
+        return np.ndarray(self.shape, dtype=np.uint8, buffer=self.shm.buf,
+                          offset=self.data_offset + slot * self.frame_bytes)
+
+    def write(self, frame: np.ndarray) -> Optional[FrameRef]:
+        """写入下一个未被钉住的槽位；所有槽位都在等待确认时返回 None"""
+        for _ in range(self.slots):
+            seq = self.next_seq
+            self.next_seq += 1
+            slot = seq % self.slots
+            if slot not in self.pins:
+                break
+        else:
+            return None
+        self.header[1 + slot] = 0
+        self._view(slot)[...] = frame
+        self.header[1 + slot] = seq
+        return FrameRef(self.name, slot, seq, self.shape)
+
+    def read(self, ref: FrameRef) -> Optional[np.ndarray]:
+        if self.header[1 + ref.slot] != ref.seq:
+            return None
+        frame = self._view(ref.slot).copy()
+        if self.header[1 + ref.slot] != ref.seq:
+            return None
+        return frame
+
+    def pin(self, ref: FrameRef):
+        self.pins[ref.slot] = self.pins.get(ref.slot, 0) + 1
+
+    def unpin(self, ref: FrameRef):
+        count = self.pins.get(ref.slot, 0) - 1
+        if count > 0:
+            self.pins[ref.slot] = count
+        else:
+            self.pins.pop(ref.slot, None)
+
+    def close(self):
+        self.header = None
+        try:
+            self.shm.close()
+            if self.owner:
+                self.shm.unlink()
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.warning(f"关闭帧缓冲区失败: {self.name}, {e}")
+
+
+def _header_bytes(slots: int) -> int:
+    return ((1 + slots) * 8 + 63) // 64 * 64
+
+
+class WorkerDetectionTask(DetectionTask):
+    """工作进程中的检测任务：入库、推送和预览方法转发给 API 进程执行"""
+
+    def __init__(self, spec: dict, result_queue):
+        super().__init__(**spec["task"])
+        self.rtsp_url = spec["rtsp_url"]
+        self.result_queue = result_queue
+        self.ring: Optional[FrameRing] = None
+        self.retired_rings: Dict[str, FrameRing] = {}  # 分辨率变化后仍有槽位等待确认的旧缓冲区
+        self.ring_lock = threading.Lock()  # 检测线程写入与命令线程确认释放互斥
+        self._last_frame = None
+        self._last_ref = None
+
+    def _resolve_rtsp_url(self) -> Optional[str]:
+        return self.rtsp_url
+
+    def _start_clip_recorder(self, rtsp_url: str) -> None:
+        if self.clip_recorder is None and self.save_mode in [SaveMode.video, SaveMode.both]:
+            pre_seconds = self.save_duration / 2
+            self.clip_recorder = ClipRecorder(self.device_id, pre_seconds, self.save_duration - pre_seconds,
+                                              on_clip=self._forward_clip)
+        super()._start_clip_recorder(rtsp_url)
+
+    def _forward_clip(self, event_id, created_at, clip_path):
+        self.result_queue.put(("clip", self.config_id, event_id, created_at, clip_path))
+
+    def _frame_arg(self, frame: np.ndarray):
+        """
+        将帧写入环形缓冲区并钉住槽位，直到 API 进程读取后确认；同一帧（同一对象）连续转发时只写一次。
+        所有槽位都在等待确认（API 进程积压）时直接随消息发送帧，不丢事件。
+        """
+        with self.ring_lock:
+            if frame is not self._last_frame:
+                if self.ring is None or self.ring.shape != frame.shape:
+                    # 分辨率变化（切换码流）时重建缓冲区
+                    self._retire_ring()
+                    self.ring = FrameRing.create(frame.shape)
+                ref = self.ring.write(frame)
+                if ref is None:
+                    logger.warning(f"帧缓冲区槽位均待确认，事件帧随消息发送: {self.config_id}")
+                    return frame
+                self._last_frame, self._last_ref = frame, ref
+            self.ring.pin(self._last_ref)
+            return self._last_ref
+
+    def _retire_ring(self):
+        """停用当前缓冲区：仍有槽位等待确认时保留到全部确认后再关闭（调用方持有 ring_lock）"""
+        if self.ring is not None:
+            if self.ring.pins:
+                self.retired_rings[self.ring.name] = self.ring
+            else:
+                self.ring.close()
+        self.ring = None
+        self._last_frame = self._last_ref = None
+
+    def release_frames(self, refs: List[FrameRef]):
+        """API 进程已读取帧，释放对应槽位"""
+        with self.ring_lock:
+            for ref in refs:
+                if self.ring is not None and self.ring.name == ref.ring:
+                    self.ring.unpin(ref)
+                    continue
+                ring = self.retired_rings.get(ref.ring)
+                if ring is not None:
+                    ring.unpin(ref)
+                    if not ring.pins:
+                        self.retired_rings.pop(ref.ring).close()
+
+    def _forward(self, method: str, *args):
+        args = tuple(self._frame_arg(arg) if isinstance(arg, np.ndarray) else arg for arg in args)
+        self.result_queue.put(("call", self.config_id, method, args))
+
+    def save_detection_event(self, frame, detections):
+        self._forward("save_detection_event", frame, detections)
+
+    def _create_behavior_event(self, event_info, frame, detections):
+        self._forward("_create_behavior_event", event_info, frame, detections)
+
+    def _create_counting_event(self, event_info, frame, detections):
+        self._forward("_create_counting_event", event_info, frame, detections)
+
+    def push_detection_data(self, detections, frame_rgb, speed):
+        self._forward("push_detection_data", detections, frame_rgb, speed)
+
+    def push_behavior_event(self, event_info, frame, detections, speed):
+        self._forward("push_behavior_event", event_info, frame, detections, speed)
+
+    def push_counting_event(self, event_info, frame, detections, speed):
+        self._forward("push_counting_event", event_info, frame, detections, speed)
+
+    def _check_alert(self, current_count):
+        self._forward("_check_alert", current_count)
+
+    def broadcast_img_result(self, pose_frame, detections):
+        # 预览在工作进程中编码，API 进程只把消息放入事件循环的队列
+        if self.clients:
+            message = self._build_preview_message(pose_frame, detections)
+            if message is not None:
+                self.result_queue.put(("call", self.config_id, "_enqueue_preview", (message,)))
+
+    def get_state(self) -> dict:
+        return {
+            "running": self.is_running(),
+            "connected": self.connected,
+            "skip_frame_count": self.skip_frame_count,
+            "use_gpu_decoder": self.ffmpeg_decoder is not None,
+            "cost": self.get_cost_stats(),
+            "latency": self.get_latency_stats(),
+            "readiness": self.readiness,
+            "ready_at": self.ready_at,
+        }
+
+    def close(self):
+        with self.ring_lock:
+            for ring in [self.ring, *self.retired_rings.values()]:
+                if ring is not None:
+                    ring.close()
+            self.ring = None
+            self.retired_rings.clear()
+            self._last_frame = self._last_ref = None
+
+
+def _stop_worker_task(task: WorkerDetectionTask, result_queue):
+    try:
+        asyncio.run(task.stop())
+    except Exception as e:
+        logger.error(f"停止检测任务失败: {task.config_id}, {e}")
+    finally:
+        task.close()
+        result_queue.put(("stopped", task.config_id))
+
+
+def _worker_main(index: int, command_queue, result_queue, torch_threads: int):
+    """工作进程入口：执行 API 进程下发的命令，定期上报任务状态"""
+    # Ctrl+C 由 API 进程统一处理，按顺序停止工作进程
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    logging.basicConfig(level=logging.INFO,
+                        format=f"%(asctime)s [detection-worker-{index}] %(name)s %(levelname)s: %(message)s")
+    import torch
+    torch.set_num_threads(torch_threads)
+
+    tasks: Dict[str, WorkerDetectionTask] = {}
+    last_state = 0.0
+    logger.info(f"检测工作进程已启动: {index} (pid {os.getpid()})")
+
+    while True:
+        try:
+            command = command_queue.get(timeout=STATE_INTERVAL)
+        except queue.Empty:
+            command = None
+
+        if command is not None:
+            action = command[0]
+            if action == "shutdown":
+                break
+            try:
+                if action == "start":
+                    spec = command[1]
+                    previous = tasks.pop(spec["task"]["config_id"], None)
+                    if previous is not None:
+                        # 任务线程已退出（如模型加载失败）后重新启动，先清理旧实例
+                        _stop_worker_task(previous, result_queue)
+                    task = WorkerDetectionTask(spec, result_queue)
+                    task.clients = {PREVIEW_CLIENT} if spec.get("preview") else set()
+                    tasks[task.config_id] = task
+                    task.start()
+                elif action == "stop":
+                    task = tasks.pop(command[1], None)
+                    if task is None:
+                        result_queue.put(("stopped", command[1]))
+                    else:
+                        # 停止需要等待读帧线程退出，不阻塞其他命令
+                        threading.Thread(target=_stop_worker_task, args=(task, result_queue), daemon=True).start()
+                elif action == "preview":
+                    task = tasks.get(command[1])
+                    if task is not None:
+                        task.clients = {PREVIEW_CLIENT} if command[2] else set()
+                elif action == "clip":
+                    task = tasks.get(command[1])
+                    if task is not None:
+                        task._request_event_clip(command[2], command[3])
+                elif action == "release":
+                    task = tasks.get(command[1])
+                    if task is not None:
+                        task.release_frames(command[2])
+            except Exception as e:
+                logger.error(f"执行命令失败: {action}, {e}")
+
+        now = time.monotonic()
+        if now - last_state >= STATE_INTERVAL:
+            result_queue.put(("state", {config_id: task.get_state() for config_id, task in tasks.items()}))
+            last_state = now
+
+    for task in list(tasks.values()):
+        _stop_worker_task(task, result_queue)
+    detection_scheduler.stop()
+    logger.info(f"检测工作进程已退出: {index}")
+
+
+class RemoteDetectionTask(DetectionTask):
+    """API 进程中的检测任务代理：检测在工作进程中运行，本对象负责事件入库、数据推送和预览广播"""
+
+    def __init__(self, pool: "DetectionWorkerPool", **task_kwargs):
+        super().__init__(**task_kwargs)
+        self.pool = pool
+        self.task_kwargs = task_kwargs
+        self.worker_spec = None
+        self.remote_state = {}
+        self.started = False
+
+    def start(self):
+        if self.started:
+            logger.info(f"检测任务已在运行: {self.config_id}")
+            return
+        self.stop_event.clear()
+        self.pool.start_task(self)
+        self.started = True
+
+    def is_running(self) -> bool:
+        return self.started and self.remote_state.get("running", True)
+
+    def get_cost(self) -> Optional[float]:
+        return self.remote_state.get("cost", {}).get("cost_ms")
+
+    def get_cost_stats(self) -> dict:
+        return self.remote_state.get("cost", {})
+
+    def get_latency_stats(self) -> dict:
+        return self.remote_state.get("latency", {})
+
+    def update_remote_state(self, state: dict):
+        self.remote_state = state
+        self.connected = state.get("connected", False)
+        self.readiness = state.get("readiness", self.readiness)
+        self.ready_at = state.get("ready_at", self.ready_at)
+        self.skip_frame_count = state.get("skip_frame_count", self.skip_frame_count)
+
+    async def stop(self):
+        logger.info(f"正在停止检测任务: {self.config_id}")
+        self.stop_event.set()
+        await self._stop_broadcast()
+        await asyncio.to_thread(self.pool.stop_task, self.config_id)
+        self.started = False
+        self.readiness = "stopped"
+
+    def add_client(self, websocket):
+        super().add_client(websocket)
+        self.pool.set_preview(self.config_id, True)
+
+    def remove_client(self, websocket):
+        super().remove_client(websocket)
+        if not self.clients:
+            self.pool.set_preview(self.config_id, False)
+
+    def _request_event_clip(self, event_id, created_at):
+        # 码流环形缓冲在工作进程中，封装完成后回传片段路径
+        if self.save_mode in [SaveMode.video, SaveMode.both]:
+            self.pool.send(self.config_id, ("clip", self.config_id, event_id, created_at))
+
+
+class _WorkerHandle:
+    def __init__(self, index: int):
+        self.index = index
+        self.process = None
+        self.command_queue = None
+        self.config_ids = set()
+
+
+class DetectionWorkerPool:
+    """检测工作进程池"""
+
+    def __init__(self, processes: int = DETECTION_PROCESSES):
+        self.processes = max(0, processes)
+        self.context = multiprocessing.get_context("spawn")  # 工作进程使用 torch/CUDA，不能 fork
+        self.workers: List[_WorkerHandle] = []
+        self.result_queue = None
+        self.tasks: Dict[str, RemoteDetectionTask] = {}
+        self.assignments: Dict[str, int] = {}  # config_id -> 工作进程序号
+        self.stopped: Dict[str, threading.Event] = {}
+        self.rings: Dict[str, FrameRing] = {}  # config_id -> 已附加的帧缓冲区
+        self.lock = threading.Lock()
+        self.ring_lock = threading.Lock()
+        self.running = False
+        self.dispatcher = None
+        self.executor = None
+        self.last_health_check = 0.0
+
+    @property
+    def enabled(self) -> bool:
+        return self.processes > 0
+
+    def start(self):
+        """启动工作进程和结果分发线程"""
+        if not self.enabled or self.running:
+            return
+        self.result_queue = self.context.Queue()
+        self.executor = ThreadPoolExecutor(max_workers=EVENT_WORKERS, thread_name_prefix="detection-events")
+        self.workers = [_WorkerHandle(index) for index in range(self.processes)]
+        for worker in self.workers:
+            self._spawn(worker)
+        self.running = True
+        self.dispatcher = threading.Thread(target=self._dispatch, name="detection-dispatcher", daemon=True)
+        self.dispatcher.start()
+        logger.info(f"检测工作进程池已启动，进程数: {self.processes}")
+
+    def stop(self):
+        if not self.running:
+            return
+        self.running = False
+        for worker in self.workers:
+            try:
+                worker.command_queue.put(("shutdown",))
+            except Exception:
+                pass
+        for worker in self.workers:
+            worker.process.join(timeout=SHUTDOWN_TIMEOUT)
+            if worker.process.is_alive():
+                logger.warning(f"检测工作进程未能及时退出，强制结束: {worker.index}")
+                worker.process.terminate()
+        if self.dispatcher:
+            self.dispatcher.join(timeout=5)
+        self.executor.shutdown(wait=True)
+        with self.ring_lock:
+            for ring in self.rings.values():
+                ring.close()
+            self.rings.clear()
+        logger.info("检测工作进程池已停止")
+
+    def _spawn(self, worker: _WorkerHandle):
+        torch_threads = max(1, (os.cpu_count() or 1) // self.processes)
+        worker.command_queue = self.context.Queue()
+        worker.process = self.context.Process(
+            target=_worker_main,
+            args=(worker.index, worker.command_queue, self.result_queue, torch_threads),
+            name=f"detection-worker-{worker.index}",
+            daemon=True,
+        )
+        worker.process.start()
+
+    def _pick_worker(self, model_path: str) -> _WorkerHandle:
+        """任务数最少的工作进程，相同时优先已加载同一模型的进程"""
+        def load(worker: _WorkerHandle):
+            shares_model = any(self.tasks[config_id].model_path == model_path
+                               for config_id in worker.config_ids if config_id in self.tasks)
+            return len(worker.config_ids), 0 if shares_model else 1, worker.index
+        return min(self.workers, key=load)
+
+    def start_task(self, task: RemoteDetectionTask):
+        rtsp_url = task._resolve_rtsp_url()
+        if not rtsp_url:
+            raise ValueError("设备信息不存在")
+        task.worker_spec = {"task": task.task_kwargs, "rtsp_url": rtsp_url}
+        with self.lock:
+            previous = self.assignments.get(task.config_id)
+            if previous is not None:
+                # 重新启动已退出的任务：从原工作进程中移除
+                self.workers[previous].config_ids.discard(task.config_id)
+                self.workers[previous].command_queue.put(("stop", task.config_id))
+            worker = self._pick_worker(task.model_path)
+            worker.config_ids.add(task.config_id)
+            self.tasks[task.config_id] = task
+            self.assignments[task.config_id] = worker.index
+        worker.command_queue.put(("start", dict(task.worker_spec, preview=bool(task.clients))))
+        logger.info(f"检测任务已分配到工作进程 {worker.index}: {task.config_id}")
+
+    def stop_task(self, config_id: str, timeout: float = STOP_TIMEOUT):
+        """停止工作进程中的任务，等待其释放拉流和模型"""
+        with self.lock:
+            index = self.assignments.pop(config_id, None)
+            self.tasks.pop(config_id, None)
+            if index is None:
+                return
+            worker = self.workers[index]
+            worker.config_ids.discard(config_id)
+            stopped = self.stopped[config_id] = threading.Event()
+        worker.command_queue.put(("stop", config_id))
+        if not stopped.wait(timeout):
+            logger.warning(f"等待工作进程停止检测任务超时: {config_id}")
+        self.stopped.pop(config_id, None)
+        self._detach_ring(config_id)
+
+    def set_preview(self, config_id: str, enabled: bool):
+        self.send(config_id, ("preview", config_id, enabled))
+
+    def send(self, config_id: str, command: tuple):
+        with self.lock:
+            index = self.assignments.get(config_id)
+        if index is not None:
+            self.workers[index].command_queue.put(command)
+
+    def _dispatch(self):
+        while self.running:
+            try:
+                message = self.result_queue.get(timeout=1)
+            except queue.Empty:
+                message = None
+            except (EOFError, OSError):
+                break
+            if message is not None:
+                try:
+                    self._handle_message(message)
+                except Exception as e:
+                    logger.error(f"处理工作进程消息失败: {message[0]}, {e}")
+            self._check_workers()
+
+    def _handle_message(self, message: tuple):
+        kind = message[0]
+        if kind == "call":
+            _, config_id, method, args = message
+            task = self.tasks.get(config_id)
+            if task is None or method not in FORWARDED_METHODS:
+                self._release_frames(config_id, args)
+                return
+            if method == "_enqueue_preview":
+                # 预览已在工作进程中编码，只需放入事件循环的队列，直接在分发线程执行
+                task._enqueue_preview(*args)
+            else:
+                self.executor.submit(self._call, task, method, args)
+        elif kind == "clip":
+            _, _, event_id, created_at, clip_path = message
+            self.executor.submit(update_clip_path, event_id, created_at, clip_path)
+        elif kind == "state":
+            for config_id, state in message[1].items():
+                task = self.tasks.get(config_id)
+                if task is not None:
+                    task.update_remote_state(state)
+        elif kind == "stopped":
+            stopped = self.stopped.get(message[1])
+            if stopped is not None:
+                stopped.set()
+
+    def _call(self, task: RemoteDetectionTask, method: str, args: tuple):
+        """在事件线程中从缓冲区复制帧（复制后立即确认释放槽位），再执行入库/推送方法"""
+        resolved = []
+        try:
+            for arg in args:
+                if isinstance(arg, FrameRef):
+                    arg = self._read_frame(task.config_id, arg)
+                    if arg is None:
+                        # 槽位在确认前不会被覆盖，只有任务已停止或工作进程重启时才会读不到
+                        logger.warning(f"帧缓冲区已不可用，丢弃 {method}: {task.config_id}")
+                        return
+                resolved.append(arg)
+        finally:
+            self._release_frames(task.config_id, args)
+        try:
+            getattr(task, method)(*resolved)
+        except Exception as e:
+            logger.error(f"执行检测任务方法失败: {task.config_id}.{method}, {e}")
+
+    def _release_frames(self, config_id: str, args: tuple):
+        refs = [arg for arg in args if isinstance(arg, FrameRef)]
+        if refs:
+            self.send(config_id, ("release", config_id, refs))
+
+    def _read_frame(self, config_id: str, ref: FrameRef) -> Optional[np.ndarray]:
+        with self.ring_lock:
+            ring = self.rings.get(config_id)
+            if ring is None or ring.name != ref.ring:
+                if ring is not None:
+                    ring.close()
+                try:
+                    ring = FrameRing.attach(ref)
+                except FileNotFoundError:
+                    self.rings.pop(config_id, None)
+                    return None
+                self.rings[config_id] = ring
+            return ring.read(ref)
+
+    def _detach_ring(self, config_id: str):
+        with self.ring_lock:
+            ring = self.rings.pop(config_id, None)
+        if ring is not None:
+            ring.close()
+
+    def _check_workers(self):
+        """每秒检查一次工作进程，异常退出时重启并重新下发其任务"""
+        now = time.monotonic()
+        if now - self.last_health_check < 1:
+            return
+        self.last_health_check = now
+        for worker in self.workers:
+            if not self.running or worker.process.is_alive():
+                continue
+            logger.error(f"检测工作进程异常退出: {worker.index} (exitcode {worker.process.exitcode})，正在重启")
+            with self.lock:
+                config_ids = list(worker.config_ids)
+                tasks = [self.tasks[config_id] for config_id in config_ids if config_id in self.tasks]
+            for config_id in config_ids:
+                stopped = self.stopped.get(config_id)
+                if stopped is not None:
+                    stopped.set()
+                self._detach_ring(config_id)
+            self._spawn(worker)
+            for task in tasks:
+                worker.command_queue.put(("start", dict(task.worker_spec, preview=bool(task.clients))))
+
+    def get_stats(self) -> Dict:
+        with self.lock:
+            return {
+                "processes": self.processes,
+                "workers": [{
+                    "index": worker.index,
+                    "pid": worker.process.pid if worker.process else None,
+                    "alive": bool(worker.process and worker.process.is_alive()),
+                    "tasks": len(worker.config_ids),
+                } for worker in self.workers],
+            }
+
+
+# 全局检测工作进程池实例
+detection_worker_pool = DetectionWorkerPool()
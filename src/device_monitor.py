@@ -8,6 +8,7 @@ import threading
 import time
 from datetime import datetime, timedelta
 from typing import Dict, List, Optional
+from sqlalchemy import case, func
 from sqlalchemy.orm import Session
 from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.triggers.interval import IntervalTrigger
@@ -19,7 +20,10 @@ from src.data_pusher import data_pusher
 logger = logging.getLogger(__name__)
 
 OFFLINE_THRESHOLD = 3 # 连续离线超过3次才标记为离线
-PER_DEVICE_CHECK_DELAY_SECONDS = 0.2 # 每个设备检查之间的延迟，单位秒
+MAX_CONCURRENT_CHECKS = 50 # 同时探测的设备数上限
+CHECK_ATTEMPTS = 3 # 每个设备最多尝试次数（1次初始尝试 + 2次重试）
+RETRY_DELAY_SECONDS = 1 # 重试间隔，单位秒
+PING_TIMEOUT_SECONDS = 5 # ping 子进程超时，单位秒
 
 class DeviceMonitor:
     """设备状态监控器"""
@@ -89,52 +93,82 @@ class DeviceMonitor:
             loop.close()
         
     async def check_all_devices_status(self):
-        """检查所有设备的在线状态 - 每5分钟执行一次"""
+        """检查所有设备的在线状态 - 每5分钟执行一次（并发探测，批量更新）"""
+        import aiohttp
+        
         try:
             db = SessionLocal()
-            devices = db.query(Device).all()
-                       
-            for device in devices:
-                try:
-                    # 检查设备连接状态
-                    is_online = False
-                    for _ in range(3):  # 最多重试3次（1次初始尝试 + 2次重试）
-                        is_online = await self._check_device_connection(device)
-                        if is_online:
-                            break
-                        await asyncio.sleep(1)  # 等待1秒后重试
-                    
-                    # 更新设备状态
-                    # 如果设备在线，重置离线计数
-                    if is_online:
-                        device.offline_count = 0
-                        device.last_online_time = datetime.now()
-                        device.status = True # 确保在线时状态为True
-                    else:
-                        if device.offline_count is None:
-                            device.offline_count = 0
-                        device.offline_count += 1
-                        # 只有当连续离线次数超过阈值，并且当前状态是在线时，才将设备状态标记为离线
-                        if device.offline_count >= OFFLINE_THRESHOLD and device.status:
-                            device.status = False
-                    
-                    # 在线时更新心跳时间
-                    if is_online:
-                        device.last_heartbeat = datetime.now()
-                    # print(f"当前设备：{device.device_name}，设备状态：{device.status}，当前时间：{datetime.now()}")
-                except Exception as e:
-                    device.status = False
-                    if device.offline_count is None:
-                        device.offline_count = 0
-                    device.offline_count += 1 # 异常也计为一次离线
-                
-                await asyncio.sleep(PER_DEVICE_CHECK_DELAY_SECONDS) # 每个设备检查后的延迟
+            try:
+                # 只取探测需要的字段，探测期间不占用数据库会话
+                devices = db.query(Device.device_id, Device.ip_address).all()
+            finally:
+                db.close()
             
-            # 批量提交数据库更新
-            db.commit()
+            if not devices:
+                return
+            
+            started = time.monotonic()
+            semaphore = asyncio.Semaphore(MAX_CONCURRENT_CHECKS)
+            connector = aiohttp.TCPConnector(limit=MAX_CONCURRENT_CHECKS, force_close=True)
+            async with aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=3)) as session:
+                results = await asyncio.gather(*[
+                    self._probe_device(device, session, semaphore) for device in devices
+                ], return_exceptions=True)
+            
+            online_ids = []
+            offline_ids = []
+            for device, result in zip(devices, results):
+                # 异常也计为一次离线
+                if result is True:
+                    online_ids.append(device.device_id)
+                else:
+                    offline_ids.append(device.device_id)
+            
+            self._update_devices_status(online_ids, offline_ids)
+            logger.info(
+                f"设备状态检查完成: 共{len(devices)}台, 在线{len(online_ids)}台, "
+                f"离线{len(offline_ids)}台, 耗时{time.monotonic() - started:.1f}秒"
+            )
             
         except Exception as e:
             logger.error(f"设备状态检查失败: {e}")
+    
+    async def _probe_device(self, device, session, semaphore: asyncio.Semaphore) -> bool:
+        """在并发上限内探测单个设备，失败时重试"""
+        async with semaphore:
+            for attempt in range(CHECK_ATTEMPTS):
+                if await self._check_device_connection(device, session):
+                    return True
+                if attempt < CHECK_ATTEMPTS - 1:
+                    await asyncio.sleep(RETRY_DELAY_SECONDS)  # 等待后重试
+            return False
+    
+    def _update_devices_status(self, online_ids: List[str], offline_ids: List[str]):
+        """批量更新设备状态：在线设备一条UPDATE，离线设备一条UPDATE"""
+        db = SessionLocal()
+        try:
+            now = datetime.now()
+            if online_ids:
+                # 在线时重置离线计数并更新心跳时间
+                db.query(Device).filter(Device.device_id.in_(online_ids)).update({
+                    Device.offline_count: 0,
+                    Device.last_online_time: now,
+                    Device.last_heartbeat: now,
+                    Device.status: True
+                }, synchronize_session=False)
+            
+            if offline_ids:
+                # 只有当连续离线次数达到阈值，并且当前状态是在线时，才将设备状态标记为离线
+                next_count = func.coalesce(Device.offline_count, 0) + 1
+                db.query(Device).filter(Device.device_id.in_(offline_ids)).update({
+                    Device.offline_count: next_count,
+                    Device.status: case((next_count >= OFFLINE_THRESHOLD, False), else_=Device.status)
+                }, synchronize_session=False)
+            
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            logger.error(f"批量更新设备状态失败: {e}")
         finally:
             db.close()
 
@@ -192,11 +226,11 @@ class DeviceMonitor:
         finally:
             db.close()
             
-    async def _check_device_connection(self, device: Device) -> bool:
+    async def _check_device_connection(self, device: Device, session=None) -> bool:
         """检查单个设备的连接状态"""
         try:  
             # 方法1: HTTP连接测试（适用于支持HTTP API的设备）
-            if await self._test_http_connection(device):
+            if await self._test_http_connection(device, session):
                 return True
 
             # 方法2: ICMP Ping测试
@@ -208,32 +242,34 @@ class DeviceMonitor:
         except Exception as e:
             return False
             
-    async def _test_http_connection(self, device: Device) -> bool:
-        """测试HTTP连接"""
+    async def _test_http_connection(self, device: Device, session=None) -> bool:
+        """测试HTTP连接（复用调用方传入的会话）"""
         try:
             import aiohttp
             
             # 大华官方的tcp测试的API端点
-            test_urls = [
-                f"http://{device.ip_address}/cgi-bin/api/tcpConnect/tcpTest"
-            ]
+            test_url = f"http://{device.ip_address}/cgi-bin/api/tcpConnect/tcpTest"
             
-            try:
+            if session is None:
                 timeout = aiohttp.ClientTimeout(total=3)
-                async with aiohttp.ClientSession(timeout=timeout) as session:
-                    async with session.get(test_urls) as response:
-                        if response.status in [200, 401, 403]:
-                            return True
-            except:
-                return False                   
+                async with aiohttp.ClientSession(timeout=timeout) as own_session:
+                    return await self._request_http_test(own_session, test_url)
+            return await self._request_http_test(session, test_url)
             
         except Exception as e:
             return False
+    
+    async def _request_http_test(self, session, test_url: str) -> bool:
+        try:
+            async with session.get(test_url) as response:
+                return response.status in [200, 401, 403]
+        except Exception:
+            return False
             
     async def _test_ping_connection(self, device: Device) -> bool:
-        """测试ICMP Ping连接"""
+        """测试ICMP Ping连接（异步子进程，不阻塞事件循环）"""
+        process = None
         try:
-            import subprocess
             import platform
             
             # Windows系统
@@ -242,9 +278,19 @@ class DeviceMonitor:
             else:
                 cmd = ["ping", "-c", "1", "-W", "3", device.ip_address]
                 
-            result = subprocess.run(cmd, capture_output=True, text=True, timeout=5)
-            return result.returncode == 0
+            process = await asyncio.create_subprocess_exec(
+                *cmd,
+                stdout=asyncio.subprocess.DEVNULL,
+                stderr=asyncio.subprocess.DEVNULL
+            )
+            return_code = await asyncio.wait_for(process.wait(), timeout=PING_TIMEOUT_SECONDS)
+            return return_code == 0
             
+        except asyncio.TimeoutError:
+            if process and process.returncode is None:
+                process.kill()
+                await process.wait()
+            return False
         except Exception as e:
             logger.error(f"Ping测试失败: {e}")
             return False
@@ -0,0 +1,448 @@
+"""
+事件表按时间分区 - detection_event / smart_events 按天、external_events 按月做范围分区
+
+过期数据整分区删除（不产生大量死元组），删除前把分区内引用的图片/视频路径流式写入
+清单文件，分区删除提交后再按清单删除文件。分区删除不会触发计数触发器，
+因此在同一事务中从 event_daily_counter 扣减该分区的计数。
+"""
+import logging
+import os
+import re
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import text
+
+from src.event_statistics import EVENT_COUNTER_SOURCES, counter_select, counter_upsert, install_counter_triggers
+from src.image_store import remove_event_file
+
+logger = logging.getLogger(__name__)
+
+PARTITION_DAILY = "daily"
+PARTITION_MONTHLY = "monthly"
+
+# 表名 -> (主键字段, 分区字段, 分区粒度)
+PARTITIONED_EVENT_TABLES = {
+    "detection_event": ("event_id", "created_at", PARTITION_DAILY),
+    "external_events": ("event_id", "created_at", PARTITION_MONTHLY),
+    "smart_events": ("id", "created_at", PARTITION_DAILY),
+}
+
+# 预先创建的未来分区数量
+PRECREATE_PERIODS = {PARTITION_DAILY: 14, PARTITION_MONTHLY: 3}
+
+# 事件行引用的文件路径（text[] 表达式），没有关联文件的表不在此列
+EVENT_FILE_PATHS = {
+    "detection_event": "ARRAY_REMOVE(ARRAY[thumbnail_path, snippet_path], NULL)",
+    "external_events": (
+        "ARRAY(SELECT path FROM jsonb_each("
+        "CASE WHEN jsonb_typeof(normalized_data->'processed_images') = 'object' "
+        "THEN normalized_data->'processed_images' ELSE '{}'::jsonb END) AS img, "
+        "LATERAL (VALUES (img.value->>'original_path'), (img.value->>'thumbnail_path')) AS paths(path) "
+        "WHERE jsonb_typeof(img.value) = 'object' AND path IS NOT NULL)"
+    ),
+}
+
+MANIFEST_DIR = Path("storage/cleanup_manifests")
+MANIFEST_PENDING_SUFFIX = ".pending"
+MANIFEST_READY_SUFFIX = ".manifest"
+MANIFEST_STREAM_ROWS = 1000
+
+_TABLE_SOURCES = {table: source for source, (table, *_) in EVENT_COUNTER_SOURCES.items()}
+_BOUND_PATTERN = re.compile(r"FROM \((.+?)\) TO \((.+?)\)")
+
+
+def period_start(value: datetime, granularity: str) -> datetime:
+    """对齐到分区起点（当天零点或当月1日零点）"""
+    start = value.replace(hour=0, minute=0, second=0, microsecond=0)
+    if granularity == PARTITION_MONTHLY:
+        start = start.replace(day=1)
+    return start
+
+
+def next_period(start: datetime, granularity: str) -> datetime:
+    if granularity == PARTITION_MONTHLY:
+        return (start + timedelta(days=32)).replace(day=1)
+    return start + timedelta(days=1)
+
+
+def partition_name(table: str, start: datetime, granularity: str) -> str:
+    suffix = start.strftime("%Y%m") if granularity == PARTITION_MONTHLY else start.strftime("%Y%m%d")
+    return f"{table}_p{suffix}"
+
+
+def _literal(value: datetime) -> str:
+    return f"'{value:%Y-%m-%d %H:%M:%S}'"
+
+
+def _parse_bound(value: str) -> Optional[datetime]:
+    value = value.strip()
+    if value in ("MINVALUE", "MAXVALUE"):
+        return None
+    return datetime.fromisoformat(value.strip("'"))
+
+
+def is_partitioned(conn, table: str) -> bool:
+    return conn.execute(
+        text("SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(:table)"),
+        {"table": table}
+    ).first() is not None
+
+
+def list_partitions(conn, table: str) -> List[Tuple[str, Optional[datetime], Optional[datetime]]]:
+    """列出范围分区 (分区名, 下界, 上界)，MINVALUE/MAXVALUE 记为 None，不含默认分区"""
+    rows = conn.execute(text(
+        "SELECT c.relname, pg_get_expr(c.relpartbound, c.oid) AS bound "
+        "FROM pg_inherits AS i JOIN pg_class AS c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = to_regclass(:table)"
+    ), {"table": table})
+
+    partitions = []
+    for name, bound in rows:
+        match = _BOUND_PATTERN.search(bound or "")
+        if match:
+            partitions.append((name, _parse_bound(match.group(1)), _parse_bound(match.group(2))))
+    return sorted(partitions, key=lambda item: item[1] or datetime.min)
+
+
+def _overlaps(partitions, lower: datetime, upper: datetime) -> bool:
+    return any(
+        (start is None or start < upper) and (end is None or end > lower)
+        for _, start, end in partitions
+    )
+
+
+def create_partitions(conn, table: str, now: Optional[datetime] = None) -> List[str]:
+    """创建默认分区以及从当前周期起的未来分区（已覆盖的周期跳过）
+
+    默认分区中已有落在新分区范围内的数据时，先把这些行移入新表再挂载为分区；
+    直接操作子分区不会触发父表上的计数触发器，计数保持不变。
+    """
+    _, key, granularity = PARTITIONED_EVENT_TABLES[table]
+    conn.execute(text("SELECT pg_advisory_xact_lock(hashtext(:name))"), {"name": f"{table}_partitions"})
+
+    default_partition = f"{table}_default"
+    conn.execute(text(f"CREATE TABLE IF NOT EXISTS {default_partition} PARTITION OF {table} DEFAULT"))
+
+    partitions = list_partitions(conn, table)
+    start = period_start(now or datetime.now(), granularity)
+    created = []
+    for _ in range(PRECREATE_PERIODS[granularity] + 1):
+        end = next_period(start, granularity)
+        if not _overlaps(partitions, start, end):
+            name = partition_name(table, start, granularity)
+            bounds = f"FROM ({_literal(start)}) TO ({_literal(end)})"
+            in_default = conn.execute(text(
+                f"SELECT 1 FROM {default_partition} WHERE {key} >= :start AND {key} < :end LIMIT 1"
+            ), {"start": start, "end": end}).first()
+            if in_default:
+                conn.execute(text(
+                    f"CREATE TABLE {name} (LIKE {table} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"
+                ))
+                conn.execute(text(
+                    f"WITH moved AS (DELETE FROM {default_partition} "
+                    f"WHERE {key} >= :start AND {key} < :end RETURNING *) "
+                    f"INSERT INTO {name} SELECT * FROM moved"
+                ), {"start": start, "end": end})
+                conn.execute(text(f"ALTER TABLE {table} ATTACH PARTITION {name} FOR VALUES {bounds}"))
+            else:
+                conn.execute(text(f"CREATE TABLE {name} PARTITION OF {table} FOR VALUES {bounds}"))
+            partitions.append((name, start, end))
+            created.append(name)
+        start = end
+    return created
+
+
+CONVERT_BATCH_SIZE = 5000  # 改造前回填空分区字段的每批行数
+CONVERT_LOCK_TIMEOUT = "5s"  # 改造中短暂持有排他锁的步骤等待锁的上限，避免排队阻塞其他写入
+
+
+def _unique_key_function(table: str) -> str:
+    pk, _, _ = PARTITIONED_EVENT_TABLES[table]
+    return f"{table}_unique_{pk}"
+
+
+def ensure_unique_key_trigger(conn, table: str) -> bool:
+    """在分区父表上安装主键值的全局唯一性检查（分区表的唯一约束必须包含分区字段）
+
+    语句级触发器按主键值加事务级咨询锁后检查整表是否已有相同主键值，同一主键的并发写入串行执行，
+    后提交的写入以 unique_violation 失败。UPDATE 只在修改主键或分区字段时检查。已安装时返回 False。
+    """
+    pk, key, _ = PARTITIONED_EVENT_TABLES[table]
+    function = _unique_key_function(table)
+    installed = conn.execute(text(
+        "SELECT COUNT(*) FROM pg_trigger WHERE tgrelid = to_regclass(:table) AND tgname LIKE :pattern"
+    ), {"table": table, "pattern": f"{function}%"}).scalar()
+    if installed >= 2:
+        return False
+
+    conn.execute(text(f"""
+        CREATE OR REPLACE FUNCTION {function}() RETURNS trigger AS $$
+        DECLARE
+            duplicate text;
+        BEGIN
+            PERFORM pg_advisory_xact_lock(hashtext('{table}:' || ids.{pk}))
+            FROM (SELECT DISTINCT {pk} FROM new_rows ORDER BY {pk}) AS ids;
+            SELECT t.{pk} INTO duplicate
+            FROM {table} AS t
+            JOIN (SELECT DISTINCT {pk} FROM new_rows) AS ids USING ({pk})
+            GROUP BY t.{pk}
+            HAVING COUNT(*) > 1
+            LIMIT 1;
+            IF duplicate IS NOT NULL THEN
+                RAISE EXCEPTION 'duplicate key value violates unique constraint on {table}.{pk}: %', duplicate
+                    USING ERRCODE = 'unique_violation';
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+    """))
+    for operation, event in (("insert", "INSERT"), ("update", f"UPDATE OF {pk}, {key}")):
+        trigger = f"{function}_{operation}"
+        conn.execute(text(f"DROP TRIGGER IF EXISTS {trigger} ON {table}"))
+        conn.execute(text(
+            f"CREATE TRIGGER {trigger} AFTER {event} ON {table} "
+            f"REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION {function}()"
+        ))
+    return True
+
+
+def convert_to_partitioned(engine, table: str, now: Optional[datetime] = None,
+                           batch_size: int = CONVERT_BATCH_SIZE) -> bool:
+    """把已有的普通事件表改造为分区表，原表整体挂载为最早的一个分区（不复制数据）
+
+    一次性的运维步骤（python -m src.event_partitions convert），不在服务启动时执行。
+    耗时的步骤都不阻塞事件写入：分批回填空的分区字段、以 NOT VALID 添加分区范围 CHECK 后 VALIDATE、
+    CONCURRENTLY 建 (主键, 分区字段) 唯一索引；最后在一个设置了 lock_timeout 的短事务中改名、
+    建父表并挂载原表——CHECK 已证明分区范围、已有索引直接挂到父表，挂载时不扫描、不建索引。
+    """
+    with engine.connect() as conn:
+        if is_partitioned(conn, table):
+            return False
+
+    pk, key, granularity = PARTITIONED_EVENT_TABLES[table]
+    legacy = f"{table}_legacy"
+    bound_check = f"{table}_partition_bound"
+    key_index = f"{table}_{pk}_{key}_key"
+    now = now or datetime.now()
+
+    # 1. 分区字段不能为空：新写入使用默认值，已有空值分批回填（只加行锁）
+    with engine.begin() as conn:
+        conn.execute(text(f"SET LOCAL lock_timeout = '{CONVERT_LOCK_TIMEOUT}'"))
+        conn.execute(text(f"ALTER TABLE {table} ALTER COLUMN {key} SET DEFAULT LOCALTIMESTAMP"))
+    backfill = text(
+        f"UPDATE {table} SET {key} = COALESCE(\"timestamp\", LOCALTIMESTAMP) "
+        f"WHERE {pk} IN (SELECT {pk} FROM {table} WHERE {key} IS NULL LIMIT :limit)"
+    )
+    while True:
+        with engine.begin() as conn:
+            if conn.execute(backfill, {"limit": batch_size}).rowcount < batch_size:
+                break
+
+    # 2. 分区范围：原表覆盖到最新数据所在周期之后再留一个周期，改造完成前的新事件仍在范围内
+    with engine.connect() as conn:
+        max_key = conn.execute(text(f"SELECT MAX({key}) FROM {table}")).scalar()
+    latest = max(max_key, now) if max_key else now
+    upper = next_period(next_period(period_start(latest, granularity), granularity), granularity)
+
+    # 3. NOT VALID 添加 CHECK 只短暂加锁；VALIDATE 只加 SHARE UPDATE EXCLUSIVE 锁，扫描期间可正常读写
+    with engine.begin() as conn:
+        conn.execute(text(f"SET LOCAL lock_timeout = '{CONVERT_LOCK_TIMEOUT}'"))
+        conn.execute(text(f"ALTER TABLE {table} DROP CONSTRAINT IF EXISTS {bound_check}"))
+        conn.execute(text(
+            f"ALTER TABLE {table} ADD CONSTRAINT {bound_check} "
+            f"CHECK ({key} IS NOT NULL AND {key} < {_literal(upper)}) NOT VALID"
+        ))
+    with engine.begin() as conn:
+        conn.execute(text(f"ALTER TABLE {table} VALIDATE CONSTRAINT {bound_check}"))
+    # 已有有效的 CHECK 证明非空，SET NOT NULL 不再扫描全表（PostgreSQL 12+）
+    with engine.begin() as conn:
+        conn.execute(text(f"SET LOCAL lock_timeout = '{CONVERT_LOCK_TIMEOUT}'"))
+        conn.execute(text(f"ALTER TABLE {table} ALTER COLUMN {key} SET NOT NULL"))
+
+    # 4. 父表主键 (主键, 分区字段) 对应的唯一索引，挂载时直接复用
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        invalid = conn.execute(text(
+            "SELECT 1 FROM pg_index WHERE indexrelid = to_regclass(:index) AND NOT indisvalid"
+        ), {"index": key_index}).first()
+        if invalid:
+            # 上次 CONCURRENTLY 中断遗留的无效索引
+            conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {key_index}"))
+        conn.execute(text(f"CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS {key_index} ON {table} ({pk}, {key})"))
+
+    # 5. 短事务：改名、建父表并挂载原表
+    with engine.begin() as conn:
+        conn.execute(text(f"SET LOCAL lock_timeout = '{CONVERT_LOCK_TIMEOUT}'"))
+        conn.execute(text(f"LOCK TABLE {table} IN ACCESS EXCLUSIVE MODE"))
+
+        index_rows = conn.execute(text(
+            "SELECT c.relname, pg_get_indexdef(i.indexrelid), i.indisprimary, i.indisunique "
+            "FROM pg_index AS i JOIN pg_class AS c ON c.oid = i.indexrelid "
+            "WHERE i.indrelid = to_regclass(:table)"
+        ), {"table": table}).all()
+        # 分区表的唯一约束必须包含分区字段，无法原样迁移的唯一索引不能静默丢弃
+        unsupported = [definition for name, definition, primary, unique in index_rows
+                       if unique and not primary and name != key_index]
+        if unsupported:
+            raise RuntimeError(f"{table} 存在不含分区字段的唯一索引，无法改造为分区表: {'; '.join(unsupported)}")
+        foreign_keys = conn.execute(text(
+            "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint "
+            "WHERE conrelid = to_regclass(:table) AND contype = 'f'"
+        ), {"table": table}).all()
+
+        # 计数触发器改由父表承担，子分区上保留会在直接操作分区时重复计数
+        for operation in ("insert", "delete", "update"):
+            conn.execute(text(f"DROP TRIGGER IF EXISTS {table}_counter_{operation} ON {table}"))
+
+        # 原表及其索引改名，腾出名称给新的父表
+        conn.execute(text(f"ALTER TABLE {table} RENAME TO {legacy}"))
+        for index_name, _, _, _ in index_rows:
+            conn.execute(text(f'ALTER INDEX "{index_name}" RENAME TO "{(index_name + "_legacy")[:63]}"'))
+
+        conn.execute(text(
+            f"CREATE TABLE {table} (LIKE {legacy} INCLUDING DEFAULTS INCLUDING CONSTRAINTS "
+            f"INCLUDING STORAGE INCLUDING COMMENTS) PARTITION BY RANGE ({key})"
+        ))
+        # 分区范围 CHECK 只用于原表，父表由各分区的范围约束
+        conn.execute(text(f"ALTER TABLE {table} DROP CONSTRAINT IF EXISTS {bound_check}"))
+        conn.execute(text(f"ALTER TABLE {table} ADD PRIMARY KEY ({pk}, {key})"))
+        for index_name, definition, primary, unique in index_rows:
+            if primary or unique:
+                continue
+            # 父表还没有分区，只登记定义；索引定义仍指向原表名，即新的父表
+            conn.execute(text(definition))
+        for constraint_name, definition in foreign_keys:
+            conn.execute(text(f'ALTER TABLE {table} ADD CONSTRAINT "{constraint_name}" {definition}'))
+
+        # CHECK 与分区范围一致，挂载时不扫描；父表的主键和索引匹配原表已有的索引，不重新构建
+        conn.execute(text(
+            f"ALTER TABLE {table} ATTACH PARTITION {legacy} FOR VALUES FROM (MINVALUE) TO ({_literal(upper)})"
+        ))
+        conn.execute(text(f"ALTER TABLE {legacy} DROP CONSTRAINT {bound_check}"))
+        ensure_unique_key_trigger(conn, table)
+        # 在同一事务中把计数触发器装到父表，改造前后的写入不漏计
+        if table in _TABLE_SOURCES:
+            install_counter_triggers(conn, _TABLE_SOURCES[table])
+
+    logger.info("已将 %s 改造为分区表，原数据挂载为分区 %s（截至 %s）", table, legacy, upper)
+    return True
+
+
+# ---- 整分区删除 ----
+
+def _write_manifest(engine, table: str, partition: str, manifest_dir: Path) -> Optional[Path]:
+    """把分区内引用的文件路径流式写入待生效清单，分区没有文件字段时返回 None"""
+    paths = EVENT_FILE_PATHS.get(table)
+    if paths is None:
+        return None
+
+    manifest_dir.mkdir(parents=True, exist_ok=True)
+    path = manifest_dir / f"{partition}{MANIFEST_PENDING_SUFFIX}"
+    count = 0
+    with engine.connect() as conn, open(path, "w", encoding="utf-8") as manifest:
+        result = conn.execution_options(yield_per=MANIFEST_STREAM_ROWS).execute(
+            text(f"SELECT {paths} FROM {partition}")
+        )
+        for (row_paths,) in result:
+            for file_path in row_paths or ():
+                if file_path:
+                    manifest.write(file_path.replace("\n", "") + "\n")
+                    count += 1
+        manifest.flush()
+        os.fsync(manifest.fileno())
+    logger.info("分区 %s 文件清单已生成: %d 个路径", partition, count)
+    return path
+
+
+def _drop_partition(engine, table: str, partition: str) -> int:
+    """删除一个分区并扣减其事件计数，返回删除的行数"""
+    source = _TABLE_SOURCES.get(table)
+    with engine.begin() as conn:
+        conn.execute(text(f"LOCK TABLE {partition} IN ACCESS EXCLUSIVE MODE"))
+        rows = conn.execute(text(f"SELECT COUNT(*) FROM {partition}")).scalar() or 0
+        if source and rows:
+            conn.execute(text(counter_upsert([counter_select(source, partition, -1)])))
+        conn.execute(text(f"DROP TABLE {partition}"))
+    return rows
+
+
+def drop_expired_partitions(engine, table: str, cutoff: datetime,
+                            manifest_dir: Path = MANIFEST_DIR) -> Dict[str, int]:
+    """删除上界不晚于 cutoff 的分区（整分区都已过期），返回 {分区名: 行数}"""
+    with engine.connect() as conn:
+        partitions = list_partitions(conn, table)
+
+    dropped = {}
+    for name, _, upper in partitions:
+        if upper is None or upper > cutoff:
+            continue
+        manifest = _write_manifest(engine, table, name, manifest_dir)
+        try:
+            dropped[name] = _drop_partition(engine, table, name)
+        except Exception:
+            if manifest is not None:
+                manifest.unlink(missing_ok=True)
+            raise
+        # 分区删除已提交，清单生效
+        if manifest is not None:
+            manifest.rename(manifest.with_suffix(MANIFEST_READY_SUFFIX))
+        logger.info("已删除过期分区 %s: %d 条记录", name, dropped[name])
+    return dropped
+
+
+# ---- 按清单删除文件 ----
+
+def _partition_exists(engine, partition: str) -> bool:
+    with engine.connect() as conn:
+        return conn.execute(text("SELECT to_regclass(:name)"), {"name": partition}).scalar() is not None
+
+
+def pending_manifests(engine, manifest_dir: Path = MANIFEST_DIR) -> List[Path]:
+    """返回可执行的清单；中断遗留的待生效清单按分区是否已删除决定生效或丢弃"""
+    if not manifest_dir.exists():
+        return []
+    for pending in manifest_dir.glob(f"*{MANIFEST_PENDING_SUFFIX}"):
+        partition = pending.name[:-len(MANIFEST_PENDING_SUFFIX)]
+        if _partition_exists(engine, partition):
+            pending.unlink(missing_ok=True)
+        else:
+            pending.rename(pending.with_suffix(MANIFEST_READY_SUFFIX))
+    return sorted(manifest_dir.glob(f"*{MANIFEST_READY_SUFFIX}"))
+
+
+def process_manifests(engine, manifest_dir: Path = MANIFEST_DIR) -> int:
+    """逐行读取清单删除文件，清单处理完后删除，返回删除的文件数"""
+    deleted = 0
+    for manifest in pending_manifests(engine, manifest_dir):
+        with open(manifest, encoding="utf-8") as lines:
+            for line in lines:
+                file_path = line.rstrip("\n")
+                try:
+                    deleted += remove_event_file(file_path)
+                except Exception as e:
+                    logger.warning(f"删除事件文件失败: {file_path}, 错误: {e}")
+        manifest.unlink(missing_ok=True)
+    return deleted
+
+
+if __name__ == "__main__":
+    # 一次性改造: python -m src.event_partitions convert [表名 ...]
+    import argparse
+
+    from src.database import engine
+    from src.db_migrations import ensure_event_list_indexes
+
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="事件表分区改造")
+    parser.add_argument("command", choices=["convert"])
+    parser.add_argument("tables", nargs="*", default=list(PARTITIONED_EVENT_TABLES))
+    args = parser.parse_args()
+
+    for name in args.tables:
+        if convert_to_partitioned(engine, name):
+            with engine.begin() as conn:
+                created = create_partitions(conn, name)
+            logger.info("已创建 %s 分区: %s", name, ", ".join(created))
+    # 列表索引在各分区上 CONCURRENTLY 补建
+    ensure_event_list_indexes(engine)
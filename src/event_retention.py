@@ -0,0 +1,108 @@
+"""
+事件保留期清理 - 按 (created_at, 主键) 游标分批流式删除过期事件
+
+每批只取固定条数的主键和文件路径，以 DELETE ... WHERE id = ANY(:batch) 删除并立即提交，
+提交后把文件交给有界线程池删除（与下一批的数据库操作重叠），内存占用与过期总量无关。
+整分区过期的数据由 event_partitions 直接删除分区，这里处理剩余的行。
+"""
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+from sqlalchemy import text
+
+from src.event_partitions import EVENT_FILE_PATHS, PARTITIONED_EVENT_TABLES
+from src.image_store import remove_event_file
+
+logger = logging.getLogger(__name__)
+
+CLEANUP_BATCH_SIZE = 1000
+FILE_DELETE_WORKERS = 8
+PROGRESS_LOG_BATCHES = 20  # 每处理多少批输出一次进度日志
+
+
+def _delete_file(file_path: str) -> int:
+    try:
+        return remove_event_file(file_path)
+    except Exception as e:
+        logger.warning(f"删除事件文件失败: {file_path}, 错误: {e}")
+        return 0
+
+
+def purge_expired_events(engine, table: str, expire_time: datetime,
+                         filters: Optional[Dict[str, str]] = None,
+                         batch_size: int = CLEANUP_BATCH_SIZE,
+                         file_workers: int = FILE_DELETE_WORKERS,
+                         progress: Optional[Callable[[int, int], None]] = None) -> Dict[str, int]:
+    """删除 table 中 created_at 早于 expire_time 的事件及其文件
+
+    filters 为附加的等值条件 {字段: 值}；progress 在每批提交后以 (本批删除行数, 本批删除文件数) 回调。
+    返回 {"events": 删除行数, "files": 删除文件数, "batches": 批数}。
+    """
+    pk, key, _ = PARTITIONED_EVENT_TABLES[table]
+    paths_expr = EVENT_FILE_PATHS.get(table, "NULL::text[]")
+
+    conditions = [f"{key} < :expire_time"]
+    params = {"expire_time": expire_time, "limit": batch_size}
+    for index, (column, value) in enumerate((filters or {}).items()):
+        conditions.append(f"{column} = :filter_{index}")
+        params[f"filter_{index}"] = value
+    where = " AND ".join(conditions)
+
+    select_first = text(
+        f"SELECT {pk}, {key}, {paths_expr} FROM {table} WHERE {where} "
+        f"ORDER BY {key}, {pk} LIMIT :limit"
+    )
+    select_next = text(
+        f"SELECT {pk}, {key}, {paths_expr} FROM {table} WHERE {where} "
+        f"AND ({key}, {pk}) > (:last_key, :last_id) ORDER BY {key}, {pk} LIMIT :limit"
+    )
+    # 带上时间条件，分区表只扫描过期的分区
+    delete_batch = text(f"DELETE FROM {table} WHERE {pk} = ANY(:batch) AND {key} < :expire_time")
+
+    totals = {"events": 0, "files": 0, "batches": 0}
+    started = time.perf_counter()
+    last = None
+    pending_files: List = []
+
+    with ThreadPoolExecutor(max_workers=file_workers, thread_name_prefix=f"cleanup-{table}") as executor:
+        while True:
+            with engine.begin() as conn:
+                if last is None:
+                    rows = conn.execute(select_first, params).all()
+                else:
+                    rows = conn.execute(select_next, {**params, "last_key": last[0], "last_id": last[1]}).all()
+                if not rows:
+                    break
+                deleted = conn.execute(
+                    delete_batch, {"batch": [row[0] for row in rows], "expire_time": expire_time}
+                ).rowcount
+            last = (rows[-1][1], rows[-1][0])
+
+            # 上一批的文件删除完成后再提交本批，线程池中最多只有一批文件
+            batch_files = sum(future.result() for future in wait(pending_files).done)
+            pending_files = [
+                executor.submit(_delete_file, file_path)
+                for row in rows for file_path in (row[2] or ()) if file_path
+            ]
+
+            totals["events"] += deleted
+            totals["files"] += batch_files
+            totals["batches"] += 1
+            if progress:
+                progress(deleted, batch_files)
+            if totals["batches"] % PROGRESS_LOG_BATCHES == 0:
+                logger.info(f"{table} 清理进度: 已删除 {totals['events']} 条记录, {totals['files']} 个文件, "
+                            f"耗时 {time.perf_counter() - started:.1f}秒")
+
+            if len(rows) < batch_size:
+                break
+
+        batch_files = sum(future.result() for future in wait(pending_files).done)
+        totals["files"] += batch_files
+        if progress and batch_files:
+            progress(0, batch_files)
+
+    return totals
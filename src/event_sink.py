@@ -0,0 +1,158 @@
+"""
+外部事件入库模块 - 监听器只负责把事件放入有界队列，由独立写库线程批量插入 ExternalEvent
+"""
+import asyncio
+import logging
+import queue
+import threading
+import time
+from typing import Dict, List, Any
+
+from sqlalchemy import insert
+
+from src.database import SessionLocal, ExternalEvent
+
+logger = logging.getLogger(__name__)
+
+
+class ExternalEventSink:
+    """外部事件批量写库器"""
+
+    def __init__(self, max_queue_size: int = 10000, batch_size: int = 200,
+                 flush_interval: float = 0.5, put_timeout: float = 2.0):
+        self.event_queue = queue.Queue(maxsize=max_queue_size)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval  # 攒批最长等待时间（秒）
+        self.put_timeout = put_timeout        # 队列满时的最长背压等待时间（秒）
+        self.running = False
+        self.writer_thread = None
+        self.lock = threading.Lock()
+
+        # 统计信息
+        self.submitted = 0
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self.batches = 0
+        self.last_batch_size = 0
+        self.last_flush_ms = 0.0
+
+    def start(self):
+        """启动写库线程"""
+        with self.lock:
+            if self.running:
+                return
+            self.running = True
+            self.writer_thread = threading.Thread(target=self._write_loop, name="external-event-sink")
+            self.writer_thread.daemon = True
+            self.writer_thread.start()
+            logger.info("外部事件写库线程已启动")
+
+    def stop(self, timeout: float = 10):
+        """停止写库线程，退出前写完队列中剩余的事件"""
+        with self.lock:
+            if not self.running:
+                return
+            self.running = False
+        if self.writer_thread:
+            self.writer_thread.join(timeout=timeout)
+            self.writer_thread = None
+        logger.info(f"外部事件写库线程已停止，剩余未写入: {self.event_queue.qsize()}")
+
+    def submit(self, record: Dict[str, Any]) -> bool:
+        """非阻塞提交一条事件记录，队列满时返回 False"""
+        if not self.running:
+            self.start()
+        try:
+            self.event_queue.put_nowait(record)
+            self.submitted += 1
+            return True
+        except queue.Full:
+            return False
+
+    async def submit_async(self, record: Dict[str, Any]) -> bool:
+        """在事件循环中提交事件；队列满时在线程池中有限等待，不阻塞事件循环"""
+        if self.submit(record):
+            return True
+
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(None, self.event_queue.put, record, True, self.put_timeout)
+            self.submitted += 1
+            return True
+        except queue.Full:
+            self.dropped += 1
+            logger.warning(f"外部事件写库队列已满，丢弃事件: {record.get('event_id')}")
+            return False
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取写库统计信息"""
+        return {
+            "running": self.running,
+            "queue_size": self.event_queue.qsize(),
+            "submitted": self.submitted,
+            "written": self.written,
+            "dropped": self.dropped,
+            "failed": self.failed,
+            "batches": self.batches,
+            "last_batch_size": self.last_batch_size,
+            "last_flush_ms": round(self.last_flush_ms, 2),
+        }
+
+    def _write_loop(self):
+        """写库线程主循环"""
+        while self.running or not self.event_queue.empty():
+            batch = self._collect_batch()
+            if batch:
+                self._flush(batch)
+
+    def _collect_batch(self) -> List[Dict[str, Any]]:
+        """取出一批事件：拿到第一条后最多再等待 flush_interval 凑满 batch_size"""
+        try:
+            first = self.event_queue.get(timeout=0.5)
+        except queue.Empty:
+            return []
+
+        batch = [first]
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.event_queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _flush(self, batch: List[Dict[str, Any]]):
+        """批量插入，整批失败时逐条重试以隔离坏数据"""
+        started = time.perf_counter()
+        db = SessionLocal()
+        try:
+            db.execute(insert(ExternalEvent), batch)
+            db.commit()
+            self.written += len(batch)
+        except Exception as e:
+            db.rollback()
+            logger.warning(f"批量写入外部事件失败，改为逐条写入: {e}")
+            for record in batch:
+                try:
+                    db.execute(insert(ExternalEvent), [record])
+                    db.commit()
+                    self.written += 1
+                except Exception as row_error:
+                    db.rollback()
+                    self.failed += 1
+                    logger.error(f"保存事件到数据库失败: {record.get('event_id')}, {row_error}")
+        finally:
+            db.close()
+
+        self.batches += 1
+        self.last_batch_size = len(batch)
+        self.last_flush_ms = (time.perf_counter() - started) * 1000
+        logger.debug(f"外部事件批量写入 {len(batch)} 条，耗时 {self.last_flush_ms:.1f}ms")
+
+
+# 创建全局外部事件写库实例
+external_event_sink = ExternalEventSink()
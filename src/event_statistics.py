@@ -0,0 +1,278 @@
+"""
+事件统计 - 按天/分类/状态的事件计数
+
+计数表 event_daily_counter 由数据库触发器在事件增删改时增量维护（检测服务和数据服务
+写入的事件都会计入）。本模块定期把计数读入内存，供首页和数据大屏接口直接使用，
+并定期按源表重算最近几天的计数进行校准。
+"""
+import logging
+import threading
+import time
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional
+
+from sqlalchemy import text
+
+from src.database import engine
+
+logger = logging.getLogger(__name__)
+
+SOURCE_DETECTION = "detection"
+SOURCE_EXTERNAL = "external"
+SOURCE_SMART = "smart"
+
+# 事件计数来源: 来源 -> (表名, 日期字段, 分类字段, 状态表达式)
+EVENT_COUNTER_SOURCES = {
+    SOURCE_DETECTION: ("detection_event", '"created_at"', '"event_type"', '"status"::text'),
+    SOURCE_EXTERNAL: ("external_events", '"timestamp"', '"engine_name"', '"status"::text'),
+    SOURCE_SMART: ("smart_events", '"timestamp"', '"event_type"', '"status"'),
+}
+
+REFRESH_INTERVAL_SECONDS = 5  # 内存计数刷新间隔
+RECONCILE_INTERVAL_SECONDS = 3600  # 校准间隔
+RECONCILE_DAYS = 2  # 校准最近几天（含今天）
+RECENT_DAYS = 8  # 内存中保留按天明细的天数（含今天）
+
+
+def counter_select(source: str, rows: str, sign: int = 1, where: str = "") -> str:
+    """生成按 (日期, 分类, 状态) 展开事件行的 SELECT，rows 为表名或触发器迁移表"""
+    _, day_column, category_column, status_expr = EVENT_COUNTER_SOURCES[source]
+    sql = (
+        f"SELECT '{source}' AS source, "
+        f"COALESCE({day_column}::date, DATE '1970-01-01') AS day, "
+        f"COALESCE({category_column}, '') AS category, "
+        f"COALESCE({status_expr}, '') AS status, "
+        f"{sign} AS delta "
+        f"FROM {rows}"
+    )
+    if where:
+        sql += f" WHERE {where}"
+    return sql
+
+
+def counter_upsert(selects: List[str]) -> str:
+    """把若干 counter_select 的结果聚合后累加进计数表"""
+    union = " UNION ALL ".join(selects)
+    # 按主键顺序写入，避免并发事务交叉加锁导致死锁
+    return f"""
+        INSERT INTO event_daily_counter (source, day, category, status, count)
+        SELECT source, day, category, status, SUM(delta)
+        FROM ({union}) AS changes
+        GROUP BY source, day, category, status
+        HAVING SUM(delta) <> 0
+        ORDER BY source, day, category, status
+        ON CONFLICT (source, day, category, status)
+        DO UPDATE SET count = event_daily_counter.count + EXCLUDED.count
+    """
+
+
+def install_counter_triggers(conn, source: str):
+    """在来源表上（重新）安装语句级计数触发器"""
+    table = EVENT_COUNTER_SOURCES[source][0]
+    operations = {
+        "insert": [counter_select(source, "new_rows")],
+        "delete": [counter_select(source, "old_rows", -1)],
+        "update": [counter_select(source, "old_rows", -1),
+                   counter_select(source, "new_rows")],
+    }
+    for operation, selects in operations.items():
+        function = f"{table}_counter_{operation}"
+        conn.execute(text(f"""
+            CREATE OR REPLACE FUNCTION {function}() RETURNS trigger AS $$
+            BEGIN
+                {counter_upsert(selects)};
+                RETURN NULL;
+            END;
+            $$ LANGUAGE plpgsql
+        """))
+
+        referencing = {
+            "insert": "REFERENCING NEW TABLE AS new_rows",
+            "delete": "REFERENCING OLD TABLE AS old_rows",
+            "update": "REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows",
+        }[operation]
+        conn.execute(text(f"DROP TRIGGER IF EXISTS {function} ON {table}"))
+        conn.execute(text(
+            f"CREATE TRIGGER {function} AFTER {operation.upper()} ON {table} "
+            f"{referencing} FOR EACH STATEMENT EXECUTE FUNCTION {function}()"
+        ))
+
+
+class EventStatistics:
+    """事件计数内存快照"""
+
+    def __init__(self, refresh_interval: float = REFRESH_INTERVAL_SECONDS,
+                 reconcile_interval: float = RECONCILE_INTERVAL_SECONDS):
+        self.refresh_interval = refresh_interval
+        self.reconcile_interval = reconcile_interval
+
+        self._totals: Dict[tuple, int] = {}  # (来源, 分类, 状态) -> 数量
+        self._daily: Dict[tuple, int] = {}  # (来源, 日期, 分类, 状态) -> 数量
+        self._crowd_jobs: List[Dict[str, Any]] = []
+        self._loaded = False
+        self.refreshed_at = None
+        self.reconciled_at = None
+
+        self._lock = threading.Lock()
+        self._running = False
+        self._thread = None
+
+    # ---- 后台刷新 ----
+
+    def start(self):
+        """启动后台刷新线程（幂等）"""
+        with self._lock:
+            if self._running:
+                return
+            self._running = True
+            self._thread = threading.Thread(target=self._run, name="event-statistics", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._running = False
+
+    def _run(self):
+        last_reconcile = time.monotonic()
+        while self._running:
+            time.sleep(self.refresh_interval)
+            try:
+                if time.monotonic() - last_reconcile >= self.reconcile_interval:
+                    last_reconcile = time.monotonic()
+                    self.reconcile()
+                self.refresh()
+            except Exception as e:
+                logger.warning(f"刷新事件统计失败: {e}")
+
+    def _ensure_loaded(self):
+        if not self._running:
+            self.start()
+        if not self._loaded:
+            self.refresh()
+
+    def refresh(self):
+        """从计数表重新加载内存快照"""
+        since = date.today() - timedelta(days=RECENT_DAYS - 1)
+        with engine.connect() as conn:
+            totals = {
+                (row.source, row.category, row.status): int(row.count)
+                for row in conn.execute(text(
+                    "SELECT source, category, status, SUM(count) AS count "
+                    "FROM event_daily_counter GROUP BY source, category, status"
+                ))
+            }
+            daily = {
+                (row.source, row.day, row.category, row.status): int(row.count)
+                for row in conn.execute(text(
+                    "SELECT source, day, category, status, count "
+                    "FROM event_daily_counter WHERE day >= :since"
+                ), {"since": since})
+            }
+            crowd_jobs = [{
+                "job_id": row.job_id,
+                "job_name": row.job_name,
+                "count": int(row.count),
+                "avg_count": float(row.sum_value) / row.count if row.count else 0,
+                "max_count": int(row.max_count) if row.max_count else 0
+            } for row in conn.execute(text(
+                # 人群分析结果使用时间桶汇总表的天桶
+                "SELECT r.job_id, j.job_name, SUM(r.sample_count) AS count, "
+                "SUM(r.sum_value) AS sum_value, MAX(r.max_value) AS max_count "
+                "FROM crowd_metric_rollup AS r "
+                "JOIN crowd_analysis_job AS j ON j.job_id = r.job_id "
+                "WHERE r.scope = 'job' AND r.bucket_seconds = 86400 "
+                "GROUP BY r.job_id, j.job_name"
+            ))]
+
+        with self._lock:
+            self._totals = totals
+            self._daily = daily
+            self._crowd_jobs = crowd_jobs
+            self._loaded = True
+            self.refreshed_at = datetime.now()
+
+    def reconcile(self, days: int = RECONCILE_DAYS):
+        """按源表重算最近几天的计数，修正触发器安装前后或异常情况下的偏差
+
+        在同一快照（REPEATABLE READ）中比较源表重算结果与计数表，得到差值；再在新事务中以行级
+        upsert 累加差值。快照之后提交的事件由触发器计入，不在差值中，因此不会漏计或重复计数；
+        全程不锁计数表，不阻塞事件写入。
+        """
+        since = date.today() - timedelta(days=days - 1)
+        started = time.perf_counter()
+        recount = " UNION ALL ".join(
+            counter_select(source, table, where=f"{day_column} >= :since")
+            for source, (table, day_column, _, _) in EVENT_COUNTER_SOURCES.items()
+        )
+        with engine.connect().execution_options(isolation_level="REPEATABLE READ") as conn:
+            with conn.begin():
+                deltas = [dict(row._mapping) for row in conn.execute(text(f"""
+                    SELECT source, day, category, status, SUM(delta) AS delta
+                    FROM (
+                        {recount}
+                        UNION ALL
+                        SELECT source, day, category, status, -count AS delta
+                        FROM event_daily_counter WHERE day >= :since
+                    ) AS changes
+                    GROUP BY source, day, category, status
+                    HAVING SUM(delta) <> 0
+                    ORDER BY source, day, category, status
+                """), {"since": since})]
+
+        if deltas:
+            # 按主键顺序逐行累加，与触发器的加锁顺序一致
+            with engine.begin() as conn:
+                conn.execute(text(
+                    "INSERT INTO event_daily_counter (source, day, category, status, count) "
+                    "VALUES (:source, :day, :category, :status, :delta) "
+                    "ON CONFLICT (source, day, category, status) "
+                    "DO UPDATE SET count = event_daily_counter.count + EXCLUDED.count"
+                ), deltas)
+        self.reconciled_at = datetime.now()
+        logger.info(f"事件计数校准完成（{since} 起，修正 {len(deltas)} 项），耗时 {time.perf_counter() - started:.2f}秒")
+
+    # ---- 查询接口 ----
+
+    def total(self, source: str, day: Optional[date] = None) -> int:
+        """事件总数；指定日期时只统计当天（仅限最近 RECENT_DAYS 天）"""
+        self._ensure_loaded()
+        if day is None:
+            return sum(count for key, count in self._totals.items() if key[0] == source)
+        return sum(count for key, count in self._daily.items() if key[0] == source and key[1] == day)
+
+    def group_by(self, source: str, field: str, day: Optional[date] = None,
+                 skip_empty: bool = False) -> Dict[Optional[str], int]:
+        """按分类(category)或状态(status)分组计数，空分类以 None 作为键"""
+        self._ensure_loaded()
+        if day is None:
+            items = ((key[1], key[2], count) for key, count in self._totals.items() if key[0] == source)
+        else:
+            items = ((key[2], key[3], count) for key, count in self._daily.items()
+                     if key[0] == source and key[1] == day)
+
+        result: Dict[Optional[str], int] = {}
+        for category, status, count in items:
+            value = category if field == "category" else status
+            if not value:
+                if skip_empty:
+                    continue
+                value = None
+            result[value] = result.get(value, 0) + count
+        return {key: count for key, count in result.items() if count}
+
+    def daily_totals(self, source: str, days: Iterable[date]) -> Dict[date, int]:
+        """指定若干天的每日事件数"""
+        self._ensure_loaded()
+        result = {day: 0 for day in days}
+        for (item_source, day, _, _), count in self._daily.items():
+            if item_source == source and day in result:
+                result[day] += count
+        return result
+
+    def crowd_job_stats(self) -> List[Dict[str, Any]]:
+        """各人群分析任务的结果条数、平均人数、最大人数"""
+        self._ensure_loaded()
+        return list(self._crowd_jobs)
+
+
+# 全局事件统计实例
+event_statistics = EventStatistics()
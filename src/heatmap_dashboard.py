@@ -0,0 +1,282 @@
+"""
+热力图展板快照 - 单条关联查询构建展板数据并缓存在内存中
+
+人群分析结果写入时（检测服务进程）通过 PostgreSQL NOTIFY 通知本进程，
+快照标记为过期，下次读取或推送时重建；展板通过 SSE 订阅版本变化。
+"""
+import asyncio
+import logging
+import select
+import threading
+import time
+import uuid
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import and_, text
+from sqlalchemy.orm import Session
+
+from src.database import (
+    SessionLocal, engine, HeatmapMap, HeatmapArea, HeatmapBinding,
+    HeatmapDashboardConfig, CrowdAnalysisJob
+)
+
+logger = logging.getLogger(__name__)
+
+HEATMAP_NOTIFY_CHANNEL = "heatmap_dashboard"
+SNAPSHOT_MAX_AGE_SECONDS = 30  # 未收到通知时的兜底重建间隔
+LISTEN_RETRY_SECONDS = 5
+
+
+def _parse_person_count(value: Optional[str]) -> int:
+    """total_person_count 以文本形式从 JSONB 中取出"""
+    if value is None:
+        return 0
+    try:
+        return int(float(value))
+    except (TypeError, ValueError):
+        return 0
+
+
+def query_map_areas(db: Session, map_id: int) -> List[Dict[str, Any]]:
+    """一次关联查询获取地图下所有区域、生效绑定及其人群分析任务的最新人数"""
+    rows = (
+        db.query(
+            HeatmapArea,
+            HeatmapBinding.data_source_type,
+            HeatmapBinding.data_source_id,
+            HeatmapBinding.data_source_name,
+            CrowdAnalysisJob.last_result["total_person_count"].astext.label("person_count"),
+            CrowdAnalysisJob.last_run,
+        )
+        .outerjoin(
+            HeatmapBinding,
+            and_(HeatmapBinding.area_id == HeatmapArea.id, HeatmapBinding.is_active == True)
+        )
+        .outerjoin(CrowdAnalysisJob, CrowdAnalysisJob.job_id == HeatmapBinding.data_source_id)
+        .filter(HeatmapArea.map_id == map_id, HeatmapArea.is_active == True)
+        .order_by(HeatmapArea.created_at.asc(), HeatmapArea.id.asc(), HeatmapBinding.id.desc())
+        .all()
+    )
+
+    result = []
+    seen = set()
+    for area, source_type, source_id, source_name, person_count, last_run in rows:
+        # 同一区域存在多条生效绑定时只取最新一条
+        if area.id in seen:
+            continue
+        seen.add(area.id)
+        result.append({
+            "id": area.id,
+            "map_id": area.map_id,
+            "name": area.name,
+            "points": area.points,
+            "color": area.color,
+            "area_size": area.area_size,
+            "max_capacity": area.max_capacity,
+            "description": area.description,
+            "data_source_type": source_type,
+            "data_source_id": source_id,
+            "data_source_name": source_name,
+            "current_count": _parse_person_count(person_count),
+            "last_update_time": last_run,
+            "created_at": area.created_at,
+            "updated_at": area.updated_at,
+            "is_active": area.is_active
+        })
+    return result
+
+
+def build_dashboard_data(db: Session) -> Dict[str, Any]:
+    """构建展板数据：配置与地图一次查询，区域与绑定一次查询"""
+    row = (
+        db.query(HeatmapDashboardConfig, HeatmapMap)
+        .outerjoin(
+            HeatmapMap,
+            and_(HeatmapMap.id == HeatmapDashboardConfig.map_id, HeatmapMap.is_active == True)
+        )
+        .filter(HeatmapDashboardConfig.is_active == True)
+        .order_by(HeatmapDashboardConfig.updated_at.desc())
+        .first()
+    )
+    if not row:
+        return {'areas': [], 'map': None}
+
+    config, map_data = row
+    map_dict = None
+    if map_data:
+        map_dict = {
+            "id": map_data.id,
+            "name": map_data.name,
+            "file_path": map_data.file_path,
+            "file_name": map_data.file_name,
+            "file_size": map_data.file_size,
+            "mime_type": map_data.mime_type,
+            "width": map_data.width,
+            "height": map_data.height,
+            "scale_factor": map_data.scale_factor,
+            "description": map_data.description,
+            "image_url": f"/api/v1/heatmap/maps/{map_data.id}/image",
+            "created_at": map_data.created_at,
+            "updated_at": map_data.updated_at,
+            "is_active": map_data.is_active,
+            "created_by": map_data.created_by
+        }
+
+    return {
+        'map': map_dict,
+        'areas': query_map_areas(db, config.map_id)
+    }
+
+
+class HeatmapDashboardSnapshot:
+    """展板数据内存快照，数据变化时版本号递增"""
+
+    def __init__(self, max_age: float = SNAPSHOT_MAX_AGE_SECONDS):
+        self.max_age = max_age
+        self.epoch = uuid.uuid4().hex[:8]  # 进程级标识，避免重启后ETag与旧版本号冲突
+        self.version = 0
+        self._data = None
+        self._bound_jobs: Set[str] = set()
+        self._dirty = True
+        self._built_at = 0.0
+        self._lock = threading.Lock()
+
+        self._listen_thread = None
+        self._listening = False
+
+        self._loop = None
+        self._subscribers: Set[asyncio.Queue] = set()
+
+    @property
+    def etag(self) -> str:
+        return f'"{self.epoch}-{self.version}"'
+
+    def get(self) -> Tuple[int, Dict[str, Any]]:
+        """获取当前快照（已转换为可JSON序列化的结构），过期时重建"""
+        version, data, _ = self.get_with_etag()
+        return version, data
+
+    def get_with_etag(self) -> Tuple[int, Dict[str, Any], str]:
+        """获取当前快照及与之对应的 ETag（在同一把锁内读取，避免与并发重建错配）"""
+        self.start_listening()
+        with self._lock:
+            if self._dirty or self._data is None or time.monotonic() - self._built_at > self.max_age:
+                self._rebuild()
+            return self.version, self._data, self.etag
+
+    def invalidate(self, job_id: Optional[str] = None):
+        """标记快照过期；传入任务ID时仅当该任务绑定在展板区域上才生效"""
+        if job_id is not None and self._data is not None and job_id not in self._bound_jobs:
+            return
+        self._dirty = True
+        self._wake_subscribers()
+
+    def _rebuild(self):
+        # 先清除标记，重建期间到达的通知会再次置位
+        self._dirty = False
+        db = SessionLocal()
+        try:
+            data = jsonable_encoder(build_dashboard_data(db))
+        except Exception:
+            self._dirty = True
+            raise
+        finally:
+            db.close()
+
+        self._built_at = time.monotonic()
+        self._bound_jobs = {
+            area["data_source_id"] for area in data["areas"] if area.get("data_source_id")
+        }
+        if data != self._data:
+            self._data = data
+            self.version += 1
+
+    # ---- 订阅推送 ----
+
+    def subscribe(self) -> asyncio.Queue:
+        """在事件循环中注册订阅者，快照过期时队列收到唤醒信号"""
+        self._loop = asyncio.get_running_loop()
+        queue = asyncio.Queue(maxsize=1)
+        self._subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        self._subscribers.discard(queue)
+
+    def _wake_subscribers(self):
+        if not self._subscribers or self._loop is None:
+            return
+        try:
+            self._loop.call_soon_threadsafe(self._put_wakeups)
+        except RuntimeError:
+            # 事件循环已关闭
+            pass
+
+    def _put_wakeups(self):
+        for queue in list(self._subscribers):
+            if queue.empty():
+                queue.put_nowait(True)
+
+    # ---- PostgreSQL LISTEN ----
+
+    def start_listening(self):
+        """启动 NOTIFY 监听线程（幂等）"""
+        if self._listening:
+            return
+        with self._lock:
+            if self._listening:
+                return
+            self._listening = True
+            self._listen_thread = threading.Thread(
+                target=self._listen_loop, name="heatmap-dashboard-listen", daemon=True
+            )
+            self._listen_thread.start()
+
+    def stop_listening(self):
+        self._listening = False
+
+    def _listen_loop(self):
+        while self._listening:
+            connection = None
+            try:
+                # 独占一条连接，不归还连接池
+                connection = engine.raw_connection()
+                connection.detach()
+                dbapi_connection = connection.dbapi_connection
+                dbapi_connection.autocommit = True
+                with dbapi_connection.cursor() as cursor:
+                    cursor.execute(f"LISTEN {HEATMAP_NOTIFY_CHANNEL}")
+                logger.info(f"已订阅热力图展板更新通知: {HEATMAP_NOTIFY_CHANNEL}")
+
+                # 断线期间可能错过通知
+                self.invalidate()
+
+                while self._listening:
+                    readable, _, _ = select.select([dbapi_connection], [], [], 5)
+                    if not readable:
+                        continue
+                    dbapi_connection.poll()
+                    while dbapi_connection.notifies:
+                        notify = dbapi_connection.notifies.pop(0)
+                        self.invalidate(notify.payload or None)
+
+            except Exception as e:
+                logger.warning(f"热力图展板通知监听异常，{LISTEN_RETRY_SECONDS}秒后重试: {e}")
+                time.sleep(LISTEN_RETRY_SECONDS)
+            finally:
+                if connection is not None:
+                    try:
+                        connection.close()
+                    except Exception:
+                        pass
+
+
+def notify_heatmap_update(db: Session, job_id: str):
+    """在当前事务中发送展板更新通知（事务提交时才会投递）"""
+    db.execute(text("SELECT pg_notify(:channel, :payload)"),
+               {"channel": HEATMAP_NOTIFY_CHANNEL, "payload": job_id})
+
+
+# 全局展板快照实例
+heatmap_snapshot = HeatmapDashboardSnapshot()
@@ -0,0 +1,142 @@
+"""
+事件图片存储 - 写入 JPEG，并在写入时生成缩略图和中等尺寸预览
+
+文件名以 JPEG 内容的 SHA-256 前32位开头，后接每张图片独立的随机后缀。摘要只用作强 ETag；
+随机后缀保证每个事件各有一份文件，删除或过期一个事件不会影响内容相同的其他事件：
+    storage/events/<日期>/<设备>/<digest>-<suffix>.jpg          原图
+    storage/events/<日期>/<设备>/<digest>-<suffix>.thumb.jpg    缩略图（列表页）
+    storage/events/<日期>/<设备>/<digest>-<suffix>.medium.jpg   中等预览（详情页）
+旧的按事件ID命名的图片没有预览文件，读取预览时回退到原图。
+"""
+import hashlib
+import logging
+import os
+import re
+import tempfile
+import uuid
+from pathlib import Path
+from typing import List, Optional
+
+import cv2
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+EVENT_IMAGE_ROOT = Path("storage/events")
+
+# 预览规格: 名称 -> (最大宽度, JPEG质量)
+IMAGE_VARIANTS = {
+    "thumb": (320, 75),
+    "medium": (960, 80),
+}
+VARIANT_PATTERN = "^(thumb|medium)$"
+
+# 外部事件图片可能保存为相对路径，依次在这些目录下查找
+FILE_SEARCH_DIRS = ("storage", "uploads", "images", "data")
+
+_DIGEST_LENGTH = 32
+# 分组: 1=不含预览后缀的文件名, 2=内容摘要, 3=预览名称（无后缀的旧文件名同样识别）
+_DIGEST_NAME = re.compile(r"^(([0-9a-f]{32})(?:-[0-9a-f]{8})?)(?:\.(thumb|medium))?\.jpg$")
+
+
+def _write_atomic(path: Path, data: bytes):
+    """先写临时文件再改名，读者不会看到写了一半的图片"""
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=".tmp-", suffix=".jpg")
+    try:
+        with os.fdopen(fd, "wb") as tmp:
+            tmp.write(data)
+        os.replace(tmp_path, path)
+    except Exception:
+        Path(tmp_path).unlink(missing_ok=True)
+        raise
+
+
+def _encode_jpeg(frame: np.ndarray, quality: int) -> bytes:
+    ok, buffer = cv2.imencode(".jpg", frame, [int(cv2.IMWRITE_JPEG_QUALITY), quality])
+    if not ok:
+        raise ValueError("JPEG 编码失败")
+    return buffer.tobytes()
+
+
+def _resize_to_width(frame: np.ndarray, max_width: int) -> np.ndarray:
+    height, width = frame.shape[:2]
+    if width <= max_width:
+        return frame
+    scale = max_width / width
+    return cv2.resize(frame, (max_width, max(1, int(height * scale))), interpolation=cv2.INTER_AREA)
+
+
+def save_event_image(frame: np.ndarray, device_id: str, timestamp, quality: int = 70) -> str:
+    """保存事件截图及其预览，返回原图路径（写入 thumbnail_path 字段）"""
+    save_dir = EVENT_IMAGE_ROOT / timestamp.strftime('%Y-%m-%d') / str(device_id)
+    save_dir.mkdir(parents=True, exist_ok=True, mode=0o777)
+
+    data = _encode_jpeg(frame, quality)
+    digest = hashlib.sha256(data).hexdigest()[:_DIGEST_LENGTH]
+    stem = f"{digest}-{uuid.uuid4().hex[:8]}"
+    original = save_dir / f"{stem}.jpg"
+    _write_atomic(original, data)
+
+    for variant, (max_width, variant_quality) in IMAGE_VARIANTS.items():
+        preview = _resize_to_width(frame, max_width)
+        _write_atomic(save_dir / f"{stem}.{variant}.jpg", _encode_jpeg(preview, variant_quality))
+
+    return str(original)
+
+
+def variant_path(path: Path, variant: Optional[str]) -> Path:
+    """原图对应的预览文件；没有预览（旧图片或非事件图片）时返回原图"""
+    if not variant:
+        return path
+    match = _DIGEST_NAME.match(path.name)
+    if not match or match.group(3):
+        return path
+    candidate = path.with_name(f"{match.group(1)}.{variant}.jpg")
+    return candidate if candidate.is_file() else path
+
+
+def content_etag(path: Path) -> Optional[str]:
+    """事件图片的强 ETag（取自文件名中的内容摘要），其他文件返回 None"""
+    match = _DIGEST_NAME.match(path.name)
+    if not match:
+        return None
+    variant = match.group(3)
+    return f'"{match.group(2)}-{variant}"' if variant else f'"{match.group(2)}"'
+
+
+def resolve_event_file(file_path: str) -> Optional[Path]:
+    """解析事件文件路径（兼容 Windows 分隔符和相对路径），文件不存在时返回 None"""
+    file_path = file_path.replace("\\", "/")
+    path = Path(file_path)
+    if path.is_file():
+        return path
+    if not path.is_absolute():
+        for base_dir in FILE_SEARCH_DIRS:
+            candidate = Path(base_dir) / file_path
+            if candidate.is_file():
+                return candidate
+    return None
+
+
+def related_files(path: Path) -> List[Path]:
+    """图片及其预览文件"""
+    files = [path]
+    match = _DIGEST_NAME.match(path.name)
+    if match and not match.group(3):
+        files.extend(path.with_name(f"{match.group(1)}.{variant}.jpg") for variant in IMAGE_VARIANTS)
+    return files
+
+
+def remove_event_file(file_path: str) -> int:
+    """删除事件文件（图片连同其预览），返回删除的文件数"""
+    path = resolve_event_file(file_path)
+    if path is None:
+        return 0
+    deleted = 0
+    for related in related_files(path):
+        try:
+            related.unlink()
+            deleted += 1
+        except FileNotFoundError:
+            pass
+    return deleted
@@ -0,0 +1,86 @@
+"""
+检测延迟控制 - 按检测结果延迟的 SLO 动态调整每路摄像机的跳帧数
+
+每次检测记录结果延迟（从帧待检测、通知调度器到检测完成）、调度器排队等待时间和检测耗时（指数平滑），
+每 CONTROL_INTERVAL 秒调整一次跳帧数：延迟超过 SLO 时按比例增大跳帧数（降低检测频率、减少排队），
+延迟明显低于 SLO 时逐步减小跳帧数（结果更新鲜）。
+跳帧只能减少排队，不能缩短单次检测：检测耗时本身已达到 SLO 时不再增大跳帧数，只标记 SLO 无法满足。
+有目标/活跃轨迹的摄像机（ACTIVE_HOLD_SECONDS 内）跳帧下限更低、恢复更快；空闲摄像机保持默认检测频率。
+"""
+import math
+import os
+import threading
+import time
+from typing import Dict, Optional
+
+DETECTION_LATENCY_SLO_MS = float(os.environ.get("DETECTION_LATENCY_SLO_MS", "300"))
+CONTROL_INTERVAL = 2.0  # 调整间隔（秒）
+LATENCY_ALPHA = 0.3  # 帧龄等指标的指数平滑系数
+ACTIVE_HOLD_SECONDS = 10  # 最后一次有目标后仍视为活跃的时间
+MIN_SKIP = 1  # 活跃摄像机的跳帧下限
+IDLE_MIN_SKIP = 5  # 空闲摄像机的跳帧下限（与默认跳帧数相同）
+MAX_SKIP = 25
+INCREASE_FACTOR = 1.5  # 超出 SLO 时跳帧数的放大倍数
+RELAX_RATIO = 0.6  # 延迟低于 SLO 的该比例时减小跳帧数
+
+
+class LatencyController:
+    """单个检测任务的跳帧控制器"""
+
+    def __init__(self, skip: int = 5, slo_ms: float = DETECTION_LATENCY_SLO_MS):
+        self.slo_ms = slo_ms
+        self.skip = skip
+        self.age_ms: Optional[float] = None
+        self.wait_ms: Optional[float] = None
+        self.detect_ms: Optional[float] = None
+        self.active = False
+        self.slo_unattainable = False  # 检测耗时本身已达到 SLO
+        self.last_active = 0.0
+        self.next_adjust = time.monotonic() + CONTROL_INTERVAL
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def _smooth(current: Optional[float], value: float) -> float:
+        return value if current is None else current + LATENCY_ALPHA * (value - current)
+
+    def record(self, age_ms: float, wait_ms: float, detect_ms: float, active: bool) -> Optional[int]:
+        """记录一次检测，到调整时间时返回新的跳帧数（没有变化时返回 None）"""
+        now = time.monotonic()
+        with self.lock:
+            self.age_ms = self._smooth(self.age_ms, age_ms)
+            self.wait_ms = self._smooth(self.wait_ms, wait_ms)
+            self.detect_ms = self._smooth(self.detect_ms, detect_ms)
+            if active:
+                self.last_active = now
+            self.active = now - self.last_active < ACTIVE_HOLD_SECONDS
+            if now < self.next_adjust:
+                return None
+            self.next_adjust = now + CONTROL_INTERVAL
+
+            previous = self.skip
+            floor = MIN_SKIP if self.active else IDLE_MIN_SKIP
+            self.slo_unattainable = self.detect_ms >= self.slo_ms
+            if self.slo_unattainable:
+                # 降低检测频率无法缩短检测耗时，保持当前跳帧数
+                skip = self.skip
+            elif self.age_ms > self.slo_ms:
+                skip = math.ceil(self.skip * INCREASE_FACTOR)
+            elif self.age_ms < self.slo_ms * RELAX_RATIO:
+                skip = self.skip - (2 if self.active else 1)
+            else:
+                skip = self.skip
+            # 空闲摄像机直接回到空闲下限，活跃后立即允许降到活跃下限
+            self.skip = min(max(skip, floor), MAX_SKIP)
+            return self.skip if self.skip != previous else None
+
+    def snapshot(self) -> Dict:
+        with self.lock:
+            return {
+                "slo_ms": self.slo_ms,
+                "skip_frame_count": self.skip,
+                "active": self.active,
+                "slo_unattainable": self.slo_unattainable,
+                "result_latency_ms": round(self.age_ms, 1) if self.age_ms is not None else None,
+                "queue_wait_ms": round(self.wait_ms, 1) if self.wait_ms is not None else None,
+                "detect_ms": round(self.detect_ms, 1) if self.detect_ms is not None else None,
+            }
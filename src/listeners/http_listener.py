@@ -346,7 +346,7 @@ class HTTPListener(BaseListener):
             enhanced_data = self._enhance_message_data(data)
             
             # 标准化数据格式
-            event = self.normalize_data(enhanced_data)
+            event = await self.normalize_event(enhanced_data)
             
             # 触发事件处理
             await self.emit_event(event)
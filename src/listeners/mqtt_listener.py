@@ -1,9 +1,10 @@
 import asyncio
+import base64
 import json
 import logging
 import queue
 import threading
-from typing import Dict, Any, List
+from typing import Dict, Any, List, NamedTuple, Optional
 from datetime import datetime
 import uuid
 
@@ -14,11 +15,35 @@ except ImportError:
     MQTT_AVAILABLE = False
     mqtt = None
 
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+    orjson = None
+
 from src.data_listener_manager import BaseListener, UnifiedEvent
 from src.database import ListenerType, ExternalEventType
 
 logger = logging.getLogger(__name__)
 
+
+class RawMQTTMessage(NamedTuple):
+    """回调线程中只保留原始字节，解析延后到事件循环中进行"""
+    topic: str
+    payload: bytes
+    qos: int
+    retain: bool
+    received_at: datetime
+
+
+def _loads_json(payload: bytes):
+    """解析JSON负载（优先使用 orjson）"""
+    if ORJSON_AVAILABLE:
+        return orjson.loads(payload)
+    return json.loads(payload)
+
+
 class MQTTListener(BaseListener):
     """MQTT监听器实现"""
     
@@ -53,11 +78,18 @@ class MQTTListener(BaseListener):
         self.certfile = self.connection_config.get('certfile')
         self.keyfile = self.connection_config.get('keyfile')
         
-        # 消息队列（用于异步处理）
-        self.message_queue = None
+        # 接入配置
+        self.queue_size = self.connection_config.get('queue_size', 10000)
+        self.drain_batch_size = self.connection_config.get('drain_batch_size', 200)
+        # 非JSON消息的原始负载保留方式: none / base64 / hex
+        self.raw_payload_mode = self.connection_config.get('raw_payload_mode', 'none')
+        
         self.loop = None
-        # 线程安全的消息缓冲队列
-        self.thread_safe_queue = queue.Queue(maxsize=1000)
+        # 线程安全的消息缓冲队列，回调线程写入，事件循环批量取出
+        self.thread_safe_queue = queue.Queue(maxsize=self.queue_size)
+        self._wakeup = None
+        self._wakeup_scheduled = False
+        self.dropped_messages = 0
     
     async def connect(self) -> bool:
         """建立MQTT连接"""
@@ -123,47 +155,54 @@ class MQTTListener(BaseListener):
                 self.client = None
                 logger.info("MQTT连接已断开")
             
-            # 清理队列和循环引用
-            self.message_queue = None
+            # 清理循环引用
             self.loop = None
+            self._wakeup = None
         except Exception as e:
             logger.error(f"断开MQTT连接失败: {e}")
     
     async def listen(self):
         """开始监听MQTT消息"""
-        # 初始化队列和事件循环引用
+        # 初始化事件循环引用和唤醒事件
         self.loop = asyncio.get_running_loop()
-        self.message_queue = asyncio.Queue()
+        self._wakeup = asyncio.Event()
         
         # 订阅主题
         await self._subscribe_topics()
         
-        # 处理消息队列
+        # 批量处理消息队列
         while self.running:
             try:
-                # 首先检查线程安全队列
-                try:
-                    message_data = self.thread_safe_queue.get_nowait()
-                    await self._process_message(message_data)
+                batch = self._drain_queue()
+                if not batch:
+                    # 队列为空时等待回调线程唤醒，超时兜底检查停止标志
+                    self._wakeup_scheduled = False
+                    self._wakeup.clear()
+                    if self.thread_safe_queue.empty():
+                        try:
+                            await asyncio.wait_for(self._wakeup.wait(), timeout=0.5)
+                        except asyncio.TimeoutError:
+                            pass
                     continue
-                except queue.Empty:
-                    pass
                 
-                # 然后检查异步队列
-                try:
-                    message_data = await asyncio.wait_for(
-                        self.message_queue.get(), 
-                        timeout=0.1
-                    )
-                    await self._process_message(message_data)
-                except asyncio.TimeoutError:
-                    # 短暂睡眠以避免忙等待
-                    await asyncio.sleep(0.01)
+                for message in batch:
+                    await self._process_message(message)
                     
             except Exception as e:
                 logger.error(f"处理MQTT消息失败: {e}")
                 await asyncio.sleep(0.1)
     
+    def _drain_queue(self) -> List[RawMQTTMessage]:
+        """从线程安全队列中一次取出一批消息"""
+        batch = []
+        get_nowait = self.thread_safe_queue.get_nowait
+        try:
+            while len(batch) < self.drain_batch_size:
+                batch.append(get_nowait())
+        except queue.Empty:
+            pass
+        return batch
+    
     async def _subscribe_topics(self):
         """订阅MQTT主题"""
         if not self.connected or not self.client:
@@ -197,45 +236,25 @@ class MQTTListener(BaseListener):
             logger.info("MQTT正常断开连接")
     
     def _on_message(self, client, userdata, msg):
-        """MQTT消息回调"""
+        """MQTT消息回调（仅入队原始字节，不做解码和解析）"""
         try:
-            # 解码消息负载
-            payload = msg.payload.decode('utf-8', errors='ignore')
-            
-            # 构造消息数据
-            message_data = {
-                'topic': msg.topic,
-                'payload': payload,
-                'qos': msg.qos,
-                'retain': msg.retain,
-                'timestamp': datetime.now().isoformat(),
-                'raw_payload': msg.payload.hex() if isinstance(msg.payload, bytes) else None
-            }
-            
-            # 尝试解析JSON负载
-            try:
-                json_payload = json.loads(payload)
-                message_data['json_payload'] = json_payload
-            except json.JSONDecodeError:
-                # 不是JSON格式，保持原始字符串
-                pass
-            
-            # 使用线程安全队列作为主要方式
+            message = RawMQTTMessage(msg.topic, msg.payload, msg.qos, msg.retain, datetime.now())
             try:
-                self.thread_safe_queue.put_nowait(message_data)
+                self.thread_safe_queue.put_nowait(message)
             except queue.Full:
-                logger.warning("线程安全队列已满，丢弃消息")
-                # 如果线程安全队列满了，尝试使用异步队列
-                if self.loop and self.message_queue:
-                    try:
-                        asyncio.run_coroutine_threadsafe(
-                            self.message_queue.put(message_data),
-                            self.loop
-                        )
-                    except RuntimeError as e:
-                        logger.warning(f"无法将消息放入异步队列: {e}")
-                else:
-                    logger.warning("消息队列或事件循环未初始化，消息丢失")
+                self.dropped_messages += 1
+                if self.dropped_messages % 1000 == 1:
+                    logger.warning(f"MQTT消息队列已满，累计丢弃 {self.dropped_messages} 条消息")
+                return
+            
+            # 仅在消费端空闲时唤醒一次，避免每条消息都跨线程调度
+            if not self._wakeup_scheduled and self.loop and self._wakeup:
+                self._wakeup_scheduled = True
+                try:
+                    self.loop.call_soon_threadsafe(self._wakeup.set)
+                except RuntimeError:
+                    # 事件循环已关闭
+                    pass
             
         except Exception as e:
             logger.error(f"处理MQTT消息回调失败: {e}")
@@ -249,14 +268,14 @@ class MQTTListener(BaseListener):
         if level <= mqtt.MQTT_LOG_WARNING:
             logger.debug(f"MQTT: {buf}")
     
-    async def _process_message(self, message_data: Dict[str, Any]):
+    async def _process_message(self, message: RawMQTTMessage):
         """处理MQTT消息"""
         try:
-            # 增强消息数据
-            enhanced_data = self._enhance_message_data(message_data)
+            # 解析并增强消息数据
+            enhanced_data = self._enhance_message_data(message)
             
             # 标准化数据格式
-            event = self.normalize_data(enhanced_data)
+            event = await self.normalize_event(enhanced_data)
 
             if event and event.event_type != ExternalEventType.heartbeat:
                 # 触发事件处理
@@ -265,30 +284,56 @@ class MQTTListener(BaseListener):
         except Exception as e:
             logger.error(f"处理MQTT消息失败: {e}")
     
-    def _enhance_message_data(self, message_data: Dict[str, Any]) -> Dict[str, Any]:
-        """增强消息数据，添加更多上下文信息"""
-        enhanced = message_data.copy()
-
-        # 如果有JSON负载，将其作为主要数据
-        if 'json_payload' in message_data:
-            enhanced = message_data['json_payload']
+    def _enhance_message_data(self, message: RawMQTTMessage) -> Dict[str, Any]:
+        """解析负载并添加MQTT上下文信息"""
+        json_payload = None
+        try:
+            json_payload = _loads_json(message.payload)
+        except ValueError:
+            # 不是JSON格式，保持原始字符串
+            pass
+        
+        if isinstance(json_payload, dict):
+            # JSON负载是新解析出的对象，直接在其上追加字段，无需复制
+            enhanced = json_payload
+        else:
+            enhanced = {
+                'topic': message.topic,
+                'payload': message.payload.decode('utf-8', errors='ignore'),
+                'qos': message.qos,
+                'retain': message.retain,
+                'timestamp': message.received_at.isoformat()
+            }
+            raw_payload = self._encode_raw_payload(message.payload)
+            if raw_payload is not None:
+                enhanced['raw_payload'] = raw_payload
+            if json_payload is not None:
+                enhanced['json_payload'] = json_payload
         
         # 添加MQTT特定信息
-        enhanced['mqtt_topic'] = message_data['topic']
-        enhanced['mqtt_qos'] = message_data['qos']
-        enhanced['mqtt_retain'] = message_data['retain']
+        enhanced['mqtt_topic'] = message.topic
+        enhanced['mqtt_qos'] = message.qos
+        enhanced['mqtt_retain'] = message.retain
         
         # 从主题提取设备信息（如果遵循约定格式）
-        topic_parts = message_data['topic'].split('/')
+        topic_parts = message.topic.split('/')
         if len(topic_parts) >= 2:
             enhanced['device_from_topic'] = topic_parts[1]  # 假设格式为 /device_id/...
         
         # 添加消息类型推断
         if 'type' not in enhanced:
-            enhanced['type'] = self._infer_message_type(message_data['topic'], enhanced)
+            enhanced['type'] = self._infer_message_type(message.topic, enhanced)
         
         return enhanced
     
+    def _encode_raw_payload(self, payload: bytes) -> Optional[str]:
+        """按配置保留原始负载"""
+        if self.raw_payload_mode == 'base64':
+            return base64.b64encode(payload).decode('ascii')
+        if self.raw_payload_mode == 'hex':
+            return payload.hex()
+        return None
+    
     def _infer_message_type(self, topic: str, data: Dict) -> str:
         """根据主题和数据推断消息类型"""
         topic_lower = topic.lower()
@@ -0,0 +1,227 @@
+"""TCP 字节流增量分帧器
+
+各分帧器在多次 feed() 之间保留扫描状态，每个字节只扫描一次，
+完整消息以 bytes 返回，已消费的前缀在每次 feed() 结束时统一丢弃。
+"""
+import re
+from typing import List
+
+DEFAULT_MAX_MESSAGE_SIZE = 16 * 1024 * 1024  # 16MB
+
+# 对象外只关心花括号和引号；字符串内只关心引号和反斜杠
+_STRUCT_PATTERN = re.compile(rb'[{}"]')
+_STRING_PATTERN = re.compile(rb'["\\]')
+_OPEN_BRACE = ord('{')
+_CLOSE_BRACE = ord('}')
+_QUOTE = ord('"')
+
+
+class FrameTooLargeError(ValueError):
+    """单条消息超过最大长度限制"""
+
+
+class BaseFramer:
+    """分帧器基类"""
+
+    def __init__(self, max_message_size: int = DEFAULT_MAX_MESSAGE_SIZE):
+        self.max_message_size = max_message_size
+        self._buffer = bytearray()
+
+    @property
+    def buffered_bytes(self) -> int:
+        return len(self._buffer)
+
+    def feed(self, data: bytes) -> List[bytes]:
+        """追加新数据并返回其中已完整的消息，超长时清空缓冲并抛出 FrameTooLargeError"""
+        try:
+            return self._feed(data)
+        except FrameTooLargeError:
+            self.reset()
+            raise
+
+    def _feed(self, data: bytes) -> List[bytes]:
+        raise NotImplementedError
+
+    def reset(self):
+        self._buffer.clear()
+
+    def _check_size(self, size: int):
+        if self.max_message_size and size > self.max_message_size:
+            raise FrameTooLargeError(f"消息长度 {size} 超过上限 {self.max_message_size}")
+
+
+class JsonStreamFramer(BaseFramer):
+    """按花括号配对切分连续 JSON 对象（适用于 UTF-8/GBK/ASCII 等 ASCII 兼容编码）"""
+
+    def __init__(self, max_message_size: int = DEFAULT_MAX_MESSAGE_SIZE):
+        super().__init__(max_message_size)
+        self._pos = 0          # 下一个待扫描字节
+        self._start = -1       # 当前对象起始位置，-1 表示尚未进入对象
+        self._depth = 0
+        self._in_string = False
+
+    def reset(self):
+        super().reset()
+        self._pos = 0
+        self._start = -1
+        self._depth = 0
+        self._in_string = False
+
+    def _feed(self, data: bytes) -> List[bytes]:
+        buf = self._buffer
+        buf += data
+        messages = []
+        pos = self._pos
+        end = len(buf)
+
+        with memoryview(buf) as view:
+            while pos < end:
+                if self._in_string:
+                    match = _STRING_PATTERN.search(buf, pos)
+                    if match is None:
+                        pos = end
+                        break
+                    pos = match.start()
+                    if buf[pos] == _QUOTE:
+                        self._in_string = False
+                        pos += 1
+                    elif pos + 1 < end:
+                        pos += 2  # 跳过被转义的字符
+                    else:
+                        break  # 反斜杠位于末尾，等待下一段数据
+                    continue
+
+                match = _STRUCT_PATTERN.search(buf, pos)
+                if match is None:
+                    pos = end
+                    break
+                pos = match.start()
+                char = buf[pos]
+
+                if self._start < 0:
+                    # 对象之外的字节（空白、分隔符、垃圾数据）直接跳过
+                    if char == _OPEN_BRACE:
+                        self._start = pos
+                        self._depth = 1
+                elif char == _QUOTE:
+                    self._in_string = True
+                elif char == _OPEN_BRACE:
+                    self._depth += 1
+                elif char == _CLOSE_BRACE:
+                    self._depth -= 1
+                    if self._depth == 0:
+                        self._check_size(pos + 1 - self._start)
+                        messages.append(bytes(view[self._start:pos + 1]))
+                        self._start = -1
+                pos += 1
+
+        if self._start >= 0:
+            self._check_size(end - self._start)
+            consumed = self._start
+            self._start = 0
+        else:
+            consumed = pos
+        if consumed:
+            del buf[:consumed]
+        self._pos = pos - consumed
+        return messages
+
+
+class DelimiterFramer(BaseFramer):
+    """按分隔符切分消息"""
+
+    def __init__(self, delimiter: bytes = b'\n', max_message_size: int = DEFAULT_MAX_MESSAGE_SIZE):
+        super().__init__(max_message_size)
+        if not delimiter:
+            raise ValueError("分隔符不能为空")
+        self.delimiter = delimiter
+        self._search_from = 0
+
+    def reset(self):
+        super().reset()
+        self._search_from = 0
+
+    def _feed(self, data: bytes) -> List[bytes]:
+        buf = self._buffer
+        buf += data
+        messages = []
+        start = 0
+        width = len(self.delimiter)
+
+        with memoryview(buf) as view:
+            while True:
+                index = buf.find(self.delimiter, max(start, self._search_from))
+                if index < 0:
+                    break
+                self._check_size(index - start)
+                messages.append(bytes(view[start:index]))
+                start = index + width
+
+        if start:
+            del buf[:start]
+        self._check_size(len(buf))
+        # 分隔符可能跨两次读取，回退 width-1 个字节重新查找
+        self._search_from = max(len(buf) - width + 1, 0)
+        return messages
+
+
+class LengthPrefixedFramer(BaseFramer):
+    """定长头部 + 消息体 的长度前缀分帧"""
+
+    def __init__(self, header_size: int = 4, byteorder: str = 'big',
+                 max_message_size: int = DEFAULT_MAX_MESSAGE_SIZE):
+        super().__init__(max_message_size)
+        if header_size not in (1, 2, 4, 8):
+            raise ValueError(f"不支持的长度头字节数: {header_size}")
+        if byteorder not in ('big', 'little'):
+            raise ValueError(f"不支持的字节序: {byteorder}")
+        self.header_size = header_size
+        self.byteorder = byteorder
+        self._expected = -1  # 当前消息体长度，-1 表示尚未读到头部
+
+    def reset(self):
+        super().reset()
+        self._expected = -1
+
+    def _feed(self, data: bytes) -> List[bytes]:
+        buf = self._buffer
+        buf += data
+        messages = []
+        offset = 0
+        end = len(buf)
+
+        with memoryview(buf) as view:
+            while True:
+                if self._expected < 0:
+                    if end - offset < self.header_size:
+                        break
+                    self._expected = int.from_bytes(view[offset:offset + self.header_size], self.byteorder)
+                    offset += self.header_size
+                    self._check_size(self._expected)
+                if end - offset < self._expected:
+                    break
+                messages.append(bytes(view[offset:offset + self._expected]))
+                offset += self._expected
+                self._expected = -1
+
+        if offset:
+            del buf[:offset]
+        return messages
+
+
+def create_framer(data_format: str, connection_config: dict) -> BaseFramer:
+    """根据监听器连接配置创建分帧器，binary 模式不分帧返回 None"""
+    max_size = int(connection_config.get('max_message_size', DEFAULT_MAX_MESSAGE_SIZE))
+    if data_format == 'json':
+        return JsonStreamFramer(max_size)
+    if data_format == 'line':
+        encoding = connection_config.get('encoding', 'utf-8')
+        delimiter = connection_config.get('delimiter', '\n')
+        return DelimiterFramer(delimiter.encode(encoding), max_size)
+    if data_format == 'length_prefixed':
+        return LengthPrefixedFramer(
+            header_size=int(connection_config.get('length_header_size', 4)),
+            byteorder=connection_config.get('length_byteorder', 'big'),
+            max_message_size=max_size,
+        )
+    return None
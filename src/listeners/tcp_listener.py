@@ -6,6 +6,7 @@ from typing import Dict, Any
 from datetime import datetime
 
 from src.data_listener_manager import BaseListener, UnifiedEvent
+from src.listeners.stream_framer import create_framer, FrameTooLargeError, DEFAULT_MAX_MESSAGE_SIZE
 from src.database import ListenerType, ExternalEventType
 
 logger = logging.getLogger(__name__)
@@ -31,8 +32,9 @@ class TCPListener(BaseListener):
         self.reconnect_interval = self.connection_config.get('reconnect_interval', 5)
         
         # 数据解析配置
-        self.data_format = self.connection_config.get('data_format', 'json')  # json, line, binary
+        self.data_format = self.connection_config.get('data_format', 'json')  # json, line, length_prefixed, binary
         self.delimiter = self.connection_config.get('delimiter', '\n')
+        self.max_message_size = self.connection_config.get('max_message_size', DEFAULT_MAX_MESSAGE_SIZE)
     
     async def connect(self) -> bool:
         """建立TCP连接"""
@@ -189,8 +191,8 @@ class TCPListener(BaseListener):
             logger.info(f"客户端断开连接: {client_addr}")
     
     async def _handle_client_data(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
-        """处理客户端数据"""
-        buffer = b''
+        """处理客户端数据（每个连接独立的增量分帧器）"""
+        framer = create_framer(self.data_format, self.connection_config)
         
         while self.running and not self.stop_event.is_set():
             try:
@@ -200,103 +202,49 @@ class TCPListener(BaseListener):
                     logger.info("连接已关闭，无更多数据")
                     break
                 
-                buffer += data
-                
-                # 根据数据格式解析
-                if self.data_format == 'json':
-                    messages = await self._parse_json_messages(buffer)
-                    for message in messages:
-                        buffer = buffer[len(message['raw_bytes']):]
-                        await self._process_message(message['data'])
-                
-                elif self.data_format == 'line':
-                    messages = await self._parse_line_messages(buffer)
-                    for message in messages:
-                        buffer = buffer[len(message['raw_bytes']):]
-                        await self._process_message(message['data'])
-                
-                elif self.data_format == 'binary':
+                if framer is None:
                     # 二进制数据处理
-                    await self._process_binary_data(buffer)
-                    buffer = b''
+                    await self._process_binary_data(data)
+                    continue
+                
+                for frame in framer.feed(data):
+                    message = self._decode_frame(frame)
+                    if message is not None:
+                        await self._process_message(message)
                 
             except asyncio.TimeoutError:
                 # 读取超时，继续循环检查停止标志
                 continue
+            except FrameTooLargeError as e:
+                logger.warning(f"TCP消息超过长度限制，断开连接: {e}")
+                break
             except Exception as e:
                 logger.error(f"处理数据失败: {e}")
                 break
     
-    async def _parse_json_messages(self, buffer: bytes) -> list:
-        """解析JSON消息"""
-        messages = []
-        text = buffer.decode(self.encoding, errors='ignore')
-        
-        # 尝试解析JSON对象
-        start = 0
-        brace_count = 0
-        in_string = False
-        escape_next = False
-        
-        for i, char in enumerate(text):
-            if escape_next:
-                escape_next = False
-                continue
-                
-            if char == '\\':
-                escape_next = True
-                continue
-                
-            if char == '"' and not escape_next:
-                in_string = not in_string
-                continue
-                
-            if not in_string:
-                if char == '{':
-                    brace_count += 1
-                elif char == '}':
-                    brace_count -= 1
-                    if brace_count == 0:
-                        # 找到完整的JSON对象
-                        json_str = text[start:i+1]
-                        try:
-                            data = json.loads(json_str)
-                            raw_bytes = json_str.encode(self.encoding)
-                            messages.append({
-                                'data': data,
-                                'raw_bytes': raw_bytes
-                            })
-                            start = i + 1
-                        except json.JSONDecodeError:
-                            # JSON解析失败，跳过
-                            start = i + 1
-                        brace_count = 0
-        
-        return messages
-    
-    async def _parse_line_messages(self, buffer: bytes) -> list:
-        """解析行分隔消息"""
-        messages = []
-        text = buffer.decode(self.encoding, errors='ignore')
-        lines = text.split(self.delimiter)
-        
-        # 最后一行可能不完整，保留在缓冲区
-        for line in lines[:-1]:
-            if line.strip():
-                try:
-                    # 尝试JSON解析
-                    data = json.loads(line)
-                except json.JSONDecodeError:
-                    # 如果不是JSON，作为文本处理
-                    data = {"message": line.strip(), "timestamp": datetime.now().isoformat()}
-                
-                raw_bytes = (line + self.delimiter).encode(self.encoding)
-                messages.append({
-                    'data': data,
-                    'raw_bytes': raw_bytes
-                })
+    def _decode_frame(self, frame: bytes):
+        """将完整的一帧解码为消息字典"""
+        if self.data_format == 'line':
+            line = frame.decode(self.encoding, errors='ignore')
+            if not line.strip():
+                return None
+            try:
+                # 尝试JSON解析
+                return json.loads(line)
+            except json.JSONDecodeError:
+                # 如果不是JSON，作为文本处理
+                return {"message": line.strip(), "timestamp": datetime.now().isoformat()}
         
-        return messages
+        try:
+            data = json.loads(frame.decode(self.encoding, errors='ignore'))
+        except json.JSONDecodeError:
+            # JSON解析失败，跳过
+            logger.warning(f"丢弃无法解析的JSON消息，长度: {len(frame)}")
+            return None
+        if not isinstance(data, dict):
+            logger.warning(f"丢弃非对象类型的JSON消息: {type(data).__name__}")
+            return None
+        return data
     
     async def _process_binary_data(self, data: bytes):
         """处理二进制数据"""
@@ -314,7 +262,7 @@ class TCPListener(BaseListener):
         """处理解析后的消息"""
         try:
             # 标准化数据格式
-            event = self.normalize_data(data)
+            event = await self.normalize_event(data)
             
             if event and event.event_type != ExternalEventType.heartbeat:
                 # 触发事件处理
@@ -0,0 +1,351 @@
+"""
+模型注册表 - 进程内共享的 YOLO 模型实例
+
+同一权重文件（按 路径+任务类型+设备 区分）在进程内只加载一次，置信度/IoU 等参数在每次推理时传入。
+加载后按参数和缓冲区的实际字节数记录占用（权重只计一次），并用一张空白图预热；超出内存预算时按 LRU 淘汰
+没有被引用的模型，正在使用（引用计数 > 0）的模型不会被淘汰。
+ultralytics 的 predictor 不是线程安全的：每个模型维护一个 predictor 池，池中的 YOLO 实例共享同一份
+权重（model.model），各自持有 predictor，最多 MODEL_PREDICTORS 个推理并行执行。
+非 PyTorch 权重（ONNX/TensorRT 等）每个 predictor 会各自加载一份，只保留一个 predictor。
+"""
+import copy
+import gc
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+import torch
+
+logger = logging.getLogger(__name__)
+
+MODEL_REGISTRY_MAX_MB = int(os.environ.get("MODEL_REGISTRY_MAX_MB", "4096"))
+MODEL_PREDICTORS = int(os.environ.get("MODEL_PREDICTORS", str(min(4, os.cpu_count() or 1))))  # 每个模型的并行推理数
+WARMUP_SIZE = 640
+
+ModelKey = Tuple[str, str, str]  # (绝对路径, 任务类型, 设备)
+
+
+def resolve_model_path(model_path: str) -> str:
+    """返回模型文件的绝对路径，找不到时在 models 目录下按文件名查找"""
+    abs_model_path = os.path.abspath(model_path)
+    if os.path.exists(abs_model_path):
+        return abs_model_path
+    alt_abs_path = os.path.abspath(os.path.join("models", os.path.basename(model_path)))
+    if os.path.exists(alt_abs_path):
+        return alt_abs_path
+    raise FileNotFoundError(f"模型文件不存在: {os.path.basename(model_path)}")
+
+
+def _measure_bytes(model, model_path: str) -> int:
+    """模型参数和缓冲区的实际字节数；非 PyTorch 模型（如 ONNX）按文件大小估算"""
+    module = getattr(model, "model", None)
+    if isinstance(module, torch.nn.Module):
+        tensors = list(module.parameters()) + list(module.buffers())
+        return sum(t.numel() * t.element_size() for t in tensors)
+    return os.path.getsize(model_path)
+
+
+class _ModelEntry:
+    def __init__(self, key: ModelKey):
+        self.key = key
+        self.model = None
+        self.names = None
+        self.size_bytes = 0
+        self.refcount = 0
+        self.load_time = None
+        self.last_used = time.time()
+        self.error: Optional[BaseException] = None
+        self.loaded = threading.Event()
+        self.retired = False  # 已从注册表移除（重新加载），最后一个引用释放时丢弃
+        # predictor 池：空闲的 YOLO 实例（共享权重），已创建数量和上限
+        self.pool_condition = threading.Condition()
+        self.idle_predictors = []
+        self.predictor_count = 0
+        self.max_predictors = 1
+        self.busy = 0
+        self.exclusive = False  # 导出等修改模型的操作独占期间不分配 predictor
+
+    def load(self):
+        from ultralytics import YOLO
+
+        path, task, device = self.key
+        # 设置离线模式，避免连接GitHub
+        os.environ["ULTRALYTICS_OFFLINE"] = "1"
+        os.environ["YOLO_NO_ANALYTICS"] = "1"
+        os.environ["NO_VERSION_CHECK"] = "1"
+        os.environ["YOLO_VERBOSE"] = "0"
+
+        started = time.perf_counter()
+        model = YOLO(path, task=task)
+        if path.endswith(".pt"):
+            model.to(torch.device(device))
+            if device == "cuda" and hasattr(model, "model") and hasattr(model.model, "dtype"):
+                # 使用半精度浮点数以提高性能
+                model.model.half()
+
+        # 预热：初始化 predictor 和 CUDA 内核，避免第一帧的延迟
+        try:
+            model(np.zeros((WARMUP_SIZE, WARMUP_SIZE, 3), dtype=np.uint8), device=device, verbose=False)
+        except Exception as e:
+            logger.warning(f"模型预热失败: {os.path.basename(path)}, {e}")
+
+        self.model = model
+        self.names = model.names
+        self.size_bytes = _measure_bytes(model, path)
+        self.idle_predictors = [model]
+        self.predictor_count = 1
+        # 只有 PyTorch 权重能在多个 predictor 间共享
+        self.max_predictors = max(1, MODEL_PREDICTORS) if path.endswith(".pt") else 1
+        self.load_time = time.perf_counter() - started
+        logger.info(f"模型已加载: {os.path.basename(path)} ({task}, {device}), "
+                    f"占用 {self.size_bytes / 1024 / 1024:.1f}MB, 耗时 {self.load_time:.2f}秒")
+
+    def _new_predictor(self):
+        """创建共享权重的 YOLO 实例：浅拷贝共享 model.model，清空 predictor 后首次推理时各自创建"""
+        clone = copy.copy(self.model)
+        clone.predictor = None
+        try:
+            # 在分配给调用方前完成 predictor 初始化，避免与其他推理并发执行初始化
+            clone(np.zeros((WARMUP_SIZE, WARMUP_SIZE, 3), dtype=np.uint8), device=self.key[2], verbose=False)
+        except Exception as e:
+            logger.warning(f"predictor 预热失败: {os.path.basename(self.key[0])}, {e}")
+        return clone
+
+    def checkout(self):
+        """取出一个空闲 predictor，没有空闲且未达上限时新建，否则等待"""
+        with self.pool_condition:
+            while True:
+                if self.model is None:
+                    raise RuntimeError(f"模型已释放: {os.path.basename(self.key[0])}")
+                if not self.exclusive:
+                    if self.idle_predictors:
+                        self.busy += 1
+                        return self.idle_predictors.pop()
+                    if self.predictor_count < self.max_predictors:
+                        self.predictor_count += 1
+                        self.busy += 1
+                        break
+                self.pool_condition.wait()
+        try:
+            return self._new_predictor()
+        except BaseException:
+            with self.pool_condition:
+                self.predictor_count -= 1
+                self.busy -= 1
+                self.pool_condition.notify_all()
+            raise
+
+    def checkin(self, predictor):
+        with self.pool_condition:
+            self.idle_predictors.append(predictor)
+            self.busy -= 1
+            self.pool_condition.notify_all()
+
+    @contextmanager
+    def exclusive_access(self):
+        """等待所有推理结束并暂停分配 predictor（用于导出等会修改共享权重的操作）"""
+        with self.pool_condition:
+            while self.exclusive:
+                self.pool_condition.wait()
+            self.exclusive = True
+            while self.busy:
+                self.pool_condition.wait()
+        try:
+            yield
+        finally:
+            with self.pool_condition:
+                self.exclusive = False
+                self.pool_condition.notify_all()
+
+
+class ModelHandle:
+    """模型引用：调用方式与 YOLO 实例相同，用完后调用 release()"""
+
+    def __init__(self, registry: "ModelRegistry", entry: _ModelEntry):
+        self._registry = registry
+        self._entry = entry
+        self._released = False
+
+    @property
+    def names(self):
+        return self._entry.names
+
+    @property
+    def device(self) -> str:
+        return self._entry.key[2]
+
+    @property
+    def model_path(self) -> str:
+        return self._entry.key[0]
+
+    def __call__(self, source, **kwargs):
+        entry = self._entry
+        kwargs.setdefault("device", entry.key[2])
+        kwargs.setdefault("verbose", False)
+        entry.last_used = time.time()
+        predictor = entry.checkout()
+        try:
+            return predictor(source, **kwargs)
+        finally:
+            entry.checkin(predictor)
+
+    def export(self, **kwargs):
+        with self._entry.exclusive_access():
+            return self._entry.model.export(**kwargs)
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            self._registry._release(self._entry)
+
+
+class ModelRegistry:
+    """进程内模型注册表"""
+
+    def __init__(self, max_bytes: int = MODEL_REGISTRY_MAX_MB * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.entries: "OrderedDict[ModelKey, _ModelEntry]" = OrderedDict()
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def _device(use_gpu: bool) -> str:
+        return "cuda" if use_gpu and torch.cuda.is_available() else "cpu"
+
+    def acquire(self, model_path: str, task: str = "detect", use_gpu: bool = False) -> ModelHandle:
+        """获取模型引用，模型未加载时加载（并发请求同一模型只加载一次）"""
+        key = (resolve_model_path(model_path), task or "detect", self._device(use_gpu))
+        with self.lock:
+            entry = self.entries.get(key)
+            loader = entry is None
+            if loader:
+                entry = _ModelEntry(key)
+                self.entries[key] = entry
+            entry.refcount += 1
+            self.entries.move_to_end(key)
+
+        if loader:
+            try:
+                entry.load()
+            except BaseException as e:
+                entry.error = e
+                with self.lock:
+                    if self.entries.get(key) is entry:
+                        del self.entries[key]
+                raise
+            finally:
+                entry.loaded.set()
+            self._evict()
+        else:
+            entry.loaded.wait()
+            if entry.error is not None:
+                raise entry.error
+
+        entry.last_used = time.time()
+        return ModelHandle(self, entry)
+
+    @contextmanager
+    def use(self, model_path: str, task: str = "detect", use_gpu: bool = False):
+        handle = self.acquire(model_path, task, use_gpu)
+        try:
+            yield handle
+        finally:
+            handle.release()
+
+    def _release(self, entry: _ModelEntry):
+        with self.lock:
+            entry.refcount -= 1
+            entry.last_used = time.time()
+            drop = entry.retired and entry.refcount <= 0
+        if drop:
+            self._free([entry])
+        else:
+            self._evict()
+
+    def _evict(self):
+        """超出内存预算时淘汰最久未使用且没有引用的模型"""
+        evicted = []
+        with self.lock:
+            total = sum(entry.size_bytes for entry in self.entries.values())
+            for key, entry in list(self.entries.items()):
+                if total <= self.max_bytes:
+                    break
+                if entry.refcount > 0 or not entry.loaded.is_set():
+                    continue
+                del self.entries[key]
+                total -= entry.size_bytes
+                evicted.append(entry)
+        if evicted:
+            logger.info(f"模型注册表超出内存预算，已淘汰: {', '.join(os.path.basename(e.key[0]) for e in evicted)}")
+            self._free(evicted)
+
+    def evict_idle(self, max_idle_seconds: float) -> int:
+        """移除超过指定时间未使用且没有引用的模型"""
+        now = time.time()
+        with self.lock:
+            idle = [key for key, entry in self.entries.items()
+                    if entry.refcount <= 0 and entry.loaded.is_set() and now - entry.last_used > max_idle_seconds]
+            entries = [self.entries.pop(key) for key in idle]
+        self._free(entries)
+        return len(entries)
+
+    def clear(self) -> int:
+        """移除所有没有引用的模型"""
+        return self.evict_idle(-1)
+
+    def invalidate(self, model_path: str) -> int:
+        """模型文件更新后调用：之后的 acquire 重新加载，正在使用的旧实例在释放后丢弃"""
+        try:
+            path = resolve_model_path(model_path)
+        except FileNotFoundError:
+            path = os.path.abspath(model_path)
+        freed = []
+        with self.lock:
+            keys = [key for key in self.entries if key[0] == path]
+            for key in keys:
+                entry = self.entries.pop(key)
+                entry.retired = True
+                if entry.refcount <= 0:
+                    freed.append(entry)
+        self._free(freed)
+        return len(keys)
+
+    def _free(self, entries):
+        if not entries:
+            return
+        for entry in entries:
+            entry.model = None
+            entry.idle_predictors = []
+        gc.collect()
+        if torch.cuda.is_available() and any(entry.key[2] == "cuda" for entry in entries):
+            torch.cuda.empty_cache()
+
+    def get_stats(self) -> Dict:
+        """获取注册表统计信息"""
+        with self.lock:
+            models = [{
+                "model_path": key[0],
+                "task": key[1],
+                "device": key[2],
+                "size_mb": round(entry.size_bytes / 1024 / 1024, 1),
+                "refcount": entry.refcount,
+                "predictors": entry.predictor_count,
+                "busy": entry.busy,
+                "load_time": entry.load_time,
+                "last_used": entry.last_used,
+            } for key, entry in self.entries.items()]
+        total_bytes = sum(entry["size_mb"] for entry in models)
+        return {
+            "cache_size": len(models),
+            "total_memory_mb": round(total_bytes, 1),
+            "max_memory_mb": round(self.max_bytes / 1024 / 1024, 1),
+            "models": models,
+        }
+
+
+# 全局模型注册表实例
+model_registry = ModelRegistry()
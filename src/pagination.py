@@ -0,0 +1,86 @@
+"""
+事件列表分页工具 - 基于 (排序时间, 主键) 的游标分页，以及可选的估算总数
+"""
+import base64
+import json
+import logging
+from datetime import datetime
+from typing import Any, List, Optional, Tuple
+
+from sqlalchemy import tuple_
+from sqlalchemy.orm import Query, Session
+
+logger = logging.getLogger(__name__)
+
+# 总数统计方式: exact 精确 COUNT；estimated 取查询计划估算行数；none 不统计
+TOTAL_MODE_PATTERN = "^(exact|estimated|none)$"
+
+
+def encode_cursor(sort_value: datetime, row_id: Any) -> str:
+    """把最后一行的 (排序时间, 主键) 编码为不透明游标"""
+    payload = json.dumps([sort_value.isoformat() if sort_value else None, str(row_id)])
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, str]:
+    """解析游标，格式无效时抛出 ValueError"""
+    try:
+        sort_value, row_id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        return datetime.fromisoformat(sort_value), row_id
+    except Exception as e:
+        raise ValueError(f"无效的分页游标: {cursor}") from e
+
+
+def fetch_page(query: Query, sort_column, id_column, limit: int,
+               cursor: Optional[str] = None, offset: int = 0) -> Tuple[List[Any], Optional[str]]:
+    """按 (sort_column, id_column) 倒序取一页
+
+    传入游标时从游标之后继续（走复合索引，不扫描前面的页），否则退回 offset 分页；
+    多取一行用于判断是否还有下一页，返回 (行列表, 下一页游标)。
+    """
+    if cursor:
+        sort_value, row_id = decode_cursor(cursor)
+        query = query.filter(tuple_(sort_column, id_column) < tuple_(sort_value, row_id))
+        offset = 0
+
+    query = query.order_by(sort_column.desc(), id_column.desc())
+    if offset:
+        query = query.offset(offset)
+    rows = query.limit(limit + 1).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_cursor(getattr(last, sort_column.key), getattr(last, id_column.key))
+    return rows, next_cursor
+
+
+def estimate_count(db: Session, query: Query) -> int:
+    """从 PostgreSQL 查询计划读取估算行数，不实际扫描数据"""
+    statement = query.order_by(None).statement.compile(
+        dialect=db.get_bind().dialect, compile_kwargs={"literal_binds": True}
+    )
+    # 直接使用 DBAPI 游标，避免条件中的 % 和 : 被当作参数占位符
+    cursor = db.connection().connection.cursor()
+    try:
+        cursor.execute(f"EXPLAIN (FORMAT JSON) {statement}")
+        plan = cursor.fetchone()[0]
+    finally:
+        cursor.close()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]["Plan"]["Plan Rows"])
+
+
+def count_total(db: Session, query: Query, mode: str = "exact") -> Tuple[Optional[int], bool]:
+    """按统计方式计算总数，返回 (总数, 是否为估算值)"""
+    if mode == "none":
+        return None, False
+    if mode == "estimated":
+        try:
+            return estimate_count(db, query), True
+        except Exception as e:
+            logger.warning(f"估算总数失败，改为精确统计: {e}")
+            db.rollback()
+    return query.order_by(None).count(), False
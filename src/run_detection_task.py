@@ -11,7 +11,6 @@ from collections import deque
 from typing import List, Optional, Dict, Any
 import os
 import torch
-from ultralytics import YOLO
 
 import uuid
 import colorsys
@@ -30,9 +29,23 @@ from src.tracker import ObjectTracker
 # 导入数据推送模块
 from src.data_pusher import data_pusher
 from src.rtsp_url import build_rtsp_url
-from src.detection_runtime import is_within_active_period, get_frame_interval
+from src.detection_runtime import get_active_schedule, get_frame_interval
+from src.image_store import save_event_image
+from src.clip_recorder import ClipRecorder
+from src.model_registry import model_registry
+from src.detection_scheduler import detection_scheduler
+from src.detection_admission import TaskCostMeter
+from src.latency_controller import LatencyController
 
 logger = logging.getLogger(__name__)
+
+PREWARM_SECONDS = 15  # 生效时段开始前提前拉流的时间，连接就绪后时段一开始即可检测
+SCHEDULE_RECHECK_SECONDS = 60  # 距离下次时段切换较远时的最长等待，兼容系统时间调整
+CAMERA_CONNECT_CONCURRENCY = int(os.environ.get("CAMERA_CONNECT_CONCURRENCY", "8"))
+
+# 本进程同时建立 RTSP 连接的数量上限，避免节点重启或网络恢复后所有摄像机同时握手
+camera_connect_slots = threading.BoundedSemaphore(CAMERA_CONNECT_CONCURRENCY)
+
 # 导入GPU解码器
 try:
     # from src.ffmpeg_decoder_docker_gpu import FFmpegGPUDecoder #docker环境使用，用于GPU解码器
@@ -48,7 +61,8 @@ class DetectionTask:
     
     def __init__(self, device_id: str, device_name: str, device_ip: str, config_id: str, model_path: str, 
                  confidence: float, models_type: str, is_gpu: bool, target_class: List[str],                  save_mode: SaveMode, area_coordinates:Optional[dict]=None,
-                 stream_type: str = 'main', frequency: str = 'realtime', runtime_config: Optional[dict] = None):
+                 stream_type: str = 'main', frequency: str = 'realtime', runtime_config: Optional[dict] = None,
+                 save_duration: int = 10):
         self.device_id = device_id
         self.device_name = device_name
         self.device_ip = device_ip
@@ -59,6 +73,7 @@ class DetectionTask:
         self.is_gpu = is_gpu
         self.target_class = target_class
         self.save_mode = save_mode
+        self.save_duration = save_duration or 10  # 事件片段总时长（秒），事件前后各占一半
         self.area_coordinates = area_coordinates  #点坐标值，前端生成的归一化坐标  
         self.class_colors = {}  # 用于存储每个类别的固定颜色
         self.class_names = None  # 用于存储类别名称
@@ -66,6 +81,10 @@ class DetectionTask:
         self.frequency = frequency or 'realtime'
         self.runtime_config = runtime_config or {}
         self.frame_interval = get_frame_interval(self.runtime_config)
+        self.active_schedule = get_active_schedule(self.runtime_config)
+        self.detection_enabled = True  # 处于生效时段（提前拉流预热期间为 False）
+        self.readiness = "starting"  # 就绪状态: starting/loading_model/connecting/ready/reconnecting/paused/failed/stopped
+        self.ready_at = None  # 首次读到帧的时间
         self.last_detection_time = 0.0
 
         self.stop_event = threading.Event()
@@ -73,6 +92,7 @@ class DetectionTask:
         self.device = None
         self.cap = None
         self.ffmpeg_decoder = None  # 添加GPU解码器
+        self.clip_recorder = None  # 事件片段录制（仅 video/both 保存模式）
         self.thread = None
         self.lock = Lock()  # 初始化锁
         self.frame_buffer = deque(maxlen=1)  # 存储最近的帧
@@ -103,95 +123,44 @@ class DetectionTask:
             
         # 性能优化参数
         self.use_gpu_decoder = GPU_DECODER_AVAILABLE and torch.cuda.is_available()
-        self.skip_frame_count = 5  # 跳帧数，可根据CPU负载动态调整
-        self.last_performance_check = time.time()
-        self.performance_check_interval = 3600  # 每3600秒检查一次性能
+        self.skip_frame_count = 5  # 跳帧数，由 latency_controller 按帧龄 SLO 动态调整
+        self.frame_count = 0  # 已读取的帧数
+        self.frame_time = 0.0  # 最新帧的读取时间（monotonic）
+        self.last_detected_frame = 0  # 上次检测的帧序号
+        if self.area_coordinates and self.area_coordinates.get('alarm_interval'):
+            self.cooldown_period = self.area_coordinates.get('alarm_interval')
+        else:
+            self.cooldown_period = 15  # 检测事件的冷却时间（秒）
+        self.cost_meter = TaskCostMeter()  # 实测解码/检测开销，用于准入控制
+        self.latency_controller = LatencyController(self.skip_frame_count)
     
     def load_model(self): # 加载YOLO模型
-        """加载YOLO模型"""
+        """从进程内模型注册表获取模型（同一权重文件只加载一次），任务停止时释放引用"""
         try:
-            # 获取模型的绝对路径并记录
-            abs_model_path = os.path.abspath(self.model_path)
-            logger.info(f"加载模型 - 路径: {abs_model_path}")
-            
-            # 设置离线模式，避免连接GitHub
-            os.environ["ULTRALYTICS_OFFLINE"] = "1"
-            # 禁用所有自动更新和在线检查
-            os.environ["YOLO_NO_ANALYTICS"] = "1"
-            os.environ["NO_VERSION_CHECK"] = "1"
-            
-            # 确保模型文件存在
-            if not os.path.exists(abs_model_path):
-                # 尝试在当前目录下的models文件夹中查找
-                base_name = os.path.basename(abs_model_path)
-                alt_path = os.path.join("models", base_name)
-                alt_abs_path = os.path.abspath(alt_path)
-                
-                if os.path.exists(alt_abs_path):
-                    abs_model_path = alt_abs_path
-                    self.model_path = alt_path
-                else:
-                    logger.error(f"无法找到模型文件")
-                    return False
-            
-            # 使用绝对路径加载模型
-            # 最新YOLO版本可能需要使用以下方式加载本地模型
-            # 设置环境变量确保使用本地模型
-            os.environ["YOLO_VERBOSE"] = "0"  # 减少冗余日志
-            
-            # 根据文件扩展名确定模型类型
-            model_ext = os.path.splitext(abs_model_path)[1].lower()
-            
-            # 直接使用本地文件路径加载
-            try:
-                # 强制指定task类型
-                task_type = 'detect'
-                if hasattr(self, 'models_type') and self.models_type == 'pose':
-                    task_type = 'pose'
-                    
-                self.model = YOLO(abs_model_path, task=task_type)
-   
-                # 使用GPU并进行优化
-                device = 'cuda' if torch.cuda.is_available() and self.is_gpu else 'cpu'
-                self.device = torch.device(device)
-                self.model.to(self.device)
-                
-                self.class_names = self.model.names
-
-                if device == 'cuda' and hasattr(self.model, 'model'): 
-                    # 使用半精度浮点数以提高性能
-                    if hasattr(self.model.model, 'dtype'):
-                        self.model.model.half()
-
-                return True
-            except Exception as e:
-                logger.error(f"加载模型时出错: {e}")
-                return False
-                
+            # 强制指定task类型
+            task_type = 'pose' if self.models_type == 'pose' else 'detect'
+            self.model = model_registry.acquire(self.model_path, task=task_type, use_gpu=self.is_gpu)
+            self.device = torch.device(self.model.device)
+            self.class_names = self.model.names
+            logger.info(f"加载模型 - 路径: {self.model.model_path}, 硬件设备: {self.model.device}")
+            return True
+        except FileNotFoundError:
+            logger.error(f"无法找到模型文件")
+            return False
         except Exception as e:
             logger.error(f"模型加载失败: {e}")
             return False
-    
+
     def connect_to_camera(self): # 连接到RTSP摄像机
         """连接到RTSP摄像机"""
         try:
             if self.connected or self.cap or self.ffmpeg_decoder:
                 self.release_camera_connection("重新连接前释放")
 
-            db = SessionLocal()
-            device = db.query(Device).filter(Device.device_id == self.device_id).first()
-            config = db.query(DetectionConfig).filter(DetectionConfig.config_id == self.config_id).first()
-            db.close()
-            
-            if not device:
-                logger.error(f"设备信息不存在: {self.device_id}")
+            rtsp_url = self._resolve_rtsp_url()
+            if not rtsp_url:
                 return False
 
-            if config and getattr(config, 'stream_type', None):
-                self.stream_type = config.stream_type or 'main'
-
-            rtsp_url = build_rtsp_url(device, stream_type=self.stream_type)
-
             # 优先使用GPU解码器
             if self.use_gpu_decoder:
                 try:
@@ -199,6 +168,7 @@ class DetectionTask:
                     if self.ffmpeg_decoder.start():
                         self.connected = True
                         self.reconnect_attempts = 0
+                        self._start_clip_recorder(rtsp_url)
                         return True
                    
                 except Exception as e:
@@ -214,6 +184,7 @@ class DetectionTask:
                 self.fps = self.cap.get(cv2.CAP_PROP_FPS)
                 self.connected = True
                 self.reconnect_attempts = 0
+                self._start_clip_recorder(rtsp_url)
                 return True
             else:
                 logger.error(f"无法连接到摄像机: {self.device_id}")
@@ -223,9 +194,55 @@ class DetectionTask:
             logger.error(f"连接摄像机时出错: {e}")
             return False
 
-    def _is_streaming_allowed(self) -> bool:
-        """当前是否处于允许拉流/检测的生效时段"""
-        return is_within_active_period(datetime.now(), self.runtime_config)
+    def _resolve_rtsp_url(self) -> Optional[str]:
+        """按设备信息和配置的码流类型生成RTSP地址"""
+        db = SessionLocal()
+        try:
+            device = db.query(Device).filter(Device.device_id == self.device_id).first()
+            config = db.query(DetectionConfig).filter(DetectionConfig.config_id == self.config_id).first()
+        finally:
+            db.close()
+
+        if not device:
+            logger.error(f"设备信息不存在: {self.device_id}")
+            return None
+
+        if config and getattr(config, 'stream_type', None):
+            self.stream_type = config.stream_type or 'main'
+
+        return build_rtsp_url(device, stream_type=self.stream_type)
+
+    def _start_clip_recorder(self, rtsp_url: str) -> None:
+        """video/both 保存模式下启动压缩码流环形缓冲，用于录制事件前后的片段"""
+        if self.save_mode not in [SaveMode.video, SaveMode.both]:
+            return
+        if self.clip_recorder is None:
+            pre_seconds = self.save_duration / 2
+            self.clip_recorder = ClipRecorder(self.device_id, pre_seconds, self.save_duration - pre_seconds)
+        self.clip_recorder.start(rtsp_url)
+
+    def _request_event_clip(self, event_id: str, created_at: datetime) -> None:
+        """登记事件片段，封装完成后由后台线程写入 snippet_path"""
+        if self.save_mode in [SaveMode.video, SaveMode.both] and self.clip_recorder:
+            if not self.clip_recorder.request_clip(event_id, created_at):
+                logger.warning(f"事件片段缓冲为空，未录制片段: {event_id}")
+
+    def _schedule_window(self):
+        """
+        按预编译的生效时段返回 (是否拉流, 是否检测, 距离下次状态变化的秒数)
+        生效时段开始前 PREWARM_SECONDS 秒开始拉流（不检测），避免时段开始时才建立连接
+        """
+        now = datetime.now()
+        active = self.active_schedule.is_active(now)
+        transition = self.active_schedule.next_transition(now)
+        if transition is None:
+            return active, active, SCHEDULE_RECHECK_SECONDS
+        seconds = (transition - now).total_seconds()
+        if active:
+            return True, True, seconds
+        if seconds <= PREWARM_SECONDS:
+            return True, False, seconds
+        return False, False, seconds - PREWARM_SECONDS
 
     def release_camera_connection(self, reason: str = "") -> None:
         """释放摄像机连接并清空帧缓冲"""
@@ -246,6 +263,9 @@ class DetectionTask:
                 logger.warning(f"释放解码器失败: {self.device_id}, {e}")
             self.ffmpeg_decoder = None
 
+        if self.clip_recorder:
+            self.clip_recorder.stop()
+
         if self.connected:
             suffix = f" ({reason})" if reason else ""
             logger.info(f"已断开摄像机拉流: {self.device_id}{suffix}")
@@ -254,20 +274,34 @@ class DetectionTask:
         self.reconnect_attempts = 0
 
     def read_frame(self): # 从摄像机读取帧的线程函数
-        """从摄像机读取帧的线程函数"""
+        """从摄像机读取帧的线程函数，需要检测的帧通知 detection_scheduler"""
         error_count = 0
         last_reconnect_time = time.time()
         schedule_paused = False
+        streaming_allowed = True
+        next_schedule_check = 0.0
+        prewarming = False
 
         while not self.stop_event.is_set():
             try:
-                if not self._is_streaming_allowed():
+                # 只在下次时段切换时重新判断，不在每帧上重复计算
+                now = time.monotonic()
+                if now >= next_schedule_check:
+                    streaming_allowed, self.detection_enabled, wait_seconds = self._schedule_window()
+                    next_schedule_check = now + min(max(wait_seconds, 0.05), SCHEDULE_RECHECK_SECONDS)
+                    if streaming_allowed and not self.detection_enabled and not prewarming:
+                        logger.info(f"生效时段即将开始，提前拉流: {self.device_id}")
+                    prewarming = streaming_allowed and not self.detection_enabled
+
+                if not streaming_allowed:
+                    self.readiness = "paused"
                     if self.connected or self.cap or self.ffmpeg_decoder:
                         self.release_camera_connection("生效时段外暂停拉流")
                     if not schedule_paused:
                         schedule_paused = True
                         logger.info(f"生效时段外，暂停拉流: {self.device_id}")
-                    time.sleep(1.0)
+                    # 等到下次时段切换（或任务停止），不轮询
+                    self.stop_event.wait(max(0.0, next_schedule_check - time.monotonic()))
                     continue
 
                 if schedule_paused:
@@ -286,19 +320,24 @@ class DetectionTask:
                             logger.info(f"尝试重新连接摄像机: {self.device_id} (尝试 {self.reconnect_attempts + 1}/{self.max_reconnect_attempts})")
                             last_reconnect_time = current_time
                             self.reconnect_attempts += 1
-                            if self.connect_to_camera():
+                            self.readiness = "connecting" if self.ready_at is None else "reconnecting"
+                            with camera_connect_slots:
+                                connected = self.connect_to_camera()
+                            if connected:
                                 error_count = 0
                             else:
                                 time.sleep(min(2 * self.reconnect_attempts, 10))  # 指数退避策略，最长等待10秒
                                 continue
                         else:
                             logger.error(f"重连摄像机 {self.device_id} 失败，停止检测任务")
+                            self.readiness = "failed"
                             break
                     else:
                         time.sleep(0.5)  # 短暂等待
                         continue
                 
-                # 根据解码器类型读取帧
+                # 根据解码器类型读取帧（记录本线程的 CPU 时间作为解码开销，不含等待网络数据的时间）
+                decode_started = time.thread_time()
                 if self.ffmpeg_decoder:
                     # 使用GPU解码器
                     try:
@@ -319,6 +358,8 @@ class DetectionTask:
                     time.sleep(0.01)  # 最小化等待时间，最大化实时性
                     continue
                 
+                self.cost_meter.record_decode((time.thread_time() - decode_started) * 1000)
+
                 # 重置错误计数
                 if error_count > 0:
                     error_count = 0
@@ -326,171 +367,137 @@ class DetectionTask:
                 # 使用锁来确保线程安全
                 with self.lock:
                     self.frame_buffer.append(frame)  # 将帧添加到缓冲区
+                    self.frame_time = time.monotonic()
+                    self.frame_count += 1
+
+                if self.readiness != "ready":
+                    self.readiness = "ready"
+                    if self.ready_at is None:
+                        self.ready_at = datetime.now()
+
+                # 每skip_frame_count帧执行一次检测，减少计算负担
+                if self.detection_enabled and self._detection_due():
+                    detection_scheduler.notify(self)
             
             except Exception as e:
                 logger.error(f"读取帧时出错: {e}")
                 error_count += 1
                 time.sleep(0.1)  # 短暂暂停后重试
 
-    def run_detection(self): # 执行检测的主循环
-        """执行检测的主循环"""
-        # 为检测线程创建和设置事件循环
-        try:
-            self.loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(self.loop)          
-        except Exception as e:
-            logger.error(f"为检测线程创建事件循环失败: {e}")
-        
+    def run_detection(self): # 检测任务线程：加载模型后读帧，检测交给调度器
+        """检测任务线程：加载模型后在本线程读帧，待检测帧由 detection_scheduler 的工作线程处理"""
         try:
             # 如果模型已经加载，跳过加载步骤
             if not hasattr(self, 'model') or self.model is None:
+                self.readiness = "loading_model"
                 if not self.load_model():
+                    self.readiness = "failed"
                     return
             
-            # 启动读取帧的线程
-            self.thread = threading.Thread(target=self.read_frame)
-            self.thread.daemon = True
-            self.thread.start()
-
-            frame_count = 0
+            detection_scheduler.register(self)
+            self.read_frame()
+        except Exception as e:
+            logger.error(f"检测任务异常: {e}")
+        finally:
+            detection_scheduler.unregister(self)
 
-            if self.area_coordinates and self.area_coordinates.get('alarm_interval'):
-                cooldown_period = self.area_coordinates.get('alarm_interval')
-            else:
-                cooldown_period = 15  # 检测事件的冷却时间（秒）
+    def _detection_due(self) -> bool:
+        """读到新帧后判断是否需要检测"""
+        if self.frequency == 'manual':
+            return time.time() - self.last_detection_time >= self.frame_interval
+        return self.frame_count % self.skip_frame_count == 0
 
-            # 动态调整参数
-            skip_frame_count = self.skip_frame_count
-            last_performance_check = time.time()
+    def process_latest_frame(self, notified_at=None): # 调度器工作线程调用：检测最新帧
+        """取最新帧执行推理和后处理（同一任务不会被并发调用），notified_at 为调度器收到通知的时间"""
+        if self.stop_event.is_set():
+            return
+        # 使用锁来安全地访问帧缓存
+        with self.lock:
+            if not self.frame_buffer:
+                return
+            frame_rgb = self.frame_buffer[-1]  # 获取最新的帧
+            frame_index = self.frame_count
+
+        started_at = time.monotonic()
+        if notified_at is None:
+            notified_at = started_at
+        started = time.perf_counter()
+        cpu_started = time.thread_time()
+        infer_ms = gpu_ms = post_started = None
+        # 跟踪器按两次检测之间实际间隔的帧数预测位置
+        frame_gap = max(1, frame_index - self.last_detected_frame)
+        self.last_detected_frame = frame_index
+        detections = []
+        # 执行检测
+        detect_frame = frame_rgb.copy()
+        # img_result = frame_rgb.copy() 保留如果保存不带检测结果的帧，可以用于调试 _process_detection_events                 
+        # 使用 try-except 捕获模型推理过程中的错误
+        try:
+            results = self.model(detect_frame, conf=self.confidence,iou=0.45,max_det=300,device=self.device, verbose=False)
+            post_started = time.perf_counter()
+            infer_ms = (post_started - started) * 1000
+            # 获取速度
+            speed = results[0].speed
+            if str(self.device).startswith('cuda'):
+                gpu_ms = speed.get('inference')
+            # 处理检测结果
+            detections = self.process_detection_results(results)                    
             
-            while not self.stop_event.is_set():
-                try:
-                    if not is_within_active_period(datetime.now(), self.runtime_config):
-                        time.sleep(0.5)
-                        continue
+            # 首次设置区域坐标
+            if self.area_coordinates and not self.area_coordinates_set:
+                self.object_tracker.set_area_coordinates(self.area_coordinates, detect_frame.shape)
+                self.area_coordinates_set = True
+            
+            # 绘制区域框提示
+            self.draw_roi(detect_frame)
+
+            if self.area_coordinates and self.area_coordinates.get('analysisType'):
+                if self.models_type == 'pose' and detections:
+                    detect_frame = self.display_pose_results(detect_frame, results[0])
+                # 智能分析：即使本帧无检测也更新 tracker，保留 ghost track
+                self.object_tracker.update(detections, frame_gap=frame_gap)
+                detect_frame = self.object_tracker.draw_tracks(
+                    detect_frame,
+                    max_trajectory_length=self.max_trajectory_length,
+                    show_boxes=True,
+                )
+                self._process_smart_analysis_events(detect_frame, detections, speed, self.cooldown_period)
+            elif detections:
+                if self.models_type == 'pose':
+                    detect_frame = self.display_pose_results(detect_frame, results[0])
+                else:
+                    detect_frame = self.display_detection_results(detect_frame, results[0], show_boxes=True)
+                    self._process_detection_events(detect_frame, detections, speed, self.cooldown_period)
 
-                    # 性能监控和动态调整
-                    current_time = time.time()
-                    if current_time - last_performance_check > self.performance_check_interval:
-                        self._adjust_performance_parameters()
-                        last_performance_check = current_time
-                        skip_frame_count = self.skip_frame_count
-                                  
-                    # 使用锁来安全地访问帧缓存
-                    with self.lock:
-                        if self.frame_buffer:
-                            frame_rgb = self.frame_buffer[-1]  # 获取最新的帧
-                        else:
-                            time.sleep(0.01)  # 短暂等待
-                            continue  # 如果没有帧，跳过
-
-                    # 优化：每skip_frame_count帧执行一次检测，减少计算负担
-                    frame_count += 1
-                    if self.frequency == 'manual':
-                        now_ts = time.time()
-                        should_detect = now_ts - self.last_detection_time >= self.frame_interval
-                    else:
-                        should_detect = frame_count % skip_frame_count == 0
-                    if should_detect:
-                         # 执行检测
-                        detect_frame = frame_rgb.copy()
-                        # img_result = frame_rgb.copy() 保留如果保存不带检测结果的帧，可以用于调试 _process_detection_events                 
-                        # 使用 try-except 捕获模型推理过程中的错误
-                        try:
-                            results = self.model(detect_frame, conf=self.confidence,iou=0.45,max_det=300,device=self.device, verbose=False)
-                            # 获取速度
-                            speed = results[0].speed
-                            # 处理检测结果
-                            detections = self.process_detection_results(results)                    
-                            
-                            # 首次设置区域坐标
-                            if self.area_coordinates and not self.area_coordinates_set:
-                                self.object_tracker.set_area_coordinates(self.area_coordinates, detect_frame.shape)
-                                self.area_coordinates_set = True
-                            
-                            # 绘制区域框提示
-                            self.draw_roi(detect_frame)
-
-                            if self.area_coordinates and self.area_coordinates.get('analysisType'):
-                                if self.models_type == 'pose' and detections:
-                                    detect_frame = self.display_pose_results(detect_frame, results[0])
-                                # 智能分析：即使本帧无检测也更新 tracker，保留 ghost track
-                                self.object_tracker.update(detections, frame_gap=skip_frame_count)
-                                detect_frame = self.object_tracker.draw_tracks(
-                                    detect_frame,
-                                    max_trajectory_length=self.max_trajectory_length,
-                                    show_boxes=True,
-                                )
-                                self._process_smart_analysis_events(detect_frame, detections, speed, cooldown_period)
-                            elif detections:
-                                if self.models_type == 'pose':
-                                    detect_frame = self.display_pose_results(detect_frame, results[0])
-                                else:
-                                    detect_frame = self.display_detection_results(detect_frame, results[0], show_boxes=True)
-                                    self._process_detection_events(detect_frame, detections, speed, cooldown_period)
-
-                            if self.frequency == 'manual':
-                                self.last_detection_time = time.time()
-
-                            if not self.clients:
-                                continue  # 没有客户端连接，跳过下面步骤
-                            else:
-                                self.broadcast_img_result(detect_frame, detections) # 向WebSocket客户端推送检测结果
-                            
-                        except Exception as e:
-                            logger.error(f"模型推理过程中出错: {e}")
-                            # 不终止整个检测循环，仅记录错误
-                    
-                    # 动态休眠，根据客户端连接情况调整
-                    if self.clients:
-                        time.sleep(0.01)  # 有客户端时短暂休眠
-                    else:
-                        time.sleep(0.05)  # 无客户端时较长休眠
-                    
-                except Exception as e:
-                    logger.error(f"检测过程中出错: {e}")
-                    time.sleep(0.1)
+            if self.frequency == 'manual':
+                self.last_detection_time = time.time()
 
+            if self.clients:
+                self.broadcast_img_result(detect_frame, detections) # 向WebSocket客户端推送检测结果
+            
         except Exception as e:
-            logger.error(f"检测任务异常: {e}")
+            logger.error(f"模型推理过程中出错: {e}")
+            # 不终止检测任务，仅记录错误
         finally:
-            # 关闭事件循环（在子线程内执行）
-            try:
-                # 关闭异步生成器
-                self.loop.run_until_complete(self.loop.shutdown_asyncgens())
-            finally:
-                self.loop.close()
-                logger.info(f"事件循环已关闭: {self.config_id}")
+            finished = time.perf_counter()
+            detect_ms = (finished - started) * 1000
+            post_ms = (finished - post_started) * 1000 if post_started is not None else None
+            self.cost_meter.record_detection((time.thread_time() - cpu_started) * 1000, infer_ms, gpu_ms, post_ms)
+            if self.frequency != 'manual':
+                self._update_skip_frame_count(notified_at, started_at, detect_ms, detections)
+
+    def _update_skip_frame_count(self, notified_at, started_at, detect_ms, detections):
+        """按本次检测的结果延迟（从通知调度器到检测完成）、排队时间和检测耗时调整跳帧数，
+        有目标或活跃轨迹时视为活跃摄像机"""
+        active = bool(detections) or bool(self.object_tracker.active_tracks)
+        age_ms = (time.monotonic() - notified_at) * 1000
+        wait_ms = (started_at - notified_at) * 1000
+        skip_frame_count = self.latency_controller.record(age_ms, wait_ms, detect_ms, active)
+        if skip_frame_count is not None:
+            logger.debug(f"调整跳帧数: {self.config_id} {self.skip_frame_count} -> {skip_frame_count} "
+                         f"(结果延迟 {self.latency_controller.age_ms:.0f}ms, 目标 {self.latency_controller.slo_ms:.0f}ms)")
+            self.skip_frame_count = skip_frame_count
     
-    def _adjust_performance_parameters(self):
-        """动态调整性能参数"""
-        try:
-            import psutil
-            
-            # 获取系统资源使用情况
-            cpu_percent = psutil.cpu_percent(interval=1)
-            memory_percent = psutil.virtual_memory().percent
-            
-            # 根据CPU使用率调整跳帧数
-            if cpu_percent > 80:
-                # 高CPU负载，增加跳帧数
-                new_skip_frames = min(self.skip_frame_count + 2, 10)
-                if new_skip_frames != self.skip_frame_count:
-                    logger.info(f"CPU负载高({cpu_percent:.1f}%)，调整跳帧数: {self.skip_frame_count} -> {new_skip_frames}")
-                    self.skip_frame_count = new_skip_frames
-            elif cpu_percent < 50 and self.skip_frame_count > 3:
-                # 低CPU负载，减少跳帧数
-                new_skip_frames = max(self.skip_frame_count - 1, 4)
-                if new_skip_frames != self.skip_frame_count:
-                    logger.info(f"CPU负载低({cpu_percent:.1f}%)，调整跳帧数: {self.skip_frame_count} -> {new_skip_frames}")
-                    self.skip_frame_count = new_skip_frames
-                    
-        except ImportError:
-            # psutil不可用，使用默认参数
-            pass
-        except Exception as e:
-            logger.warning(f"性能参数调整失败: {e}")
-
     def process_detection_results(self, results):
         """处理检测结果"""
         detections = []
@@ -604,16 +611,47 @@ class DetectionTask:
             return
         
         self.stop_event.clear()
-        self.thread = threading.Thread(target=self.run_detection)
+        detection_scheduler.start()
+        self.thread = threading.Thread(target=self.run_detection, name=f"detection-{self.device_id}")
         self.thread.daemon = True
         self.thread.start()
+
+    def is_running(self) -> bool:
+        """检测线程是否在运行"""
+        return self.thread is not None and self.thread.is_alive()
+
+    def get_cost(self) -> Optional[float]:
+        """实测开销（每秒消耗的计算毫秒数），还没有统计数据时返回 None"""
+        return self.cost_meter.cost_ms()
+
+    def get_cost_stats(self) -> dict:
+        return self.cost_meter.snapshot()
+
+    def get_latency_stats(self) -> dict:
+        return self.latency_controller.snapshot()
     
     async def stop(self): # 停止检测任务
         """停止检测任务"""
         logger.info(f"正在停止检测任务: {self.config_id}")
         self.stop_event.set()
+        await self._stop_broadcast()
         
-        # 停止广播任务
+        if self.thread:
+            self.thread.join(timeout=5)
+            if self.thread.is_alive():
+                logger.warning(f"检测线程未能及时停止: {self.config_id}")
+
+        # 等待调度器中正在执行的检测结束后再释放模型
+        detection_scheduler.unregister(self)
+        self.release_camera_connection("任务停止")
+        self.readiness = "stopped"
+
+        if self.model is not None:
+            self.model.release()
+            self.model = None
+
+    async def _stop_broadcast(self):
+        """停止预览广播任务"""
         if self.broadcast_task:
             self.broadcast_task.cancel()
             try:
@@ -627,13 +665,6 @@ class DetectionTask:
                 await self.message_queue.put(None)
         except Exception as e:
             logger.error(f"发送停止信号到消息队列失败: {e}")
-        
-        if self.thread:
-            self.thread.join(timeout=5)
-            if self.thread.is_alive():
-                logger.warning(f"检测线程未能及时停止: {self.config_id}")
-
-        self.release_camera_connection("任务停止")
     
     # 保存检测事件到数据库并存储图像/视频
     def _process_detection_events(self, img_result, detections, speed, cooldown_period): # 处理检测事件
@@ -683,21 +714,15 @@ class DetectionTask:
             }
             
             if self.save_mode in [SaveMode.screenshot, SaveMode.both]:
-                # 根据保存模式保存图像/视频
-                save_dir = Path(f"storage/events/{current_time.strftime('%Y-%m-%d')}/{self.device_id}")
-                save_dir.mkdir(parents=True, exist_ok=True, mode=0o777)   
-                # 保存带检测框的截图（原图）
-                thumbnail_path = save_dir / f"{event_id}.jpg"
-                if self.stream_type == 'sub':
-                    cv2.imwrite(str(thumbnail_path), frame, [int(cv2.IMWRITE_JPEG_QUALITY), 100])
-                else:
-                    cv2.imwrite(str(thumbnail_path), frame, [int(cv2.IMWRITE_JPEG_QUALITY), 70])
-                event.thumbnail_path = str(thumbnail_path)
+                # 保存带检测框的截图（原图）及缩略图、中等预览
+                event.thumbnail_path = save_event_image(frame, self.device_id, current_time,
+                                                        quality=self._snapshot_quality())
             
             # 提交事件
             db.add(event)
             db.commit()
             logger.info(f"已保存检测事件: {event_id}")
+            self._request_event_clip(event_id, current_time)
             
         except Exception as e:
             logger.error(f"保存检测事件失败: {e}")
@@ -707,6 +732,10 @@ class DetectionTask:
             if 'db' in locals() and db:
                 db.close()  
     
+    def _snapshot_quality(self) -> int:
+        """事件截图的 JPEG 质量，子码流分辨率低，用更高质量保存"""
+        return 100 if self.stream_type == 'sub' else 70
+
     def push_detection_data(self, detections, frame_rgb, speed): # 推送检测数据
         """推送检测数据"""
         if not data_pusher.push_configs:
@@ -827,22 +856,16 @@ class DetectionTask:
             }
             
             # 根据保存模式保存图像/视频
-            save_dir = Path(f"storage/events/{current_time.strftime('%Y-%m-%d')}/{self.device_id}")
-            save_dir.mkdir(parents=True, exist_ok=True, mode=0o777)
-            
             if self.save_mode in [SaveMode.screenshot, SaveMode.both]:   
-                # 保存带检测框的截图（原图）
-                thumbnail_path = save_dir / f"{event_id}.jpg"
-                if self.stream_type == 'sub':
-                    cv2.imwrite(str(thumbnail_path), frame, [int(cv2.IMWRITE_JPEG_QUALITY), 100])
-                else:
-                    cv2.imwrite(str(thumbnail_path), frame, [int(cv2.IMWRITE_JPEG_QUALITY), 70])
-                event.thumbnail_path = str(thumbnail_path)
+                # 保存带检测框的截图（原图）及缩略图、中等预览
+                event.thumbnail_path = save_event_image(frame, self.device_id, current_time,
+                                                        quality=self._snapshot_quality())
           
             # 提交事件
             db.add(event)
             db.commit()
             logger.info(f"已保存智能行为事件: {event_id}")
+            self._request_event_clip(event_id, current_time)
             
         except Exception as e:
             logger.error(f"保存智能行为事件失败: {e}")
@@ -896,22 +919,16 @@ class DetectionTask:
             }
             
             # 根据保存模式保存图像/视频
-            save_dir = Path(f"storage/events/{current_time.strftime('%Y-%m-%d')}/{self.device_id}")
-            save_dir.mkdir(parents=True, exist_ok=True, mode=0o777)
-            
             if self.save_mode in [SaveMode.screenshot, SaveMode.both]:   
-                # 保存带检测框的截图（原图）
-                thumbnail_path = save_dir / f"{event_id}.jpg"
-                if self.stream_type == 'sub':
-                    cv2.imwrite(str(thumbnail_path), frame, [int(cv2.IMWRITE_JPEG_QUALITY), 100])
-                else:
-                    cv2.imwrite(str(thumbnail_path), frame, [int(cv2.IMWRITE_JPEG_QUALITY), 70])
-                event.thumbnail_path = str(thumbnail_path)
+                # 保存带检测框的截图（原图）及缩略图、中等预览
+                event.thumbnail_path = save_event_image(frame, self.device_id, current_time,
+                                                        quality=self._snapshot_quality())
           
             # 提交事件
             db.add(event)
             db.commit()
             logger.info(f"已保存智能人数统计事件: {event_id}")
+            self._request_event_clip(event_id, current_time)
             
         except Exception as e:
             logger.error(f"保存智能人数统计事件失败: {e}")
@@ -1075,6 +1092,12 @@ class DetectionTask:
         if not self.clients:
             return  # 没有客户端连接，跳过
         
+        message = self._build_preview_message(pose_frame, detections)
+        if message is not None:
+            self._enqueue_preview(message)
+
+    def _build_preview_message(self, pose_frame, detections) -> Optional[dict]:
+        """将帧编码为 JPEG/base64 预览消息，失败时返回 None"""
         try:            
             
             # 将帧转换为JPEG，增加质量参数
@@ -1086,22 +1109,24 @@ class DetectionTask:
             base64_image = base64.b64encode(jpg_bytes).decode('utf-8')
             
             # 创建消息
-            message = {
+            return {
                 "device_id": self.device_id,
                 "config_id": self.config_id,
                 "timestamp": time.time(),
                 "image": base64_image,
                 "detections": detections
             }
-            
-            # 将消息放入队列（线程安全）
-            if self.loop and self.loop.is_running():
-                self.loop.call_soon_threadsafe(
-                    lambda: self.message_queue.put_nowait(message)
-                )
        
         except Exception as e:
             logger.error(f"广播检测结果失败: {e}")
+            return None
+
+    def _enqueue_preview(self, message: dict):
+        """将预览消息放入事件循环的队列（线程安全）"""
+        if self.loop and self.loop.is_running():
+            self.loop.call_soon_threadsafe(
+                lambda: self.message_queue.put_nowait(message)
+            )
 
     def normalize_points(self, points, frame_shape): #归一化坐标转换
         """归一化坐标转换"""
@@ -1227,16 +1252,10 @@ class DetectionTask:
         # 如果没有广播任务，立即启动一个
         if not self.broadcast_task or self.broadcast_task.done():
             try:
-                # 确保在正确的事件循环中创建任务
-                if self.loop and self.loop.is_running():
-                    self.broadcast_task = asyncio.run_coroutine_threadsafe(
-                        self.broadcast_worker(),
-                        self.loop
-                    )
-                else:
-                    self.loop = asyncio.get_event_loop()
-                    self.broadcast_task = asyncio.create_task(self.broadcast_worker())
-                    logger.info(f"为检测任务 {self.config_id} 创建了新的广播任务")
+                # 在调用方（WebSocket 处理协程）所在的事件循环中创建任务
+                self.loop = asyncio.get_running_loop()
+                self.broadcast_task = self.loop.create_task(self.broadcast_worker())
+                logger.info(f"为检测任务 {self.config_id} 创建了新的广播任务")
             except Exception as e:
                 logger.error(f"创建广播任务失败: {e}")
     
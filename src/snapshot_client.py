@@ -0,0 +1,174 @@
+"""
+摄像机抓图客户端 - 每个设备一个长连接 HTTP 会话，缓存 Digest 认证的 realm/nonce
+
+首次请求收到 401 后记录认证方式和挑战参数，之后每次请求直接携带 Authorization
+（Digest 的 nc 递增），稳定状态下一次抓图只需一次往返；nonce 过期（stale）或设备重启后
+收到 401 时更新挑战参数并重试一次。
+"""
+import base64
+import hashlib
+import logging
+import re
+import secrets
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional
+from urllib.parse import urlsplit
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_TIMEOUT = 10
+MAX_SNAPSHOT_CLIENTS = 256
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
+
+_CHALLENGE_PATTERN = re.compile(r'(\w+)=(?:"([^"]*)"|([^\s,]+))')
+
+
+def build_snapshot_url(ip_address: str, device_type: str, channel=1) -> str:
+    """构建设备抓图URL，NVR 按通道号抓图"""
+    if (device_type or '').lower() == 'nvr':
+        return f"http://{ip_address}/cgi-bin/snapshot.cgi?channel={channel}&type=0"
+    return f"http://{ip_address}/cgi-bin/snapshot.cgi?channel=1&type=0"
+
+
+def parse_challenge(auth_header: str) -> Dict[str, str]:
+    """解析 WWW-Authenticate 头中的参数"""
+    return {key.lower(): quoted or bare for key, quoted, bare in _CHALLENGE_PATTERN.findall(auth_header)}
+
+
+class SnapshotClient:
+    """单个设备的抓图客户端，线程安全（同一设备的请求串行，保证 nc 单调递增）"""
+
+    def __init__(self, username: str, password: str):
+        self.username = username or ''
+        self.password = password or ''
+        self.session = requests.Session()
+        self.session.headers['User-Agent'] = USER_AGENT
+        self.lock = threading.Lock()
+        self.scheme: Optional[str] = None  # None / 'digest' / 'basic'
+        self.challenge: Dict[str, str] = {}
+        self.nc = 0
+
+    def get(self, url: str, timeout: float = SNAPSHOT_TIMEOUT) -> requests.Response:
+        """抓图请求，必要时完成（或刷新）认证后重试一次"""
+        with self.lock:
+            response = self.session.get(url, headers=self._authorization(url), timeout=timeout)
+            if response.status_code != 401:
+                return response
+
+            auth_header = response.headers.get('www-authenticate', '')
+            had_credentials = self.scheme is not None
+            self._update_scheme(auth_header)
+            if had_credentials and self.scheme == 'basic' and 'Digest' not in auth_header:
+                # Basic 认证已携带仍被拒绝，凭据错误，不再重试
+                return response
+            response.close()
+            return self.session.get(url, headers=self._authorization(url), timeout=timeout)
+
+    def close(self):
+        self.session.close()
+
+    def _update_scheme(self, auth_header: str):
+        if 'Digest' in auth_header:
+            challenge = parse_challenge(auth_header.split('Digest', 1)[1])
+            if challenge.get('nonce') != self.challenge.get('nonce'):
+                self.nc = 0
+            self.scheme = 'digest'
+            self.challenge = challenge
+        else:
+            # Basic 或设备未返回 www-authenticate 头时都尝试 Basic 认证
+            self.scheme = 'basic'
+            self.challenge = {}
+
+    def _authorization(self, url: str) -> Dict[str, str]:
+        if self.scheme == 'basic':
+            credentials = base64.b64encode(f"{self.username}:{self.password}".encode()).decode()
+            return {'Authorization': f'Basic {credentials}'}
+        if self.scheme == 'digest':
+            return {'Authorization': self._digest_authorization('GET', url)}
+        return {}
+
+    def _digest_authorization(self, method: str, url: str) -> str:
+        challenge = self.challenge
+        realm = challenge.get('realm', '')
+        nonce = challenge.get('nonce', '')
+        algorithm = challenge.get('algorithm', 'MD5')
+        qop_options = [option.strip() for option in challenge.get('qop', '').split(',') if option.strip()]
+        qop = 'auth' if 'auth' in qop_options else (qop_options[0] if qop_options else '')
+
+        parts = urlsplit(url)
+        uri = parts.path + (f"?{parts.query}" if parts.query else '')
+
+        self.nc += 1
+        nc = f"{self.nc:08x}"
+        cnonce = secrets.token_hex(8)
+
+        # HA1 = MD5(username:realm:password)，HA2 = MD5(method:uri)
+        ha1 = hashlib.md5(f"{self.username}:{realm}:{self.password}".encode()).hexdigest()
+        if algorithm.upper() == 'MD5-SESS':
+            ha1 = hashlib.md5(f"{ha1}:{nonce}:{cnonce}".encode()).hexdigest()
+        ha2 = hashlib.md5(f"{method}:{uri}".encode()).hexdigest()
+
+        if qop:
+            response = hashlib.md5(f"{ha1}:{nonce}:{nc}:{cnonce}:{qop}:{ha2}".encode()).hexdigest()
+        else:
+            response = hashlib.md5(f"{ha1}:{nonce}:{ha2}".encode()).hexdigest()
+
+        header = (f'Digest username="{self.username}", realm="{realm}", nonce="{nonce}", uri="{uri}", '
+                  f'algorithm={algorithm}, response="{response}"')
+        if 'opaque' in challenge:
+            header += f', opaque="{challenge["opaque"]}"'
+        if qop:
+            header += f', qop={qop}, nc={nc}, cnonce="{cnonce}"'
+        return header
+
+
+class SnapshotClientPool:
+    """按设备复用抓图客户端，凭据变化时重建，超过上限时关闭最久未用的客户端"""
+
+    def __init__(self, max_clients: int = MAX_SNAPSHOT_CLIENTS):
+        self.max_clients = max_clients
+        self.clients: "OrderedDict[str, tuple]" = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get_client(self, device_id: str, username: str, password: str) -> SnapshotClient:
+        credentials = (username or '', password or '')
+        with self.lock:
+            entry = self.clients.get(device_id)
+            if entry and entry[0] == credentials:
+                self.clients.move_to_end(device_id)
+                return entry[1]
+            if entry:
+                entry[1].close()
+            client = SnapshotClient(username, password)
+            self.clients[device_id] = (credentials, client)
+            while len(self.clients) > self.max_clients:
+                _, (_, evicted) = self.clients.popitem(last=False)
+                evicted.close()
+            return client
+
+    def fetch(self, device_id: str, username: str, password: str, url: str,
+              timeout: float = SNAPSHOT_TIMEOUT) -> requests.Response:
+        return self.get_client(device_id, username, password).get(url, timeout=timeout)
+
+    def discard(self, device_id: str):
+        with self.lock:
+            entry = self.clients.pop(device_id, None)
+        if entry:
+            entry[1].close()
+
+    def retain(self, device_ids):
+        """只保留给定设备的客户端"""
+        keep = set(device_ids)
+        with self.lock:
+            stale = [device_id for device_id in self.clients if device_id not in keep]
+            entries = [self.clients.pop(device_id) for device_id in stale]
+        for _, client in entries:
+            client.close()
+        return len(entries)
+
+
+# 全局抓图客户端池实例
+snapshot_clients = SnapshotClientPool()